@@ -0,0 +1,88 @@
+"""
+    This is the AWS shadow executor benchmark.
+    It sends a burst of state notifications of many things to a stub of the AWS
+    IoT shadow service, and compares one thread per notification (as the cloud
+    communicators used to do) with the rate limited and coalescing executor of
+    the AWS communicator: time taken, shadow updates sent and peak request rate.
+
+    Usage: python benchmarks/bench_aws_executor.py [things] [updates_per_thing] [aws_latency_ms]
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+sys.path.append(my_dir+"/../tests/")
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import settings
+from stubmqtt import StubMQTTBroker, StubIoTService, StubShadowService
+from cloudcommunicators.aws_comm import AWSCommunicator
+
+__author__ = "Jose Requeijo Dias"
+
+class BenchState(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get_simplified_wanted_state(self):
+        return {"power": self.value}
+
+    def get_simplified_current_state(self):
+        return {"power": self.value}
+
+def notifications(things, updates):
+    for u in range(updates):
+        for n in range(things):
+            yield "dev"+str(n)+"-"+str(n+1), BenchState(u)
+
+def one_thread_per_update(things, updates, latency):
+    shadows = StubShadowService(StubMQTTBroker(), latency)
+    start = time.time()
+    threads = []
+    for thing_name, state in notifications(things, updates):
+        data = {"state": {"desired": state.get_simplified_wanted_state(),\
+                          "reported": state.get_simplified_current_state()}}
+        t = threading.Thread(target=shadows.update_thing_shadow,\
+                                args=(thing_name, json.dumps(data)))
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return {"seconds": round(time.time() - start, 3),
+            "shadow_updates": shadows.total_calls(),
+            "peak_requests_per_sec": shadows.peak_rate(),
+            "threads": len(threads)}
+
+def executor(things, updates, latency):
+    shadows = StubShadowService(StubMQTTBroker(), latency)
+    aws = AWSCommunicator(clients=(StubIoTService(latency), shadows), listen=False)
+    start = time.time()
+    for thing_name, state in notifications(things, updates):
+        aws.notify_shadow(thing_name, state)
+    aws.executor.join()
+    aws.executor.stop()
+    latest = all(s["reported"]["power"] == updates-1 for s in shadows.shadows.itervalues())
+    return {"seconds": round(time.time() - start, 3),
+            "shadow_updates": shadows.total_calls(),
+            "peak_requests_per_sec": shadows.peak_rate(),
+            "threads": settings.AWS_EXECUTOR_WORKERS,
+            "latest_states_sent": latest}
+
+def run(things=1000, updates=10, latency_ms=20):
+    latency = latency_ms/1000.0
+    result = {"things": things, "updates_per_thing": updates, "aws_latency_ms": latency_ms,
+              "shadow_rate_limit": settings.AWS_SHADOW_RATE_LIMIT,
+              "one_thread_per_update": one_thread_per_update(things, updates, latency),
+              "executor": executor(things, updates, latency)}
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
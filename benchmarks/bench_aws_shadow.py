@@ -0,0 +1,125 @@
+"""
+    This is the AWS shadow synchronization benchmark.
+    It compares the shadow polling mode with the MQTT shadow delta mode of the
+    AWS communicator, using the stub MQTT broker and shadow service, for a home
+    with many devices where only a few wanted states are changed on AWS.
+    The local CoAP server is replaced by a recorder of the requests made to it.
+
+    Usage: python benchmarks/bench_aws_shadow.py [things] [changes] [aws_latency_ms]
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+sys.path.append(my_dir+"/../tests/")
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import settings
+from stubmqtt import StubMQTTBroker, StubMQTTClient, StubShadowService
+from cloudcommunicators.aws_comm import AWSCommunicator
+
+__author__ = "Jose Requeijo Dias"
+
+class RecordingResponse(object):
+    def __init__(self, payload):
+        self.payload = payload
+
+class RecordingComm(object):
+    """
+        This records the requests made to the local CoAP server.
+    """
+    def __init__(self, devices):
+        self.devices = devices
+        self.puts = {}
+        self.done = threading.Event()
+        self.expected = 0
+
+    def get(self, path, timeout=None):
+        return RecordingResponse(json.dumps({"devices": self.devices}))
+
+    def get_response(self, resp):
+        return resp
+
+    def put(self, path, payload, timeout=None):
+        self.puts[path] = time.time()
+        if len(self.puts) >= self.expected:
+            self.done.set()
+
+def make_communicator(mode, broker, shadows, comm):
+    settings.AWS_SHADOW_MODE = mode
+    mqtt_client = StubMQTTClient(broker) if mode == "mqtt" else None
+    aws = AWSCommunicator(mqtt_client=mqtt_client, clients=(None, shadows), listen=False)
+    aws.comm = comm
+    return aws
+
+def change_wanted_states(shadows, devices, changes):
+    start = time.time()
+    for dev in devices[:changes]:
+        shadows.update_thing_shadow(thingName=dev["name"]+"-"+str(dev["local_id"]),\
+                                    payload=json.dumps({"state": {"desired": {"power": "on"}}}))
+    return start
+
+def setup(things, latency):
+    broker = StubMQTTBroker()
+    shadows = StubShadowService(broker, latency)
+    devices = [{"local_id": n+1, "name": "dev"+str(n)} for n in range(things)]
+    for dev in devices:
+        shadows.update_thing_shadow(thingName=dev["name"]+"-"+str(dev["local_id"]),\
+                payload=json.dumps({"state": {"desired": {"power": "off"},\
+                                              "reported": {"power": "off"}}}))
+    shadows.calls.clear()
+    return broker, shadows, devices
+
+def polling(things, changes, latency):
+    broker, shadows, devices = setup(things, latency)
+    comm = RecordingComm(devices)
+    aws = make_communicator("polling", broker, shadows, comm)
+
+    last_states = {}
+    aws.sync_cloud_shadows(last_states)
+    start = change_wanted_states(shadows, devices, changes)
+    calls = shadows.calls.get("get_thing_shadow", 0)
+    cycle = time.time()
+    aws.sync_cloud_shadows(last_states)
+    cycle = time.time() - cycle
+    # on average a change waits half of the polling interval plus the cycle
+    return {"cycle_seconds": round(cycle, 3),
+            "shadow_reads_per_cycle": shadows.calls["get_thing_shadow"] - calls,
+            "avg_reaction_seconds": round(settings.AWS_SHADOW_POLLING_INTERVAL/2.0 + cycle, 3),
+            "coap_puts": len(comm.puts)}
+
+def delta(things, changes, latency):
+    broker, shadows, devices = setup(things, latency)
+    comm = RecordingComm(devices)
+    comm.expected = changes
+    aws = make_communicator("mqtt", broker, shadows, comm)
+    aws.start_shadow_listener()
+    reads = shadows.calls.get("get_thing_shadow", 0)
+
+    start = change_wanted_states(shadows, devices, changes)
+    comm.done.wait(60)
+    broker.join()
+    reactions = [t - start for t in comm.puts.values()]
+    return {"startup_shadow_reads": reads,
+            "steady_shadow_reads": shadows.calls.get("get_thing_shadow", 0) - reads,
+            "max_reaction_seconds": round(max(reactions), 3) if reactions else None,
+            "coap_puts": len(comm.puts),
+            "mqtt_messages": broker.published}
+
+def run(things=200, changes=10, latency_ms=20):
+    latency = latency_ms/1000.0
+    result = {"things": things, "changes": changes, "aws_latency_ms": latency_ms,
+              "polling": polling(things, changes, latency),
+              "mqtt_delta": delta(things, changes, latency)}
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
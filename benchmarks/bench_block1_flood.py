@@ -0,0 +1,87 @@
+"""
+    This is the CoAP Block1 reassembly benchmark.
+    It floods the block layer of the Home Server with Block1 uploads that are
+    abandoned after a few blocks (as done by crashing or malicious clients),
+    checking that the memory used by the reassembly buffers stays bounded, and
+    measures the time taken to reassemble one large upload.
+
+    Usage: python benchmarks/bench_block1_flood.py [rounds] [uploads_per_round]
+"""
+import os
+import sys
+import json
+import time
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.transaction import Transaction
+from coapthon.layers.blocklayer import BlockLayer
+
+__author__ = "Jose Requeijo Dias"
+
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+
+def block1_transaction(source, token, num, m, payload):
+    request = Request()
+    request.source = source
+    request.token = token
+    request.code = defines.Codes.PUT.number
+    request.content_type = defines.Content_types["application/json"]
+    request.payload = payload
+    request.block1 = (num, m, defines.BLOCKWISE_SIZE)
+    return Transaction(request=request, timestamp=time.time())
+
+def flood(layer, uploads, blocks, offset):
+    chunk = "x" * defines.BLOCKWISE_SIZE
+    too_large = 0
+    for n in range(uploads):
+        source = ("10.%d.%d.%d" % ((offset+n)/65536 % 256, (offset+n)/256 % 256, (offset+n) % 256), 5683)
+        for num in range(blocks):
+            transaction = layer.receive_request(block1_transaction(source, "tk", num, 1, chunk))
+            if transaction.response.code == defines.Codes.REQUEST_ENTITY_TOO_LARGE.number:
+                too_large += 1
+                break
+    return too_large
+
+def reassemble(layer, size):
+    chunk = "y" * defines.BLOCKWISE_SIZE
+    blocks = size / defines.BLOCKWISE_SIZE
+    start = time.time()
+    for num in range(blocks):
+        transaction = layer.receive_request(block1_transaction(("10.255.0.1", 5683), "big", num,\
+                                                               int(num < blocks-1), chunk))
+    elapsed = time.time() - start
+    return elapsed, len(transaction.request.payload)
+
+def run(rounds=10, uploads=2000):
+    layer = BlockLayer()
+    samples = []
+    rejected = 0
+    for r in range(rounds):
+        rejected += flood(layer, uploads, 8, r*uploads)
+        samples.append({"round": r, "rss_kb": rss_kb(), "buffered_bytes": layer._block1_bytes,
+                        "open_uploads": len(layer._block1_receive)})
+        # the abandoned uploads of this round become idle
+        layer.purge(lifetime=0)
+
+    elapsed, size = reassemble(layer, defines.MAX_BLOCK1_PAYLOAD)
+    growth = samples[-1]["rss_kb"] - samples[1]["rss_kb"] if rounds > 1 else 0
+    result = {"rounds": rounds, "abandoned_uploads_per_round": uploads,
+              "rejected_with_4.13": rejected, "samples": samples,
+              "rss_growth_kb_after_first_round": growth,
+              "max_block1_buffers": defines.MAX_BLOCK1_BUFFERS,
+              "reassembly_1MB_ms": round(elapsed*1000, 2), "reassembled_bytes": size}
+    print json.dumps(result, indent=2, sort_keys=True)
+
+    assert all(s["buffered_bytes"] <= defines.MAX_BLOCK1_BUFFERS for s in samples)
+    assert growth < defines.MAX_BLOCK1_BUFFERS / 1024
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,73 @@
+"""
+    This is the CoAP blockwise transfer benchmark.
+    It serves a large resource (the JSON list of the devices of a big home, as
+    the DevicesList resource does) from a local CoAPthon server and measures how
+    long a client takes to download it with Block2 transfers, and how many times
+    the resource had to be rendered to send all the blocks.
+
+    Usage: python benchmarks/bench_blockwise.py [devices] [downloads]
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+
+__author__ = "Jose Requeijo Dias"
+
+class BenchDevicesList(Resource):
+    def __init__(self, devices):
+        super(BenchDevicesList, self).__init__("BenchDevicesList", observable=False)
+        self.devices = devices
+        self.renders = 0
+
+    def render_GET(self, request):
+        self.renders += 1
+        self.payload = (defines.Content_types["application/json"],\
+                        json.dumps({"devices": [{"local_id": n, "name": "device"+str(n),\
+                                                 "address": "10.0.%d.%d" % (n/250, n%250+1),\
+                                                 "port": 5683, "device_type": 1,\
+                                                 "universal_id": n, "timeout": 60}\
+                                                for n in range(self.devices)]}))
+        return self
+
+def run(devices=2000, downloads=5):
+    port = 15683
+    server = CoAP(("127.0.0.1", port))
+    resource = BenchDevicesList(devices)
+    server.add_resource("devices/", resource)
+    listener = threading.Thread(target=server.listen, args=(1,))
+    listener.start()
+
+    client = HelperClient(server=("127.0.0.1", port))
+    try:
+        start = time.time()
+        for n in range(downloads):
+            resp = client.get("devices", timeout=10)
+            payload = json.loads(resp.payload)
+        elapsed = time.time() - start
+        size = len(resp.payload)
+        result = {"devices": devices, "downloads": downloads,
+                  "payload_bytes": size,
+                  "blocks_per_download": size/defines.MAX_PAYLOAD + 1,
+                  "renders_per_download": resource.renders/float(downloads),
+                  "seconds_per_download": round(elapsed/downloads, 4),
+                  "complete": len(payload["devices"]) == devices}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        client.stop()
+        server.close()
+        listener.join()
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,112 @@
+"""
+    This is the device bulk synchronization benchmark.
+    It emulates a Home Server restart with many devices registering again and
+    compares, against a local stub of the mHouse cloud, the time taken to have
+    all the devices registered on the cloud doing one registration per device
+    and doing a single bulk synchronization of the whole list of devices.
+
+    Usage: python benchmarks/bench_bulksync.py [devices] [cloud_latency_ms] [workers]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+
+import settings
+from stubcloud import StubCloud
+from cloudcommunicators.outbox import CloudOutbox
+import cloudcommunicators.mhouse_comm as mhouse_comm
+from cloudcommunicators.bulksync import BulkSync
+
+__author__ = "Jose Requeijo Dias"
+
+class BenchServices(object):
+    def __init__(self):
+        self.services = []
+
+class BenchDevice(object):
+    """
+        This is a lightweight stand-in for the Device resource, with the
+        attributes used by the cloud communicators.
+    """
+    def __init__(self, n):
+        self.id = n+1
+        self.name = "dev"+str(n)
+        self.address = "10.2.%d.%d" % (n/250, n%250+1)
+        self.port = 5683
+        self.device_type = 1
+        self.universal_id = None
+        self.timeout = 60
+        self.services = BenchServices()
+
+    def get_info(self):
+        return {"local_id": self.id, "name": self.name, "address": self.address,\
+                "port": self.port, "device_type": self.device_type,\
+                "universal_id": self.universal_id, "timeout": self.timeout}
+
+    def get_json(self):
+        return json.dumps(self.get_info())
+
+def prepare_cloud(devices, latency):
+    cloud = StubCloud(latency=latency).start()
+    settings.CLOUD_BASE_URL = cloud.base_url
+    # half of the devices were registered before the restart and a tenth
+    # of those changed their configurations while the Home Server was down
+    for n in range(0, devices, 2):
+        info = BenchDevice(n).get_info()
+        if n % 20 == 0:
+            info["timeout"] = 30
+        cloud.add_device(info)
+    cloud.requests.clear()
+    mhouse_comm.device_index.invalidate()
+    return cloud
+
+def one_by_one(devices, latency):
+    cloud = prepare_cloud(devices, latency)
+    try:
+        start = time.time()
+        for n in range(devices):
+            mhouse_comm.regist_device_on_cloud(BenchDevice(n))
+        elapsed = time.time() - start
+        return {"seconds": round(elapsed, 3), "cloud_requests": cloud.total_requests(),\
+                "cloud_devices": len(cloud.devices)}
+    finally:
+        cloud.stop()
+
+def bulk(devices, latency, workers):
+    cloud = prepare_cloud(devices, latency)
+    try:
+        start = time.time()
+        stats = BulkSync(workers=workers).sync([BenchDevice(n) for n in range(devices)])
+        elapsed = time.time() - start
+        return {"seconds": round(elapsed, 3), "cloud_requests": cloud.total_requests(),\
+                "cloud_devices": len(cloud.devices), "plan": stats}
+    finally:
+        cloud.stop()
+
+def run(devices=500, latency_ms=10, workers=settings.CLOUD_SYNC_WORKERS):
+    settings.USER_EMAIL = "bench@mhouse.local"
+    settings.USER_PASSWORD = "bench"
+    settings.HOME_SERVER_ID = 1
+
+    directory = tempfile.mkdtemp(prefix="outbox-")
+    mhouse_comm.outbox = CloudOutbox(directory)
+    try:
+        latency = latency_ms/1000.0
+        result = {"devices": devices, "cloud_latency_ms": latency_ms, "workers": workers,
+                  "one_by_one": one_by_one(devices, latency),
+                  "bulk_sync": bulk(devices, latency, workers)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
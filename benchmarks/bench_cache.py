@@ -0,0 +1,98 @@
+"""
+    This is the CoAP proxy cache benchmark.
+    It fills the cache layer of a reverse proxy with the responses of the
+    resources of a big home (a state and a type resource per device) and
+    measures the cache lookups, the invalidations made on every 2.04 Changed
+    response, the expiration of the responses and the memory cap.
+
+    Usage: python benchmarks/bench_cache.py [devices] [requests]
+"""
+import os
+import sys
+import json
+import time
+import random
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+from coapthon.layers.cachelayer import CacheLayer
+
+__author__ = "Jose Requeijo Dias"
+
+def transaction(path, code=defines.Codes.GET.number, payload=None):
+    request = Request()
+    request.source = ("10.0.0.1", 5683)
+    request.token = "tk"
+    request.type = defines.Types["CON"]
+    request.mid = 1
+    request.code = code
+    request.uri_path = path
+    request.payload = payload
+    return Transaction(request=request, timestamp=time.time())
+
+def origin_response(t, code, max_age=60, etag=None):
+    t.response = Response()
+    t.response.destination = t.request.source
+    t.response.token = t.request.token
+    t.response.code = code
+    t.response.payload = json.dumps({"path": t.request.uri_path, "state": [0]*20}) \
+        if code == defines.Codes.CONTENT.number else None
+    t.response.max_age = max_age
+    if etag is not None:
+        t.response.etag = etag
+    return t
+
+def request(layer, path, code=defines.Codes.GET.number, response_code=defines.Codes.CONTENT.number, **kwargs):
+    t = layer.receive_request(transaction(path, code))
+    if t.cacheHit is False:
+        t = layer.send_response(origin_response(t, response_code, **kwargs))
+    return t
+
+def run(devices=5000, requests=20000):
+    paths = ["devices/%d/%s" % (n, r) for n in range(devices) for r in ("state", "type")]
+    layer = CacheLayer(defines.REVERSE_PROXY, max_dim=len(paths))
+    start = time.time()
+    for p in paths:
+        request(layer, p, etag="e1")
+    fill = time.time() - start
+
+    rnd = random.Random(1)
+    lookups = [rnd.choice(paths) for n in range(requests)]
+    start = time.time()
+    for p in lookups:
+        request(layer, p)
+    hits = requests/(time.time() - start)
+
+    changed = ["devices/%d/state" % rnd.randrange(devices) for n in range(requests/10)]
+    start = time.time()
+    for p in changed:
+        request(layer, p, defines.Codes.PUT.number, defines.Codes.CHANGED.number)
+    invalidations = len(changed)/(time.time() - start)
+
+    start = time.time()
+    for p in changed:
+        request(layer, p, response_code=defines.Codes.VALID.number, etag="e1")
+    revalidations = len(changed)/(time.time() - start)
+
+    small = CacheLayer(defines.REVERSE_PROXY, max_dim=len(paths), max_bytes=256*1024)
+    for p in paths:
+        request(small, p, max_age=1)
+    capped = small.cache.get_stats()
+    time.sleep(1.1)
+    small.purge()
+
+    result = {"cached_responses": len(paths), "fill_per_sec": round(len(paths)/fill, 1),
+              "lookups_per_sec": round(hits, 1), "invalidations_per_sec": round(invalidations, 1),
+              "revalidations_per_sec": round(revalidations, 1), "stats": layer.cache.get_stats(),
+              "capped_stats": capped, "capped_after_max_age": small.cache.get_stats()}
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
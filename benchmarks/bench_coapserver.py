@@ -0,0 +1,65 @@
+"""
+    This is the Home Server load benchmark.
+    It runs a Home Server (server.coapserver.CoAPServer) working offline on
+    loopback and a load of virtual endpoints (benchmarks/loadgen.py), each
+    one with its own loopback address, running the real device lifecycle:
+    registration (POST /devices), observation of its state
+    (/devices/<id>/state), a state PUT every period seconds and the answers
+    to the liveness GETs of the Home Server. It reports the registration and
+    steady state throughput, the p50/p95/p99 latencies, the errors and
+    retransmissions, and the memory and threads of the Home Server, as JSON
+    for regression tracking.
+
+    Usage: python benchmarks/bench_coapserver.py [endpoints] [duration] [period_ms] [timeout] [concurrency]
+"""
+import os
+import sys
+import json
+import shutil
+import resource
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from loadgen import HomeServerProcess, LoadGenerator, process_status
+
+__author__ = "Jose Requeijo Dias"
+
+def run(endpoints=1000, duration=20, period_ms=5000, timeout=10, concurrency=50):
+    home_server = HomeServerProcess().start()
+    generator = None
+    try:
+        rss_start, threads_start = process_status(home_server.pid)
+        peak = {"rss_mb": rss_start, "threads": threads_start}
+
+        def sample():
+            rss, threads = process_status(home_server.pid)
+            peak["rss_mb"] = max(peak["rss_mb"], rss)
+            peak["threads"] = max(peak["threads"], threads)
+
+        generator = LoadGenerator(("127.0.0.1", home_server.port), endpoints, duration=duration,
+                                  period=period_ms/1000.0, timeout=timeout, concurrency=concurrency,
+                                  sample=sample)
+        result = generator.run()
+        rss_end, threads_end = process_status(home_server.pid)
+
+        result.update({"duration": duration, "period_ms": period_ms, "device_timeout": timeout,
+                       "concurrency": concurrency,
+                       "server_rss_start_mb": rss_start, "server_rss_end_mb": rss_end,
+                       "server_rss_peak_mb": peak["rss_mb"],
+                       "server_threads_start": threads_start, "server_threads_end": threads_end,
+                       "server_threads_peak": peak["threads"],
+                       "loadgen_maxrss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0, 1)})
+        for key, value in home_server.stop().iteritems():
+            result["server_" + key] = value
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        if generator is not None:
+            generator.close()
+        shutil.rmtree(home_server.work_dir, ignore_errors=True)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:6]]
+    run(*args)
@@ -0,0 +1,115 @@
+"""
+    This is the configurations fetch benchmark.
+    It measures the registration of a Home Server already registered (the
+    registration on the cloud and the fetch of its configurations and
+    services) against a local stub of the mHouse cloud, with value, property
+    and device types and services: fetching them one after the other and
+    rewriting every configuration file (as before), fetching them
+    concurrently on the first start, and on a restart when nothing changed on
+    the cloud (conditional requests answered with 304, no file rewritten).
+
+    Usage: python benchmarks/bench_config_fetch.py [types] [cloud_latency_ms] [runs]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+import settings
+from stubcloud import StubCloud
+from loadgen import deployment_logging, percentiles
+
+__author__ = "Jose Requeijo Dias"
+
+def cloud_configs(types):
+    """
+        This function returns the configurations of the cloud (as on its
+        /api/configs/), with the given number of each kind of type.
+    """
+    choices = [{"id": n+1, "name": "choice"+str(n), "value": "Choice "+str(n)} for n in range(types)]
+    scalars = [{"id": n+1, "name": "scalar"+str(n), "units": "%", "min_value": 0, "max_value": 100,
+                "step": 1, "default_value": 0} for n in range(types)]
+    enums = [{"id": n+1, "name": "enum"+str(n), "choices": [n+1, (n+1) % types + 1],
+              "default_value": n+1} for n in range(types)]
+    properties = [{"id": n+1, "name": "property"+str(n), "access_mode": "RW",
+                   "value_type_class": "SCALAR" if n % 2 else "ENUM", "value_type_id": n+1}
+                  for n in range(types)]
+    device_types = [{"id": n+1, "name": "type"+str(n), "properties": [n+1, (n+1) % types + 1]}
+                    for n in range(types)]
+    return {"device_types": device_types, "property_types": properties,
+            "value_types": {"scalars": scalars, "enums": enums, "choices": choices}}
+
+def files_state():
+    return [(os.stat(path).st_ino, os.stat(path).st_mtime) if os.path.isfile(path) else None
+            for path in (settings.DEVICE_TYPES_CONFIG_FILE, settings.PROPERTY_TYPES_CONFIG_FILE,
+                         settings.VALUE_TYPES_CONFIG_FILE, settings.SERVICES_CONFIG_FILE)]
+
+def measure(register, cloud, runs, clear):
+    """
+        This function runs the registration 'runs' times (clearing the stored
+        configurations before each one with clear) and returns its timings,
+        the cloud requests and the configuration files rewritten per run.
+    """
+    times, rewritten = [], 0
+    requests, not_modified = cloud.total_requests(), cloud.not_modified
+    for n in range(runs):
+        if clear:
+            for path in (settings.DEVICE_TYPES_CONFIG_FILE, settings.PROPERTY_TYPES_CONFIG_FILE,
+                         settings.VALUE_TYPES_CONFIG_FILE, settings.SERVICES_CONFIG_FILE,
+                         settings.CONFIGS_VALIDATORS_FILE):
+                if os.path.isfile(path):
+                    os.remove(path)
+        before = files_state()
+        start = time.time()
+        if not register():
+            raise Exception("Registration failed")
+        times.append(time.time() - start)
+        rewritten += len([1 for b, a in zip(before, files_state()) if b != a])
+    return {"seconds": percentiles(times),
+            "cloud_requests_per_run": round((cloud.total_requests() - requests)/float(runs), 1),
+            "not_modified_per_run": round((cloud.not_modified - not_modified)/float(runs), 1),
+            "files_rewritten_per_run": round(rewritten/float(runs), 1)}
+
+def run(types=200, cloud_latency_ms=50, runs=5):
+    work_dir = tempfile.mkdtemp()
+    cloud = StubCloud(latency=cloud_latency_ms/1000.0)
+    cloud.configs = cloud_configs(types)
+    cloud.services = [{"id": n+1, "name": "service"+str(n), "core_service_ref": None} for n in range(types)]
+    cloud.start()
+    try:
+        settings.CLOUD_BASE_URL = cloud.base_url
+        settings.SERVER_CONFIG_FILE = os.path.join(work_dir, "serverconf.json")
+        settings.DEVICE_TYPES_CONFIG_FILE = os.path.join(work_dir, "device_types.json")
+        settings.PROPERTY_TYPES_CONFIG_FILE = os.path.join(work_dir, "property_types.json")
+        settings.VALUE_TYPES_CONFIG_FILE = os.path.join(work_dir, "value_types.json")
+        settings.SERVICES_CONFIG_FILE = os.path.join(work_dir, "services.json")
+        settings.CONFIGS_VALIDATORS_FILE = os.path.join(work_dir, "validators.json")
+        with open(settings.SERVER_CONFIG_FILE, "w") as f:
+            json.dump({"id": 1, "name": "BenchHomeServer", "coap_address": "127.0.0.1", "coap_port": 5683,
+                       "proxy_address": "127.0.0.1", "proxy_port": 8080,
+                       "email": "bench@mhouse.local", "password": "bench"}, f)
+        deployment_logging(settings, work_dir)
+        import cloudcommunicators.register as register
+
+        def sequential():
+            register.load_server_confs()
+            return register.register_from_file() and register.get_configs() and register.get_services()
+
+        result = {"types": types, "services": types, "cloud_latency_ms": cloud_latency_ms, "runs": runs,
+                  "sequential": measure(sequential, cloud, runs, True),
+                  "concurrent_first_start": measure(register.register, cloud, runs, True),
+                  "concurrent_restart_unchanged": measure(register.register, cloud, runs, False)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        cloud.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
@@ -0,0 +1,151 @@
+"""
+    This is the configurations update benchmark.
+    It builds a Home Server (server.coapserver.CoAPServer, working offline and
+    not listening) with a home of registered devices of several device types,
+    and measures the configuration updates: per item upserts of value,
+    property and device types (which rebuild and revalidate only the
+    configurations and devices that depend on them), the update of a whole
+    list of value types with a single change (PUT /configs), and the full
+    rebuild and revalidation of every configuration and device, as needed
+    without the dependency graph. It checks that no device is left with a
+    stale device type or state.
+
+    Usage: python benchmarks/bench_configs_update.py [devices] [device_types] [runs]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from loadgen import home_server_settings, write_configs, percentiles
+
+__author__ = "Jose Requeijo Dias"
+
+PROPERTIES_PER_TYPE = 4
+
+def home_configs(device_types):
+    """
+        This function returns the configurations of the home: a scalar and an
+        enum value type for each device type, two property types of each, and
+        device types with their own properties and the shared property 1.
+    """
+    scalars = [{"id": n+1, "name": "scalar"+str(n), "units": "%", "min_value": 0, "max_value": 100,
+                "step": 1, "default_value": 0} for n in range(device_types)]
+    enums = [{"id": n+1, "name": "enum"+str(n), "choices": {"on": "On", "off": "Off"},
+              "default_value": "off"} for n in range(device_types)]
+    properties = []
+    for n in range(device_types):
+        for k in range(PROPERTIES_PER_TYPE/2):
+            properties.append({"id": len(properties)+1, "name": "level"+str(len(properties)),
+                               "access_mode": "RW", "value_type_class": "SCALAR", "value_type_id": n+1})
+            properties.append({"id": len(properties)+1, "name": "power"+str(len(properties)),
+                               "access_mode": "RW", "value_type_class": "ENUM", "value_type_id": n+1})
+    types = [{"id": n+1, "name": "type"+str(n),
+              "properties": sorted(set([1] + range(n*PROPERTIES_PER_TYPE+1, (n+1)*PROPERTIES_PER_TYPE+1)))}
+             for n in range(device_types)]
+    return {"value_types.json": {"SCALAR_TYPES": scalars, "ENUM_TYPES": enums},
+            "property_types.json": {"PROPERTY_TYPES": properties},
+            "device_types.json": {"DEVICE_TYPES": types}}
+
+def stale_devices(server):
+    """
+        This function returns the number of devices with a stale device type
+        or with a state that does not match its device type.
+    """
+    stale = 0
+    configs = server.configs
+    for dev in server.devices.devices.values():
+        dev_type = dev.device_type.type
+        props = [configs.property_types[p.id] for p in dev_type.properties]
+        if dev_type is not configs.device_types[int(dev.device_type_id)] or \
+           any(p is not configs.property_types[p.id] for p in dev_type.properties) or \
+           [s["property_id"] for s in dev.state.state] != [p.id for p in props] or \
+           not all(p.validate(s["value"]) for p, s in zip(props, dev.state.state)):
+            stale += 1
+    return stale
+
+def timed(runs, update):
+    times = []
+    for n in range(runs):
+        start = time.time()
+        update(n)
+        times.append(time.time() - start)
+    return percentiles(times)
+
+def run(devices=5000, device_types=50, runs=20):
+    work_dir = tempfile.mkdtemp()
+    try:
+        import settings
+        home_server_settings(settings, work_dir, 15800)
+        write_configs(work_dir)
+        for name, data in home_configs(device_types).iteritems():
+            with open(os.path.join(work_dir, name), "w") as f:
+                json.dump(data, f)
+        from server.coapserver import CoAPServer
+        server = CoAPServer(1, "BenchHomeServer")
+        configs = server.configs
+
+        start = time.time()
+        for n in range(devices):
+            server.devices.add_device({"name": "dev"+str(n), "device_type": n % device_types + 1,
+                                       "services": [], "timeout": 60},
+                                      "10.%d.%d.%d" % (n/62500, n/250 % 250, n % 250 + 1), 5683)
+        setup = time.time() - start
+
+        scalars = home_configs(device_types)["value_types.json"]["SCALAR_TYPES"]
+        last = scalars[-1]
+        shared = dict(scalars[0])
+        dev_type = {"id": 2, "name": "type1", "properties": configs.device_types[2].get_properties_ids()}
+
+        def upsert_scalar(scalar):
+            def update(n):
+                scalar["max_value"] = 100 - n % 2
+                configs.upsert_configs("SCALAR_TYPES", [scalar])
+            return update
+
+        def upsert_device_type(n):
+            dev_type["name"] = "type1-"+str(n)
+            configs.upsert_configs("DEVICE_TYPES", [dev_type])
+
+        def upsert_property_type(n):
+            # the value type class of the shared property changes, resetting its value on every device
+            configs.upsert_configs("PROPERTY_TYPES", [{"id": 1, "name": "level0", "access_mode": "RW",
+                                                       "value_type_class": "ENUM" if n % 2 else "SCALAR",
+                                                       "value_type_id": 1}])
+
+        def put_scalars(n):
+            last["max_value"] = 100 - n % 2
+            configs.update_server_configs({"SCALAR_TYPES": scalars}, "SCALAR_TYPES")
+
+        def full_rebuild(n):
+            with configs.lock:
+                nodes = [("PROPERTY_TYPES", id) for id in configs.property_types] + \
+                        [("DEVICE_TYPES", id) for id in configs.device_types] + \
+                        [("DEVICES", id) for id in server.devices.devices]
+                configs.revalidate(nodes)
+
+        result = {"devices": devices, "device_types": device_types, "runs": runs,
+                  "property_types": len(configs.property_types),
+                  "setup_seconds": round(setup, 1),
+                  "upsert_scalar_one_type": timed(runs, upsert_scalar(dict(last))),
+                  "upsert_scalar_all_devices": timed(runs, upsert_scalar(shared)),
+                  "upsert_device_type": timed(runs, upsert_device_type),
+                  "upsert_property_type_all_devices": timed(runs, upsert_property_type),
+                  "put_scalar_types_one_changed": timed(runs, put_scalars),
+                  "full_rebuild": timed(runs, full_rebuild),
+                  "stale_devices": stale_devices(server)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        server.close()
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
@@ -0,0 +1,98 @@
+"""
+    This is the CoAP resource discovery benchmark.
+    It registers the resources of a big home (four resources per device, with
+    the rt and if attributes set by the Home Server) on a local CoAPthon server
+    and measures the .well-known/core requests: the full document, a filtered
+    query (?rt=DeviceState), the rebuild after a device is added and a complete
+    Block2 download of the document by a client.
+
+    Usage: python benchmarks/bench_discovery.py [devices] [requests]
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+
+__author__ = "Jose Requeijo Dias"
+
+RESOURCES = [("", "Device"), ("/state", "DeviceState"), ("/type", "home_server"), ("/services", "DeviceServices")]
+
+def add_device(server, n):
+    for suffix, rt in RESOURCES:
+        resource = Resource(rt, server, visible=True, observable=True, allow_children=True)
+        resource.resource_type = rt
+        resource.interface_type = "if1"
+        resource.content_type = "application/json"
+        server.add_resource("devices/"+str(n)+suffix, resource)
+
+def discovery(query):
+    request = Request()
+    request.code = defines.Codes.GET.number
+    request.uri_path = defines.DISCOVERY_URL
+    if query:
+        request.uri_query = query
+    return Transaction(request=request, timestamp=time.time())
+
+def per_sec(server, query, requests):
+    transactions = [discovery(query) for n in range(requests)]
+    start = time.time()
+    for transaction in transactions:
+        transaction.response = Response()
+        server.resourceLayer.discover(transaction)
+    return round(requests/(time.time() - start), 1), len(transaction.response.payload)
+
+def run(devices=2500, requests=100):
+    port = 15683
+    server = CoAP(("127.0.0.1", port))
+    server.add_resource("devices/", Resource("DevicesList", server))
+    for n in range(devices):
+        add_device(server, n)
+
+    start = time.time()
+    full_rate, full_size = per_sec(server, None, 1)
+    first = time.time() - start
+    full_rate, full_size = per_sec(server, None, requests)
+    filtered_rate, filtered_size = per_sec(server, "rt=DeviceState", requests)
+
+    start = time.time()
+    for n in range(10):
+        add_device(server, devices+n)
+        per_sec(server, "rt=DeviceState", 1)
+    rebuild = (time.time() - start)/10
+
+    listener = threading.Thread(target=server.listen, args=(1,))
+    listener.start()
+    client = HelperClient(server=("127.0.0.1", port))
+    try:
+        start = time.time()
+        resp = client.discover(timeout=30)
+        download = time.time() - start
+        result = {"devices": devices, "resources": len(server.root) - 1,
+                  "first_discovery_ms": round(first*1000, 2),
+                  "full_discoveries_per_sec": full_rate, "document_bytes": full_size,
+                  "filtered_discoveries_per_sec": filtered_rate, "filtered_bytes": filtered_size,
+                  "rebuild_after_new_device_ms": round(rebuild*1000, 2),
+                  "block2_download_seconds": round(download, 3),
+                  "block2_download_bytes": len(resp.payload)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        client.stop()
+        server.close()
+        listener.join()
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
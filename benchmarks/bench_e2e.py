@@ -0,0 +1,178 @@
+"""
+    This is the end to end benchmark of the Home Server deployment (main.py).
+    It runs a local stub of the mHouse cloud (benchmarks/stubcloud.py), the
+    Home Server working with it, its HTTP proxy (proxy/proxy_main.py) and
+    virtual endpoints (benchmarks/loadgen.py) acting as actuators: when they
+    are notified of a new wanted state they apply it and PUT it as their
+    current state, which the Home Server notifies to the cloud.
+    Once the devices are registered on the cloud, HTTP clients drive the
+    proxy: dashboards polling GET /devices and users changing the state of
+    the devices with PUT /devices/<id>/state. It reports the HTTP latencies
+    and, for the state changes, the lag until the device applies it and until
+    the cloud is notified of the new state.
+
+    Usage: python benchmarks/bench_e2e.py [endpoints] [duration] [dashboards] [poll_ms] [users] [think_ms] [cloud_latency_ms]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import bisect
+import threading
+
+import requests
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from stubcloud import StubCloud
+from loadgen import HomeServerProcess, LoadGenerator, percentiles
+
+__author__ = "Jose Requeijo Dias"
+
+HEADERS = {"Accept": "application/json", "Content-Type": "application/json"}
+
+def dashboard(base_url, poll, stopped, latencies, statuses):
+    session = requests.Session()
+    while not stopped.is_set():
+        start = time.time()
+        try:
+            status = session.get(base_url+"devices", headers=HEADERS, timeout=30).status_code
+        except requests.RequestException:
+            status = "error"
+        latencies.append(time.time() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        stopped.wait(max(0, poll - (time.time() - start)))
+
+def user(base_url, devices, think, stopped, latencies, statuses, changes):
+    session = requests.Session()
+    levels = {}
+    n = 0
+    while not stopped.is_set() and devices:
+        device_id, address = devices[n % len(devices)]
+        n += 1
+        # a level different from the current one of the device
+        level = levels.get(address, 0) % 100 + 1
+        levels[address] = level
+        start = time.time()
+        try:
+            status = session.put(base_url+"devices/"+str(device_id)+"/state", headers=HEADERS,
+                                 data=json.dumps({"level": level}), timeout=30).status_code
+        except requests.RequestException:
+            status = "error"
+        latencies.append(time.time() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 200:
+            changes.append((address, level, start))
+        stopped.wait(max(0, think - (time.time() - start)))
+
+def lags(changes, events):
+    """
+        This function returns, for each state change (address, level, time),
+        the time until the first event (address, level, time) after it.
+    """
+    times = {}
+    for address, level, t in events:
+        times.setdefault((address, level), []).append(t)
+    for t in times.itervalues():
+        t.sort()
+    ret = []
+    for address, level, start in changes:
+        t = times.get((address, level), [])
+        i = bisect.bisect_left(t, start)
+        if i < len(t):
+            ret.append(t[i] - start)
+    return ret
+
+def cloud_events(cloud):
+    addresses = dict((uid, d["address"]) for uid, d in cloud.devices.items())
+    events = []
+    for uid, t, state in list(cloud.state_log):
+        for p in state:
+            if p["name"] == "level" and uid in addresses:
+                events.append((addresses[uid], int(p["value"]), t))
+    return events
+
+def run(endpoints=200, duration=20, dashboards=2, poll_ms=1000, users=4, think_ms=250, cloud_latency_ms=20):
+    cloud = StubCloud(latency=cloud_latency_ms/1000.0).start()
+    home_server = HomeServerProcess(cloud_url=cloud.base_url, proxy_port=18080,
+                                    overrides={"CLOUD_SYNC_STARTUP_DELAY": 2})
+    generator = None
+    try:
+        home_server.start()
+        base_url = "http://127.0.0.1:"+str(home_server.proxy_port)+"/"
+        generator = LoadGenerator(("127.0.0.1", home_server.port), endpoints, duration=3600, period=10.0,
+                                  timeout=30, silent_every=0, apply_wanted=True)
+        endpoints_result = []
+        generator_t = threading.Thread(target=lambda: endpoints_result.append(generator.run()))
+        generator_t.start()
+
+        # the devices must be registered on the Home Server and on the cloud
+        start = time.time()
+        while generator.steady is None or len(cloud.devices) < generator.registered:
+            if time.time() - start > 120:
+                raise Exception("Devices not registered on the cloud")
+            time.sleep(0.2)
+        setup = time.time() - start
+        time.sleep(1)
+
+        devices = [(e.device_id, e.address) for e in generator.endpoints if e.device_id is not None]
+        stopped = threading.Event()
+        dashboard_latencies, dashboard_statuses = [], {}
+        user_latencies, user_statuses, changes = [], {}, []
+        threads = [threading.Thread(target=dashboard, args=(base_url, poll_ms/1000.0, stopped,
+                                                            dashboard_latencies, dashboard_statuses))
+                   for n in range(dashboards)]
+        threads += [threading.Thread(target=user, args=(base_url, devices[n::users], think_ms/1000.0, stopped,
+                                                        user_latencies, user_statuses, changes))
+                    for n in range(users)]
+        cloud_requests = cloud.total_requests()
+        for t in threads:
+            t.start()
+        time.sleep(duration)
+        stopped.set()
+        for t in threads:
+            t.join()
+        # the last changes reach the devices and the cloud
+        time.sleep(3)
+        cloud_requests = cloud.total_requests() - cloud_requests
+
+        generator.stop()
+        generator_t.join()
+        device_lags = lags(changes, generator.applied)
+        cloud_lags = lags(changes, cloud_events(cloud))
+
+        result = {"endpoints": endpoints, "duration": duration, "dashboards": dashboards, "poll_ms": poll_ms,
+                  "users": users, "think_ms": think_ms, "cloud_latency_ms": cloud_latency_ms,
+                  "setup_seconds": round(setup, 1),
+                  "registered": generator.registered,
+                  "cloud_devices": len(cloud.devices),
+                  "dashboard_get_devices": percentiles(dashboard_latencies),
+                  "dashboard_statuses": dashboard_statuses,
+                  "dashboard_requests_per_sec": round(len(dashboard_latencies)/float(duration), 1),
+                  "user_put_state": percentiles(user_latencies),
+                  "user_statuses": user_statuses,
+                  "user_requests_per_sec": round(len(user_latencies)/float(duration), 1),
+                  "state_changes": len(changes),
+                  "device_lag": percentiles(device_lags),
+                  "cloud_lag": percentiles(cloud_lags),
+                  "cloud_lost": len(changes) - len(cloud_lags),
+                  "cloud_requests_per_sec": round(cloud_requests/float(duration + 3), 1),
+                  "coap_retransmissions": endpoints_result[0]["client_retransmissions"] if endpoints_result
+                                          else None}
+        for key, value in home_server.stop().iteritems():
+            result["server_" + key] = value
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        if generator is not None:
+            generator.stop()
+            generator.close()
+        cloud.stop()
+        shutil.rmtree(home_server.work_dir, ignore_errors=True)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:8]]
+    run(*args)
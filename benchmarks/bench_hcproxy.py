@@ -0,0 +1,101 @@
+"""
+    This is the HTTP-CoAP proxy load test.
+    It puts the CoAPthon HTTP-CoAP proxy in front of a local home server whose
+    device state resource takes some milliseconds to answer and measures the
+    requests per second served to concurrent HTTP clients on persistent
+    connections, for a serving mode of the proxy (workers: -1 one request at a
+    time, 0 a thread per connection, N a pool of N threads).
+
+    Usage: python benchmarks/bench_hcproxy.py [clients] [requests_per_client] [upstream_delay_ms] [workers]
+"""
+import os
+import sys
+import json
+import time
+import httplib
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.http_proxy.http_coap_proxy import HCProxy
+from coapthon.resources.resource import Resource
+
+__author__ = "Jose Requeijo Dias"
+
+class SlowDeviceState(Resource):
+    def __init__(self, delay):
+        super(SlowDeviceState, self).__init__("SlowDeviceState", observable=False)
+        self.delay = delay
+        self.payload = (defines.Content_types["application/json"], json.dumps({"state": "on"}))
+        self.etag = "v1"
+        self.max_age = 30
+
+    def render_GET(self, request):
+        time.sleep(self.delay)
+        return self
+
+def client_body(port, requests, results, headers):
+    conn = httplib.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        for n in range(requests):
+            conn.request("GET", "/coap://127.0.0.1:15683/state")
+            resp = conn.getresponse()
+            resp.read()
+            results.append(resp.status == 200)
+            if n == 0:
+                headers.update(resp.getheaders())
+        # revalidation of the representation the client already has
+        conn.request("GET", "/coap://127.0.0.1:15683/state", headers={"If-None-Match": headers.get("etag", "")})
+        resp = conn.getresponse()
+        resp.read()
+        results.append(resp.status == 304)
+    except Exception:
+        results.append(False)
+    finally:
+        conn.close()
+
+def run(clients=20, requests=10, delay=20, workers=defines.HC_PROXY_WORKERS):
+    server_port, proxy_port = 15683, 18080
+    server = CoAP(("127.0.0.1", server_port))
+    server.add_resource("state/", SlowDeviceState(delay/1000.0))
+    server_t = threading.Thread(target=server.listen, args=(1,))
+    server_t.start()
+
+    proxy = HCProxy(hc_port=proxy_port, workers=workers if workers >= 0 else None)
+    proxy_t = threading.Thread(target=proxy.run)
+    proxy_t.start()
+    while proxy.server is None:
+        time.sleep(0.01)
+
+    try:
+        results = []
+        headers = {}
+        threads = [threading.Thread(target=client_body, args=(proxy_port, requests, results, headers))
+                   for n in range(clients)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        result = {"clients": clients, "requests_per_client": requests + 1, "upstream_delay_ms": delay,
+                  "workers": workers,
+                  "requests_per_sec": round(len(results)/elapsed, 1),
+                  "seconds": round(elapsed, 3),
+                  "successful": results.count(True),
+                  "upstream_clients": len(proxy.pool._clients),
+                  "response_headers": dict((k, v) for k, v in headers.items()
+                                           if k in ("cache-control", "etag", "content-type", "content-length"))}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        proxy.close()
+        server.close()
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:5]]
+    run(*args)
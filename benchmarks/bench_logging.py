@@ -0,0 +1,143 @@
+"""
+    This is the logging overhead benchmark.
+    It measures the cost of the per datagram debug log line of the CoAP layers,
+    formatted eagerly (as it was) and lazily, and the time per request of a
+    local CoAP server and client with the coapthon logs disabled, written to a
+    file by the logging thread (FileHandler) and written by a background
+    thread (utils.QueueFileHandler), also on a slow storage (as the SD card of
+    a Raspberry Pi) where every flush of the log file takes some milliseconds.
+
+    Usage: python benchmarks/bench_logging.py [requests] [log_calls] [slow_flush_ms]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+from coapthon.messages.request import Request
+from utils import QueueFileHandler
+
+__author__ = "Jose Requeijo Dias"
+
+class DeviceState(Resource):
+    def __init__(self):
+        super(DeviceState, self).__init__("DeviceState", observable=False)
+        self.payload = (defines.Content_types["application/json"], json.dumps({"state": "on"}))
+
+class SlowFile(object):
+    def __init__(self, f, delay):
+        self.f = f
+        self.delay = delay
+
+    def write(self, data):
+        self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+        time.sleep(self.delay)
+
+    def close(self):
+        self.f.close()
+
+def slow(handler, delay):
+    handler.stream = SlowFile(handler.stream, delay)
+    return handler
+
+def configure(handler, level):
+    logger = logging.getLogger("coapthon")
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+        h.close()
+    logger.propagate = 0
+    logger.setLevel(level)
+    if handler is not None:
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(threadName)-10s - %(name)s - "
+                                               "%(levelname)s - %(message)s"))
+        logger.addHandler(handler)
+
+def log_calls(calls):
+    logger = logging.getLogger("coapthon.bench")
+    message = Request()
+    message.code = defines.Codes.GET.number
+    message.type = defines.Types["CON"]
+    message.mid = 1
+    message.token = "abcd"
+    message.uri_path = "devices/1/state"
+    message.destination = ("127.0.0.1", 5683)
+
+    start = time.time()
+    for n in range(calls):
+        logger.debug("receive_datagram - " + str(message))
+    eager = time.time() - start
+    start = time.time()
+    for n in range(calls):
+        logger.debug("receive_datagram - %s", message)
+    lazy = time.time() - start
+    return round(eager*1000000/calls, 2), round(lazy*1000000/calls, 2)
+
+def requests_time(port, requests):
+    client = HelperClient(server=("127.0.0.1", port))
+    try:
+        start = time.time()
+        for n in range(requests):
+            client.get("state")
+        return round((time.time() - start)*1000000/requests, 1)
+    finally:
+        client.stop()
+
+def run(requests=2000, calls=100000, flush=2):
+    port = 15683
+    server = CoAP(("127.0.0.1", port))
+    server.add_resource("state/", DeviceState())
+    server_t = threading.Thread(target=server.listen, args=(1,))
+    server_t.start()
+    log_dir = tempfile.mkdtemp()
+
+    try:
+        result = {"requests": requests, "log_calls": calls}
+        configure(None, logging.INFO)
+        eager, lazy = log_calls(calls)
+        result["debug_off_eager_log_call_us"] = eager
+        result["debug_off_lazy_log_call_us"] = lazy
+        result["debug_off_request_us"] = requests_time(port, requests)
+
+        configure(logging.FileHandler(os.path.join(log_dir, "file.log"), "w"), logging.DEBUG)
+        result["debug_on_filehandler_request_us"] = requests_time(port, requests)
+
+        configure(QueueFileHandler(os.path.join(log_dir, "queue.log"), "w"), logging.DEBUG)
+        result["debug_on_queuehandler_request_us"] = requests_time(port, requests)
+
+        configure(slow(logging.FileHandler(os.path.join(log_dir, "slow_file.log"), "w"), flush/1000.0),
+                  logging.DEBUG)
+        result["slow_storage_filehandler_request_us"] = requests_time(port, requests)
+
+        configure(slow(QueueFileHandler(os.path.join(log_dir, "slow_queue.log"), "w"), flush/1000.0),
+                  logging.DEBUG)
+        result["slow_storage_queuehandler_request_us"] = requests_time(port, requests)
+        configure(None, logging.INFO)
+        result["slow_flush_ms"] = flush
+
+        lines = [sum(1 for l in open(os.path.join(log_dir, f))) for f in ("file.log", "queue.log")]
+        result["log_lines_filehandler"], result["log_lines_queuehandler"] = lines
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        server.close()
+        for f in os.listdir(log_dir):
+            os.remove(os.path.join(log_dir, f))
+        os.rmdir(log_dir)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
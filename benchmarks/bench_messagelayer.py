@@ -0,0 +1,93 @@
+"""
+    This is the CoAP message layer benchmark.
+    It fills the message layer of the Home Server with many live transactions
+    (as after a burst of requests from many devices) and measures how many
+    incoming datagrams per second can be deserialized and matched against the
+    transaction tables (new requests, duplicates and empty ACKs), and how long
+    the periodic purge takes.
+
+    Usage: python benchmarks/bench_messagelayer.py [live_transactions] [datagrams]
+"""
+import os
+import sys
+import json
+import time
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.messages.message import Message
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from coapthon.layers.messagelayer import MessageLayer
+
+__author__ = "Jose Requeijo Dias"
+
+def source(n):
+    return ("10.%d.%d.%d" % (n/65536 % 256, n/256 % 256, n % 256), 5683 + n % 7)
+
+def request_datagram(n, mid):
+    request = Request()
+    request.type = defines.Types["CON"]
+    request.code = defines.Codes.GET.number
+    request.mid = mid
+    request.token = "t%05d" % (n % 100000)
+    request.uri_path = "devices/"+str(n % 5000)+"/state"
+    return Serializer().serialize(request)
+
+def ack_datagram(mid):
+    message = Message()
+    message.type = defines.Types["ACK"]
+    message.code = defines.Codes.EMPTY.number
+    message.mid = mid
+    return Serializer().serialize(message)
+
+def receive(layer, datagrams):
+    start = time.time()
+    for data, address in datagrams:
+        message = Serializer().deserialize(data, address)
+        if isinstance(message, Request):
+            layer.receive_request(message)
+        else:
+            layer.receive_empty(message)
+    return len(datagrams)/(time.time() - start)
+
+def run(live=100000, datagrams=20000):
+    layer = MessageLayer(1)
+    fill = [(request_datagram(n, n % 65535), source(n)) for n in range(live)]
+    start = time.time()
+    receive(layer, fill)
+    fill_time = time.time() - start
+
+    new = [(request_datagram(live+n, n % 65535), source(live+n)) for n in range(datagrams)]
+    duplicated = [fill[(n*7919) % live] for n in range(datagrams)]
+    acks = [(ack_datagram(n % 65535), source(n)) for n in range(datagrams)]
+
+    result = {"live_transactions": live, "datagrams": datagrams,
+              "fill_seconds": round(fill_time, 3),
+              "new_requests_per_sec": round(receive(layer, new), 1),
+              "duplicates_per_sec": round(receive(layer, duplicated), 1),
+              "empty_acks_per_sec": round(receive(layer, acks), 1)}
+
+    # nothing expired yet, then everything expired
+    start = time.time()
+    layer.purge()
+    result["purge_nothing_expired_ms"] = round((time.time() - start)*1000, 3)
+
+    now = time.time
+    start = now()
+    time.time = lambda: now() + defines.EXCHANGE_LIFETIME + 1
+    try:
+        layer.purge()
+    finally:
+        time.time = now
+    result["purge_all_expired_ms"] = round((time.time() - start)*1000, 3)
+    result["transactions_left"] = len(layer._transactions) + len(layer._transactions_token)
+
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
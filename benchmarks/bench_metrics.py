@@ -0,0 +1,111 @@
+"""
+    This is the metrics overhead benchmark.
+    It measures the time per request of a local CoAP server and client, and
+    the time of the handling of a request inside the server (the layers, the
+    rendering and send_datagram, without the network and the client), with
+    the server instrumentation disabled and enabled (histograms of every layer
+    stage, of the rendering of each resource type and of send_datagram, plus
+    the request, error and in flight counters) and the time to export the
+    metrics in the Prometheus text format.
+
+    Usage: python benchmarks/bench_metrics.py [requests] [rounds]
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.metrics import Metrics
+from coapthon.messages.request import Request
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+
+__author__ = "Jose Requeijo Dias"
+
+class DeviceState(Resource):
+    def __init__(self):
+        super(DeviceState, self).__init__("DeviceState", observable=False)
+        self.payload = (defines.Content_types["application/json"], json.dumps({"state": "on"}))
+
+def requests_time(port, requests, metrics):
+    server = CoAP(("127.0.0.1", port), metrics=metrics)
+    server.add_resource("state/", DeviceState())
+    server_t = threading.Thread(target=server.listen, args=(1,))
+    server_t.start()
+    client = HelperClient(server=("127.0.0.1", port))
+    try:
+        client.get("state")
+        start = time.time()
+        for n in range(requests):
+            client.get("state")
+            client.get("missing")
+        return (time.time() - start)*1000000/(2*requests)
+    finally:
+        client.stop()
+        server.close()
+        server_t.join()
+
+def handling_time(port, requests, metrics):
+    server = CoAP(("127.0.0.1", port), metrics=metrics)
+    server.add_resource("state/", DeviceState())
+    try:
+        transactions = []
+        for n in range(requests):
+            request = Request()
+            request.code = defines.Codes.GET.number
+            request.type = defines.Types["NON"]
+            request.mid = n
+            request.token = str(n)
+            request.uri_path = "state"
+            request.source = ("127.0.0.1", port + 1)
+            request.destination = ("127.0.0.1", port)
+            transactions.append(server._messageLayer.receive_request(request))
+        start = time.time()
+        for transaction in transactions:
+            server.receive_request(transaction)
+        return (time.time() - start)*1000000/requests
+    finally:
+        server.close()
+
+def run(requests=1000, rounds=3):
+    port = 15683
+    try:
+        off, on, handling_off, handling_on = [], [], [], []
+        for r in range(rounds):
+            handling_off.append(handling_time(port, requests, None))
+            handling_on.append(handling_time(port, requests, Metrics()))
+            off.append(requests_time(port, requests, None))
+            metrics = Metrics()
+            on.append(requests_time(port, requests, metrics))
+
+        start = time.time()
+        for n in range(100):
+            text = metrics.render()
+        render = (time.time() - start)*1000/100
+
+        result = {"requests": 2*requests, "rounds": rounds,
+                  "metrics_off_request_us": round(min(off), 1),
+                  "metrics_on_request_us": round(min(on), 1),
+                  "handling_metrics_off_us": round(min(handling_off), 1),
+                  "handling_metrics_on_us": round(min(handling_on), 1),
+                  "render_ms": round(render, 3),
+                  "series": len([l for l in text.splitlines() if not l.startswith("#")]),
+                  "requests_total": metrics.value("coap_requests_total", (("method", "GET"),)),
+                  "errors_total": metrics.value("coap_errors_total", (("code", "NOT_FOUND"),)),
+                  "render_DeviceState_count":
+                      metrics.histogram("coap_render_seconds", (("resource", "DeviceState"),
+                                                                ("method", "get_resource"))).count}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,112 @@
+"""
+    This is the CoAP observe relay benchmark.
+    It puts the CoAPthon reverse proxy in front of a local home server with an
+    observable device state, registers many observers (e.g. dashboards) on the
+    proxy and changes the state a number of times, checking that every observer
+    gets every notification while the home server only has one observer.
+
+    Usage: python benchmarks/bench_observe_relay.py [observers] [changes]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.reverse_proxy.coap import CoAP as ReverseProxy
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+
+__author__ = "Jose Requeijo Dias"
+
+class DeviceState(Resource):
+    def __init__(self):
+        super(DeviceState, self).__init__("DeviceState", observable=True)
+        self.value = 0
+        self.renders = 0
+
+    def render_GET(self, request):
+        self.renders += 1
+        self.payload = (defines.Content_types["application/json"], json.dumps({"state": self.value}))
+        return self
+
+def run(observers=50, changes=10):
+    server_port, proxy_port = 15683, 15684
+    server = CoAP(("127.0.0.1", server_port))
+    state = DeviceState()
+    server.add_resource("state/", state)
+    server_t = threading.Thread(target=server.listen, args=(1,))
+    server_t.start()
+
+    xml = tempfile.NamedTemporaryFile(suffix=".xml", delete=False)
+    xml.write("<servers><server name=\"home\">127.0.0.1:%d</server></servers>" % server_port)
+    xml.close()
+    proxy = ReverseProxy(("127.0.0.1", proxy_port), xml.name)
+    proxy_t = threading.Thread(target=proxy.listen, args=(1,))
+    proxy_t.start()
+
+    clients = []
+    received = {}
+    lock = threading.Lock()
+
+    def callback(n):
+        def notification(response):
+            if response is None:
+                # client stopped
+                return
+            with lock:
+                received.setdefault(n, set()).add(json.loads(response.payload)["state"])
+        return notification
+
+    try:
+        start = time.time()
+        for n in range(observers):
+            client = HelperClient(server=("127.0.0.1", proxy_port))
+            client.observe("home/state", callback(n))
+            clients.append(client)
+        while len(received) < observers and time.time() - start < 30:
+            time.sleep(0.05)
+        registration = time.time() - start
+
+        start = time.time()
+        for v in range(1, changes + 1):
+            state.value = v
+            state.observe_count += 1
+            server.notify(state)
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                with lock:
+                    if all(v in values for values in received.values()) and len(received) == observers:
+                        break
+                time.sleep(0.005)
+        fanout = time.time() - start
+
+        complete = sum(1 for values in received.values() if len(values) == changes + 1)
+        result = {"observers": observers, "changes": changes,
+                  "registration_seconds": round(registration, 3),
+                  "notification_fanout_ms": round(fanout*1000/changes, 2),
+                  "observers_with_all_notifications": complete,
+                  "upstream_observers": len(server._observeLayer._relations),
+                  "upstream_renders": state.renders,
+                  "upstream_observations_on_proxy": proxy._forwardLayer._relay.size()}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        for client in clients:
+            client.protocol.stopped.set()
+        for client in clients:
+            client.stop()
+        proxy.close()
+        server.close()
+        os.remove(xml.name)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,88 @@
+"""
+    This is the cloud outbox benchmark.
+    It fills a cloud outbox with the events generated by a home with several
+    devices while the cloud is down (many state updates per device, which are
+    compacted to the latest one), and then measures how fast those events are
+    replayed against a local stub of the mHouse cloud.
+
+    Usage: python benchmarks/bench_outbox.py [devices] [updates_per_device]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+
+import settings
+from stubcloud import StubCloud
+from cloudcommunicators.outbox import CloudOutbox
+import cloudcommunicators.mhouse_comm as mhouse_comm
+
+__author__ = "Jose Requeijo Dias"
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path))
+
+def run(devices=500, updates=20):
+    cloud = StubCloud().start()
+    settings.CLOUD_BASE_URL = cloud.base_url
+    settings.USER_EMAIL = "bench@mhouse.local"
+    settings.USER_PASSWORD = "bench"
+    settings.HOME_SERVER_ID = 1
+
+    directory = tempfile.mkdtemp(prefix="outbox-")
+    try:
+        outbox = CloudOutbox(directory, segment_size=64*1024, max_size=4*1024*1024)
+
+        start = time.time()
+        for n in range(devices):
+            address = "10.0.%d.%d" % (n/250, n%250+1)
+            if n % 2 == 0:
+                # already registered on the cloud, only the state is pending
+                dev = cloud.add_device({"address": address, "name": "dev"+str(n)})
+                universal_id = dev["id"]
+            else:
+                universal_id = None
+                outbox.put("register", address, {"local_id": n, "name": "dev"+str(n),\
+                                                "address": address, "port": 5683,\
+                                                "device_type": 1, "universal_id": None,\
+                                                "timeout": 60})
+            for u in range(updates):
+                outbox.put("state", address, {"universal_id": universal_id,\
+                                              "current_state": [{"property_id": 1,\
+                                                                 "name": "power",\
+                                                                 "value": float(u)}]})
+        enqueue_time = time.time() - start
+        total_events = devices*updates + devices/2
+
+        outbox.compact()
+        pending = outbox.pending()
+        disk = directory_size(directory)
+
+        start = time.time()
+        sent, done = outbox.drain(mhouse_comm.send_outbox_record)
+        replay_time = time.time() - start
+
+        result = {"devices": devices, "events_generated": total_events,
+                  "enqueue_events_per_sec": round(total_events/enqueue_time, 1),
+                  "pending_after_compaction": pending,
+                  "disk_bytes_after_compaction": disk,
+                  "replayed": sent, "replay_complete": done,
+                  "replay_seconds": round(replay_time, 3),
+                  "replay_events_per_sec": round(sent/replay_time, 1) if replay_time else None,
+                  "cloud_requests": cloud.requests,
+                  "cloud_states_received": len(cloud.states)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        cloud.stop()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
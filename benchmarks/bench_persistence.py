@@ -0,0 +1,124 @@
+"""
+    This is the configuration files persistence benchmark.
+    It builds a Home Server (server.coapserver.CoAPServer, working offline and
+    not listening) with many value, property and device types and measures a
+    burst of configuration updates (per item upserts of scalar value types, as
+    POST /configs does): writing the value types file on every update, in
+    place (as before), and with the write-behind writer (persistence.py),
+    which writes it on the background once per burst (the bursts are apart
+    by twice settings.PERSISTENCE_DELAY). A reader thread keeps
+    loading the file during the updates and counts the partial files it finds.
+
+    Usage: python benchmarks/bench_persistence.py [types] [updates] [runs]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from loadgen import home_server_settings, write_configs, percentiles
+from bench_configs_update import home_configs
+
+__author__ = "Jose Requeijo Dias"
+
+class FileReader(threading.Thread):
+    """
+        This thread loads the file at path until it is stopped and counts the
+        loads that found a partial (not valid JSON) file.
+    """
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.stopped = threading.Event()
+        self.loads = 0
+        self.partial = 0
+
+    def run(self):
+        while not self.stopped.isSet():
+            try:
+                with open(self.path, "r") as f:
+                    json.load(f)
+            except ValueError:
+                self.partial += 1
+            except IOError:
+                continue
+            self.loads += 1
+
+def burst(configs, scalars, updates, n):
+    """
+        This function upserts the given number of scalar value types and
+        returns the time of each upsert.
+    """
+    times = []
+    for k in range(updates):
+        scalar = dict(scalars[k % len(scalars)])
+        scalar["max_value"] = 100 - (n + k) % 2
+        start = time.time()
+        configs.upsert_configs("SCALAR_TYPES", [scalar])
+        times.append(time.time() - start)
+    return times
+
+def measure(configs, scalars, updates, runs, path, persistence, first=0):
+    times = []
+    reader = FileReader(path)
+    reader.start()
+    writes = persistence.writer.writes
+    for n in range(first, first + runs):
+        times += burst(configs, scalars, updates, n)
+        # the bursts are apart, as the updates of the cloud or of an user
+        time.sleep(persistence.writer.delay * 2)
+    persistence.flush()
+    reader.stopped.set()
+    reader.join()
+    return {"upsert_seconds": percentiles(times),
+            "file_writes_per_burst": round((persistence.writer.writes - writes)/float(runs), 1),
+            "reader_loads": reader.loads,
+            "reader_partial_files": reader.partial}
+
+def run(types=500, updates=50, runs=5):
+    work_dir = tempfile.mkdtemp()
+    try:
+        import settings
+        home_server_settings(settings, work_dir, 15900)
+        write_configs(work_dir)
+        for name, data in home_configs(types).iteritems():
+            with open(os.path.join(work_dir, name), "w") as f:
+                json.dump(data, f)
+        import persistence
+        from server.coapserver import CoAPServer
+        server = CoAPServer(1, "BenchHomeServer")
+        configs = server.configs
+        scalars = home_configs(types)["value_types.json"]["SCALAR_TYPES"]
+        path = settings.VALUE_TYPES_CONFIG_FILE
+
+        def save_in_place():
+            fp = open(str(path), "w")
+            json.dump(configs.get_all_value_types()["VALUE_TYPES"], fp)
+            fp.close()
+            persistence.writer.writes += 1
+
+        write_behind = configs.save_value_types_to_file
+        configs.save_value_types_to_file = save_in_place
+        in_place = measure(configs, scalars, updates, runs, path, persistence)
+        configs.save_value_types_to_file = write_behind
+        result = {"types": types, "updates_per_burst": updates, "runs": runs,
+                  "file_bytes": os.path.getsize(path),
+                  "in_place": in_place,
+                  "write_behind": measure(configs, scalars, updates, runs, path, persistence, runs)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        server.close()
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
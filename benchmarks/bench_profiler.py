@@ -0,0 +1,90 @@
+"""
+    This is the sampling profiler overhead benchmark.
+    It measures the time per request of a local CoAP server and client, with
+    some idle threads around (as the Home Server monitoring and cloud
+    threads), without a profile and while a profile of all the threads is
+    being taken, and the cost of each sample.
+
+    Usage: python benchmarks/bench_profiler.py [requests] [idle_threads] [interval_ms] [rounds]
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.profiler import SamplingProfiler
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+
+__author__ = "Jose Requeijo Dias"
+
+class DeviceState(Resource):
+    def __init__(self):
+        super(DeviceState, self).__init__("DeviceState", observable=False)
+        self.payload = (defines.Content_types["application/json"], json.dumps({"state": "on"}))
+
+def requests_time(client, requests):
+    start = time.time()
+    for n in range(requests):
+        client.get("state")
+    return (time.time() - start)*1000000/requests
+
+def run(requests=2000, idle=20, interval=10, rounds=3):
+    port = 15683
+    server = CoAP(("127.0.0.1", port))
+    server.add_resource("state/", DeviceState())
+    server_t = threading.Thread(target=server.listen, args=(1,))
+    server_t.start()
+    stopped = threading.Event()
+    for n in range(idle):
+        t = threading.Thread(target=stopped.wait, name="Idle-"+str(n))
+        t.daemon = True
+        t.start()
+    client = HelperClient(server=("127.0.0.1", port))
+
+    try:
+        client.get("state")
+        without, during = [], []
+        for r in range(rounds):
+            without.append(requests_time(client, requests))
+
+            # the profile lasts about as long as the requests
+            duration = requests*without[-1]/1000000
+            profiles = []
+            profiler_t = threading.Thread(target=lambda: profiles.append(
+                SamplingProfiler(interval/1000.0).profile(duration)))
+            profiler_t.start()
+            during.append(requests_time(client, requests))
+            profiler_t.join()
+            profiler = profiles[0]
+
+        start = time.time()
+        for n in range(100):
+            for ident, frame in sys._current_frames().items():
+                profiler._sample("Thread", frame)
+        sample = (time.time() - start)*1000000/100
+
+        result = {"requests": requests, "idle_threads": idle, "interval_ms": interval, "rounds": rounds,
+                  "request_us": round(min(without), 1),
+                  "request_while_profiling_us": round(min(during), 1),
+                  "sample_us": round(sample, 1),
+                  "samples": profiler.samples,
+                  "stacks": len(profiler.stacks),
+                  "collapsed_bytes": len(profiler.collapsed())}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        stopped.set()
+        client.stop()
+        server.close()
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:5]]
+    run(*args)
@@ -0,0 +1,69 @@
+"""
+    This is the device registration benchmark.
+    It emulates a registration storm (every device of a home registering again
+    after a Home Server restart) against a local stub of the mHouse cloud, and
+    compares the number of cloud requests and the time taken with the cloud
+    device index disabled (fetched on every registration) and enabled.
+
+    Usage: python benchmarks/bench_registration.py [devices] [cloud_latency_ms]
+"""
+import os
+import sys
+import json
+import time
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+
+import settings
+from stubcloud import StubCloud
+import cloudcommunicators.mhouse_comm as mhouse_comm
+
+__author__ = "Jose Requeijo Dias"
+
+def device_info(n):
+    return {"local_id": n+1, "name": "dev"+str(n), "address": "10.1.%d.%d" % (n/250, n%250+1),\
+            "port": 5683, "device_type": 1, "universal_id": None, "timeout": 60}
+
+def registration_storm(devices, latency, max_age):
+    cloud = StubCloud(latency=latency).start()
+    settings.CLOUD_BASE_URL = cloud.base_url
+    try:
+        # half of the devices were already registered on the cloud before the restart
+        for n in range(0, devices, 2):
+            cloud.add_device(device_info(n))
+        cloud.requests.clear()
+
+        mhouse_comm.device_index.max_age = max_age
+        mhouse_comm.device_index.invalidate()
+
+        client = mhouse_comm.open_cloud_session()
+        start = time.time()
+        for n in range(devices):
+            mhouse_comm.send_device_registration(client, device_info(n))
+        elapsed = time.time() - start
+
+        return {"seconds": round(elapsed, 3),
+                "registrations_per_sec": round(devices/elapsed, 1),
+                "cloud_requests": cloud.total_requests() - 1,
+                "device_list_fetches": cloud.requests.get("GET /api/devices/", 0),
+                "cloud_devices": len(cloud.devices)}
+    finally:
+        cloud.stop()
+
+def run(devices=500, latency_ms=2):
+    settings.USER_EMAIL = "bench@mhouse.local"
+    settings.USER_PASSWORD = "bench"
+    settings.HOME_SERVER_ID = 1
+
+    result = {"devices": devices, "cloud_latency_ms": latency_ms,
+              "without_index": registration_storm(devices, latency_ms/1000.0, -1),
+              "with_index": registration_storm(devices, latency_ms/1000.0,\
+                                                settings.CLOUD_DEVICE_INDEX_MAX_AGE)}
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
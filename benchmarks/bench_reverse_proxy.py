@@ -0,0 +1,89 @@
+"""
+    This is the CoAP reverse proxy benchmark.
+    It puts the CoAPthon reverse proxy in front of a local home server whose
+    device state resource takes some milliseconds to answer (as when the device
+    itself has to be queried) and measures how many concurrent clients the
+    proxy serves, and how many upstream clients it opens to do so.
+
+    Usage: python benchmarks/bench_reverse_proxy.py [clients] [requests_per_client] [upstream_delay_ms]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.server.coap import CoAP
+from coapthon.reverse_proxy.coap import CoAP as ReverseProxy
+from coapthon.resources.resource import Resource
+from coapthon.client.helperclient import HelperClient
+
+__author__ = "Jose Requeijo Dias"
+
+class SlowDeviceState(Resource):
+    def __init__(self, delay):
+        super(SlowDeviceState, self).__init__("SlowDeviceState", observable=False)
+        self.delay = delay
+        self.payload = (defines.Content_types["application/json"], json.dumps({"state": "on"}))
+
+    def render_GET(self, request):
+        time.sleep(self.delay)
+        return self
+
+def client_body(port, requests, results):
+    client = HelperClient(server=("127.0.0.1", port))
+    try:
+        for n in range(requests):
+            resp = client.get("home/state", timeout=30)
+            results.append(resp is not None and resp.code == defines.Codes.CONTENT.number)
+    finally:
+        client.stop()
+
+def run(clients=20, requests=10, delay=50):
+    server_port, proxy_port = 15683, 15684
+    server = CoAP(("127.0.0.1", server_port))
+    server.add_resource("state/", SlowDeviceState(delay/1000.0))
+    server_t = threading.Thread(target=server.listen, args=(1,))
+    server_t.start()
+
+    xml = tempfile.NamedTemporaryFile(suffix=".xml", delete=False)
+    xml.write("<servers><server name=\"home\">127.0.0.1:%d</server></servers>" % server_port)
+    xml.close()
+    proxy = ReverseProxy(("127.0.0.1", proxy_port), xml.name)
+    proxy_t = threading.Thread(target=proxy.listen, args=(1,))
+    proxy_t.start()
+
+    try:
+        results = []
+        threads = [threading.Thread(target=client_body, args=(proxy_port, requests, results))
+                   for n in range(clients)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+        result = {"clients": clients, "requests_per_client": requests, "upstream_delay_ms": delay,
+                  "requests_per_sec": round(len(results)/elapsed, 1),
+                  "seconds": round(elapsed, 3),
+                  "serial_upstream_seconds": round(len(results)*delay/1000.0, 3),
+                  "successful": results.count(True),
+                  "upstream_clients": len(proxy._forwardLayer._pool._clients)}
+        print json.dumps(result, indent=2, sort_keys=True)
+        return result
+    finally:
+        proxy.close()
+        server.close()
+        proxy_t.join()
+        server_t.join()
+        os.remove(xml.name)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
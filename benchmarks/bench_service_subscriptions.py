@@ -0,0 +1,109 @@
+"""
+    This is the service subscriptions benchmark.
+    It builds a Home Server (server.coapserver.CoAPServer, working offline and
+    not listening) with many services and registered devices, each one
+    subscribing a few of them, and measures: the services of a device (as on
+    GET /devices/<id>/services) checked against the services of the server on
+    every request (as before) and as kept by the reverse index of the
+    subscriptions, the devices of a service (GET /services/<id>/devices), and
+    the removal of a service (PUT /services), which prunes only the devices
+    that subscribed it. It checks that no device is left with a removed
+    service.
+
+    Usage: python benchmarks/bench_service_subscriptions.py [devices] [services] [runs]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from loadgen import home_server_settings, write_configs, percentiles
+
+__author__ = "Jose Requeijo Dias"
+
+SERVICES_PER_DEVICE = 3
+
+def services_list(ids):
+    return {"SERVICES": [{"id": n, "name": "service"+str(n), "core_service_ref": None} for n in ids]}
+
+def checked_services(device):
+    """
+        This function returns the services of a device as they were checked
+        on every request, against a copy of the ids of the services of the
+        server.
+    """
+    services = list(device.services.services)
+    for s in list(services):
+        if int(s) not in device.server.services.services.keys():
+            services.remove(s)
+    return services
+
+def timed(runs, call):
+    times = []
+    for n in range(runs):
+        start = time.time()
+        call(n)
+        times.append(time.time() - start)
+    return percentiles(times)
+
+def run(devices=5000, services=500, runs=50):
+    work_dir = tempfile.mkdtemp()
+    try:
+        import settings
+        home_server_settings(settings, work_dir, 15850)
+        write_configs(work_dir)
+        with open(settings.SERVICES_CONFIG_FILE, "w") as f:
+            json.dump(services_list(range(1, services+1)), f)
+        from server.coapserver import CoAPServer
+        server = CoAPServer(1, "BenchHomeServer")
+        server_services = server.services
+
+        start = time.time()
+        for n in range(devices):
+            subscribed = [(n + k*services/SERVICES_PER_DEVICE) % services + 1 for k in range(SERVICES_PER_DEVICE)]
+            server.devices.add_device({"name": "dev"+str(n), "device_type": 1,
+                                       "services": subscribed, "timeout": 60},
+                                      "10.%d.%d.%d" % (n/62500, n/250 % 250, n % 250 + 1), 5683)
+        setup = time.time() - start
+        all_devices = server.devices.devices.values()
+
+        def device_services_checked(n):
+            checked_services(all_devices[n % len(all_devices)])
+
+        def device_services_indexed(n):
+            all_devices[n % len(all_devices)].services.get_payload()
+
+        def service_devices(n):
+            server.root["/services/"+str(n % services + 1)+"/devices"].get_payload()
+
+        remaining = range(1, services+1)
+        removed = []
+
+        def remove_service(n):
+            removed.append(remaining.pop())
+            server_services.update_server_services(services_list(remaining))
+
+        result = {"devices": devices, "services": services, "runs": runs,
+                  "services_per_device": SERVICES_PER_DEVICE,
+                  "setup_seconds": round(setup, 1),
+                  "device_services_checked": timed(runs, device_services_checked),
+                  "device_services_indexed": timed(runs, device_services_indexed),
+                  "service_devices": timed(runs, service_devices),
+                  "remove_service": timed(min(runs, services), remove_service),
+                  "devices_with_removed_services": len([d for d in all_devices
+                                                        if set(d.services.services) & set(removed)])}
+        print json.dumps(result, indent=2, sort_keys=True)
+        server.close()
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os._exit(0)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
@@ -0,0 +1,160 @@
+"""
+    This is the Home Server startup benchmark.
+    It measures the time to import the settings (with the resolution of the
+    addresses of the Home Server) and the time from the start of a Home
+    Server already registered until it answers its devices (a CoAP GET /info),
+    with a stub of the mHouse cloud (benchmarks/stubcloud.py) answering each
+    request after cloud_latency_ms: registering on the cloud before serving
+    (as a Home Server registered from scratch) and serving with the cached
+    configurations while it registers in the background (as main.py starts a
+    Home Server already registered). For the background registration it also
+    reports when the configurations were refreshed from the cloud.
+
+    Usage: python benchmarks/bench_startup.py [runs] [cloud_latency_ms]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+import multiprocessing
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+from stubcloud import StubCloud
+from loadgen import home_server_settings, deployment_logging, write_configs, percentiles
+
+__author__ = "Jose Requeijo Dias"
+
+IMPORT_SETTINGS = "import time; start = time.time(); import settings; print time.time() - start"
+
+def settings_import_time():
+    """
+        This function returns the seconds a new interpreter takes to import the
+        settings.
+    """
+    out = subprocess.check_output([sys.executable, "-c", IMPORT_SETTINGS], cwd=my_dir+"/../")
+    return float(out.split()[-1])
+
+def public_address_time():
+    """
+        This function returns the seconds of a lookup of the public address
+        (which the settings no longer do on import) and if it succeeded.
+    """
+    import utils
+    start = time.time()
+    try:
+        utils.get_my_ip(public=True)
+        ok = True
+    except utils.AppError:
+        ok = False
+    return time.time() - start, ok
+
+def home_server(work_dir, port, cloud_url, background_registration):
+    """
+        This function runs a Home Server already registered on the cloud at
+        cloud_url, as main.py does.
+    """
+    import settings
+    home_server_settings(settings, work_dir, port, cloud_url)
+    settings.SERVER_CONFIG_FILE = os.path.join(work_dir, "serverconf.json")
+    deployment_logging(settings, work_dir)
+    import server.server_main as server_main
+    from cloudcommunicators.register import register
+    if not background_registration and not register():
+        os._exit(4)
+    server_main.run_homeserver(background_registration)
+
+def wait_start(port, cloud, timeout=60):
+    """
+        This function sends a GET /info to the Home Server every 20 ms until it
+        answers and checks when it fetched its services from the cloud (the
+        last step of its registration), and returns both times.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.02)
+    request = Request()
+    request.type = defines.Types["NON"]
+    request.code = defines.Codes.GET.number
+    request.uri_path = "info"
+    request.token = "st"
+    request.destination = ("127.0.0.1", port)
+    answered, registered = None, None
+    start = time.time()
+    try:
+        while answered is None or registered is None:
+            if time.time() - start > timeout:
+                raise Exception("Home Server did not start")
+            if registered is None and cloud.requests.get("GET /api/services/"):
+                registered = time.time()
+            if answered is None:
+                request.mid = (request.mid or 0) % 65535 + 1
+                sock.sendto(Serializer.serialize(request), request.destination)
+                try:
+                    data, address = sock.recvfrom(4096)
+                    if isinstance(Serializer.deserialize(data, address), Response):
+                        answered = time.time()
+                except socket.error:
+                    pass
+            else:
+                time.sleep(0.01)
+        return answered, registered
+    finally:
+        sock.close()
+
+def start_once(port, cloud_latency_ms, background_registration):
+    cloud = StubCloud(latency=cloud_latency_ms/1000.0).start()
+    work_dir = tempfile.mkdtemp()
+    process = None
+    try:
+        write_configs(work_dir)
+        with open(os.path.join(work_dir, "serverconf.json"), "w") as f:
+            json.dump({"id": 1, "name": "BenchHomeServer", "coap_address": "127.0.0.1", "coap_port": port,
+                       "proxy_address": "127.0.0.1", "proxy_port": 8080,
+                       "email": "bench@mhouse.local", "password": "bench"}, f)
+
+        start = time.time()
+        process = multiprocessing.Process(target=home_server, args=(work_dir, port, cloud.base_url,
+                                                                    background_registration))
+        process.daemon = True
+        process.start()
+        answered, registered = wait_start(port, cloud)
+        return answered - start, registered - start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join(5)
+        cloud.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run(runs=5, cloud_latency_ms=200):
+    imports = [settings_import_time() for n in range(runs)]
+    lookup, lookup_ok = public_address_time()
+    result = {"runs": runs, "cloud_latency_ms": cloud_latency_ms,
+              "settings_import": percentiles(imports),
+              "public_address_lookup_ms": round(lookup*1000, 2),
+              "public_address_lookup_ok": lookup_ok}
+
+    for name, background in (("foreground", False), ("background", True)):
+        answers, registrations = [], []
+        for n in range(runs):
+            answered, registered = start_once(15700 + n, cloud_latency_ms, background)
+            answers.append(answered)
+            registrations.append(registered)
+        result[name + "_first_answer"] = percentiles(answers)
+        result[name + "_registered"] = percentiles(registrations)
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,65 @@
+"""
+    This is the CoAP resource directory benchmark.
+    It registers the resources of a very big home (four endpoints per device:
+    /devices/<id>, /state, /type and /services) on the resource Tree used by the
+    Home Server and measures the lookups made on every request: exact lookups,
+    prefix lookups (POST, observe notifications), subtree enumeration and
+    deletion (device deletion) and the listing used by the discovery.
+
+    Usage: python benchmarks/bench_tree.py [paths] [lookups]
+"""
+import os
+import sys
+import json
+import time
+import random
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon.utils import Tree
+
+__author__ = "Jose Requeijo Dias"
+
+def per_sec(fn, args):
+    start = time.time()
+    for a in args:
+        fn(a)
+    return round(len(args)/(time.time() - start), 1)
+
+def run(paths=50000, lookups=2000, tree_class=Tree):
+    devices = paths/4
+    tree = tree_class()
+    start = time.time()
+    for p in ["/", "/devices", "/services", "/configs", "/info"]:
+        tree[p] = p
+    for n in range(devices):
+        root = "/devices/"+str(n)
+        for p in [root, root+"/state", root+"/type", root+"/services"]:
+            tree[p] = p
+    build = time.time() - start
+
+    rnd = random.Random(1)
+    states = ["/devices/%d/state" % rnd.randrange(devices) for n in range(lookups)]
+    new = ["/devices/%d/state/new" % rnd.randrange(devices) for n in range(lookups)]
+    deleted = ["/devices/%d" % n for n in rnd.sample(range(devices), min(lookups, devices)/10)]
+
+    result = {"paths": len(tree.dump()), "build_seconds": round(build, 3),
+              "exact_lookups_per_sec": per_sec(lambda p: tree[p], states),
+              "prefix_lookups_per_sec": per_sec(tree.with_prefix, new),
+              "notify_prefix_resources_per_sec": per_sec(tree.with_prefix_resource, states)}
+    if hasattr(tree, "subtree"):
+        result["subtree_enumerations_per_sec"] = per_sec(tree.subtree, deleted)
+        result["subtree_deletions_per_sec"] = per_sec(tree.del_subtree, deleted)
+    start = time.time()
+    for n in range(10):
+        for p in tree.dump():
+            tree[p]
+    result["discovery_listings_per_sec"] = round(10/(time.time() - start), 2)
+
+    print json.dumps(result, indent=2, sort_keys=True)
+    return result
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
@@ -0,0 +1,558 @@
+"""
+    This is the Home Server load generator file.
+    Here are specified the virtual endpoints, that emulate the devices of a
+    home with the real device lifecycle (registration with POST /devices,
+    observation of /devices/<id>/state, periodic state PUTs and answers to the
+    liveness GETs of the Home Server monitoring), the load generator that
+    drives thousands of them from a single thread, and the helpers that run a
+    Home Server (server.coapserver.CoAPServer) on loopback in a child process,
+    working offline or with a stub of the mHouse cloud and its HTTP proxy.
+
+    The Home Server identifies each device by its IP address and sends the
+    liveness GETs to port 5683 of that address, so each virtual endpoint has
+    its own loopback address (127.1.0.0/16, all of 127.0.0.0/8 is routed to
+    the loopback interface on Linux) and its own socket on port 5683.
+"""
+import os
+import json
+import time
+import heapq
+import random
+import select
+import socket
+import resource
+import tempfile
+import multiprocessing
+
+from coapthon import defines
+from coapthon.messages.message import Message
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+__author__ = "Jose Requeijo Dias"
+
+DEVICE_PORT = 5683
+
+# configurations of the Home Server: lamps with a power and a level property
+CONFIGS = {
+    "device_types.json": {"DEVICE_TYPES": [{"id": 1, "name": "BenchLamp", "properties": [1, 2]}]},
+    "property_types.json": {"PROPERTY_TYPES": [
+        {"id": 1, "name": "power", "access_mode": "RW", "value_type_class": "ENUM", "value_type_id": 1},
+        {"id": 2, "name": "level", "access_mode": "RW", "value_type_class": "SCALAR", "value_type_id": 1}]},
+    "value_types.json": {
+        "SCALAR_TYPES": [{"id": 1, "name": "Percentage", "units": "%", "min_value": 0, "max_value": 100,
+                          "step": 1, "default_value": 0}],
+        "ENUM_TYPES": [{"id": 1, "name": "OnOff", "choices": {"on": "On", "off": "Off"},
+                        "default_value": "off"}]},
+    "services.json": {"SERVICES": [{"id": 1, "name": "Lighting", "core_service_ref": None}]}
+}
+
+def endpoint_address(n):
+    """
+        This function returns the loopback address of the virtual endpoint n.
+    """
+    return "127.1.%d.%d" % (n / 250, n % 250 + 1)
+
+def percentiles(values):
+    """
+        This function returns the count, p50, p95, p99 and max of a list of
+        latencies (in seconds), in milliseconds.
+    """
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    def at(p):
+        return round(values[min(len(values)-1, int(p*len(values)))]*1000, 2)
+    return {"count": len(values), "p50_ms": at(0.5), "p95_ms": at(0.95), "p99_ms": at(0.99),
+            "max_ms": round(values[-1]*1000, 2)}
+
+def process_status(pid):
+    """
+        This function returns the resident memory (in MB) and the number of
+        threads of a process, from /proc.
+    """
+    rss, threads = 0, 0
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1])/1024.0
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+    except IOError:
+        pass
+    return round(rss, 1), threads
+
+#
+########################################################################################
+### Home Server
+def write_configs(configs_dir):
+    """
+        This function writes the device, property and value types and the
+        services configuration files of the Home Server to configs_dir.
+    """
+    for name, data in CONFIGS.iteritems():
+        with open(os.path.join(configs_dir, name), "w") as f:
+            json.dump(data, f)
+
+def home_server_settings(settings, work_dir, port, cloud_url=None, overrides=None):
+    """
+        This function points the Home Server settings to the benchmark
+        configurations, on loopback. Without cloud_url the Home Server works
+        offline (without the mHouse cloud), else it works with the cloud (a
+        StubCloud) at cloud_url. The overrides dictionary replaces any other
+        settings.
+    """
+    settings.DEVICE_TYPES_CONFIG_FILE = os.path.join(work_dir, "device_types.json")
+    settings.PROPERTY_TYPES_CONFIG_FILE = os.path.join(work_dir, "property_types.json")
+    settings.VALUE_TYPES_CONFIG_FILE = os.path.join(work_dir, "value_types.json")
+    settings.SERVICES_CONFIG_FILE = os.path.join(work_dir, "services.json")
+    settings.CLOUD_OUTBOX_DIR = os.path.join(work_dir, "outbox/")
+    settings.COAP_ADDR = "127.0.0.1"
+    settings.COAP_PORT = port
+    settings.COAP_MULTICAST = False
+    settings.WORKING_OFFLINE = cloud_url is None
+    if cloud_url is not None:
+        settings.CLOUD_BASE_URL = cloud_url
+        settings.USER_EMAIL = "bench@mhouse.local"
+        settings.USER_PASSWORD = "bench"
+        settings.HOME_SERVER_ID = 1
+    for name, value in (overrides or {}).iteritems():
+        setattr(settings, name, value)
+
+def deployment_logging(settings, work_dir):
+    """
+        This function configures the logging as on the deployment (main.py),
+        with the log files on work_dir/logs.
+    """
+    import logging.config
+    if not os.path.isdir(os.path.join(work_dir, "logs")):
+        os.mkdir(os.path.join(work_dir, "logs"))
+    os.chdir(work_dir)
+    logging.config.fileConfig(settings.LOGGING_CONFIG_FILE, disable_existing_loggers=False)
+
+def serve(work_dir, port, conn, cloud_url=None, overrides=None):
+    """
+        This function runs a Home Server until it receives anything on conn,
+        then it sends its own statistics on conn. Working offline only the
+        devices monitoring runs with the server, else it is started as on the
+        deployment (with the cloud threads).
+    """
+    import threading
+    import settings
+    home_server_settings(settings, work_dir, port, cloud_url, overrides)
+    if cloud_url is not None:
+        deployment_logging(settings, work_dir)
+    from server.coapserver import CoAPServer
+
+    server = CoAPServer(1, "BenchHomeServer")
+    if cloud_url is None:
+        mon_t = threading.Thread(target=server.devices.monitoring_devices)
+        mon_t.daemon = True
+        mon_t.start()
+        server_t = threading.Thread(target=server.listen, args=(10,))
+    else:
+        server_t = threading.Thread(target=server.start)
+    server_t.daemon = True
+    server_t.start()
+    conn.send("ready")
+
+    conn.recv()
+    server.save_capture()
+    stats = {"devices": len(server.devices.devices)}
+    if server.metrics is not None:
+        stats["retransmissions"] = server.metrics.value("coap_retransmissions_total")
+        stats["requests_total"] = sum(c.value for (name, labels), c in server.metrics._counters.items()
+                                      if name == "coap_requests_total")
+    conn.send(stats)
+    server.close()
+    os._exit(0)
+
+def serve_proxy(work_dir, port, proxy_port, cloud_url, overrides=None):
+    """
+        This function runs the HTTP proxy of a Home Server, as on the
+        deployment.
+    """
+    import settings
+    home_server_settings(settings, work_dir, port, cloud_url, overrides)
+    settings.PROXY_PORT = proxy_port
+    deployment_logging(settings, work_dir)
+    import proxy.proxy_main as proxy_main
+    proxy_main.run_proxy()
+
+class HomeServerProcess(object):
+    """
+        This is a Home Server on loopback, in a child process (so that its
+        memory and threads are measured apart from the load generator, and
+        both do not share the same interpreter lock), optionally with its HTTP
+        proxy on another child process (as on main.py).
+    """
+    def __init__(self, port=15683, cloud_url=None, proxy_port=None, overrides=None):
+        self.port = port
+        self.cloud_url = cloud_url
+        self.proxy_port = proxy_port
+        self.overrides = overrides
+        self.work_dir = tempfile.mkdtemp()
+        self.process = None
+        self.proxy_process = None
+        self.conn = None
+
+    def start(self):
+        write_configs(self.work_dir)
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(self.work_dir, self.port, child_conn,
+                                                                   self.cloud_url, self.overrides))
+        self.process.daemon = True
+        self.process.start()
+        while not self.conn.poll(0.5):
+            if not self.process.is_alive():
+                raise Exception("Home Server failed to start")
+        self.conn.recv()
+
+        if self.proxy_port is not None:
+            self.proxy_process = multiprocessing.Process(target=serve_proxy, args=(self.work_dir, self.port,
+                                                                                   self.proxy_port,
+                                                                                   self.cloud_url,
+                                                                                   self.overrides))
+            self.proxy_process.daemon = True
+            self.proxy_process.start()
+            while True:
+                if not self.proxy_process.is_alive():
+                    raise Exception("Proxy failed to start")
+                try:
+                    socket.create_connection(("127.0.0.1", self.proxy_port), 0.5).close()
+                    break
+                except socket.error:
+                    time.sleep(0.1)
+        return self
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def stop(self):
+        """
+            This method stops the Home Server (and its proxy) and returns its
+            statistics.
+        """
+        stats = {}
+        try:
+            if self.proxy_process is not None:
+                self.proxy_process.terminate()
+                self.proxy_process.join(5)
+            self.conn.send("stop")
+            if self.conn.poll(10):
+                stats = self.conn.recv()
+        finally:
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+        return stats
+
+#
+########################################################################################
+### Virtual Endpoints
+class VirtualEndpoint(object):
+    """
+        This is a virtual endpoint, i.e. an emulated device with its own
+        address and socket, driven by the load generator.
+    """
+    def __init__(self, generator, number):
+        self.generator = generator
+        self.number = number
+        self.address = endpoint_address(number)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.address, DEVICE_PORT))
+        self.sock.setblocking(0)
+
+        self.device_id = None
+        self.reporting = generator.silent_every == 0 or number % generator.silent_every != 0
+        self.power = "off"
+        self.level = 0
+        self.mid = random.randint(1, 65535)
+        self.pending = {}
+
+    def close(self):
+        self.sock.close()
+
+    def send(self, message):
+        self.sock.sendto(Serializer().serialize(message), self.generator.server)
+
+    def request(self, kind, code, path, payload=None, observe=None):
+        """
+            This method sends a confirmable request to the Home Server.
+        """
+        self.mid = self.mid % 65535 + 1
+        request = Request()
+        request.type = defines.Types["CON"]
+        request.code = code
+        request.mid = self.mid
+        request.token = "%04x%04x" % (self.number % 65536, self.mid)
+        request.uri_path = path
+        request.destination = self.generator.server
+        if observe is not None:
+            request.observe = observe
+        if payload is not None:
+            request.content_type = defines.Content_types["application/json"]
+            request.payload = json.dumps(payload)
+
+        now = time.time()
+        timeout = random.uniform(defines.ACK_TIMEOUT, defines.ACK_TIMEOUT*defines.ACK_RANDOM_FACTOR)
+        self.pending[request.token] = [request, kind, now, 0, timeout]
+        self.send(request)
+        self.generator.schedule(now + timeout, self.retransmit, request.token)
+
+    def retransmit(self, token):
+        pending = self.pending.get(token)
+        if pending is None:
+            return
+        request, kind, sent, attempts, timeout = pending
+        if attempts >= defines.MAX_RETRANSMIT:
+            del self.pending[token]
+            self.generator.failed(self, kind)
+            return
+        pending[3] += 1
+        pending[4] = timeout*2
+        self.generator.retransmissions += 1
+        self.send(request)
+        self.generator.schedule(time.time() + pending[4], self.retransmit, token)
+
+    def register(self):
+        self.request("register", defines.Codes.POST.number, "devices",
+                     {"name": "Lamp" + str(self.number), "device_type": 1, "services": [1],
+                      "timeout": self.generator.timeout})
+
+    def observe(self):
+        self.request("observe", defines.Codes.GET.number, "devices/%d/state" % self.device_id, observe=0)
+
+    def put_state(self):
+        self.request("put", defines.Codes.PUT.number, "devices/%d/state" % self.device_id,
+                     {"power": self.power, "level": self.level})
+
+    def receive(self):
+        """
+            This method handles all the datagrams waiting on the socket.
+        """
+        while True:
+            try:
+                data, source = self.sock.recvfrom(4096)
+            except socket.error:
+                return
+            message = Serializer().deserialize(data, source)
+            if isinstance(message, Request):
+                self.answer(message)
+            elif isinstance(message, Response):
+                if message.type == defines.Types["CON"]:
+                    self.ack(message)
+                pending = self.pending.pop(message.token, None)
+                if pending is None:
+                    # notification or duplicated response
+                    if message.observe is not None:
+                        self.generator.notified(self, message)
+                    continue
+                request, kind, sent, attempts, timeout = pending
+                self.generator.completed(self, kind, message, time.time() - sent)
+
+    def ack(self, message):
+        ack = Message()
+        ack.type = defines.Types["ACK"]
+        ack.mid = message.mid
+        ack.code = 0
+        ack.destination = message.source
+        self.sock.sendto(Serializer().serialize(ack), message.source)
+
+    def answer(self, request):
+        """
+            This method answers a request of the Home Server (the liveness GETs
+            of the devices monitoring) with the state of the device.
+        """
+        response = Response()
+        response.type = defines.Types["ACK"] if request.type == defines.Types["CON"] else defines.Types["NON"]
+        response.mid = request.mid
+        response.token = request.token
+        response.code = defines.Codes.CONTENT.number
+        response.content_type = defines.Content_types["application/json"]
+        response.payload = json.dumps({"power": self.power})
+        response.destination = request.source
+        self.sock.sendto(Serializer().serialize(response), request.source)
+        self.generator.liveness_gets += 1
+
+#
+########################################################################################
+### Load Generator
+class LoadGenerator(object):
+    """
+        This is the load generator. It runs the lifecycle of all the virtual
+        endpoints from a single thread (an epoll loop with a timers heap):
+        the endpoints register and start observing their state, at most
+        'concurrency' at a time, then each one sends a state PUT every 'period'
+        seconds (except one out of 'silent_every', which only answers the
+        liveness GETs) during 'duration' seconds. The steady state starts when
+        all the endpoints are registered or after 'registration_timeout'
+        seconds.
+        The reporting endpoints toggle their power on each PUT. With
+        'apply_wanted' the endpoints behave as actuators instead: when they are
+        notified of a new wanted state they apply it and PUT it as their
+        current state (the time of each applied state is kept on 'applied').
+    """
+    def __init__(self, server, endpoints, duration=10, period=2.0, timeout=5, concurrency=100,
+                 silent_every=4, registration_timeout=60, apply_wanted=False, sample=None):
+        self.server = server
+        self.duration = duration
+        self.period = period
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.silent_every = silent_every
+        self.registration_timeout = registration_timeout
+        self.apply_wanted = apply_wanted
+        self.sample = sample
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < endpoints + 256:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, endpoints + 256), hard))
+        self.endpoints = [VirtualEndpoint(self, n) for n in range(endpoints)]
+
+        self.timers = []
+        self.sequence = 0
+        self.latencies = {"register": [], "observe": [], "put": []}
+        self.errors = {}
+        self.failures = {}
+        self.retransmissions = 0
+        self.notifications = 0
+        self.liveness_gets = 0
+        self.applied = []
+        self.steady = None
+        self.steady_requests = 0
+        self.stopped = False
+
+    def schedule(self, when, function, *args):
+        self.sequence += 1
+        heapq.heappush(self.timers, (when, self.sequence, function, args))
+
+    def completed(self, endpoint, kind, response, latency):
+        """
+            This method is called on each response, and moves the endpoint on
+            its lifecycle.
+        """
+        ok = response.code < 128
+        if not ok:
+            key = kind + " " + defines.Codes.LIST[response.code].name
+            self.errors[key] = self.errors.get(key, 0) + 1
+        self.latencies[kind].append(latency)
+        if self.steady is not None and kind == "put":
+            self.steady_requests += 1
+
+        if kind == "register":
+            if ok:
+                endpoint.device_id = json.loads(response.payload)["local_id"]
+                endpoint.observe()
+            else:
+                self.next_registration()
+        elif kind == "observe":
+            self.next_registration()
+            if ok and endpoint.reporting:
+                self.schedule(time.time() + random.uniform(0, self.period), self.report, endpoint)
+
+    def notified(self, endpoint, response):
+        """
+            This method is called on each notification of the state of an
+            endpoint.
+        """
+        self.notifications += 1
+        if not self.apply_wanted or endpoint.device_id is None:
+            return
+        try:
+            wanted = json.loads(response.payload)["wanted_state"]
+        except (ValueError, KeyError, TypeError):
+            return
+        level = int(wanted.get("level", endpoint.level))
+        power = str(wanted.get("power", endpoint.power))
+        if (power, level) != (endpoint.power, endpoint.level):
+            endpoint.power, endpoint.level = power, level
+            self.applied.append((endpoint.address, level, time.time()))
+            endpoint.put_state()
+
+    def failed(self, endpoint, kind):
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+        if kind != "put":
+            self.next_registration()
+
+    def report(self, endpoint):
+        if self.steady is not None and time.time() >= self.steady + self.duration:
+            return
+        if not self.apply_wanted:
+            endpoint.power = "on" if endpoint.power == "off" else "off"
+        endpoint.put_state()
+        self.schedule(time.time() + self.period, self.report, endpoint)
+
+    def next_registration(self):
+        self.registered += 1
+        if self.waiting:
+            self.waiting.pop().register()
+
+    def run(self):
+        """
+            This method runs the load and returns the results.
+        """
+        poller = select.epoll()
+        by_fd = {}
+        for e in self.endpoints:
+            poller.register(e.sock.fileno(), select.EPOLLIN)
+            by_fd[e.sock.fileno()] = e
+
+        self.registered = 0
+        self.waiting = list(reversed(self.endpoints))
+        start = time.time()
+        for n in range(min(self.concurrency, len(self.waiting))):
+            self.waiting.pop().register()
+
+        registration = None
+        next_sample = start
+        end = None
+        while not self.stopped and (end is None or time.time() < end):
+            now = time.time()
+            if self.sample is not None and now >= next_sample:
+                self.sample()
+                next_sample = now + 0.5
+            if registration is None and (self.registered == len(self.endpoints) or
+                                         now - start >= self.registration_timeout):
+                registration = now - start
+                self.steady = now
+                end = now + self.duration
+
+            wait = 0.05
+            if self.timers:
+                wait = max(0, min(wait, self.timers[0][0] - now))
+            for fd, event in poller.poll(wait):
+                by_fd[fd].receive()
+            now = time.time()
+            while self.timers and self.timers[0][0] <= now:
+                when, sequence, function, args = heapq.heappop(self.timers)
+                function(*args)
+        poller.close()
+        steady = min(time.time(), end) - self.steady if self.steady is not None else 0
+
+        registered = len([e for e in self.endpoints if e.device_id is not None])
+        return {"endpoints": len(self.endpoints),
+                "registered": registered,
+                "registration_seconds": round(registration or 0, 3),
+                "registrations_per_sec": round(registered/registration, 1) if registration else 0,
+                "steady_puts_per_sec": round(self.steady_requests/steady, 1) if steady else 0,
+                "latency": dict((kind, percentiles(values)) for kind, values in self.latencies.iteritems()),
+                "errors": self.errors,
+                "failures": self.failures,
+                "client_retransmissions": self.retransmissions,
+                "notifications": self.notifications,
+                "liveness_gets": self.liveness_gets}
+
+    def stop(self):
+        """
+            This method stops the load (run returns), from another thread.
+        """
+        self.stopped = True
+
+    def close(self):
+        for e in self.endpoints:
+            e.close()
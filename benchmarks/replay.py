@@ -0,0 +1,282 @@
+"""
+    This is the traffic replay tool.
+    It replays a capture of the datagrams received by a CoAP server (a
+    coapthon.capture.Capture file, as the ones saved by the Home Server on
+    kill -USR1 when settings.CAPTURE_SIZE is set) against a test server, at
+    the original speed, scaled or as fast as possible, and reports as JSON
+    the divergence of the responses (codes and payloads) and of the timing
+    (response times and lateness of the replay) from the capture. The
+    response times of the capture are taken on the server, so they do not
+    include the network, unlike the ones of the replay.
+    Each source of the capture is replayed from its own socket. With -m (for
+    a test server on loopback) each source host gets its own loopback address
+    (127.2.x.y), as the Home Server identifies the devices by their address.
+
+    Usage: python benchmarks/replay.py capture_file [-ip host] [-p port] [-s speed] [-t timeout] [-m]
+"""
+import os
+import sys
+import json
+import time
+import select
+import socket
+import argparse
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.capture import Capture
+from coapthon.messages.message import Message
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+from loadgen import percentiles
+
+__author__ = "Jose Requeijo Dias"
+
+def code_name(code):
+    code = defines.Codes.LIST.get(code)
+    return code.name if code is not None else "UNKNOWN"
+
+def original_exchanges(records):
+    """
+        This function pairs each request received on the capture with the
+        first response sent to its source with its token. It returns the
+        datagrams received, as (time, source, datagram, key), and the
+        responses, as key: (response time, code, payload).
+    """
+    received = []
+    responses = {}
+    waiting = {}
+    for t, direction, host, port, data in records:
+        message = Serializer.deserialize(data, (host, port))
+        if direction == "i":
+            key = None
+            if isinstance(message, Request):
+                key = ((host, port), message.token, message.mid)
+                if key not in responses:
+                    waiting[((host, port), message.token)] = (key, t)
+            received.append((t, (host, port), data, key))
+        elif isinstance(message, Response):
+            pending = waiting.pop(((host, port), message.token), None)
+            if pending is not None:
+                key, start = pending
+                responses[key] = (t - start, message.code, message.payload)
+    return received, responses
+
+class Replay(object):
+    """
+        This is the replay of a capture against a server, from a single
+        thread (an epoll loop over the sockets of all the sources).
+    """
+    def __init__(self, records, server, speed=1.0, timeout=5.0, map_sources=False):
+        self.server = server
+        self.speed = speed
+        self.timeout = timeout
+        self.received, self.original = original_exchanges(records)
+
+        self.sockets = {}
+        self.hosts = {}
+        hosts = self.hosts
+        for t, source, data, key in self.received:
+            if source in self.sockets:
+                continue
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if map_sources:
+                if source[0] not in hosts:
+                    n = len(hosts)
+                    hosts[source[0]] = "127.2.%d.%d" % (n / 250, n % 250 + 1)
+                try:
+                    # the original port, e.g. 5683 for the liveness GETs of the Home Server
+                    sock.bind((hosts[source[0]], source[1]))
+                except socket.error:
+                    sock.bind((hosts[source[0]], 0))
+            else:
+                sock.bind(("", 0))
+            sock.setblocking(0)
+            self.sockets[source] = sock
+
+        self.replayed = {}
+        self.notifications = 0
+        self.server_requests = 0
+        self.lateness = []
+
+    def receive(self, sock, source, waiting):
+        while True:
+            try:
+                data, address = sock.recvfrom(4096)
+            except socket.error:
+                return
+            message = Serializer.deserialize(data, address)
+            if isinstance(message, Request):
+                # e.g. the liveness GETs of the Home Server, answered as a device would
+                self.server_requests += 1
+                response = Response()
+                response.type = defines.Types["ACK"] if message.type == defines.Types["CON"] \
+                    else defines.Types["NON"]
+                response.mid = message.mid
+                response.token = message.token
+                response.code = defines.Codes.CONTENT.number
+                response.destination = address
+                sock.sendto(Serializer.serialize(response), address)
+            elif isinstance(message, Response):
+                if message.type == defines.Types["CON"]:
+                    ack = Message()
+                    ack.type = defines.Types["ACK"]
+                    ack.mid = message.mid
+                    ack.code = 0
+                    ack.destination = address
+                    sock.sendto(Serializer.serialize(ack), address)
+                pending = waiting.pop((source, message.token), None)
+                if pending is None:
+                    self.notifications += 1
+                    continue
+                key, start = pending
+                self.replayed[key] = (time.time() - start, message.code, message.payload)
+
+    def run(self):
+        """
+            This method replays the capture and returns the report.
+            At a given speed each datagram is sent at its (scaled) time of the
+            capture. As fast as possible (speed 0) each source sends its next
+            datagram as soon as its last request is answered (or timed out),
+            so that the requests of a source keep their order (e.g. a device
+            registration before its state updates).
+        """
+        poller = select.epoll()
+        by_fd = {}
+        for source, sock in self.sockets.iteritems():
+            poller.register(sock.fileno(), select.EPOLLIN)
+            by_fd[sock.fileno()] = (sock, source)
+
+        queues = {}
+        for record in reversed(self.received):
+            queues.setdefault(record[1], []).append(record)
+        waiting = {}
+        first = self.received[0][0] if self.received else 0
+        start = time.time()
+        n = 0
+        sent = None
+        while True:
+            now = time.time()
+            due = now
+            if self.speed > 0:
+                while n < len(self.received):
+                    t, source, data, key = self.received[n]
+                    due = start + (t - first) / self.speed
+                    if due > now:
+                        break
+                    self.lateness.append(now - due)
+                    self.send(source, data, key, waiting, now)
+                    n += 1
+            else:
+                for (source, token), (key, sent_at) in waiting.items():
+                    if now - sent_at >= self.timeout:
+                        del waiting[(source, token)]
+                busy = set(source for source, token in waiting)
+                for source, queue in queues.items():
+                    while queue and source not in busy:
+                        t, source, data, key = queue.pop()
+                        if self.send(source, data, key, waiting, now):
+                            busy.add(source)
+                        n += 1
+                    if not queue:
+                        del queues[source]
+
+            if n == len(self.received):
+                if sent is None:
+                    sent = now - start
+                if not waiting or now - start - sent >= self.timeout:
+                    break
+            wait = 0.05
+            if self.speed > 0 and n < len(self.received):
+                wait = min(wait, max(0, due - now))
+            for fd, event in poller.poll(wait):
+                sock, source = by_fd[fd]
+                self.receive(sock, source, waiting)
+        poller.close()
+        for sock in self.sockets.itervalues():
+            sock.close()
+        return self.report(time.time() - start if sent is None else sent)
+
+    def send(self, source, data, key, waiting, now):
+        """
+            This method sends a datagram of the capture from its source, and
+            returns True if it is a request waiting for its response.
+        """
+        self.sockets[source].sendto(data, self.server)
+        if key is None or key in self.replayed:
+            return False
+        waiting[(source, key[1])] = (key, now)
+        return True
+
+    def original_payload(self, host, payload):
+        # the Home Server answers with the address of the device
+        if host in self.hosts and payload:
+            return payload.replace('"' + host + '"', '"' + self.hosts[host] + '"')
+        return payload
+
+    def report(self, duration):
+        same, payload_diff, missing, unexpected = 0, 0, 0, 0
+        code_diff = {}
+        original_times, replay_times = [], []
+        for key in set(self.original) | set(self.replayed):
+            original = self.original.get(key)
+            replayed = self.replayed.get(key)
+            if replayed is None:
+                missing += 1
+                continue
+            if original is None:
+                unexpected += 1
+                continue
+            original_times.append(original[0])
+            replay_times.append(replayed[0])
+            if original[1] != replayed[1]:
+                change = code_name(original[1]) + " -> " + code_name(replayed[1])
+                code_diff[change] = code_diff.get(change, 0) + 1
+            elif self.original_payload(key[0][0], original[2]) != replayed[2]:
+                payload_diff += 1
+            else:
+                same += 1
+
+        received = self.received
+        return {"datagrams": len(received),
+                "sources": len(self.sockets),
+                "requests": len([r for r in received if r[3] is not None]),
+                "speed": self.speed,
+                "original_seconds": round(received[-1][0] - received[0][0], 3) if received else 0,
+                "replay_seconds": round(duration, 3),
+                "datagrams_per_sec": round(len(received)/duration, 1) if duration else 0,
+                "lateness": percentiles(self.lateness),
+                "responses_same": same,
+                "responses_code_diff": code_diff,
+                "responses_payload_diff": payload_diff,
+                "responses_missing": missing,
+                "responses_unexpected": unexpected,
+                "capture_response_time": percentiles(original_times),
+                "replay_response_time": percentiles(replay_times),
+                "notifications": self.notifications,
+                "server_requests": self.server_requests}
+
+def get_command_line_args():
+    parser = argparse.ArgumentParser(description='Replay a capture of CoAP traffic against a server.')
+    parser.add_argument('capture', help='the capture file')
+    parser.add_argument('-ip', dest='ip', default="127.0.0.1",
+                        help='the ip of the server')
+    parser.add_argument('-p', dest='port', default=5683, type=int,
+                        help='the port of the server')
+    parser.add_argument('-s', dest='speed', default=1.0, type=float,
+                        help='the speed of the replay: 1 for the original speed, 2 for twice as fast, '
+                             '0 for as fast as possible')
+    parser.add_argument('-t', dest='timeout', default=5.0, type=float,
+                        help='the seconds waiting for the last responses')
+    parser.add_argument('-m', dest='map_sources', action='store_true',
+                        help='replay each source host from its own loopback address')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_command_line_args()
+    replay = Replay(Capture.load(args.capture), (args.ip, args.port), args.speed, args.timeout, args.map_sources)
+    print json.dumps(replay.run(), indent=2, sort_keys=True)
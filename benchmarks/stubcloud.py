@@ -0,0 +1,246 @@
+"""
+    This is the Stub Cloud file for the Home Server benchmarks.
+    Here is specified a small local HTTP server that mimics the parts of the
+    mHouse cloud REST API used by the Home Server (login, servers, devices,
+    device states, configs and services), so that the cloud communicators can
+    be measured without internet connection.
+"""
+import json
+import re
+import hashlib
+import time
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+__author__ = "Jose Requeijo Dias"
+
+DEVICE_URI = re.compile(r"^/api/devices/(\d+)/?$")
+DEVICE_STATE_URI = re.compile(r"^/api/devices/(\d+)/state/?$")
+SERVER_URI = re.compile(r"^/api/servers/(\d+)/?$")
+SERVER_STATE_URI = re.compile(r"^/api/servers/(\d+)/state/?$")
+
+
+class StubCloudHandler(BaseHTTPRequestHandler):
+    """
+        This is the request handler of the Stub Cloud.
+        It answers the requests with the data stored on the StubCloud server.
+    """
+    protocol_version = "HTTP/1.1"
+    # buffer the whole response (avoids Nagle delays on keep-alive connections)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, data=None, headers=None):
+        body = json.dumps(data) if data is not None else ""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).iteritems():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def handle_request(self, method):
+        cloud = self.server.cloud
+        path = self.path.split("?")[0]
+        cloud.count(method, path)
+        if cloud.latency:
+            time.sleep(cloud.latency)
+        if cloud.down:
+            self.send_json(503, {"detail": "Stub cloud is down"})
+            return
+
+        handler = cloud.route(method, path)
+        if handler is None:
+            self.send_json(404, {"detail": "Not found"})
+            return
+        handler(self, path)
+
+    def do_HEAD(self):
+        self.handle_request("HEAD")
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class StubCloudServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubCloud(object):
+    """
+        This is the Stub Cloud class.
+        It stores the devices, configs and services known by the cloud and
+        counts every request received, by method and path.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency
+        self.down = False
+
+        self.devices = {}
+        self.states = {}
+        self.state_times = {}
+        self.state_log = []
+        self.next_id = 1
+        self.configs = {"device_types": [], "property_types": [],\
+                        "value_types": {"scalars": [], "enums": [], "choices": []}}
+        self.services = []
+        self.requests = {}
+        self.not_modified = 0
+
+        self._lock = threading.Lock()
+        self.httpd = StubCloudServer((host, port), StubCloudHandler)
+        self.httpd.cloud = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return "http://"+host+":"+str(port)+"/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, method, path):
+        key = method+" "+re.sub(r"/\d+", "/<id>", path)
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def total_requests(self):
+        return sum(self.requests.itervalues())
+
+    def add_device(self, data):
+        with self._lock:
+            dev = dict(data)
+            dev["id"] = self.next_id
+            dev.setdefault("services", [])
+            self.next_id += 1
+            self.devices[dev["id"]] = dev
+            return dev
+
+    #
+    ### Routes
+    def route(self, method, path):
+        if path == "/login/":
+            return self.login
+        if path == "/api/devices/":
+            return {"GET": self.list_devices, "POST": self.create_device}.get(method)
+        if DEVICE_STATE_URI.match(path):
+            return {"PATCH": self.update_state}.get(method)
+        if DEVICE_URI.match(path):
+            return {"GET": self.get_device, "PATCH": self.update_device,\
+                    "DELETE": self.delete_device}.get(method)
+        if SERVER_STATE_URI.match(path) or SERVER_URI.match(path):
+            return {"PATCH": self.update_server}.get(method)
+        if path == "/api/configs/":
+            return {"GET": self.get_configs}.get(method)
+        if path == "/api/services/":
+            return {"GET": self.get_services}.get(method)
+        return None
+
+    def login(self, handler, path):
+        handler.send_json(200, headers={"Set-Cookie": "csrftoken=stubtoken; Path=/"})
+
+    def list_devices(self, handler, path):
+        with self._lock:
+            devices = self.devices.values()
+        handler.send_json(200, {"devices": devices})
+
+    def create_device(self, handler, path):
+        data = handler.read_json()
+        with self._lock:
+            for d in self.devices.itervalues():
+                if d["address"] == data["address"]:
+                    handler.send_json(400, {"non_field_errors": ["address must be unique"]})
+                    return
+        self.add_device(data)
+        self.list_devices(handler, path)
+
+    def get_device(self, handler, path):
+        dev_id = int(DEVICE_URI.match(path).group(1))
+        dev = self.devices.get(dev_id)
+        if dev is None:
+            handler.send_json(404, {"detail": "Not found"})
+        else:
+            handler.send_json(200, dev)
+
+    def update_device(self, handler, path):
+        dev_id = int(DEVICE_URI.match(path).group(1))
+        data = handler.read_json()
+        with self._lock:
+            dev = self.devices.get(dev_id)
+            if dev is None:
+                handler.send_json(404, {"detail": "Not found"})
+                return
+            for k, v in data.iteritems():
+                if k not in ["id", "services", "local_id", "universal_id"]:
+                    dev[k] = v
+        handler.send_json(200, dev)
+
+    def delete_device(self, handler, path):
+        dev_id = int(DEVICE_URI.match(path).group(1))
+        with self._lock:
+            self.devices.pop(dev_id, None)
+        handler.send_json(204)
+
+    def update_state(self, handler, path):
+        dev_id = int(DEVICE_STATE_URI.match(path).group(1))
+        data = handler.read_json()
+        with self._lock:
+            self.states[dev_id] = data["current_state"]
+            self.state_times[dev_id] = time.time()
+            self.state_log.append((dev_id, self.state_times[dev_id], data["current_state"]))
+        handler.send_json(200, data)
+
+    def update_server(self, handler, path):
+        data = handler.read_json()
+        if SERVER_URI.match(path):
+            data["id"] = int(SERVER_URI.match(path).group(1))
+        handler.send_json(200, data)
+
+    def send_cacheable(self, handler, data):
+        # answers with an ETag, and 304 to a request with the same one
+        etag = '"'+hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()+'"'
+        if handler.headers.get("If-None-Match") == etag:
+            with self._lock:
+                self.not_modified += 1
+            handler.send_json(304, headers={"ETag": etag})
+        else:
+            handler.send_json(200, data, headers={"ETag": etag})
+
+    def get_configs(self, handler, path):
+        self.send_cacheable(handler, self.configs)
+
+    def get_services(self, handler, path):
+        self.send_cacheable(handler, {"services": self.services})
@@ -4,6 +4,7 @@ import threading
 import time
 import sys
 import os
+import logging
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 
 my_dir = os.path.abspath(os.path.dirname(__file__))
@@ -13,11 +14,18 @@ sys.path.append(my_dir+"/../server/")
 import settings
 from utils import AppError
 from proxy.communicator import Communicator
+from shadowexecutor import ShadowExecutor, RateLimiter
+
+logger = logging.getLogger("cloud_comm_log")
+
+SHADOW_DELTA_TOPIC = "$aws/things/%s/shadow/update/delta"
 
 class AWSCommunicator(object):
 
-    def __init__(self, credentials=None):
-        if credentials is not None and isinstance(credentials, tuple) and len(credentials) == 2:
+    def __init__(self, credentials=None, mqtt_client=None, clients=None, listen=True):
+        if clients is not None:
+            self.client, self.dataclient = clients
+        elif credentials is not None and isinstance(credentials, tuple) and len(credentials) == 2:
             self.client = boto3.client("iot",\
                                         aws_access_key_id=credentials[0],\
                                         aws_secret_access_key=credentials[1])
@@ -27,16 +35,68 @@ class AWSCommunicator(object):
         else:
             self.client = boto3.client("iot")
             self.dataclient = boto3.client("iot-data")
-        
+
+        # the AWS operations are run by a bounded executor, within the AWS IoT quotas
+        self.executor = ShadowExecutor(settings.AWS_EXECUTOR_WORKERS)
+        self.thing_rate = RateLimiter(settings.AWS_THING_RATE_LIMIT)
+        self.shadow_rate = RateLimiter(settings.AWS_SHADOW_RATE_LIMIT)
+
+        self.comm = Communicator(settings.COAP_ADDR, settings.COAP_PORT, persistent=True)
+        self.mqtt_client = mqtt_client
+        self.listener_thread = None
+        self.stopped = threading.Event()
+        if listen:
+            self.start_shadow_listener()
+
+    def start_shadow_listener(self):
+        if settings.AWS_SHADOW_MODE == "mqtt" and\
+            (self.mqtt_client is not None or settings.AWS_IOT_ENDPOINT):
+            try:
+                self.run_cloud_shadow_delta_listener()
+                return
+            except Exception as err:
+                logger.error("ERROR: Could not subscribe to AWS shadow deltas ("+str(err)\
+                                +"), falling back to shadow polling")
+
         self.listener_thread = threading.Thread(target=self.run_cloud_shadow_listener)
         self.listener_thread.start()
 
+    def connect_mqtt(self):
+        client = AWSIoTMQTTClient(settings.AWS_IOT_CLIENT_ID)
+        client.configureEndpoint(settings.AWS_IOT_ENDPOINT, settings.AWS_IOT_PORT)
+        client.configureCredentials(settings.AWS_IOT_ROOT_CA,\
+                                    settings.AWS_IOT_PRIVATE_KEY,\
+                                    settings.AWS_IOT_CERTIFICATE)
+        client.configureAutoReconnectBackoffTime(1, 32, 20)
+        client.configureOfflinePublishQueueing(-1)
+        client.configureConnectDisconnectTimeout(10)
+        client.configureMQTTOperationTimeout(5)
+        return client
+
     def register_new_device(self, device_name, state):
+        data = {"state":{"desired":state.get_simplified_wanted_state(),
+                         "reported":state.get_simplified_current_state()}}
+        return self.executor.submit(device_name, "register",\
+                                    lambda: self.create_thing(device_name, data))
+
+    def unregister_device(self, device_name):
+        self.executor.cancel(device_name, "update")
+        return self.executor.submit(device_name, "unregister",\
+                                    lambda: self.delete_thing(device_name))
+
+    def notify_shadow(self, device_name, state):
+        # only the latest state of each thing waiting to be sent is sent
+        data = {"state":{"desired":state.get_simplified_wanted_state(),
+                         "reported":state.get_simplified_current_state()}}
+        return self.executor.submit(device_name, "update",\
+                                    lambda: self.update_shadow(device_name, data))
+
+    def create_thing(self, device_name, data):
         try:
+            self.thing_rate.acquire()
             resp = self.client.create_thing(thingName=device_name)
 
-            data = {"state":{"desired":state.get_simplified_wanted_state(),
-                             "reported":state.get_simplified_current_state()}}
+            self.shadow_rate.acquire()
             resp = self.dataclient.update_thing_shadow(thingName=device_name,\
                                                         payload=json.dumps(data))
 
@@ -44,20 +104,20 @@ class AWSCommunicator(object):
         except Exception as err:
             msg = "ERROR: "+str(err)
             logger.error(msg)
-    
-    def unregister_device(self, device_name):
+
+    def delete_thing(self, device_name):
         try:
-            resp = self.client.create_thing(thingName=device_name)
+            self.thing_rate.acquire()
+            resp = self.client.delete_thing(thingName=device_name)
 
             logger.info("Device Successfully Unregistered from AWS")
         except Exception as err:
             msg = "ERROR: "+str(err)
             logger.error(msg)
-    
-    def notify_shadow(self, device_name, state):
+
+    def update_shadow(self, device_name, data):
         try:
-            data = {"state":{"desired":state.get_simplified_wanted_state(),
-                             "reported":state.get_simplified_current_state()}}
+            self.shadow_rate.acquire()
             resp = self.dataclient.update_thing_shadow(thingName=device_name,\
                                                         payload=json.dumps(data))
 
@@ -66,38 +126,95 @@ class AWSCommunicator(object):
             msg = "ERROR: "+str(err)
             logger.error(msg)
 
+    def get_shadow(self, device_name):
+        self.shadow_rate.acquire()
+        response = self.dataclient.get_thing_shadow(thingName=device_name)
+        return json.loads(response["payload"].read())["state"]
+
+    def run_cloud_shadow_delta_listener(self):
+        if self.mqtt_client is None:
+            self.mqtt_client = self.connect_mqtt()
+        self.mqtt_client.connect()
+        self.mqtt_client.subscribe(SHADOW_DELTA_TOPIC % "+", 1, self.on_shadow_delta)
+        logger.info("Listening to AWS shadow deltas")
+
+        # the deltas are only sent when the desired state changes, so the
+        # changes made while the Home Server was offline are fetched once
+        try:
+            self.sync_cloud_shadows()
+        except AppError as err:
+            logger.error("ERROR: "+str(err.msg))
+        except Exception as err:
+            logger.error("ERROR: "+str(err))
+
+    def on_shadow_delta(self, client, userdata, message):
+        try:
+            thing_name = message.topic.split("/")[2]
+            local_id = thing_name.rsplit("-", 1)[1]
+            delta = json.loads(message.payload)["state"]
+        except (IndexError, KeyError, ValueError):
+            logger.warning("Invalid AWS shadow delta on topic "+str(message.topic))
+            return
+
+        logger.info("Update From AWS cloud")
+        try:
+            self.comm.put("/devices/"+str(local_id)+"/state",\
+                            json.dumps(delta), timeout=settings.COMM_TIMEOUT)
+        except AppError as err:
+            logger.error("ERROR: "+str(err.msg))
+        except Exception as err:
+            logger.error("ERROR: "+str(err))
+
+    def sync_cloud_shadows(self, last_states=None):
+        comm = self.comm
+        resp = comm.get("/devices", timeout=settings.COMM_TIMEOUT)
+        resp = comm.get_response(resp)
+        devs = json.loads(resp.payload)
+
+        tasks = []
+        for dev in devs["devices"]:
+            thing_name = dev["name"]+"-"+str(dev["local_id"])
+            tasks.append(self.executor.submit(thing_name, "get",\
+                                                lambda t=thing_name: self.get_shadow(t)))
+
+        for dev, task in zip(devs["devices"], tasks):
+            try:
+                state = task.wait()
+            except Exception:
+                # already logged by the executor
+                continue
+            if state is None:
+                continue
+            if last_states is None:
+                # no previous states, push the pending shadow delta (if any)
+                wanted = state.get("delta")
+            elif dev["local_id"] in last_states and last_states[dev["local_id"]] != state.get("desired"):
+                wanted = state["desired"]
+            else:
+                wanted = None
+
+            if wanted:
+                logger.info("Update From AWS cloud")
+                comm.put("/devices/"+str(dev["local_id"])+"/state",\
+                            json.dumps(wanted), timeout=settings.COMM_TIMEOUT)
+
+            if last_states is not None:
+                last_states[dev["local_id"]] = state.get("reported")
+
+    def stop(self):
+        self.stopped.set()
+        self.executor.stop()
+        if self.listener_thread is not None:
+            self.listener_thread.join()
+
     def run_cloud_shadow_listener(self):
-        comm = Communicator(settings.COAP_ADDR, settings.COAP_PORT)
         last_states = {}
-        while 1:
+        while not self.stopped.isSet():
             try:
-                resp = comm.get("/devices", timeout=settings.COMM_TIMEOUT)
+                self.sync_cloud_shadows(last_states)
             except AppError as err:
-                abort(err.code, err.msg)
-            except:
-                abort(500, "Unknown Proxy fatal error")
-
-            resp = comm.get_response(resp)
-            devs = json.loads(resp.payload)
-            
-            for dev in devs["devices"]:
-                response = self.dataclient.get_thing_shadow(thingName=dev["name"]+"-"+str(dev["local_id"]))
-                state = json.loads(response["payload"].read())["state"]
-                try:
-                    if last_states[dev["local_id"]] != state["desired"]:
-                        logger.info("Update From AWS cloud") 
-                        try:
-                            resp = comm.put("/devices/"+str(dev["local_id"])+"/state",\
-                                            json.dumps(state["desired"]), timeout=settings.COMM_TIMEOUT)
-                        except AppError as err:
-                            abort(err.code, err.msg)
-                        except:
-                            abort(500, "Unknown Proxy fatal error")
-                except:
-                    logger.info("State From AWS cloud") 
-                    logger.info(str(state))
-                    # print "--------------------\n\n"
-
-                last_states[dev["local_id"]] = state["reported"]
-            
-            time.sleep(5)
\ No newline at end of file
+                logger.error("ERROR: "+str(err.msg))
+            except Exception as err:
+                logger.error("ERROR: "+str(err))
+
+            self.stopped.wait(settings.AWS_SHADOW_POLLING_INTERVAL)
@@ -0,0 +1,255 @@
+"""
+    This is the Cloud Bulk Synchronization File.
+    Here is specified the bulk synchronization of the Home Server devices with
+    the mHouse cloud service. Instead of one registration round trip for each
+    device that registers itself after a Home Server (re)start, the whole list
+    of devices is compared with the devices known by the cloud and only the
+    differences (creates, updates and deletes) are sent, in parallel.
+"""
+import json
+import time
+import logging
+import threading
+import Queue
+
+import settings
+from utils import AppError
+import mhouse_comm
+
+__author__ = "Jose Requeijo Dias"
+
+logger = logging.getLogger("cloud_comm_log")
+
+# Device fields that are kept on the cloud and compared to detect changes
+SYNC_FIELDS = ["local_id", "name", "port", "device_type", "timeout"]
+
+class SyncPlan(object):
+    """
+        This represents the differences between the local list of devices
+        and the devices known by the cloud service.
+    """
+    def __init__(self):
+        self.creates = []
+        self.updates = []
+        self.deletes = []
+        self.unchanged = 0
+
+    def get_info(self):
+        """
+            This method returns a dictionary with the size of each part of the plan.
+        """
+        return {"creates": len(self.creates), "updates": len(self.updates),\
+                "deletes": len(self.deletes), "unchanged": self.unchanged}
+
+
+def compute_plan(devices, cloud_devices, server_id, delete_missing=False):
+    """
+        This function computes the synchronization plan for the given local
+        devices (Device resources) and the given cloud devices (indexed by address).
+        The local devices that already exist on the cloud take the cloud name,
+        services and universal id (as in a regular registration) and they are only
+        updated on the cloud if some of the SYNC_FIELDS changed.
+        When 'delete_missing' is True, the cloud devices of this Home Server that
+        are not present locally are deleted from the cloud.
+    """
+    plan = SyncPlan()
+    addresses = set()
+    for device in devices:
+        addresses.add(device.address)
+        d = cloud_devices.get(device.address)
+        if d is None:
+            plan.creates.append(device)
+            continue
+
+        device.universal_id = d["id"]
+        device.services.set_services(d["services"])
+        device.name = d["name"]
+
+        info = device.get_info()
+        if any(k in d and d[k] != info[k] for k in SYNC_FIELDS):
+            plan.updates.append(device)
+        else:
+            plan.unchanged += 1
+
+    if delete_missing:
+        for address, d in cloud_devices.iteritems():
+            if address not in addresses and d.get("server") == server_id:
+                plan.deletes.append(d)
+    return plan
+
+
+class BulkSync(object):
+    """
+        This is the Bulk Synchronization class.
+        It synchronizes a full list of devices with the cloud service using a
+        bounded number of parallel workers. During the Home Server startup window
+        the individual device registrations are deferred and handled by a single
+        bulk synchronization when the window ends.
+    """
+    def __init__(self, workers=8, delete_missing=False):
+        self.workers = int(workers)
+        self.delete_missing = delete_missing
+        self.deferring = False
+        self._lock = threading.Lock()
+
+    def defer(self, device):
+        """
+            This method checks if the registration of the given device on the
+            cloud should be deferred to the startup bulk synchronization.
+        """
+        with self._lock:
+            return self.deferring
+
+    def run_startup_sync(self, server, delay=None):
+        """
+            This method waits for the devices to register themselves on the Home
+            Server after it starts (for 'delay' seconds), deferring their cloud
+            registrations, and then synchronizes all of them at once. When the
+            Home Server is being registered in background (see the server
+            'registered' event) the synchronization waits for that registration.
+            Nothing is synchronized while the Home Server is working offline.
+            At the end the outbox is woken up to send the states notified
+            meanwhile by the devices still not registered on the cloud.
+        """
+        if delay is None:
+            delay = settings.CLOUD_SYNC_STARTUP_DELAY
+        if not mhouse_comm.check_settings():
+            return False
+
+        with self._lock:
+            self.deferring = True
+        server.stopped.wait(delay)
+        while not server.registered.isSet() and not server.stopped.isSet():
+            server.registered.wait(1)
+        with self._lock:
+            self.deferring = False
+
+        if server.stopped.isSet():
+            return False
+        if settings.WORKING_OFFLINE:
+            logger.info("Working offline, the devices are not synchronized with the cloud")
+            return False
+        stats = self.sync(server.devices.devices.values())
+        mhouse_comm.outbox.wake()
+        return stats
+
+    def sync(self, devices):
+        """
+            This method synchronizes the given list of devices (Device resources)
+            with the cloud service and returns a dictionary with the synchronization
+            statistics. The devices that could not be synchronized are stored on the
+            cloud outbox to be registered later on.
+        """
+        start = time.time()
+        try:
+            client = mhouse_comm.open_cloud_session()
+            if not mhouse_comm.device_index.load(client, force=True):
+                logger.error("Could not fetch the devices list from the cloud")
+                return None
+        except AppError:
+            logger.error("You do not have connection to the internet or the cloud server is down")
+            for device in devices:
+                mhouse_comm.outbox.put("register", device.address, device.get_info())
+            return None
+
+        plan = compute_plan(devices, mhouse_comm.device_index.devices,\
+                            settings.HOME_SERVER_ID, self.delete_missing)
+
+        tasks = Queue.Queue()
+        for device in plan.creates:
+            tasks.put((self.create, device))
+        for device in plan.updates:
+            tasks.put((self.update, device))
+        for d in plan.deletes:
+            tasks.put((self.delete, d))
+
+        stats = plan.get_info()
+        stats["failed"] = 0
+        workers = []
+        for n in range(min(self.workers, tasks.qsize())):
+            t = threading.Thread(target=self._worker, args=(tasks, stats))
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+
+        stats["seconds"] = round(time.time() - start, 3)
+        logger.info("Devices synchronized with the cloud: "+json.dumps(stats))
+        return stats
+
+    def _worker(self, tasks, stats):
+        """
+            This is an auxiliary method run by each synchronization worker. Each
+            worker uses its own cloud session until there are no tasks left.
+        """
+        client = None
+        while True:
+            try:
+                method, arg = tasks.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                if client is None:
+                    client = mhouse_comm.open_cloud_session()
+                method(client, arg)
+            except AppError:
+                client = None
+                with self._lock:
+                    stats["failed"] += 1
+                if method != self.delete:
+                    mhouse_comm.outbox.put("register", arg.address, arg.get_info())
+            except Exception as err:
+                logger.error("ERROR: "+str(err))
+                with self._lock:
+                    stats["failed"] += 1
+
+    @staticmethod
+    def create(client, device):
+        """
+            This method creates the given device on the cloud service.
+        """
+        data = device.get_info()
+        data["server"] = settings.HOME_SERVER_ID
+        try:
+            resp = client.post(settings.CLOUD_BASE_URL+"api/devices/", data=json.dumps(data))
+        except:
+            raise AppError(503)
+
+        if resp.status_code == 200:
+            mhouse_comm.device_index.update(json.loads(resp.text)["devices"])
+            d = mhouse_comm.device_index.get(device.address)
+            if d is not None:
+                device.universal_id = d["id"]
+        else:
+            logger.error("Error ("+str(resp.status_code)+") creating device ("\
+                            +str(device.address)+") on the cloud")
+
+    @staticmethod
+    def update(client, device):
+        """
+            This method updates the given device on the cloud service.
+        """
+        try:
+            resp = client.patch(settings.CLOUD_BASE_URL+"api/devices/"\
+                                +str(device.universal_id)+"/?fromserver=true", data=device.get_json())
+        except:
+            raise AppError(503)
+
+        if resp.status_code == 200:
+            d = mhouse_comm.device_index.get(device.address)
+            if d is not None:
+                d.update(device.get_info())
+                d["id"] = device.universal_id
+
+    @staticmethod
+    def delete(client, cloud_device):
+        """
+            This method deletes the given cloud device from the cloud service.
+        """
+        mhouse_comm.send_device_unregistration(client, cloud_device["id"])
+        mhouse_comm.device_index.remove(cloud_device["address"])
+
+
+bulk_sync = BulkSync(workers=settings.CLOUD_SYNC_WORKERS,\
+                        delete_missing=settings.CLOUD_SYNC_DELETE_MISSING)
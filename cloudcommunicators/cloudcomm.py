@@ -4,6 +4,7 @@ import sys
 
 import settings
 import mhouse_comm
+from bulksync import bulk_sync
 
 if settings.AWS_INTEGRATION:
     from aws_comm import AWSCommunicator
@@ -14,25 +15,23 @@ if settings.AWS_INTEGRATION:
         aws_communicator = AWSCommunicator()
 
 def register_device_on_cloud_platforms(device):
-    mhouse_t = threading.Thread(target=mhouse_comm.regist_device_on_cloud,\
-                                args=(device,))
-    mhouse_t.start()
+    # during the startup window the device is registered by the bulk sync
+    if not bulk_sync.defer(device):
+        mhouse_t = threading.Thread(target=mhouse_comm.regist_device_on_cloud,\
+                                    args=(device,))
+        mhouse_t.start()
 
     if settings.AWS_INTEGRATION:
-        aws_t = threading.Thread(target=aws_communicator.register_new_device,\
-                                args=(device.name+"-"+str(device.id),\
-                                        device.state))
-        aws_t.start()
+        aws_communicator.register_new_device(device.name+"-"+str(device.id),\
+                                                device.state)
 
 def unregister_device_from_cloud_platforms(device):
     mhouse_t = threading.Thread(target=mhouse_comm.unregist_device_from_cloud,\
-                                args=(device.id,))
+                                args=(device.id, device.address))
     mhouse_t.start()
 
     if settings.AWS_INTEGRATION:
-        aws_t = threading.Thread(target=aws_communicator.unregister_device,\
-                                args=(device.name+"-"+str(device.id),))
-        aws_t.start()
+        aws_communicator.unregister_device(device.name+"-"+str(device.id))
 
 def notify_cloud_platforms(device):
     mhouse_t = threading.Thread(target=mhouse_comm.notify_cloud,\
@@ -40,7 +39,5 @@ def notify_cloud_platforms(device):
     mhouse_t.start()
 
     if settings.AWS_INTEGRATION:
-        aws_t = threading.Thread(target=aws_communicator.notify_shadow,\
-                                    args=(device.name+"-"+str(device.id),\
-                                        device.state,))
-        aws_t.start()
\ No newline at end of file
+        aws_communicator.notify_shadow(device.name+"-"+str(device.id),\
+                                        device.state)
\ No newline at end of file
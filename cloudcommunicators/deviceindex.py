@@ -0,0 +1,93 @@
+"""
+    This is the Cloud Device Index File.
+    Here is specified the local index of the devices known by the cloud service,
+    used by the cloud communicators to find the cloud side representation of a
+    device (by its address) without fetching the full list of devices from the
+    cloud every time a device is registered.
+"""
+import json
+import time
+import threading
+
+import settings
+from utils import AppError
+
+__author__ = "Jose Requeijo Dias"
+
+class CloudDeviceIndex(object):
+    """
+        This is the Cloud Device Index class.
+        It keeps a local copy of the devices present on the cloud service, indexed
+        by their address. The full list of devices is fetched only once (and again
+        when the index becomes older than 'max_age' seconds or is invalidated), and
+        it is incrementally updated with the responses to the registrations made
+        by the Home Server.
+    """
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.devices = {}
+        self.timestamp = None
+        self._lock = threading.RLock()
+
+    def is_stale(self):
+        """
+            This method checks if the index must be fetched again from the cloud.
+        """
+        return self.timestamp is None or (time.time() - self.timestamp) > self.max_age
+
+    def load(self, client, force=False):
+        """
+            This method fetches the full list of devices from the cloud service,
+            using the given session, if the index is stale (or if 'force' is True).
+            Concurrent callers wait for a single fetch. It returns True if the
+            index can be used, and raises an AppError (503) if the cloud service
+            is not reachable.
+        """
+        with self._lock:
+            if not force and not self.is_stale():
+                return True
+            try:
+                resp = client.get(settings.CLOUD_BASE_URL+"api/devices/")
+            except:
+                raise AppError(503)
+
+            if resp.status_code != 200:
+                return False
+
+            self.update(json.loads(resp.text)["devices"], replace=True)
+            return True
+
+    def update(self, devices, replace=False):
+        """
+            This method adds or updates the given list of cloud devices on the index.
+            If 'replace' is True, the given list replaces the whole index.
+        """
+        with self._lock:
+            if replace:
+                self.devices = {}
+                self.timestamp = time.time()
+            for d in devices:
+                self.devices[d["address"]] = d
+
+    def get(self, address):
+        """
+            This method returns the cloud representation of the device with the
+            given address, or None if the device is not present on the cloud.
+        """
+        with self._lock:
+            return self.devices.get(address)
+
+    def remove(self, address):
+        """
+            This method removes the device with the given address from the index.
+        """
+        with self._lock:
+            return self.devices.pop(address, None)
+
+    def invalidate(self):
+        """
+            This method marks the index as stale, so that it is fetched again
+            from the cloud on the next lookup.
+        """
+        with self._lock:
+            self.timestamp = None
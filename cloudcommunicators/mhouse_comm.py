@@ -11,11 +11,21 @@ import time
 
 import settings
 from utils import AppError
+from outbox import CloudOutbox
+from deviceindex import CloudDeviceIndex
 
 __author__ = "Jose Requeijo Dias"
 
 logger = logging.getLogger("cloud_comm_log")
 
+outbox = CloudOutbox(settings.CLOUD_OUTBOX_DIR,\
+                        segment_size=settings.CLOUD_OUTBOX_SEGMENT_SIZE,\
+                        max_size=settings.CLOUD_OUTBOX_MAX_SIZE,\
+                        retry_min=settings.CLOUD_OUTBOX_RETRY_MIN,\
+                        retry_max=settings.CLOUD_OUTBOX_RETRY_MAX)
+
+device_index = CloudDeviceIndex(max_age=settings.CLOUD_DEVICE_INDEX_MAX_AGE)
+
 def sendServerAliveSignaltoCloud(server):
     while not server.stopped.isSet():
         time.sleep(settings.HOME_SERVER_TIMEOUT-settings.HOME_SERVER_TIMEOUT_GUARD)
@@ -51,138 +61,280 @@ def sendServerAliveSignaltoCloud(server):
         except Exception as err:
             logger.error("ERROR: "+str(err))
 
-def regist_device_on_cloud(device):
+def check_settings():
     """
-        This method tries to register a new device on the cloud server.
-        If the device already exists, it synchronizes the information overall system.
+        This function checks if the settings needed to communicate with
+        the cloud service were properly set during the Home Server registration.
     """
     try:
-        email = settings.USER_EMAIL
-        password = settings.USER_PASSWORD
-        server_id = settings.HOME_SERVER_ID
-    except:
+        settings.USER_EMAIL
+        settings.USER_PASSWORD
+        settings.HOME_SERVER_ID
+    except AttributeError:
         logger.error("Settings file not properly configured. Probably Home Server registration improperly done.")
         return False
+    return True
 
+def open_cloud_session():
+    """
+        This function opens a new authenticated session with the cloud service.
+        It raises an AppError (503) if the cloud service is not reachable.
+    """
     client = requests.Session()
     try:
         resp = client.head(settings.CLOUD_BASE_URL+"login/")
         csrftoken = resp.cookies["csrftoken"]
+    except:
+        raise AppError(503)
 
-        client.headers.update({"Accept":"application/json",\
-                "Content-Type":"application/json",\
-                "X-CSRFToken":csrftoken})
-        client.auth = (email, password)
+    client.headers.update({"Accept":"application/json",\
+            "Content-Type":"application/json",\
+            "X-CSRFToken":csrftoken})
+    client.auth = (settings.USER_EMAIL, settings.USER_PASSWORD)
+    return client
 
+def send_device_registration(client, info, device=None):
+    """
+        This function registers a device, described by the dictionary 'info'
+        (as returned by the device get_info method), on the cloud server.
+        If the device already exists, it synchronizes the information overall
+        system (the 'device' argument, when given, is updated with the information
+        present on the cloud). It returns the device universal id, or None if the
+        cloud refused the registration.
+        The cloud side device is found on the local device index, so the full list
+        of devices is only fetched from the cloud when that index is stale.
+    """
+    if not device_index.load(client):
+        return None
+
+    d = device_index.get(info["address"])
+    if d is not None:
+        if device is not None:
+            device.universal_id = d["id"]
+            device.services.set_services(d["services"])
+            device.name = d["name"]
+            info = device.get_info()
+        else:
+            info = dict(info)
+            info["universal_id"] = d["id"]
         try:
-            resp = client.get(settings.CLOUD_BASE_URL+"api/devices/")
-            regist_done = False
-            if resp.status_code == 200:
-                js = json.loads(resp.text)
-                devices = js["devices"]
-                for d in devices:
-                    if d["address"] == device.address:
-                        device.universal_id = d["id"]
-                        device.services.services = d["services"]
-                        device.name = d["name"]
-                        try:
-                            resp = client.patch(settings.CLOUD_BASE_URL+"api/devices/"\
-                                                    +str(d["id"])+"/?fromserver=true", data=device.get_json())
-                            regist_done = True
-                            break
-                        except:
-                            raise AppError(503)
-
-                if not regist_done:
-                    data = device.get_info()
-                    data["server"] = server_id
-                    try:
-                        resp = client.post(settings.CLOUD_BASE_URL+"api/devices/",\
-                                                data=json.dumps(data))
-
-                        if resp.status_code == 200:
-                            js = json.loads(resp.text)
-                            devices = js["devices"]
-                            for d in devices:
-                                if d["address"] == device.address:
-                                    device.universal_id = d["id"]
-                                    break
-
-                        elif resp.status_code == 400:
-                            js = json.loads(resp.text)
-                            try:
-                                errs = js["non_field_errors"]
-                                for ele in errs:
-                                    if "address" in ele:
-                                        logger.error("Problems with address")
-                            except:
-                                logger.error("ERROR DUMMMM")
-                    except:
-                        AppError(503)
+            resp = client.patch(settings.CLOUD_BASE_URL+"api/devices/"\
+                            +str(d["id"])+"/?fromserver=true", data=json.dumps(info))
         except:
             raise AppError(503)
-    except AppError:
-        logger.error("You do not have connection to the internet or the cloud server is down")
 
-def unregist_device_from_cloud(device_id):
+        if resp.status_code != 404:
+            return d["id"]
+        # the device was deleted from the cloud meanwhile
+        device_index.remove(info["address"])
+
+    data = dict(info)
+    data["server"] = settings.HOME_SERVER_ID
+    try:
+        resp = client.post(settings.CLOUD_BASE_URL+"api/devices/",\
+                                data=json.dumps(data))
+    except:
+        raise AppError(503)
+
+    if resp.status_code == 200:
+        js = json.loads(resp.text)
+        device_index.update(js["devices"])
+        d = device_index.get(info["address"])
+        if d is not None:
+            if device is not None:
+                device.universal_id = d["id"]
+            return d["id"]
+
+    elif resp.status_code == 400:
+        # the local index may be outdated, so it is fetched again on the next registration
+        device_index.invalidate()
+        js = json.loads(resp.text)
+        try:
+            errs = js["non_field_errors"]
+            for ele in errs:
+                if "address" in ele:
+                    logger.error("Problems with address")
+        except:
+            logger.error("ERROR DUMMMM")
+    return None
+
+def send_device_unregistration(client, device_id):
     """
-        This method tries to unregister a new device on the cloud server.
+        This function unregisters the device with the given id from the cloud server.
     """
     try:
-        email = settings.USER_EMAIL
-        password = settings.USER_PASSWORD
-        server_id = settings.HOME_SERVER_ID
+        client.delete(settings.CLOUD_BASE_URL+"api/devices/"+str(device_id))
     except:
-        logger.error("Settings file not properly configured. Probably Home Server registration improperly done.")
+        raise AppError(503)
+
+def send_device_state(client, universal_id, state):
+    """
+        This function sends the current state of the device with the given
+        universal id to the cloud server.
+    """
+    try:
+        resp = client.patch(settings.CLOUD_BASE_URL+"api/devices/"\
+                            +str(universal_id)\
+                            +"/state/?fromserver=true", data=json.dumps({"current_state":state}))
+        if resp.status_code == 200:
+            logger.info("STATE CHANGED")
+    except:
+        raise AppError(503)
+
+def regist_device_on_cloud(device):
+    """
+        This method tries to register a new device on the cloud server.
+        If the device already exists, it synchronizes the information overall system.
+        If the cloud server is not reachable, the registration is stored on the
+        outbox to be sent later on.
+    """
+    if not check_settings():
         return False
 
-    client = requests.Session()
+    info = device.get_info()
     try:
-        resp = client.head(settings.CLOUD_BASE_URL+"login/")
-        csrftoken = resp.cookies["csrftoken"]
+        client = open_cloud_session()
+        send_device_registration(client, info, device)
+    except AppError:
+        logger.error("You do not have connection to the internet or the cloud server is down")
+        outbox.put("register", device.address, info)
+        return False
 
-        client.headers.update({"Accept":"application/json",\
-                "Content-Type":"application/json",\
-                "X-CSRFToken":csrftoken})
-        client.auth = (email, password)
+    outbox.discard("register", device.address)
+    outbox.wake()
+    return True
 
-        resp = client.delete(settings.CLOUD_BASE_URL+"api/devices/"+str(device_id))
-    except:
+def unregist_device_from_cloud(device_id, address=None):
+    """
+        This method tries to unregister a new device on the cloud server.
+        If the cloud server is not reachable, the unregistration is stored on the
+        outbox to be sent later on.
+    """
+    if not check_settings():
+        return False
+
+    if address is None:
+        address = device_id
+
+    try:
+        client = open_cloud_session()
+        send_device_unregistration(client, device_id)
+    except AppError:
         logger.error("You do not have connection to the internet or the cloud server is down")
+        outbox.put("unregister", address, {"device_id": device_id})
+        return False
+
+    device_index.remove(address)
+    outbox.discard("unregister", address)
+    outbox.wake()
+    return True
 
 #
 def notify_cloud(device_state):
     """
         This method notifies the cloud service about changes on the
         devices or Home Server states/informations.
+        If the cloud server is not reachable (or the device is still not registered
+        on it), the notification is stored on the outbox to be sent later on.
     """
 
     logger.info("Notifying Cloud")
+    if not check_settings():
+        return False
+
+    device = device_state.device
+    if device.universal_id is None:
+        # registered on the cloud by an outbox drain or by the bulk synchronization
+        d = device_index.get(device.address)
+        if d is not None:
+            device.universal_id = d["id"]
+
+    data = {"universal_id": device.universal_id, "current_state": device_state.state}
+    if device.universal_id is None:
+        outbox.put("state", device.address, data)
+        return False
+
     try:
-        email = settings.USER_EMAIL
-        password = settings.USER_PASSWORD
-        server_id = settings.HOME_SERVER_ID
-    except:
-        logger.error("Settings file not properly configured. Probably Home Server registration improperly done.")
+        client = open_cloud_session()
+        send_device_state(client, device.universal_id, device_state.state)
+    except AppError:
+        logger.error("You do not have connection to the internet or the cloud server is down")
+        outbox.put("state", device.address, data)
         return False
 
-    client = requests.Session()
+    outbox.discard("state", device.address)
+    outbox.wake()
+    return True
+
+#
+### Outbox
+def send_outbox_record(record, context, server=None):
+    """
+        This function sends to the cloud server one event stored on the outbox.
+        The 'context' dictionary is shared by all the events sent on the same
+        outbox drain, and it is used to reuse the cloud session and to keep the
+        universal ids given to the devices registered during that drain.
+        The universal id of a registered device is also given to the device
+        (when it is still on the given server), so its next state changes are
+        sent right away.
+        It returns True if the event was delivered (or can never be delivered),
+        False if the cloud is not reachable and None if the event must wait (the
+        state of a device still not registered on the cloud).
+    """
     try:
-        resp = client.head(settings.CLOUD_BASE_URL+"login/")
-        csrftoken = resp.cookies["csrftoken"]
+        if "client" not in context:
+            context["client"] = open_cloud_session()
+            context["universal_ids"] = {}
+        client = context["client"]
 
-        client.headers.update({"Accept":"application/json",\
-                "Content-Type":"application/json",\
-                "X-CSRFToken":csrftoken})
-        client.auth = (email, password)
+        if record.kind == "register":
+            universal_id = send_device_registration(client, record.data)
+            context["universal_ids"][record.device] = universal_id
+            device = get_server_device(server, record.device)
+            if device is not None and universal_id is not None:
+                device.universal_id = universal_id
 
-        try:
-            resp = client.patch(settings.CLOUD_BASE_URL+"api/devices/"\
-                                +str(device_state.device.universal_id)\
-                                +"/state/?fromserver=true", data=json.dumps({"current_state":device_state.state}))
-            if resp.status_code == 200:
-                logger.info("STATE CHANGED")
-        except:
-            raise AppError(503)
+        elif record.kind == "unregister":
+            send_device_unregistration(client, record.data["device_id"])
+            device_index.remove(record.device)
+
+        elif record.kind == "state":
+            universal_id = record.data["universal_id"]
+            if universal_id is None:
+                universal_id = context["universal_ids"].get(record.device)
+            if universal_id is None and device_index.get(record.device) is not None:
+                universal_id = device_index.get(record.device)["id"]
+            if universal_id is None and server is not None\
+                    and get_server_device(server, record.device) is None:
+                logger.warning("Dropping state of device ("+str(record.device)\
+                                +") not registered on the cloud")
+                return True
+            if universal_id is None:
+                # kept until the device is registered (by the outbox or the bulk synchronization)
+                return None
+            send_device_state(client, universal_id, record.data["current_state"])
+        return True
     except AppError:
-        logger.error("You do not have connection to the internet or the cloud server is down")
+        context.pop("client", None)
+        return False
+
+def run_outbox_worker(server):
+    """
+        This function runs the outbox worker until the server is stopped,
+        sending to the cloud all the events stored while it was not reachable.
+    """
+    if not check_settings():
+        return False
+    outbox.run(server.stopped, lambda record, context: send_outbox_record(record, context, server))
+
+def get_server_device(server, address):
+    """
+        This function returns the device with the given address registered
+        on the given server, or None.
+    """
+    if server is None:
+        return None
+    for d in server.devices.devices.values():
+        if d.address == address:
+            return d
+    return None
@@ -0,0 +1,351 @@
+"""
+    This is the Cloud Outbox File.
+    Here is specified the store-and-forward outbox used by the cloud
+    communicators. When the cloud service is not reachable, the events that
+    should be sent to it (device registrations, unregistrations and state
+    notifications) are stored on disk and sent later on, when the connection
+    with the cloud service comes back.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+
+__author__ = "Jose Requeijo Dias"
+
+logger = logging.getLogger("cloud_comm_log")
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+
+class OutboxRecord(object):
+    """
+        This represents one event stored on the outbox.
+        Each record is identified by its kind of event and by the device it
+        refers to, so that only the latest record of each kind is kept for
+        each device.
+    """
+    def __init__(self, seq, kind, device, data):
+        self.seq = seq
+        self.kind = kind
+        self.device = device
+        self.data = data
+
+    @property
+    def key(self):
+        """
+            This property returns the key used to compact the records.
+        """
+        return (self.kind, self.device)
+
+    def get_info(self):
+        """
+            This method returns a dictionary with all the record informations.
+        """
+        return {"seq": self.seq, "kind": self.kind, "device": self.device, "data": self.data}
+
+    def get_json(self):
+        """
+            This method returns a JSON representation (one line) of the record.
+        """
+        return json.dumps(self.get_info(), separators=(",", ":"))
+
+
+class CloudOutbox(object):
+    """
+        This is the Cloud Outbox class.
+        It keeps, in memory and on append-only segment files stored on the given
+        directory, the latest pending event of each kind for each device.
+        The segments are compacted (rewritten with only the latest record for
+        each device) when they grow past the given limits, so the disk usage of
+        the outbox is always bounded.
+    """
+    # Order by which the different kinds of events are sent to the cloud
+    KINDS = ("unregister", "register", "state")
+
+    def __init__(self, directory, segment_size=256*1024, max_size=8*1024*1024,\
+                    retry_min=1, retry_max=300):
+        self.directory = directory
+        self.segment_size = int(segment_size)
+        self.max_size = int(max_size)
+        self.retry_min = float(retry_min)
+        self.retry_max = float(retry_max)
+
+        self.records = OrderedDict()
+        self.seq = 0
+
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._loaded = False
+        self._segment = None
+        self._segment_num = 0
+        self._disk_size = 0
+
+    #
+    ### Public interface
+    def put(self, kind, device, data):
+        """
+            This method stores a new event on the outbox. If an event of the same
+            kind already exists for the given device it is replaced by the new one.
+            An unregistration event discards all the other pending events of
+            the device.
+        """
+        if kind not in self.KINDS:
+            raise ValueError("Invalid outbox event kind ("+str(kind)+")")
+
+        with self._lock:
+            self._load()
+            self.seq += 1
+            record = OutboxRecord(self.seq, kind, device, data)
+
+            if kind == "unregister":
+                for k in self.KINDS:
+                    self.records.pop((k, device), None)
+            self.records.pop(record.key, None)
+            self.records[record.key] = record
+
+            self._append(record)
+            logger.info("Event (%s) for device (%s) stored on the outbox", kind, device)
+        self._wakeup.set()
+        return record
+
+    def discard(self, kind, device):
+        """
+            This method discards the pending event of the given kind for the
+            given device (ex: because a newer event was just sent to the cloud).
+        """
+        with self._lock:
+            if not self._loaded and not self._has_segments():
+                return False
+            self._load()
+            if self.records.pop((kind, device), None) is not None:
+                self._append(OutboxRecord(None, kind, device, None))
+                return True
+        return False
+
+    def pending(self):
+        """
+            This method returns the number of events waiting on the outbox.
+        """
+        with self._lock:
+            self._load()
+            return len(self.records)
+
+    def wake(self):
+        """
+            This method wakes up the outbox worker so that it retries to send
+            the pending events right away.
+        """
+        self._wakeup.set()
+
+    def drain(self, send):
+        """
+            This method tries to send all the pending events to the cloud, by
+            the order specified on KINDS. The 'send' argument must be a function
+            receiving a record and a dictionary shared among all the records sent
+            in this drain, and returning True if the record was delivered, False
+            if it was not (stopping the drain) or None if it must be kept for a
+            later drain. It returns the tuple (number of sent records, True if all
+            of them were sent).
+        """
+        with self._lock:
+            self._load()
+            batch = sorted(self.records.values(),\
+                            key=lambda r: (self.KINDS.index(r.kind), r.seq))
+
+        context = {}
+        sent = 0
+        done = True
+        for record in batch:
+            try:
+                ok = send(record, context)
+            except Exception as err:
+                logger.error("ERROR: "+str(err))
+                ok = False
+
+            if ok is None:
+                done = False
+                continue
+            if not ok:
+                done = False
+                break
+
+            sent += 1
+            with self._lock:
+                current = self.records.get(record.key)
+                if current is not None and current.seq == record.seq:
+                    del self.records[record.key]
+
+        if sent > 0:
+            with self._lock:
+                self.compact()
+        return sent, done
+
+    def run(self, stopped, send):
+        """
+            This method is the outbox worker. It runs until the 'stopped' event
+            is set, draining the outbox every time a new event arrives and retrying
+            with an exponential backoff while the cloud service is not reachable.
+        """
+        delay = self.retry_min
+        while not stopped.isSet():
+            if self.pending() == 0:
+                self._wakeup.wait(self.retry_max)
+                self._wakeup.clear()
+                delay = self.retry_min
+                continue
+
+            sent, done = self.drain(send)
+            if done:
+                logger.info("Outbox drained ("+str(sent)+" events sent)")
+                delay = self.retry_min
+                continue
+
+            logger.info("Outbox not drained ("+str(sent)+" events sent), retrying in "\
+                        +str(delay)+" seconds")
+            self._wakeup.wait(delay)
+            if not self._wakeup.isSet():
+                delay = min(delay*2, self.retry_max)
+            self._wakeup.clear()
+
+    #
+    ### Segment files management
+    def compact(self):
+        """
+            This method rewrites all the segments into a single one, keeping only
+            the latest record of each kind for each device. If the outbox is still
+            bigger than the maximum size, the oldest state notifications are dropped.
+        """
+        with self._lock:
+            self._load()
+            old_segments = self._segments()
+
+            lines = [r.get_json()+"\n" for r in self.records.itervalues()]
+            size = sum(len(l) for l in lines)
+            while size > self.max_size and lines:
+                dropped = self._drop_oldest()
+                if dropped is None:
+                    break
+                lines = [r.get_json()+"\n" for r in self.records.itervalues()]
+                size = sum(len(l) for l in lines)
+
+            self._close_segment()
+            self._segment_num += 1
+            path = self._segment_path(self._segment_num)
+            tmp = path+".tmp"
+            f = open(tmp, "w")
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.rename(tmp, path)
+
+            for seg in old_segments:
+                try:
+                    os.remove(seg)
+                except OSError:
+                    pass
+
+            self._disk_size = size
+
+    def _drop_oldest(self):
+        """
+            This is an auxiliary method that drops the oldest record (state
+            notifications first) to keep the outbox under its maximum size.
+        """
+        for kind in reversed(self.KINDS):
+            for key, record in self.records.iteritems():
+                if record.kind == kind:
+                    del self.records[key]
+                    logger.warning("Outbox full. Dropping event ("+kind+") for device ("\
+                                    +str(record.device)+")")
+                    return record
+        return None
+
+    def _append(self, record):
+        """
+            This is an auxiliary method that appends a record to the current
+            segment, rotating and compacting the segments when needed.
+        """
+        line = record.get_json()+"\n"
+        if self._segment is None or self._segment.tell() + len(line) > self.segment_size:
+            self._close_segment()
+            if self._disk_size + len(line) > self.max_size:
+                self.compact()
+            self._segment_num += 1
+            self._segment = open(self._segment_path(self._segment_num), "a")
+
+        self._segment.write(line)
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._disk_size += len(line)
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _load(self):
+        """
+            This is an auxiliary method that loads all the records stored on the
+            segment files (by their order) the first time the outbox is used.
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        for seg in self._segments():
+            self._segment_num = max(self._segment_num, self._segment_index(seg))
+            self._disk_size += os.path.getsize(seg)
+            f = open(seg, "r")
+            for line in f:
+                try:
+                    js = json.loads(line)
+                    record = OutboxRecord(js["seq"], str(js["kind"]), js["device"], js["data"])
+                except (ValueError, KeyError):
+                    # a crash in the middle of a write leaves an incomplete last line
+                    logger.warning("Ignoring corrupted outbox record on "+seg)
+                    continue
+
+                if record.seq is None:
+                    self.records.pop(record.key, None)
+                    continue
+                if record.kind == "unregister":
+                    for k in self.KINDS:
+                        self.records.pop((k, record.device), None)
+                self.records.pop(record.key, None)
+                self.records[record.key] = record
+                self.seq = max(self.seq, record.seq)
+            f.close()
+
+        if self.records:
+            logger.info("Outbox loaded with "+str(len(self.records))+" pending events")
+
+    def _has_segments(self):
+        return os.path.isdir(self.directory) and len(self._segments()) > 0
+
+    def _segments(self):
+        """
+            This is an auxiliary method that returns the paths of all the
+            segment files, ordered from the oldest to the newest.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        names = [n for n in os.listdir(self.directory)\
+                    if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+        paths = [os.path.join(self.directory, n) for n in names]
+        return sorted(paths, key=self._segment_index)
+
+    def _segment_path(self, num):
+        return os.path.join(self.directory, SEGMENT_PREFIX+str(num).zfill(8)+SEGMENT_SUFFIX)
+
+    @staticmethod
+    def _segment_index(path):
+        name = os.path.basename(path)
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
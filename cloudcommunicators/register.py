@@ -3,22 +3,29 @@
     Here are specified the functions used to register the HomeServer on the cloud
     service and also to fetch the HomeServer configuration data from it.
 """
+import os
 import json
 import sys
 import getpass
 import re
+import hashlib
 import logging
+import threading
 
 import requests
 
 import utils
 import settings
+import persistence
 
 __author__ = "Jose Requeijo Dias"
 
 logging.config.fileConfig(settings.LOGGING_CONFIG_FILE, disable_existing_loggers=False)
 logger = logging.getLogger("proxylog")
 
+# serializes the updates of the validators of the configuration files
+validators_lock = threading.Lock()
+
 def register():
     """
         This function register the HomeServer on the cloud service.
@@ -34,22 +41,11 @@ def register():
         connection and without cloud service support/registration.
     """
     try:
-        f = open(settings.SERVER_CONFIG_FILE, "r")
-        confs = json.load(f)
-        f.close()
-
-        settings.HOME_SERVER_ID = confs["id"]
-        settings.HOME_SERVER_NAME = confs["name"]
-        settings.HOME_SERVER_COAP_ADDRESS = confs["coap_address"]
-        settings.HOME_SERVER_COAP_PORT = confs["coap_port"]
-        settings.HOME_SERVER_PROXY_ADDRESS = confs["proxy_address"]
-        settings.HOME_SERVER_PROXY_PORT = confs["proxy_port"]
-        settings.USER_PASSWORD = confs["password"]
-        settings.USER_EMAIL = confs["email"]
+        load_server_confs()
 
         if register_from_file():
             settings.WORKING_OFFLINE = False
-            return get_configs() and get_services()
+            return fetch_configs()
 
         elif settings.ALLOW_WORKING_OFFLINE:
             settings.WORKING_OFFLINE = True
@@ -58,7 +54,7 @@ def register():
     except IOError:
         if register_from_scratch():
             settings.WORKING_OFFLINE = False
-            return get_configs() and get_services()
+            return fetch_configs()
 
         elif settings.ALLOW_WORKING_OFFLINE:
             settings.WORKING_OFFLINE = True
@@ -71,6 +67,63 @@ def register():
         logger.error("Unknown Fatal Home Server Error!")
         return False
 
+def load_server_confs():
+    """
+        This function loads to the settings the HomeServer informations stored
+        on the HomeServer configuration file. It raises IOError if the file
+        does not exist and KeyError if some information is missing.
+    """
+    f = open(settings.SERVER_CONFIG_FILE, "r")
+    confs = json.load(f)
+    f.close()
+
+    settings.HOME_SERVER_ID = confs["id"]
+    settings.HOME_SERVER_NAME = confs["name"]
+    settings.HOME_SERVER_COAP_ADDRESS = confs["coap_address"]
+    settings.HOME_SERVER_COAP_PORT = confs["coap_port"]
+    settings.HOME_SERVER_PROXY_ADDRESS = confs["proxy_address"]
+    settings.HOME_SERVER_PROXY_PORT = confs["proxy_port"]
+    settings.USER_PASSWORD = confs["password"]
+    settings.USER_EMAIL = confs["email"]
+
+def is_registered():
+    """
+        This function checks if the HomeServer was already registered, i.e. if
+        it has its configuration file and all the configurations files fetched
+        from the cloud service, so that it can start serving with them.
+    """
+    for path in (settings.SERVER_CONFIG_FILE, settings.DEVICE_TYPES_CONFIG_FILE,\
+                 settings.PROPERTY_TYPES_CONFIG_FILE, settings.VALUE_TYPES_CONFIG_FILE,\
+                 settings.SERVICES_CONFIG_FILE):
+        if not os.path.isfile(path):
+            return False
+    return True
+
+def register_in_background(stopped, on_registered=None):
+    """
+        This function registers the HomeServer (with the informations already
+        loaded from its configuration file) on the cloud service and fetches
+        its configurations, retrying until it succeeds or the 'stopped' event
+        is set, and then calls on_registered. Meanwhile the HomeServer works
+        offline if the setting ALLOW_WORKING_OFFLINE is set to True.
+    """
+    retry = settings.REGISTER_RETRY_MIN
+    while not stopped.isSet():
+        if register_from_file() and fetch_configs():
+            settings.WORKING_OFFLINE = False
+            logger.info("Home Server registered and configurations refreshed")
+            if on_registered is not None:
+                on_registered()
+            return True
+
+        if settings.ALLOW_WORKING_OFFLINE and not settings.WORKING_OFFLINE:
+            settings.WORKING_OFFLINE = True
+            logger.info("Working Offline")
+        logger.info("Retrying the registration in "+str(retry)+" seconds")
+        stopped.wait(retry)
+        retry = min(retry*2, settings.REGISTER_RETRY_MAX)
+    return False
+
 def register_from_file():
     """
         This function regist the HomeServer with the informations stored
@@ -114,12 +167,10 @@ def register_from_file():
             return False
 
         if resp.status_code == 200:
-            f = open(settings.SERVER_CONFIG_FILE, "w")
             js = json.loads(resp.text)
             js["email"] = email
             js["password"] = password
-            json.dump(js, f)
-            f.close()
+            write_config_file(settings.SERVER_CONFIG_FILE, js)
             logger.info("Server Info Retrieved Successfully")
             return True
         else:
@@ -139,7 +190,6 @@ def register_from_file():
                 return False
 
             if resp.status_code == 200:
-                f = open(settings.SERVER_CONFIG_FILE, "w")
                 js = json.loads(resp.text)
                 for ele in js["servers"]:
                     if ele["coap_address"] == data["coap_address"]:
@@ -148,8 +198,7 @@ def register_from_file():
 
                 serv["email"] = email
                 serv["password"] = password
-                json.dump(serv, f)
-                f.close()
+                write_config_file(settings.SERVER_CONFIG_FILE, serv)
                 logger.info("Server Registed Successfully")
                 return True
             else:
@@ -198,6 +247,12 @@ def register_from_scratch():
                 multicast = settings.COAP_MULTICAST
 
                 proxy_ip_addr = settings.PROXY_ADDR
+                if not proxy_ip_addr:
+                    try:
+                        proxy_ip_addr = utils.get_my_ip(public=True,\
+                                                        cache_file=settings.ADDRESSES_CACHE_FILE)
+                    except utils.AppError:
+                        return False
                 proxy_port = settings.PROXY_PORT
 
                 if utils.validate_IPv4(coap_ip_addr):
@@ -250,7 +305,6 @@ def register_from_scratch():
             if resp.status_code == 200:
                 print "Server Registed Successfully"
                 try:
-                    f = open(settings.SERVER_CONFIG_FILE, "w")
                     js = json.loads(resp.text)
 
                     for serv in js["servers"]:
@@ -260,8 +314,7 @@ def register_from_scratch():
 
                     confs["email"] = email
                     confs["password"] = password
-                    json.dump(confs, f)
-                    f.close()
+                    write_config_file(settings.SERVER_CONFIG_FILE, confs)
 
                     settings.HOME_SERVER_ID = confs["id"]
                     settings.HOME_SERVER_NAME = confs["name"]
@@ -297,105 +350,208 @@ def register_from_scratch():
     return True
 
 
-def get_configs():
+def open_configs_session():
+    """
+        This function opens a session with the cloud service to fetch the
+        HomeServer configurations. Its connections are pooled, so it can be
+        shared by concurrent fetches.
+    """
+    client = requests.Session()
+    client.headers = {"Accept":"application/json"}
+    client.auth = (settings.USER_EMAIL, settings.USER_PASSWORD)
+    return client
+
+def fetch_configs():
+    """
+        This function fetches the HomeServer configurations and services from
+        the cloud service concurrently, over one pooled session, and stores them
+        to the configuration files specified on the settings file.
+    """
+    with open_configs_session() as client:
+        results = {}
+        services_t = threading.Thread(target=lambda: results.update(services=get_services(client)))
+        services_t.start()
+        configs_ok = get_configs(client)
+        services_t.join()
+    return configs_ok and results.get("services", False)
+
+def load_validators():
+    try:
+        with open(settings.CONFIGS_VALIDATORS_FILE, "r") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def files_digest(files):
+    """
+        This function returns a digest of the content of the given files, or
+        None if any of them can not be read.
+    """
+    digest = hashlib.md5()
+    try:
+        for path in files:
+            with open(path, "r") as f:
+                digest.update(f.read())
+    except IOError:
+        return None
+    return digest.hexdigest()
+
+def conditional_get(client, url, files):
+    """
+        This function fetches url unless it was not modified since it was stored
+        on the given configuration files, sending the validators (ETag and
+        Last-Modified) stored with them on 'settings.CONFIGS_VALIDATORS_FILE'
+        (only if the files were not changed since). It returns the response, or
+        None if it was not modified.
+    """
+    headers = {}
+    with validators_lock:
+        validators = load_validators().get(url, {})
+    digest = files_digest(files)
+    if digest is not None and validators.get("digest") == digest:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    resp = client.get(url, headers=headers)
+    if resp.status_code == 304:
+        logger.info("Not modified: "+url)
+        return None
+    return resp
+
+def save_validators(url, resp, files):
+    """
+        This function stores the validators (ETag and Last-Modified) of the
+        response of url on 'settings.CONFIGS_VALIDATORS_FILE', with the digest
+        of the configuration files where its content was stored.
+    """
+    with validators_lock:
+        validators = load_validators()
+        validators[url] = {"etag": resp.headers.get("ETag"),\
+                           "last_modified": resp.headers.get("Last-Modified"),\
+                           "digest": files_digest(files)}
+        write_config_file(settings.CONFIGS_VALIDATORS_FILE, validators)
+
+def write_config_file(path, data):
+    """
+        This function stores data (as JSON) on the configuration file at path,
+        only if its content changed, atomically (a temporary file renamed over
+        it, so the Home Server never reads a partial file). It returns True if
+        the file was written.
+    """
+    content = json.dumps(data)
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                return False
+    except IOError:
+        pass
+
+    persistence.write_atomic(path, content)
+    return True
+
+def get_configs(client=None):
     """
         This function fetches all the needed HomeServer configurations from
         the cloud service and store them to the configuration files specified
-        on the settings file.
+        on the settings file, when they were modified.
     """
+    if client is None:
+        with open_configs_session() as client:
+            return get_configs(client)
+
     core_configs_url = settings.CLOUD_BASE_URL+"api/configs/"
-    email = settings.USER_EMAIL
-    password = settings.USER_PASSWORD
+    files = (settings.DEVICE_TYPES_CONFIG_FILE, settings.VALUE_TYPES_CONFIG_FILE,\
+             settings.PROPERTY_TYPES_CONFIG_FILE)
+    try:
+        resp = conditional_get(client, core_configs_url, files)
+        if resp is None:
+            return True
+        js = json.loads(resp.text)
+    except:
+        logger.error("ERROR: You do not have connection to the internet or the cloud server is down")
+        return False
 
-    with requests.Session() as client:
-        client.headers = {"Accept":"application/json"}
-        client.auth = (email, password)
-        try:
-            # Retrieve the CSRF token first
-            resp = client.get(core_configs_url)
-            js = json.loads(resp.text)
-        except:
-            logger.error("ERROR: You do not have connection to the internet or the cloud server is down")
-            return False
+    try:
+        logger.info("Getting configurations: (device_types)")
+        data = {}
+        data["DEVICE_TYPES"] = js["device_types"]
+        write_config_file(settings.DEVICE_TYPES_CONFIG_FILE, data)
+    except:
+        logger.error("Could not open/create "+settings.DEVICE_TYPES_CONFIG_FILE+" file")
+        return False
 
-        try:
-            logger.info("Getting configurations: (device_types)")
-            device_types_file = open(settings.DEVICE_TYPES_CONFIG_FILE, "w")
-            data = {}
-            data["DEVICE_TYPES"] = js["device_types"]
-            json.dump(data, device_types_file)
-            device_types_file.close()
-        except:
-            logger.error("Could not open/create "+settings.DEVICE_TYPES_CONFIG_FILE+" file")
-            return False
+    try:
+        logger.info("Getting configurations: (value_types)")
+        data = {}
+        data["SCALAR_TYPES"] = js["value_types"]["scalars"]
+        data["ENUM_TYPES"] = js["value_types"]["enums"]
+
+        choices = dict((ele["id"], ele) for ele in js["value_types"]["choices"])
+        for e in data["ENUM_TYPES"]:
+            ch = e["choices"]
+            e["choices"] = {}
+            for ele in ch:
+                if ele in choices:
+                    e["choices"][str(choices[ele]["name"])] = choices[ele]["value"]
+            if ch and e["default_value"] in choices:
+                e["default_value"] = choices[e["default_value"]]["name"]
+
+        write_config_file(settings.VALUE_TYPES_CONFIG_FILE, data)
+    except:
+        logger.error("Could not open/create "+settings.VALUE_TYPES_CONFIG_FILE+" file")
+        return False
 
-        try:
-            logger.info("Getting configurations: (value_types)")
-            value_types_file = open(settings.VALUE_TYPES_CONFIG_FILE, "w")
-            data = {}
-            data["SCALAR_TYPES"] = js["value_types"]["scalars"]
-            data["ENUM_TYPES"] = js["value_types"]["enums"]
-
-            for e in data["ENUM_TYPES"]:
-                ch = e["choices"]
-                e["choices"] = {}
-                for ele in ch:
-                    for ele1 in js["value_types"]["choices"]:
-                        if ele1["id"] == ele:
-                            e["choices"][str(ele1["name"])] = ele1["value"]
-                        if ele1["id"] == e["default_value"]:
-                            e["default_value"] = ele1["name"]
-
-            json.dump(data, value_types_file)
-            value_types_file.close()
-        except:
-            logger.error("Could not open/create "+settings.VALUE_TYPES_CONFIG_FILE+" file")
-            return False
+    try:
+        logger.info("Getting configurations: (property_types)")
+        data = {}
+        data["PROPERTY_TYPES"] = js["property_types"]
+        write_config_file(settings.PROPERTY_TYPES_CONFIG_FILE, data)
+    except:
+        logger.error("Could not open/create "+settings.PROPERTY_TYPES_CONFIG_FILE+" file")
+        return False
 
-        try:
-            logger.info("Getting configurations: (property_types)")
-            property_types_file = open(settings.PROPERTY_TYPES_CONFIG_FILE, "w")
-            data = {}
-            data["PROPERTY_TYPES"] = js["property_types"]
-            json.dump(data, property_types_file)
-            property_types_file.close()
-        except:
-            logger.error("Could not open/create "+settings.PROPERTY_TYPES_CONFIG_FILE+" file")
-            return False
+    try:
+        save_validators(core_configs_url, resp, files)
+    except (IOError, OSError):
+        logger.error("Could not open/create "+settings.CONFIGS_VALIDATORS_FILE+" file")
     return True
 
-def get_services():
+def get_services(client=None):
     """
         This function fetches all the user services present on
         the cloud service and store them to the configuration file specified
-        on the settings file.
+        on the settings file, when they were modified.
     """
-    services_url = settings.CLOUD_BASE_URL+"api/services/"
-    email = settings.USER_EMAIL
-    password = settings.USER_PASSWORD
+    if client is None:
+        with open_configs_session() as client:
+            return get_services(client)
 
-    with requests.Session() as client:
-        client.headers = {"Accept":"application/json"}
-        client.auth = (email, password)
-        try:
-            # Retrieve the CSRF token first
-            resp = client.get(services_url)
-            js = json.loads(resp.text)
-        except:
-            print "ERROR: You do not have connection to the internet or the cloud server is down"
-            return False
+    services_url = settings.CLOUD_BASE_URL+"api/services/"
+    files = (settings.SERVICES_CONFIG_FILE,)
+    try:
+        resp = conditional_get(client, services_url, files)
+        if resp is None:
+            return True
+        js = json.loads(resp.text)
+    except:
+        logger.error("ERROR: You do not have connection to the internet or the cloud server is down")
+        return False
 
-        try:
-            logger.info("Getting Services")
-            services_file = open(settings.SERVICES_CONFIG_FILE, "w")
-            data = {}
-            data["SERVICES"] = js["services"]
-            json.dump(data, services_file)
-            services_file.close()
-        except:
-            logger.error("Could not open/create "+settings.SERVICES_CONFIG_FILE+" file")
-            return False
+    try:
+        logger.info("Getting Services")
+        data = {}
+        data["SERVICES"] = js["services"]
+        write_config_file(settings.SERVICES_CONFIG_FILE, data)
+    except:
+        logger.error("Could not open/create "+settings.SERVICES_CONFIG_FILE+" file")
+        return False
 
+    try:
+        save_validators(services_url, resp, files)
+    except (IOError, OSError):
+        logger.error("Could not open/create "+settings.CONFIGS_VALIDATORS_FILE+" file")
     return True
 
 if __name__ == "__main__":
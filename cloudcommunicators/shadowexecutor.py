@@ -0,0 +1,176 @@
+"""
+    This is the Shadow Executor File.
+    Here are specified the executor used to run the AWS IoT thing and shadow
+    operations with a bounded number of threads, and the rate limiter used to
+    keep those operations within the AWS IoT request quotas.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+__author__ = "Jose Requeijo Dias"
+
+logger = logging.getLogger("cloud_comm_log")
+
+class RateLimiter(object):
+    """
+        This is the Rate Limiter class (a token bucket).
+        It allows at most 'rate' operations per second, with bursts of up to
+        'burst' operations. A rate of None (or 0) disables the limit.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate) if rate else None
+        self.burst = float(burst or rate or 1)
+        self.tokens = self.burst
+        self.timestamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+            This method blocks until one more operation is allowed.
+        """
+        if self.rate is None:
+            return
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.timestamp)*self.rate)
+            self.timestamp = now
+            # the token is taken right away (the bucket may owe tokens) and
+            # waited for outside the lock, so the other threads are not blocked
+            self.tokens -= 1
+            wait = -self.tokens/self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ShadowTask(object):
+    """
+        This represents an operation submitted to the Shadow Executor.
+    """
+    def __init__(self, thing, kind, fn):
+        self.thing = thing
+        self.kind = kind
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+            This method waits for the operation to be done and returns its result
+            (or raises the error raised by the operation).
+        """
+        if not self.done.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class ShadowExecutor(object):
+    """
+        This is the Shadow Executor class.
+        The operations are run by 'workers' threads, one operation of each thing
+        at a time and in the order they were submitted. An operation submitted
+        while another operation of the same kind is still pending for the same
+        thing replaces it (i.e. only the latest shadow update of a thing is sent)
+        and is moved after the operations submitted meanwhile.
+    """
+    def __init__(self, workers=4):
+        self.pending = OrderedDict()
+        self.running = set()
+        self.stopped = threading.Event()
+        self._cond = threading.Condition()
+
+        self.workers = []
+        for n in range(workers):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def submit(self, thing, kind, fn):
+        """
+            This method submits the operation 'fn' (a function without arguments)
+            of the given kind for the given thing, and returns its ShadowTask.
+        """
+        with self._cond:
+            task = self.pending.pop((thing, kind), None)
+            if task is not None:
+                task.fn = fn
+                self.pending[(thing, kind)] = task
+                return task
+            task = ShadowTask(thing, kind, fn)
+            self.pending[(thing, kind)] = task
+            self._cond.notify()
+            return task
+
+    def cancel(self, thing, kind):
+        """
+            This method cancels the pending operation of the given kind for the
+            given thing (if any), and returns True if it was cancelled.
+        """
+        with self._cond:
+            task = self.pending.pop((thing, kind), None)
+        if task is None:
+            return False
+        task.done.set()
+        return True
+
+    def size(self):
+        """
+            This method returns the number of pending operations.
+        """
+        with self._cond:
+            return len(self.pending)
+
+    def join(self, timeout=None):
+        """
+            This method waits until there are no pending or running operations.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self.pending or self.running:
+                remaining = end - time.time() if end is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        """
+            This method stops the executor workers.
+        """
+        self.stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _next_task(self):
+        for key, task in self.pending.iteritems():
+            if task.thing not in self.running:
+                del self.pending[key]
+                self.running.add(task.thing)
+                return task
+        return None
+
+    def _worker(self):
+        while not self.stopped.isSet():
+            with self._cond:
+                task = self._next_task()
+                while task is None and not self.stopped.isSet():
+                    self._cond.wait(1)
+                    task = self._next_task()
+            if task is None:
+                return
+
+            try:
+                task.result = task.fn()
+            except Exception as err:
+                task.error = err
+                logger.error("ERROR: "+str(err))
+
+            with self._cond:
+                self.running.discard(task.thing)
+                task.done.set()
+                self._cond.notify_all()
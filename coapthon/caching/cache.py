@@ -1,264 +1,299 @@
-import time
-
-from coaplrucache import CoapLRUCache
-from coapthon import utils
-from coapthon.messages.request import *
-from coapthon.messages.message import Message
-
-
-__author__ = 'Emilio Vallati'
-
-
-class Cache(object):
-
-    def __init__(self, mode, max_dim):
-        """
-
-        :param max_dim: max number of elements in the cache
-        :param mode: used to differentiate between a cache used in a forward-proxy or in a reverse-proxy
-        """
-
-        self.max_dimension = max_dim
-        self.mode = mode
-        self.cache = CoapLRUCache(max_dim)
-
-    def cache_add(self, request, response):
-        """
-        checks for full cache and valid code before updating the cache
-
-        :param request:
-        :param response:
-        :return:
-        """
-        print "adding response to the cache"
-
-        """
-        checking for valid code
--       """
-        code = response.code
-        try:
-            utils.check_code(code)
-        except utils.InvalidResponseCode:
-            print "Invalid response code"
-            return
-
-        """
-        return if max_age is 0
-        """
-        if response.max_age == 0:
-            return
-
-        """
-        Initialising new cache element based on the mode and updating the cache
-        """
-
-        if self.mode == defines.FORWARD_PROXY:
-            new_key = CacheKey(request)
-        else:
-            new_key = ReverseCacheKey(request)
-
-        print "max age = ", response.max_age
-        new_element = CacheElement(new_key, response, request, response.max_age)
-
-        self.cache.update(new_key, new_element)
-        print "cache size = ", self.cache.debug_print()
-
-
-
-    def search_related(self, request):
-        print "searching similar payload"
-        if self.cache.is_empty() is True:
-            print "empty cache"
-            return None
-
-        print "cache not empty"
-
-        """
-        extracting everything from the cache
-        """
-        result = []
-        items = self.cache.cache.items()
-        for key, item in items:
-            print "key = ", key
-            print "item = ", item
-
-        for key, item in items:
-            element = self.cache.get(item.key)
-            print "element.uri: ", element.uri
-            print "uri path: ", request.proxy_uri
-            if request.proxy_uri == element.uri:
-                result.append(item)
-
-        return result
-
-
-    def search_response(self, request):
-        """
-        creates a key from the request and searches the cache with it
-
-        :param request:
-        :return CacheElement: returns None if there's a cache miss
-        """
-        print "searching response"
-
-        if self.cache.is_empty() is True:
-            print "empty cache"
-            return None
-
-        print "cache not empty"
-
-        """
-        create a new cache key from the request
-        """
-
-        if self.mode == defines.FORWARD_PROXY:
-            search_key = CacheKey(request)
-        else:
-            search_key = ReverseCacheKey(request)
-
-        response = self.cache.get(search_key)
-
-        return response
-
-
-    def validate(self, request, response):
-        """
-        refreshes a resource when a validation response is received
-
-        :param request:
-        :param response:
-        :return:
-        """
-        element = self.search_response(request)
-        if element is not None:
-            element.cached_response.options = response.options
-            element.freshness = True
-            element.max_age = response.max_age
-            element.creation_time = time.time()
-            element.uri = request.proxy_uri
-
-    def mark(self, element):
-        """
-        marks the requested resource in the cache as not fresh
-        :param request:
-        :return:
-        """
-        print "element.response = ", element.cached_response
-        print "element.uri = ", element.uri
-        print "element.freshness = ", element.freshness
-        if element is not None:
-            print "unfreshening"
-            element.freshness = False
-        self.cache.debug_print()
-
-"""
-class for the element contained in the cache
-"""
-
-
-class CacheElement(object):
-    def __init__(self, cache_key, response, request,  max_age=60):
-        """
-
-        :param cache_key: the key used to search for the element in the cache
-        :param response: the server response to store
-        :param max_age: maximum number of seconds that the resource is considered fresh
-        """
-        self.freshness = True
-        self.key = cache_key
-        self.cached_response = response
-        self.max_age = max_age
-        self.creation_time = time.time()
-        self.uri = request.proxy_uri
-
-    def debug_print(self):
-        print "freshness = ", self.freshness
-        print "key"
-        self.key.debug_print()
-        print "response = ", self.cached_response
-        print "max age = ", self.max_age
-        print "creation time = ", self.creation_time
-
-"""
-class for the key used to search elements in the cache (forward-proxy only)
-"""
-
-
-class CacheKey(object):
-    def __init__(self, request):
-        """
-
-        :param request:
-        """
-        print "creating key"
-        if (request.payload is not None):
-            self._payload = request.payload
-        else:
-            self._payload = None
-        self._method = request.code
-
-        """
-        making a list of the options that do not have a nocachekey option number and are not uri-path, uri-host, uri-port, uri-query
-        """
-
-        self._options = []
-        for option in request.options:
-            if (utils.check_nocachekey(option) is False) and (utils.is_uri_option(option.number) is False):
-                self._options.append(option)
-
-        """
-        creating a usable key for the cache structure
-        """
-
-        option_str = ', '.join(map(str, self._options))
-        self._list = [self._payload, self._method, option_str]
-
-        self.hashkey = ', '.join(map(str, self._list))
-        self.debug_print()
-
-    def debug_print(self):
-        print "payload = ", self._payload
-        print "method = ", self._method
-        print "options = "
-        for option in self._options:
-            print option
-
-
-"""
-class for the key used to search elements in the cache (reverse-proxy only)
-"""
-
-
-class ReverseCacheKey(object):
-    def __init__(self, request):
-        """
-
-        :param request:
-        """
-        self._payload = request.payload
-        self._method = request.code
-
-        """
-        making a list of the options that do not have a nocachekey option number
-        """
-
-        self._options = []
-        for option in request.options:
-            if utils.check_nocachekey(option) is False:
-                self._options.append(option)
-
-        """
-        creating a usable key for the cache structure
-        """
-
-        option_str = ', '.join(map(str, self._options))
-        self.hashkey = (self._payload, self._method, option_str)
-
-    def debug_print(self):
-        print "payload = ", self._payload
-        print "method = ", self._method
-        print "options = "
-        for option in self._options:
-            print option
-
-
+import logging
+import time
+
+from coaplrucache import CoapLRUCache
+from coapthon import utils
+from coapthon.messages.request import *
+from coapthon.messages.response import Response
+from coapthon.messages.message import Message
+
+
+__author__ = 'Emilio Vallati'
+
+logger = logging.getLogger(__name__)
+
+"""
+options of the origin response that are not stored with the cached response
+"""
+NOT_STORED_OPTIONS = (defines.OptionRegistry.BLOCK1.number, defines.OptionRegistry.BLOCK2.number,
+                      defines.OptionRegistry.OBSERVE.number, defines.OptionRegistry.MAX_AGE.number)
+
+"""
+options of the request that are not part of the cache key, the whole representation is cached and split in blocks
+"""
+KEY_EXCLUDED_OPTIONS = (defines.OptionRegistry.BLOCK2.number,)
+
+
+class Cache(object):
+
+    def __init__(self, mode, max_dim, max_bytes=defines.CACHE_MAX_BYTES):
+        """
+
+        :param max_dim: max number of elements in the cache
+        :param mode: used to differentiate between a cache used in a forward-proxy or in a reverse-proxy
+        :param max_bytes: max size of the responses in the cache
+        """
+
+        self.max_dimension = max_dim
+        self.mode = mode
+        self.cache = CoapLRUCache(max_dim, max_bytes)
+        self.stats = {"hits": 0, "misses": 0, "revalidations": 0, "validated": 0}
+
+    def uri(self, request):
+        """
+        the URI the cached responses of a request are indexed with
+
+        :param request:
+        :return:
+        """
+        if self.mode == defines.FORWARD_PROXY:
+            return request.proxy_uri
+        return request.uri_path
+
+    def key(self, request):
+        if self.mode == defines.FORWARD_PROXY:
+            return CacheKey(request)
+        return ReverseCacheKey(request)
+
+    def cache_add(self, request, response):
+        """
+        checks for valid code before updating the cache
+
+        :param request:
+        :param response:
+        :return:
+        """
+
+        """
+        checking for valid code
+        """
+        code = response.code
+        try:
+            utils.check_code(code)
+        except utils.InvalidResponseCode:
+            logger.debug("Invalid response code %s, not cached", code)
+            return
+
+        """
+        return if max_age is 0
+        """
+        if response.max_age == 0:
+            return
+
+        """
+        Initialising new cache element based on the mode and updating the cache
+        """
+        new_key = self.key(request)
+        new_element = CacheElement(new_key, response, request, response.max_age, self.uri(request))
+        self.cache.update(new_key, new_element)
+
+    def search_related(self, request):
+        """
+        returns the elements cached for the URI of the request
+
+        :param request:
+        :return:
+        """
+        return self.cache.related(self.uri(request))
+
+    def search_response(self, request):
+        """
+        creates a key from the request and searches the cache with it
+
+        :param request:
+        :return CacheElement: returns None if there's a cache miss
+        """
+        return self.cache.get(self.key(request))
+
+    def validate(self, request, response):
+        """
+        refreshes a resource when a validation response is received
+
+        :param request:
+        :param response:
+        :return: the refreshed element, None if not cached
+        """
+        element = self.search_response(request)
+        if element is not None:
+            element.refresh(response)
+            self.cache.refresh(element.key.hashkey, element)
+            self.count("validated")
+        return element
+
+    def mark(self, element):
+        """
+        marks the requested resource in the cache as not fresh
+        :param element:
+        :return:
+        """
+        if element is not None:
+            element.freshness = False
+            self.count("invalidations")
+
+    def count(self, name):
+        """
+        increments a counter of the stats, under the lock of the cache since the requests are handled by
+        concurrent threads
+
+        :param name: the name of the counter
+        :return:
+        """
+        with self.cache._lock:
+            if name in self.stats:
+                self.stats[name] += 1
+            else:
+                self.cache.stats[name] += 1
+
+    def get_stats(self):
+        """
+        returns the hit/miss/eviction counters and the size of the cache
+
+        :return:
+        """
+        with self.cache._lock:
+            ret = dict(self.stats)
+            ret.update(self.cache.stats)
+            ret["elements"] = len(self.cache.cache)
+            ret["bytes"] = self.cache.size
+        return ret
+
+"""
+class for the element contained in the cache
+"""
+
+
+class CacheElement(object):
+    def __init__(self, cache_key, response, request, max_age=60, uri=None):
+        """
+
+        :param cache_key: the key used to search for the element in the cache
+        :param response: the server response to store
+        :param max_age: maximum number of seconds that the resource is considered fresh
+        :param uri: the URI the element is indexed with
+        """
+        self.freshness = True
+        self.key = cache_key
+        self.cached_response = Response()
+        self.cached_response.code = response.code
+        self.cached_response.payload = response.payload
+        self.cached_response.options = [o for o in response.options if o.number not in NOT_STORED_OPTIONS]
+        etag = response.etag
+        self.etag = etag[0] if len(etag) > 0 else None
+        self.max_age = max_age
+        self.creation_time = time.time()
+        self.expiration = self.creation_time + max_age
+        self.uri = uri if uri is not None else request.proxy_uri
+        self.size = 64 + len(response.payload or "") + sum(o.length for o in self.cached_response.options)
+
+    def refresh(self, response):
+        """
+        updates the element with the options of a 2.03 Valid response
+
+        :param response:
+        :return:
+        """
+        numbers = set(o.number for o in response.options)
+        options = [o for o in self.cached_response.options if o.number not in numbers]
+        options.extend(o for o in response.options if o.number not in NOT_STORED_OPTIONS)
+        self.cached_response.options = options
+        etag = response.etag
+        if len(etag) > 0:
+            self.etag = etag[0]
+        self.max_age = response.max_age
+        self.creation_time = time.time()
+        self.expiration = self.creation_time + self.max_age
+        self.freshness = True
+
+    def is_fresh(self, now=None):
+        if now is None:
+            now = time.time()
+        return self.freshness and self.expiration > now
+
+    def response_for(self, request, code=None):
+        """
+        builds the response to a request from the cached response, with the remaining Max-Age
+
+        :param request:
+        :param code: the code of the response, the cached one if None
+        :return:
+        """
+        response = Response()
+        response.destination = request.source
+        response.token = request.token
+        response.code = self.cached_response.code if code is None else code
+        response.options = list(self.cached_response.options)
+        if code is None:
+            response.payload = self.cached_response.payload
+        response.max_age = max(0, int(self.expiration - time.time()))
+        return response
+
+    def debug_print(self):
+        logger.debug("freshness = %s, response = %s, max age = %s, creation time = %s", self.freshness,
+                     self.cached_response, self.max_age, self.creation_time)
+
+"""
+class for the key used to search elements in the cache (forward-proxy only)
+"""
+
+
+class CacheKey(object):
+    def __init__(self, request):
+        """
+
+        :param request:
+        """
+        self._payload = request.payload
+        self._method = request.code
+
+        """
+        making a list of the options that do not have a nocachekey option number and are not uri-path, uri-host, uri-port, uri-query
+        or block2
+        """
+
+        self._options = []
+        for option in request.options:
+            if (utils.check_nocachekey(option) is False) and (utils.is_uri_option(option.number) is False) \
+                    and option.number not in KEY_EXCLUDED_OPTIONS:
+                self._options.append(option)
+
+        """
+        creating a usable key for the cache structure
+        """
+        self.hashkey = (self._payload, self._method, tuple((o.number, str(o.value)) for o in self._options))
+
+    def debug_print(self):
+        logger.debug("payload = %s, method = %s, options = %s", self._payload, self._method,
+                     [str(o) for o in self._options])
+
+
+"""
+class for the key used to search elements in the cache (reverse-proxy only)
+"""
+
+
+class ReverseCacheKey(object):
+    def __init__(self, request):
+        """
+
+        :param request:
+        """
+        self._payload = request.payload
+        self._method = request.code
+
+        """
+        making a list of the options that do not have a nocachekey option number and are not block2
+        """
+
+        self._options = []
+        for option in request.options:
+            if utils.check_nocachekey(option) is False and option.number not in KEY_EXCLUDED_OPTIONS:
+                self._options.append(option)
+
+        """
+        creating a usable key for the cache structure
+        """
+        self.hashkey = (self._payload, self._method, tuple((o.number, str(o.value)) for o in self._options))
+
+    def debug_print(self):
+        logger.debug("payload = %s, method = %s, options = %s", self._payload, self._method,
+                     [str(o) for o in self._options])
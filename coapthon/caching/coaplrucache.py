@@ -1,69 +1,159 @@
-from cachetools import LRUCache
-from coapthon.caching.coapcache import CoapCache
-
-__author__ = 'Emilio Vallati'
-
-
-class CoapLRUCache(CoapCache):
-    def __init__(self, max_dim):
-        """
-
-        :param max_dim:
-        """
-        self.cache = LRUCache(maxsize=max_dim)
-
-    def update(self, key, element):
-        """
-
-        :param key:
-        :param element:
-        :return:
-        """
-        print "updating cache"
-        print "key: ", key.hashkey
-        print "element: ", element
-        self.cache.update([(key.hashkey, element)])
-
-    def get(self, key):
-        """
-
-        :param key:
-        :return: CacheElement
-        """
-        try:
-            response = self.cache[key.hashkey]
-        except KeyError:
-            print "problem here"
-            response = None
-        return response
-
-    def is_full(self):
-        """
-        :return:
-        """
-        if self.cache.currsize == self.cache.maxsize:
-            return True
-        return False
-
-    def is_empty(self):
-        """
-
-        :return:
-        """
-
-        if self.cache.currsize == 0:
-            return True
-        return False
-
-    def debug_print(self):
-        """
-
-        :return:
-        """
-        print "size = ", self.cache.currsize
-        list = self.cache.items()
-        for key, element in list:
-            print "element.max age ", element.max_age
-            print "element.uri", element.uri
-            print "element.freshness ", element.freshness
-
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from coapthon import defines
+from coapthon.caching.coapcache import CoapCache
+
+__author__ = 'Emilio Vallati'
+
+logger = logging.getLogger(__name__)
+
+
+class CoapLRUCache(CoapCache):
+    def __init__(self, max_dim, max_bytes=defines.CACHE_MAX_BYTES):
+        """
+        LRU cache of responses, bounded both in number of elements and in bytes.
+        The elements are also indexed by URI, so that the invalidation of a resource only touches its own responses,
+        and by expiration time in a heap, so that the expired elements are found without scanning the cache.
+
+        :param max_dim: max number of elements in the cache
+        :param max_bytes: max size of the cached responses
+        """
+        # hashkey -> CacheElement, from the least to the most recently used
+        self.cache = OrderedDict()
+        self.max_dim = max_dim
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._uris = {}
+        self._expiry = []
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+        self.stats = {"evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def update(self, key, element):
+        """
+        Add or replace an element, evicting the least recently used ones while the cache is over its limits.
+
+        :param key: the CacheKey
+        :param element: the CacheElement
+        :return:
+        """
+        with self._lock:
+            self.expire()
+            self.remove(key.hashkey)
+            if element.size > self.max_bytes:
+                logger.debug("Response of %d bytes too large for the cache", element.size)
+                return
+            self.cache[key.hashkey] = element
+            self.size += element.size
+            self._uris.setdefault(element.uri, set()).add(key.hashkey)
+            heapq.heappush(self._expiry, (element.expiration, next(self._counter), key.hashkey, element))
+            if len(self._expiry) > 2 * len(self.cache) + 64:
+                # drop the entries of replaced elements
+                self._expiry = [e for e in self._expiry if self.cache.get(e[2]) is e[3]]
+                heapq.heapify(self._expiry)
+            while len(self.cache) > self.max_dim or self.size > self.max_bytes:
+                hashkey = next(iter(self.cache))
+                self.remove(hashkey)
+                self.stats["evictions"] += 1
+
+    def get(self, key):
+        """
+
+        :param key: the CacheKey
+        :return: CacheElement, None if not cached
+        """
+        with self._lock:
+            self.expire()
+            element = self.cache.pop(key.hashkey, None)
+            if element is not None:
+                # most recently used
+                self.cache[key.hashkey] = element
+            return element
+
+    def remove(self, hashkey):
+        """
+        Remove an element.
+
+        :param hashkey: the hashkey of the element
+        :return: the removed CacheElement, None if not cached
+        """
+        with self._lock:
+            element = self.cache.pop(hashkey, None)
+            if element is None:
+                return None
+            self.size -= element.size
+            keys = self._uris.get(element.uri)
+            if keys is not None:
+                keys.discard(hashkey)
+                if not keys:
+                    del self._uris[element.uri]
+            return element
+
+    def related(self, uri):
+        """
+        Get the elements cached for a URI.
+
+        :param uri: the URI
+        :return: the list of CacheElement
+        """
+        with self._lock:
+            return [self.cache[hashkey] for hashkey in self._uris.get(uri, ())]
+
+    def expire(self, now=None):
+        """
+        Handle the elements whose Max-Age elapsed. The ones with an ETag are kept, not fresh, so that they can be
+        revalidated with the origin server, the others are removed.
+
+        :param now: the current time
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expiration, count, hashkey, element = heapq.heappop(self._expiry)
+                if self.cache.get(hashkey) is not element or element.expiration != expiration:
+                    # replaced or refreshed after being scheduled
+                    continue
+                element.freshness = False
+                if element.etag is None:
+                    self.remove(hashkey)
+                    self.stats["expirations"] += 1
+
+    def refresh(self, hashkey, element):
+        """
+        Schedule again the expiration of an element whose Max-Age has been updated.
+
+        :param hashkey: the hashkey of the element
+        :param element: the CacheElement
+        """
+        with self._lock:
+            heapq.heappush(self._expiry, (element.expiration, next(self._counter), hashkey, element))
+
+    def is_full(self):
+        """
+        :return:
+        """
+        return len(self.cache) >= self.max_dim or self.size >= self.max_bytes
+
+    def is_empty(self):
+        """
+
+        :return:
+        """
+        return len(self.cache) == 0
+
+    def debug_print(self):
+        """
+
+        :return:
+        """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug("Cache: %d elements, %d bytes", len(self.cache), self.size)
+        for element in list(self.cache.values()):
+            logger.debug("uri=%s max_age=%s freshness=%s", element.uri, element.max_age, element.freshness)
@@ -0,0 +1,89 @@
+import collections
+import copy
+import os
+import struct
+import time
+
+from coapthon import defines
+
+__author__ = 'Jose Requeijo Dias'
+
+# magic number of the capture files
+MAGIC = "CoAPCAP1"
+
+# time, direction ("i" received, "o" sent), port, length of the host, length of the datagram
+RECORD = struct.Struct("!dcHBH")
+
+
+class Capture(object):
+    """
+    Traffic capture of a server: a ring buffer with the last datagrams received and sent, with their times and
+    addresses, which can be saved to a compact capture file and replayed.
+    """
+    def __init__(self, size=defines.CAPTURE_SIZE):
+        """
+        Initialize the capture.
+
+        :param size: the number of datagrams kept
+        """
+        self.records = collections.deque(maxlen=size)
+
+    def received(self, data, address):
+        """
+        Add a datagram received by the server.
+
+        :param data: the datagram
+        :param address: the (host, port) of the source
+        """
+        self.records.append((time.time(), "i", address[0], address[1], data))
+
+    def sent(self, data, address):
+        """
+        Add a datagram sent by the server.
+
+        :param data: the datagram
+        :param address: the (host, port) of the destination
+        """
+        self.records.append((time.time(), "o", address[0], address[1], data))
+
+    def save(self, path):
+        """
+        Write the datagrams kept to a capture file (replacing it).
+
+        :param path: the path of the capture file
+        :return: the number of datagrams written
+        """
+        # copied without running Python code, so the server threads can keep adding datagrams
+        records = copy.copy(self.records)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            for timestamp, direction, host, port, data in records:
+                f.write(RECORD.pack(timestamp, direction, port, len(host), len(data)))
+                f.write(host)
+                f.write(data)
+        os.rename(tmp, path)
+        return len(records)
+
+    @staticmethod
+    def load(path):
+        """
+        Read a capture file.
+
+        :param path: the path of the capture file
+        :return: the list of (time, direction, host, port, datagram) of the datagrams, by time
+        """
+        with open(path, "rb") as f:
+            content = f.read()
+        if content[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a capture file: " + path)
+        records = []
+        pos = len(MAGIC)
+        while pos < len(content):
+            timestamp, direction, port, host_length, length = RECORD.unpack_from(content, pos)
+            pos += RECORD.size
+            host = content[pos:pos + host_length]
+            pos += host_length
+            records.append((timestamp, direction, host, port, content[pos:pos + length]))
+            pos += length
+        return records
@@ -0,0 +1,310 @@
+import logging
+import random
+import threading
+import time
+
+from coapthon import defines
+from coapthon.client.coap import CoAP
+from coapthon.messages.request import Request
+from coapthon.utils import generate_random_token
+
+__author__ = 'Jose Requeijo Dias'
+
+logger = logging.getLogger(__name__)
+
+
+class PooledClient(object):
+    """
+    Persistent client of one upstream server. Many requests can be outstanding at the same time on its socket,
+    their responses are paired with them by token and delivered to a callback. Observations stay registered until
+    cancelled, their notifications are delivered to the same callback.
+    """
+    def __init__(self, server):
+        """
+        Initialize the client of an upstream server.
+
+        :param server: the upstream server (IP, port)
+        """
+        self.server = server
+        self.protocol = CoAP(self.server, random.randint(1, 65535), self._receive)
+        self.last_used = time.time()
+        self._pending = {}
+        self._observations = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def _new_token(self):
+        token = generate_random_token(4)
+        while token in self._pending or token in self._observations:
+            token = generate_random_token(4)
+        return token
+
+    def send(self, request, callback, timeout=defines.UPSTREAM_TIMEOUT):
+        """
+        Send a request without waiting for its response.
+
+        :param request: the request to send
+        :param callback: the function invoked with the response, or None if it did not arrive within the timeout
+        :param timeout: the timeout of the request
+        :return: False if the client has been closed
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            if request.token is None or request.token in self._pending:
+                request.token = self._new_token()
+            request.destination = self.server
+            self._pending[request.token] = (callback, time.time() + timeout)
+            self.last_used = time.time()
+            self._started = True
+        try:
+            self.protocol.send_message(request)
+        except Exception:
+            with self._lock:
+                self._pending.pop(request.token, None)
+            raise
+        return True
+
+    def observe(self, request, callback):
+        """
+        Start an observation. The callback is invoked with the first response and with every notification, and with
+        None if the client is closed.
+
+        :param request: the request to send (with the Observe option set to 0)
+        :param callback: the function invoked with the notifications
+        :return: the token of the observation, None if the client has been closed
+        """
+        with self._lock:
+            if self._closed:
+                return None
+            request.token = self._new_token()
+            request.destination = self.server
+            self._observations[request.token] = (callback, request)
+            self.last_used = time.time()
+            self._started = True
+        try:
+            self.protocol.send_message(request)
+        except Exception:
+            with self._lock:
+                self._observations.pop(request.token, None)
+            raise
+        return request.token
+
+    def cancel(self, token):
+        """
+        Cancel an observation, deregistering from the upstream server.
+
+        :param token: the token of the observation
+        """
+        with self._lock:
+            observation = self._observations.pop(token, None)
+        if observation is None:
+            return
+        request = Request()
+        request.options = [o for o in observation[1].options if o.number != defines.OptionRegistry.OBSERVE.number]
+        request.observe = 1
+        request.code = defines.Codes.GET.number
+        request.token = token
+        self.send(request, lambda response: None)
+
+    def _receive(self, response):
+        """
+        Deliver a response received from the upstream server.
+
+        :param response: the response
+        """
+        if response.code == defines.Codes.CONTINUE.number:
+            return
+        with self._lock:
+            observation = self._observations.get(response.token)
+            pending = self._pending.pop(response.token, None) if observation is None else None
+        if observation is not None:
+            self._complete(observation[0], response)
+            return
+        if pending is None:
+            logger.debug("Response without a pending request from %s", self.server)
+            return
+        self._complete(pending[0], response)
+
+    def expire(self, now):
+        """
+        Complete with None the requests whose timeout elapsed.
+
+        :param now: the current time
+        """
+        with self._lock:
+            expired = [token for token, (callback, deadline) in self._pending.iteritems() if deadline <= now]
+            callbacks = [self._pending.pop(token)[0] for token in expired]
+        for callback in callbacks:
+            self._complete(callback, None)
+        self.protocol.purge()
+
+    def retire(self, now, timeout):
+        """
+        Stop accepting requests if the client has not been used for a while and has no outstanding request.
+
+        :param now: the current time
+        :param timeout: the idle timeout
+        :return: True if the client is retired and must be closed
+        """
+        with self._lock:
+            if len(self._pending) == 0 and len(self._observations) == 0 and now - self.last_used > timeout:
+                self._closed = True
+            return self._closed
+
+    def outstanding(self):
+        """
+        Get the number of requests waiting for their response.
+
+        :return: the number of requests
+        """
+        return len(self._pending)
+
+    def close(self):
+        """
+        Stop the client, completing the outstanding requests with None.
+        """
+        with self._lock:
+            self._closed = True
+            observations = self._observations.values()
+            self._observations = {}
+        self.expire(float("inf"))
+        for callback, request in observations:
+            self._complete(callback, None)
+        self.protocol.stopped.set()
+        for event in self.protocol.to_be_stopped:
+            event.set()
+        if self._started:
+            self.protocol.close()
+
+    @staticmethod
+    def _complete(callback, response):
+        try:
+            callback(response)
+        except Exception:
+            logger.exception("Error completing a proxied request")
+
+
+class ClientPool(object):
+    """
+    Pool of the persistent clients of the upstream servers of a proxy, one for each server.
+    """
+    def __init__(self, timeout=defines.UPSTREAM_TIMEOUT, idle_timeout=defines.UPSTREAM_IDLE_TIMEOUT):
+        """
+        Initialize the pool.
+
+        :param timeout: the timeout of the requests
+        :param idle_timeout: the idle seconds after which the client of a server is closed
+        """
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sweeper = None
+
+    def client(self, server):
+        """
+        Get the client of an upstream server, creating it if needed.
+
+        :param server: the upstream server (IP, port)
+        :return: the client
+        """
+        with self._lock:
+            client = self._clients.get(server)
+            if client is None:
+                client = PooledClient(server)
+                self._clients[server] = client
+                if self._sweeper is None:
+                    self._sweeper = threading.Thread(target=self._sweep, name="ClientPool-Sweeper")
+                    self._sweeper.daemon = True
+                    self._sweeper.start()
+            return client
+
+    def send(self, server, request, callback):
+        """
+        Send a request to an upstream server and return immediately, the callback is invoked with the response
+        (None on timeout) from the thread receiving the responses of the server.
+
+        :param server: the upstream server (IP, port)
+        :param request: the request
+        :param callback: the function invoked with the response
+        """
+        while not self.client(server).send(request, callback, self.timeout):
+            # closed by the sweeper in the meantime
+            continue
+
+    def observe(self, server, request, callback):
+        """
+        Start an observation of a resource of an upstream server.
+
+        :param server: the upstream server (IP, port)
+        :param request: the request (with the Observe option set to 0)
+        :param callback: the function invoked with the notifications (None when the observation is lost)
+        :return: the token of the observation
+        """
+        while True:
+            token = self.client(server).observe(request, callback)
+            if token is not None:
+                return token
+
+    def cancel(self, server, token):
+        """
+        Cancel an observation of a resource of an upstream server.
+
+        :param server: the upstream server (IP, port)
+        :param token: the token of the observation
+        """
+        with self._lock:
+            client = self._clients.get(server)
+        if client is not None:
+            client.cancel(token)
+
+    def request(self, server, request):
+        """
+        Send a request to an upstream server and wait for its response.
+
+        :param server: the upstream server (IP, port)
+        :param request: the request
+        :return: the response, None on timeout
+        """
+        done = threading.Event()
+        ret = []
+
+        def callback(response):
+            ret.append(response)
+            done.set()
+
+        self.send(server, request, callback)
+        done.wait()
+        return ret[0]
+
+    def _sweep(self):
+        """
+        Expire the requests without response and close the idle clients.
+        """
+        while not self._stopped.isSet():
+            self._stopped.wait(1)
+            now = time.time()
+            with self._lock:
+                clients = self._clients.items()
+            for server, client in clients:
+                client.expire(now)
+                with self._lock:
+                    if self._clients.get(server) is not client or not client.retire(now, self.idle_timeout):
+                        continue
+                    del self._clients[server]
+                client.close()
+
+    def close(self):
+        """
+        Close all the clients.
+        """
+        self._stopped.set()
+        with self._lock:
+            clients = self._clients.values()
+            self._clients = {}
+        for client in clients:
+            client.close()
+
@@ -58,15 +58,27 @@ class CoAP(object):
 
         self._receiver_thread = threading.Thread(target=self.receive_datagram,
                                                  name=threading.current_thread().name+'-Receive_Datagram')
+        # the client may be shared by many threads (see clientpool.py), the receiver is started only once
+        self._receiver_lock = threading.Lock()
+        self._receiver_started = False
 
     def close(self):
         """
         Stop the client.
 
         """
-        self._receiver_thread.join()
+        if self._receiver_started:
+            self._receiver_thread.join()
         self._socket.close()
 
+    def purge(self):
+        """
+        Clean old transactions, for clients that stay open for a long time.
+
+        """
+        self._messageLayer.purge(keep=self._observeLayer.observing)
+        self._blockLayer.purge()
+
     @property
     def current_mid(self):
         """
@@ -113,14 +125,23 @@ class CoAP(object):
         :param message: the message to send
         """
         host, port = message.destination
-        logger.debug("send_datagram - " + str(message))
+        logger.debug("send_datagram - %s", message)
         serializer = Serializer()
         message = serializer.serialize(message)
 
         self._socket.sendto(message, (host, port))
 
-        if not self._receiver_thread.isAlive():
-            self._receiver_thread.start()
+        if not self._receiver_started:
+            self._start_receiver()
+
+    def _start_receiver(self):
+        """
+        Start the thread receiving the datagrams, once.
+        """
+        with self._receiver_lock:
+            if not self._receiver_started:
+                self._receiver_thread.start()
+                self._receiver_started = True
 
     def _start_retransmission(self, transaction, message):
         """
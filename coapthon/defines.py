@@ -34,6 +34,33 @@ MAX_NON_NOTIFICATIONS = 10
 
 BLOCKWISE_SIZE = 1024
 
+BLOCKWISE_LIFETIME = 60  # idle seconds after which a blockwise transfer is abandoned
+
+MAX_BLOCK1_PAYLOAD = 1024 * 1024  # maximum payload received with Block1 in one exchange
+
+MAX_BLOCK1_BUFFERS = 8 * 1024 * 1024  # maximum size of all the Block1 payloads being received
+
+CACHE_MAX_ELEMENTS = 2048  # maximum number of responses kept by the proxy cache
+
+CACHE_MAX_BYTES = 4 * 1024 * 1024  # maximum size of the responses kept by the proxy cache
+
+UPSTREAM_TIMEOUT = MAX_TRANSMIT_SPAN  # seconds a proxied request waits for the response of the upstream server
+
+UPSTREAM_IDLE_TIMEOUT = 300  # idle seconds after which the pooled client of an upstream server is closed
+
+HC_PROXY_WORKERS = 16  # threads serving the HTTP connections of the HTTP-CoAP proxy
+
+HC_PROXY_KEEPALIVE_TIMEOUT = 15  # idle seconds after which a persistent HTTP connection is closed by the HC proxy
+
+# upper bounds (seconds) of the buckets of the latency histograms
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PROFILER_INTERVAL = 0.01  # seconds between two samples of the sampling profiler
+
+PROFILER_MAX_DURATION = 60  # maximum seconds of a profile
+
+CAPTURE_SIZE = 10000  # datagrams kept by the ring buffer of a traffic capture
+
 """  Message Format """
 
 # number of bits used for the encoding of the CoAP version field.
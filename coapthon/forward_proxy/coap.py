@@ -129,6 +129,9 @@ class CoAP(object):
         while not self.stopped.isSet():
             self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
             self._messageLayer.purge()
+            self._blockLayer.purge()
+            if self._cacheLayer is not None:
+                self._cacheLayer.purge()
 
     def listen(self, timeout=10):
         """
@@ -158,6 +161,7 @@ class CoAP(object):
         self.stopped.set()
         for event in self.to_be_stopped:
             event.set()
+        self._forwardLayer.close()
         self._socket.close()
 
     def receive_datagram(self, args):
@@ -188,7 +192,7 @@ class CoAP(object):
             rst.code = message
             self.send_datagram(rst)
             return
-        logger.debug("receive_datagram - " + str(message))
+        logger.debug("receive_datagram - %s", message)
         if isinstance(message, Request):
 
             transaction = self._messageLayer.receive_request(message)
@@ -219,36 +223,15 @@ class CoAP(object):
 
             """
             call to the cache layer to check if there's a cached response for the request
-            if not, call the forward layer
+            if not, call the forward layer, that completes the transaction when the upstream server answers
             """
             if self._cacheLayer is not None:
                 transaction = self._cacheLayer.receive_request(transaction)
 
-                if transaction.cacheHit is False:
-                    print transaction.request
-                    transaction = self._forwardLayer.receive_request(transaction)
-                    print transaction.response
-
-                transaction = self._observeLayer.send_response(transaction)
-
-                transaction = self._blockLayer.send_response(transaction)
-
-                transaction = self._cacheLayer.send_response(transaction)
+            if self._cacheLayer is None or transaction.cacheHit is False:
+                self._forwardLayer.receive_request(transaction, self._send_response)
             else:
-                transaction = self._forwardLayer.receive_request(transaction)
-
-                transaction = self._observeLayer.send_response(transaction)
-
-                transaction = self._blockLayer.send_response(transaction)
-
-            self._stop_separate_timer(transaction.separate_timer)
-
-            transaction = self._messageLayer.send_response(transaction)
-
-            if transaction.response is not None:
-                if transaction.response.type == defines.Types["CON"]:
-                    self._start_retrasmission(transaction, transaction.response)
-                self.send_datagram(transaction.response)
+                self._send_response(transaction)
 
         elif isinstance(message, Message):
             transaction = self._messageLayer.receive_empty(message)
@@ -259,6 +242,30 @@ class CoAP(object):
         else:  # is Response
             logger.error("Received response from %s", message.source)
 
+    def _send_response(self, transaction):
+        """
+        Send the response of a forwarded request to the client.
+
+        :type transaction: Transaction
+        :param transaction: the completed transaction
+        """
+        if self._cacheLayer is not None:
+            # cache the whole representation, before it is split in blocks
+            transaction = self._cacheLayer.send_response(transaction)
+
+        transaction = self._observeLayer.send_response(transaction)
+
+        transaction = self._blockLayer.send_response(transaction)
+
+        self._stop_separate_timer(transaction.separate_timer)
+
+        transaction = self._messageLayer.send_response(transaction)
+
+        if transaction.response is not None:
+            if transaction.response.type == defines.Types["CON"]:
+                self._start_retrasmission(transaction, transaction.response)
+            self.send_datagram(transaction.response)
+
     def send_datagram(self, message):
         """
         Send a message through the udp socket.
@@ -268,7 +275,7 @@ class CoAP(object):
         """
         if not self.stopped.isSet():
             host, port = message.destination
-            logger.debug("send_datagram - " + str(message))
+            logger.debug("send_datagram - %s", message)
             serializer = Serializer()
             message = serializer.serialize(message)
 
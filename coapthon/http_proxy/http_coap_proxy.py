@@ -1,7 +1,17 @@
+import Queue
 import argparse
+import binascii
+import logging
+import os
+import select
+import threading
+import time
 
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-from coapthon.client.helperclient import HelperClient
+from SocketServer import ThreadingMixIn
+from coapthon import defines
+from coapthon.client.clientpool import ClientPool
+from coapthon.messages.request import Request
 from coapthon.utils import parse_uri
 from coapthon.defines import Codes, DEFAULT_HC_PATH, HC_PROXY_DEFAULT_PORT, COAP_DEFAULT_PORT, LOCALHOST, BAD_REQUEST, \
     NOT_IMPLEMENTED, CoAP_HTTP
@@ -11,8 +21,13 @@ from urlparse import urlparse
 __author__ = "Marco Ieni, Davide Foti"
 __email__ = "marcoieni94@gmail.com, davidefoti.uni@gmail.com"
 
+logger = logging.getLogger(__name__)
+
 hc_path = DEFAULT_HC_PATH
 
+# CoAP Content-Format -> HTTP Content-Type
+HTTP_CONTENT_TYPES = dict((v, k) for k, v in defines.Content_types.iteritems())
+
 """ the class that realizes the HTTP-CoAP Proxy """
 
 
@@ -25,7 +40,7 @@ class HCProxy:
     project.
     """
     def __init__(self, path=DEFAULT_HC_PATH, hc_port=HC_PROXY_DEFAULT_PORT, ip=LOCALHOST,
-                 coap_port=COAP_DEFAULT_PORT):
+                 coap_port=COAP_DEFAULT_PORT, workers=defines.HC_PROXY_WORKERS):
         """
         Initialize the HC proxy.
 
@@ -33,22 +48,43 @@ class HCProxy:
         :param hc_port: the port of the hc_proxy server
         :param ip: the ip of the hc_proxy server
         :param coap_port: the coap server port you want to reach
+        :param workers: the number of threads serving the HTTP connections, 0 for a thread per connection,
+            None to serve one request at a time
         """
         global hc_path
         hc_path = HCProxy.get_formatted_path(path)
         self.hc_port = hc_port
         self.ip = ip
         self.coap_port = coap_port
+        self.workers = workers
+        self.pool = ClientPool()
+        self.server = None
 
     def run(self):
         """
         Start the proxy.
         """
         server_address = (self.ip, self.hc_port)
-        hc_proxy = HTTPServer(server_address, HCProxyHandler)
-        print 'Starting HTTP-CoAP Proxy...'
+        if self.workers is None:
+            hc_proxy = HTTPServer(server_address, HCProxyHandler)
+        elif self.workers == 0:
+            hc_proxy = ThreadedHTTPServer(server_address, HCProxyHandler)
+        else:
+            hc_proxy = PooledHTTPServer(server_address, HCProxyHandler, self.workers)
+        hc_proxy.pool = self.pool
+        self.server = hc_proxy
+        logger.info("Starting HTTP-CoAP Proxy on %s:%d", self.ip, self.hc_port)
         hc_proxy.serve_forever()  # the server listen to http://ip:hc_port/path
 
+    def close(self):
+        """
+        Stop the proxy and close the upstream clients.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.pool.close()
+
     @staticmethod
     def get_formatted_path(path):
         """
@@ -64,6 +100,164 @@ class HCProxy:
         return path
 
 
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server handling each connection in a new thread """
+    daemon_threads = True
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server handling the connections with a fixed number of threads. The threads serve one request at a time: the
+    idle persistent connections are watched by another thread and served again when their next request arrives.
+    """
+    def __init__(self, server_address, handler_class, workers):
+        """
+        Initialize the server and start its threads.
+
+        :param server_address: the address of the server (IP, port)
+        :param handler_class: the class handling the requests, its timeout is the keep-alive timeout
+        :param workers: the number of threads
+        """
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.keepalive_timeout = handler_class.timeout
+
+        class ConnectionHandler(handler_class):
+            """ Handler of a connection, serving its requests when the threads call handle_one_request """
+            def __init__(self, request, client_address, server):
+                self.request = request
+                self.client_address = client_address
+                self.server = server
+                self.setup()
+        self._connection_handler = ConnectionHandler
+        self._connections = Queue.Queue()
+        self._stopped = threading.Event()
+        # idle connection -> (client address, handler, time of its last request)
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._watcher = threading.Thread(target=self._watch_idle, name="HCProxy-Idle")
+        self._watcher.daemon = True
+        self._watcher.start()
+        self._workers = []
+        for n in range(workers):
+            worker = threading.Thread(target=self._work, name="HCProxy-Worker-" + str(n))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        """
+        Queue an accepted connection for the threads.
+        """
+        self._connections.put((request, client_address, None))
+
+    def _work(self):
+        """
+        Serve the next request of the queued connections.
+        """
+        while True:
+            request, client_address, handler = self._connections.get()
+            if request is None:
+                return
+            try:
+                if handler is None:
+                    handler = self._connection_handler(request, client_address, self)
+                handler.close_connection = 1
+                handler.handle_one_request()
+                keep_alive = not handler.close_connection
+            except Exception:
+                self.handle_error(request, client_address)
+                keep_alive = False
+            if keep_alive and PooledHTTPServer._buffered(handler):
+                # a pipelined request
+                self._connections.put((request, client_address, handler))
+            elif not keep_alive or not self._add_idle(request, client_address, handler):
+                self._close_connection(request, handler)
+
+    def _add_idle(self, request, client_address, handler):
+        """
+        Watch a connection waiting for its next request.
+
+        :return: False if the server is stopped
+        """
+        with self._idle_lock:
+            if self._stopped.isSet():
+                return False
+            self._idle[request] = (client_address, handler, time.time())
+            os.write(self._wakeup_write, "x")
+        return True
+
+    def _watch_idle(self):
+        """
+        Queue the idle connections whose next request arrived and close the ones idle for longer than the keep-alive
+        timeout.
+        """
+        while not self._stopped.isSet():
+            with self._idle_lock:
+                connections = self._idle.keys()
+            try:
+                readable = select.select(connections + [self._wakeup_read], [], [], 1)[0]
+            except select.error:
+                # interrupted by a signal
+                readable = []
+            now = time.time()
+            with self._idle_lock:
+                for request in readable:
+                    if request is self._wakeup_read:
+                        os.read(self._wakeup_read, 4096)
+                    elif request in self._idle:
+                        client_address, handler, last = self._idle.pop(request)
+                        self._connections.put((request, client_address, handler))
+                expired = [(request, handler) for request, (client_address, handler, last) in self._idle.iteritems()
+                           if now - last > self.keepalive_timeout]
+                for request, handler in expired:
+                    del self._idle[request]
+            for request, handler in expired:
+                self._close_connection(request, handler)
+
+        with self._idle_lock:
+            idle = self._idle.items()
+            self._idle.clear()
+        for request, (client_address, handler, last) in idle:
+            self._close_connection(request, handler)
+
+    def _close_connection(self, request, handler):
+        """
+        Finish the handler of a connection and close it.
+        """
+        try:
+            if handler is not None:
+                handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(request)
+
+    @staticmethod
+    def _buffered(handler):
+        """
+        Check if the next request of a connection was already read from its socket.
+
+        :param handler: the handler of the connection
+        :return: True if the request is buffered
+        """
+        rbuf = getattr(handler.rfile, "_rbuf", None)
+        return rbuf is not None and rbuf.tell() > 0
+
+    def server_close(self):
+        """
+        Close the socket and stop the threads.
+        """
+        HTTPServer.server_close(self)
+        with self._idle_lock:
+            self._stopped.set()
+            os.write(self._wakeup_write, "x")
+        for worker in self._workers:
+            self._connections.put((None, None, None))
+        self._watcher.join()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+
 class CoapUri:  # this class takes the URI from the HTTP URI
     """ Class that can manage and inbox the CoAP URI """
     def __init__(self, coap_uri):
@@ -97,8 +291,10 @@ class CoapUri:  # this class takes the URI from the HTTP URI
 
 class HCProxyHandler(BaseHTTPRequestHandler):
     """ It maps the requests from HTTP to CoAP """
+    # persistent connections, every response carries its Content-Length
+    protocol_version = "HTTP/1.1"
+    timeout = defines.HC_PROXY_KEEPALIVE_TIMEOUT
     coap_uri = None
-    client = None
 
     def set_coap_uri(self):
         """
@@ -108,81 +304,136 @@ class HCProxyHandler(BaseHTTPRequestHandler):
 
     def do_initial_operations(self):
         """
-        Setup the client for interact with remote server
+        Read the body of the request and parse the CoAP URI
+
+        :return: False if the request has been answered with an error
         """
+        length = int(self.headers.getheader('Content-Length', 0))
+        self.body = self.rfile.read(length) if length > 0 else None
         if not self.request_hc_path_corresponds():
             # the http URI of the request is not the same of the one specified by the admin for the hc proxy,
             # so I do not answer
             # For example the admin setup the http proxy URI like: "http://127.0.0.1:8080:/my_hc_path/" and the URI of
             # the requests asks for "http://127.0.0.1:8080:/another_hc_path/"
-            return
-        self.set_coap_uri()
-        self.client = HelperClient(server=(self.coap_uri.host, self.coap_uri.port))
+            self.send_error(BAD_REQUEST)
+            return False
+        try:
+            self.set_coap_uri()
+        except (IndexError, ValueError):
+            self.send_error(BAD_REQUEST)
+            return False
+        return True
+
+    def request_coap(self, method, payload=None):
+        """
+        Send a request to the CoAP server on a persistent client and wait for its response.
+
+        :param method: the CoAP method
+        :param payload: the payload of the request
+        :return: the CoAP response, None if the server did not answer
+        """
+        request = Request()
+        request.code = method.number
+        request.uri_path = self.coap_uri.path
+        etags = self.get_if_none_match()
+        if len(etags) > 0:
+            request.etag = etags
+        if payload is not None:
+            request.payload = payload
+            content_type = self.headers.getheader('Content-Type')
+            if content_type is not None and content_type in defines.Content_types:
+                request.content_type = defines.Content_types[content_type]
+        coap_response = self.server.pool.request((self.coap_uri.host, self.coap_uri.port), request)
+        if coap_response is not None:
+            logger.debug("Server response: %s", coap_response)
+        return coap_response
+
+    def get_request_payload(self):
+        """
+        Get the payload of a POST or PUT request, the body of the request or the query string of the uri.
+
+        :return: the payload or None
+        """
+        if self.body is not None:
+            return self.body
+        return self.coap_uri.get_payload()
+
+    def get_if_none_match(self):
+        """
+        Map the If-None-Match header to CoAP ETags.
+
+        :return: the list of the ETags
+        """
+        header = self.headers.getheader('If-None-Match')
+        if header is None:
+            return []
+        etags = []
+        for etag in header.split(","):
+            etag = etag.strip()
+            if etag.startswith("W/"):
+                etag = etag[2:]
+            try:
+                etags.append(binascii.unhexlify(etag.strip('"')))
+            except TypeError:
+                continue
+        return etags
 
     def do_GET(self):
         """
         Perform a GET request
         """
-        self.do_initial_operations()
-        coap_response = self.client.get(self.coap_uri.path)
-        self.client.stop()
-        print "Server response: ", coap_response.pretty_print()
+        if not self.do_initial_operations():
+            return
+        coap_response = self.request_coap(Codes.GET)
         self.set_http_response(coap_response)
 
     def do_HEAD(self):
         """
         Perform a HEAD request
         """
-        self.do_initial_operations()
+        if not self.do_initial_operations():
+            return
         # the HEAD method is not present in CoAP, so we treat it
         # like if it was a GET and then we exclude the body from the response
         # with send_body=False we say that we do not need the body, because it is a HEAD request
-        coap_response = self.client.get(self.coap_uri.path)
-        self.client.stop()
-        print "Server response: ", coap_response.pretty_print()
-        self.set_http_header(coap_response)
+        coap_response = self.request_coap(Codes.GET)
+        self.set_http_response(coap_response, send_body=False)
 
     def do_POST(self):
         """
         Perform a POST request
         """
-        # Doesn't do anything with posted data
-        # print "uri: ", self.client_address, self.path
-        self.do_initial_operations()
-        payload = self.coap_uri.get_payload()
+        if not self.do_initial_operations():
+            return
+        payload = self.get_request_payload()
         if payload is None:
-            print "BAD POST REQUEST"
+            logger.debug("Bad POST request: %s", self.path)
             self.send_error(BAD_REQUEST)
             return
-        coap_response = self.client.post(self.coap_uri.path, payload)
-        self.client.stop()
-        print "Server response: ", coap_response.pretty_print()
+        coap_response = self.request_coap(Codes.POST, payload)
         self.set_http_response(coap_response)
 
     def do_PUT(self):
         """
         Perform a PUT request
         """
-        self.do_initial_operations()
-        payload = self.coap_uri.get_payload()
+        if not self.do_initial_operations():
+            return
+        payload = self.get_request_payload()
         if payload is None:
-            print "BAD PUT REQUEST"
+            logger.debug("Bad PUT request: %s", self.path)
             self.send_error(BAD_REQUEST)
             return
-        print payload
-        coap_response = self.client.put(self.coap_uri.path, payload)
-        self.client.stop()
-        print "Server response: ", coap_response.pretty_print()
+        coap_response = self.request_coap(Codes.PUT, payload)
         self.set_http_response(coap_response)
 
     def do_DELETE(self):
         """
         Perform a DELETE request
         """
-        self.do_initial_operations()
-        coap_response = self.client.delete(self.coap_uri.path)
-        self.client.stop()
-        print "Server response: ", coap_response.pretty_print()
+        if not self.do_initial_operations():
+            return
+        coap_response = self.request_coap(Codes.DELETE)
         self.set_http_response(coap_response)
 
     def do_CONNECT(self):
@@ -211,50 +462,82 @@ class HCProxyHandler(BaseHTTPRequestHandler):
         """
         uri_path = self.path.split(COAP_PREFACE)
         request_hc_path = uri_path[0]
-        print "HCPATH: ", hc_path
-        # print HC_PATH
-        print "URI: ", request_hc_path
         if hc_path != request_hc_path:
             return False
         else:
             return True
 
-    def set_http_header(self, coap_response):
+    def set_http_header(self, coap_response, length):
         """
-        Sets http headers.
+        Sets http headers, mapping the Max-Age and the ETag of the CoAP response to the HTTP caching headers.
 
         :param coap_response: the coap response
+        :param length: the length of the body
         """
-        print "Server: ", coap_response.source
-        print "codice risposta: ", coap_response.code
-        print "PROXED: ", CoAP_HTTP[Codes.LIST[coap_response.code].name]
-        print "payload risposta: ", coap_response.payload
         self.send_response(int(CoAP_HTTP[Codes.LIST[coap_response.code].name]))
-        self.send_header('Content-type', 'text/html')
+        content_type = self.get_content_type(coap_response)
+        self.send_header('Content-Type', content_type if content_type is not None else 'text/html')
+        if coap_response.code < Codes.ERROR_LOWER_BOUND:
+            self.send_header('Cache-Control', 'max-age=' + str(coap_response.max_age))
+            etag = coap_response.etag
+            if len(etag) > 0:
+                self.send_header('ETag', '"' + binascii.hexlify(str(etag[0])) + '"')
+        self.send_header('Content-Length', str(length))
         self.end_headers()
 
-    def set_http_body(self, coap_response):
+    @staticmethod
+    def get_content_type(coap_response):
         """
-        Set http body.
+        Map the Content-Format of the CoAP response to an HTTP Content-Type.
 
         :param coap_response: the coap response
+        :return: the Content-Type, None if the response has no Content-Format
         """
+        for option in coap_response.options:
+            if option.number == defines.OptionRegistry.CONTENT_TYPE.number:
+                return HTTP_CONTENT_TYPES.get(int(option.value), 'application/octet-stream')
+        return None
+
+    def get_http_body(self, coap_response):
+        """
+        Get http body.
+
+        :param coap_response: the coap response
+        :return: the body
+        """
+        if coap_response.code == Codes.VALID.number:
+            # 304 Not Modified has no body
+            return ""
+        if self.get_content_type(coap_response) is not None:
+            return str(coap_response.payload) if coap_response.payload is not None else ""
         if coap_response.payload is not None:
-            body = "<html><body><h1>", coap_response.payload, "</h1></body></html>"
-            self.wfile.write("".join(body))
+            body = "<html><body><h1>", str(coap_response.payload), "</h1></body></html>"
+            return "".join(body)
         else:
-            self.wfile.write("<html><body><h1>None</h1></body></html>")
+            return "<html><body><h1>None</h1></body></html>"
 
-    def set_http_response(self, coap_response):
+    def set_http_response(self, coap_response, send_body=True):
         """
         Set http response.
 
-        :param coap_response: the coap response
+        :param coap_response: the coap response, None if the CoAP server did not answer
+        :param send_body: False to send only the headers
         """
-        self.set_http_header(coap_response)
-        self.set_http_body(coap_response)
+        if coap_response is None:
+            self.send_error(int(CoAP_HTTP[Codes.GATEWAY_TIMEOUT.name]))
+            return
+        body = self.get_http_body(coap_response)
+        self.set_http_header(coap_response, len(body))
+        if send_body:
+            self.wfile.write(body)
         return
 
+    def log_message(self, format, *args):
+        """
+        Log the requests at debug level instead of printing them on stderr.
+        """
+        logger.debug("%s - " + format, self.client_address[0], *args)
+
 
 def get_command_line_args():
     parser = argparse.ArgumentParser(description='Run the HTTP-CoAP Proxy.')
@@ -266,10 +549,14 @@ def get_command_line_args():
                         help='the ip of the hc_proxy server')
     parser.add_argument('-cp', dest='coap_port', default=COAP_DEFAULT_PORT,
                         help='the coap server port you want to reach')
+    parser.add_argument('-w', dest='workers', default=defines.HC_PROXY_WORKERS, type=int,
+                        help='the threads serving the HTTP connections, 0 for a thread per connection, '
+                             '-1 to serve one request at a time')
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = get_command_line_args()
-    hc_proxy = HCProxy(args.path, int(args.hc_port), args.ip, args.coap_port)
+    hc_proxy = HCProxy(args.path, int(args.hc_port), args.ip, args.coap_port,
+                       args.workers if args.workers >= 0 else None)
     hc_proxy.run()
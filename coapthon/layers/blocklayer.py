@@ -1,7 +1,11 @@
 import logging
+import time
+import threading
+from collections import OrderedDict
 from coapthon import defines
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
+from coapthon.messages.option import Option
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +30,27 @@ class BlockItem(object):
         self.size = size
         self.payload = payload
         self.content_type = content_type
+        self.timestamp = time.time()
+        # rendered response of a Block2 transfer, served to the next blocks
+        self.snapshot = None
+
+
+class BlockSnapshot(object):
+    def __init__(self, response, uri_path):
+        """
+        The fully rendered response of a blockwise (Block2) transfer. It is rendered only once and all the blocks
+        are taken from it, so they are consistent with each other.
+
+        :param response: the full response (before being split in blocks)
+        :param uri_path: the path of the requested resource
+        """
+        self.uri_path = uri_path
+        self.code = response.code
+        self.payload = response.payload
+        self.options = [o for o in response.options if o.number not in BlockSnapshot.SKIPPED_OPTIONS]
+
+    # options that are not repeated in the next blocks
+    SKIPPED_OPTIONS = (defines.OptionRegistry.BLOCK2.number, defines.OptionRegistry.OBSERVE.number)
 
 
 class BlockLayer(object):
@@ -35,8 +60,10 @@ class BlockLayer(object):
     def __init__(self):
         self._block1_sent = {}
         self._block2_sent = {}
-        self._block1_receive = {}
-        self._block2_receive = {}
+        self._block1_receive = OrderedDict()
+        self._block2_receive = OrderedDict()
+        self._block1_bytes = 0
+        self._lock = threading.RLock()
 
     def receive_request(self, transaction):
         """
@@ -48,64 +75,107 @@ class BlockLayer(object):
         :return: the edited transaction
         """
         if transaction.request.block2 is not None:
-            host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
-            num, m, size = transaction.request.block2
-            if key_token in self._block2_receive:
-                self._block2_receive[key_token].num = num
-                self._block2_receive[key_token].size = size
-                self._block2_receive[key_token].m = m
-                del transaction.request.block2
-            else:
-                # early negotiation
-                byte = 0
-                self._block2_receive[key_token] = BlockItem(byte, num, m, size)
-                del transaction.request.block2
+            with self._lock:
+                return self._receive_block2(transaction)
 
         elif transaction.request.block1 is not None:
             # POST or PUT
-            host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
-            num, m, size = transaction.request.block1
-            if key_token in self._block1_receive:
-                content_type = transaction.request.content_type
-                if num != self._block1_receive[key_token].num \
-                        or content_type != self._block1_receive[key_token].content_type:
-                    # Error Incomplete
-                    return self.incomplete(transaction)
-                self._block1_receive[key_token].payload += transaction.request.payload
-            else:
-                # first block
-                if num != 0:
-                    # Error Incomplete
-                    return self.incomplete(transaction)
-                content_type = transaction.request.content_type
-                self._block1_receive[key_token] = BlockItem(size, num, m, size, transaction.request.payload,
-                                                            content_type)
+            with self._lock:
+                return self._receive_block1(transaction)
 
-            if m == 0:
-                transaction.request.payload = self._block1_receive[key_token].payload
-                # end of blockwise
-                del transaction.request.block1
-                transaction.block_transfer = False
-                # TODO remove from _block1_receive
-                return transaction
-            else:
-                # Continue
-                transaction.block_transfer = True
-                transaction.response = Response()
-                transaction.response.destination = transaction.request.source
-                transaction.response.token = transaction.request.token
-                transaction.response.code = defines.Codes.CONTINUE.number
-                transaction.response.block1 = (num, m, size)
-
-            num += 1
-            byte = size
-            self._block1_receive[key_token].byte = byte
-            self._block1_receive[key_token].num = num
-            self._block1_receive[key_token].size = size
-            self._block1_receive[key_token].m = m
+        return transaction
+
+    def _receive_block2(self, transaction):
+        """
+        Handles the Block2 option in a incoming request, serving the next blocks from the snapshot of the transfer.
 
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :rtype : Transaction
+        :return: the edited transaction
+        """
+        host, port = transaction.request.source
+        key_token = (host, port, transaction.request.token)
+        num, m, size = transaction.request.block2
+        item = self._block2_receive.pop(key_token, None)
+        if item is not None:
+            self._block2_receive[key_token] = item
+            item.num = num
+            item.size = size
+            item.m = m
+            item.byte = num * size
+            item.timestamp = time.time()
+            del transaction.request.block2
+            if item.snapshot is not None and num > 0 and transaction.request.code == defines.Codes.GET.number \
+                    and item.snapshot.uri_path == transaction.request.uri_path:
+                return self.send_snapshot(transaction, key_token, item)
+        else:
+            # early negotiation
+            byte = 0
+            self._block2_receive[key_token] = BlockItem(byte, num, m, size)
+            del transaction.request.block2
+        return transaction
+
+    def _receive_block1(self, transaction):
+        """
+        Handles the Block1 option in a incoming request, reassembling the payload of the blocks.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :rtype : Transaction
+        :return: the edited transaction
+        """
+        host, port = transaction.request.source
+        key_token = (host, port, transaction.request.token)
+        num, m, size = transaction.request.block1
+        payload = transaction.request.payload or ""
+        content_type = transaction.request.content_type
+        item = self._block1_receive.pop(key_token, None)
+        if item is not None:
+            if num != item.num or content_type != item.content_type:
+                # Error Incomplete
+                self._block1_bytes -= len(item.payload)
+                return self.incomplete(transaction)
+        else:
+            # first block
+            if num != 0:
+                # Error Incomplete
+                return self.incomplete(transaction)
+            item = BlockItem(size, num, m, size, bytearray(), content_type)
+
+        if len(item.payload) + len(payload) > defines.MAX_BLOCK1_PAYLOAD or \
+                not self._reserve_block1(len(payload)):
+            self._block1_bytes -= len(item.payload)
+            return self.too_large(transaction)
+
+        item.payload.extend(payload)
+        self._block1_bytes += len(payload)
+
+        if m == 0:
+            transaction.request.payload = str(item.payload)
+            self._block1_bytes -= len(item.payload)
+            # end of blockwise
+            del transaction.request.block1
+            transaction.block_transfer = False
+            return transaction
+        else:
+            # Continue
+            transaction.block_transfer = True
+            transaction.response = Response()
+            transaction.response.destination = transaction.request.source
+            transaction.response.token = transaction.request.token
+            transaction.response.code = defines.Codes.CONTINUE.number
+            transaction.response.block1 = (num, m, size)
+
+        num += 1
+        byte = size
+        item.byte = byte
+        item.num = num
+        item.size = size
+        item.m = m
+        item.timestamp = time.time()
+        # the transfers are kept from the least to the most recently active
+        self._block1_receive[key_token] = item
         return transaction
 
     def receive_response(self, transaction):
@@ -118,7 +188,7 @@ class BlockLayer(object):
         :return: the edited transaction
         """
         host, port = transaction.response.source
-        key_token = hash(str(host) + str(port) + str(transaction.response.token))
+        key_token = (host, port, transaction.response.token)
         if key_token in self._block1_sent and transaction.response.block1 is not None:
             item = self._block1_sent[key_token]
             transaction.block_transfer = True
@@ -128,11 +198,10 @@ class BlockLayer(object):
                 return transaction
             n_num, n_m, n_size = transaction.response.block1
             if n_num != item.num:  # pragma: no cover
-                logger.warning("Blockwise num acknowledged error, expected " + str(item.num) + " received " +
-                               str(n_num))
+                logger.warning("Blockwise num acknowledged error, expected %s received %s", item.num, n_num)
                 return None
             if n_size < item.size:
-                logger.debug("Scale down size, was " + str(item.size) + " become " + str(n_size))
+                logger.debug("Scale down size, was %s become %s", item.size, n_size)
                 item.size = n_size
             request = transaction.request
             del request.mid
@@ -202,13 +271,27 @@ class BlockLayer(object):
         """
         Handles the Blocks option in a outgoing response.
 
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the response
+        :rtype : Transaction
+        :return: the edited transaction
+        """
+        if transaction.response.payload is None:
+            return transaction
+        with self._lock:
+            return self._send_block2(transaction)
+
+    def _send_block2(self, transaction):
+        """
+        Splits the outgoing response in blocks, keeping the snapshot of the transfer for the next blocks.
+
         :type transaction: Transaction
         :param transaction: the transaction that owns the response
         :rtype : Transaction
         :return: the edited transaction
         """
         host, port = transaction.request.source
-        key_token = hash(str(host) + str(port) + str(transaction.request.token))
+        key_token = (host, port, transaction.request.token)
         if (key_token in self._block2_receive and transaction.response.payload is not None) or \
                 (transaction.response.payload is not None and len(transaction.response.payload) > defines.MAX_PAYLOAD):
             if key_token in self._block2_receive:
@@ -227,6 +310,9 @@ class BlockLayer(object):
 
             if len(transaction.response.payload) > (byte + size):
                 m = 1
+                # render once, the next blocks are served from the snapshot
+                self._block2_receive[key_token].snapshot = BlockSnapshot(transaction.response,
+                                                                         transaction.request.uri_path)
             else:
                 m = 0
             transaction.response.payload = transaction.response.payload[byte:byte + size]
@@ -236,7 +322,7 @@ class BlockLayer(object):
             self._block2_receive[key_token].byte += size
             self._block2_receive[key_token].num += 1
             if m == 0:
-                del self._block2_receive[key_token]
+                self._block2_receive.pop(key_token, None)
 
         return transaction
 
@@ -251,7 +337,7 @@ class BlockLayer(object):
         assert isinstance(request, Request)
         if request.block1 or (request.payload is not None and len(request.payload) > defines.MAX_PAYLOAD):
             host, port = request.destination
-            key_token = hash(str(host) + str(port) + str(request.token))
+            key_token = (host, port, request.token)
             if request.block1:
                 num, m, size = request.block1
             else:
@@ -265,13 +351,84 @@ class BlockLayer(object):
             request.block1 = (num, m, size)
         elif request.block2:
             host, port = request.destination
-            key_token = hash(str(host) + str(port) + str(request.token))
+            key_token = (host, port, request.token)
             num, m, size = request.block2
             item = BlockItem(size, num, m, size, "", None)
             self._block2_sent[key_token] = item
             return request
         return request
 
+    def send_snapshot(self, transaction, key_token, item):
+        """
+        Answers a Block2 request with the requested block of the rendered response of the transfer.
+        It is called holding the lock of the layer.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :param key_token: the key of the blockwise transfer
+        :type item: BlockItem
+        :param item: the blockwise transfer
+        :rtype : Transaction
+        :return: the edited transaction
+        """
+        snapshot = item.snapshot
+        transaction.block_transfer = True
+        transaction.response = Response()
+        transaction.response.destination = transaction.request.source
+        transaction.response.token = transaction.request.token
+        if item.byte >= len(snapshot.payload):
+            transaction.response.code = defines.Codes.BAD_REQUEST.number
+            self._block2_receive.pop(key_token, None)
+            return transaction
+
+        transaction.response.code = snapshot.code
+        for option in snapshot.options:
+            transaction.response.add_option(option)
+        transaction.response.payload = snapshot.payload[item.byte:item.byte + item.size]
+        if len(snapshot.payload) > (item.byte + item.size):
+            m = 1
+        else:
+            m = 0
+        transaction.response.block2 = (item.num, m, item.size)
+
+        item.byte += item.size
+        item.num += 1
+        if m == 0:
+            self._block2_receive.pop(key_token, None)
+        return transaction
+
+    def purge(self, lifetime=defines.BLOCKWISE_LIFETIME):
+        """
+        Delete the blockwise transfers idle for more than lifetime seconds.
+
+        :param lifetime: the maximum idle time of a transfer
+        """
+        expired = time.time() - lifetime
+        with self._lock:
+            for transfers in (self._block1_receive, self._block2_receive):
+                while transfers:
+                    key, item = next(transfers.iteritems())
+                    if item.timestamp >= expired:
+                        break
+                    logger.debug("Delete blockwise transfer")
+                    del transfers[key]
+                    if transfers is self._block1_receive:
+                        self._block1_bytes -= len(item.payload)
+
+    def _reserve_block1(self, length):
+        """
+        Checks if there is memory for length more bytes of Block1 payloads, evicting the least recently active
+        uploads if they are idle.
+
+        :param length: the number of bytes
+        :rtype : bool
+        :return: True if the bytes can be stored
+        """
+        if self._block1_bytes + length <= defines.MAX_BLOCK1_BUFFERS:
+            return True
+        self.purge()
+        return self._block1_bytes + length <= defines.MAX_BLOCK1_BUFFERS
+
     @staticmethod
     def incomplete(transaction):
         """
@@ -289,6 +446,27 @@ class BlockLayer(object):
         transaction.response.code = defines.Codes.REQUEST_ENTITY_INCOMPLETE.number
         return transaction
 
+    @staticmethod
+    def too_large(transaction):
+        """
+        Notifies that the payload of a blockwise exchange is too large.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the response
+        :rtype : Transaction
+        :return: the edited transaction
+        """
+        transaction.block_transfer = True
+        transaction.response = Response()
+        transaction.response.destination = transaction.request.source
+        transaction.response.token = transaction.request.token
+        transaction.response.code = defines.Codes.REQUEST_ENTITY_TOO_LARGE.number
+        option = Option()
+        option.number = defines.OptionRegistry.SIZE1.number
+        option.value = defines.MAX_BLOCK1_PAYLOAD
+        transaction.response.add_option(option)
+        return transaction
+
     @staticmethod
     def error(transaction, code):  # pragma: no cover
         """
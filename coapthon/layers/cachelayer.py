@@ -1,108 +1,124 @@
-
-from coapthon.defines import Codes
-
-from coapthon.caching.cache import *
-
-__author__ = 'Emilio Vallati'
-
-
-class CacheLayer(object):
-
-    def __init__(self, mode, max_dim=2048):
-        """
-
-        :param max_dim:
-        """
-        self.cache = Cache(mode, max_dim)
-
-    def receive_request(self, transaction):
-        """
-        checks the cache for a response to the request
-
-        :param transaction:
-        :return:
-        """
-
-        transaction.cached_element = self.cache.search_response(transaction.request)
-        if transaction.cached_element is None:
-            transaction.cacheHit = False
-        else:
-            transaction.response = transaction.cached_element.cached_response
-            transaction.response.mid = transaction.request.mid
-            transaction.cacheHit = True
-
-            age = transaction.cached_element.creation_time + transaction.cached_element.max_age - time.time()
-            if transaction.cached_element.freshness is True:
-                if age <= 0:
-                    print "resource not fresh"
-                    """
-                    if the resource is not fresh, its Etag must be added to the request so that the server might validate it instead of sending a new one
-                    """
-                    transaction.cached_element.freshness = False
-                    """
-                    ensuring that the request goes to the server
-                    """
-                    transaction.cacheHit = False
-                    print "requesting etag ", transaction.response.etag
-                    transaction.request.etag = transaction.response.etag
-                else:
-                    transaction.response.max_age = age
-            else:
-                transaction.cacheHit = False
-        return transaction
-
-    def send_response(self, transaction):
-        """
-        updates the cache with the response if there was a cache miss
-
-        :param transaction:
-        :return:
-        """
-        if transaction.cacheHit is False:
-            """
-            handling response based on the code
-            """
-            print "handling response"
-            self._handle_response(transaction)
-        return transaction
-
-    def _handle_response(self, transaction):
-        """
-        handles responses based on their type
-
-        :param transaction:
-        :return:
-        """
-        code = transaction.response.code
-        utils.check_code(code)
-        """
-        VALID response:
-        change the current cache value by switching the option set with the one provided
-        also resets the timestamp
-        if the request etag is different from the response, send the cached response
-        """
-        if code == Codes.VALID.number:
-            print "received VALID"
-            self.cache.validate(transaction.request, transaction.response)
-            if transaction.request.etag != transaction.response.etag:
-                element = self.cache.search_response(transaction.request)
-                transaction.response = element.cached_response
-            return transaction
-
-        """
-        CHANGED, CREATED or DELETED response:
-        mark the requested resource as not fresh
-        """
-        if code == Codes.CHANGED.number or code == Codes.CREATED.number or code == Codes.DELETED.number:
-            target = self.cache.search_related(transaction.request)
-            if target is not None:
-                for element in target:
-                    self.cache.mark(element)
-            return transaction
-
-        """
-        any other response code can be cached normally
-        """
-        self.cache.cache_add(transaction.request, transaction.response)
-        return transaction
-
+
+from coapthon.defines import Codes
+
+from coapthon.caching.cache import *
+
+__author__ = 'Emilio Vallati'
+
+
+class CacheLayer(object):
+
+    def __init__(self, mode, max_dim=defines.CACHE_MAX_ELEMENTS, max_bytes=defines.CACHE_MAX_BYTES):
+        """
+
+        :param max_dim: max number of elements in the cache
+        :param max_bytes: max size of the responses in the cache
+        """
+        self.cache = Cache(mode, max_dim, max_bytes)
+
+    def receive_request(self, transaction):
+        """
+        checks the cache for a response to the request
+
+        :param transaction:
+        :return:
+        """
+        request = transaction.request
+        transaction.cacheHit = False
+        transaction.cache_revalidation = False
+        if request.observe is not None:
+            """
+            observe requests are not answered from the cache, observations are relayed by the forward layer
+            """
+            transaction.cached_element = None
+            return transaction
+        transaction.cached_element = self.cache.search_response(request)
+        element = transaction.cached_element
+        if element is None:
+            self.cache.count("misses")
+        elif element.is_fresh():
+            if element.etag is not None and element.etag in request.etag:
+                """
+                the client already has the cached representation
+                """
+                transaction.response = element.response_for(request, Codes.VALID.number)
+            else:
+                transaction.response = element.response_for(request)
+            transaction.cacheHit = True
+            self.cache.count("hits")
+        else:
+            element.freshness = False
+            if element.etag is not None:
+                """
+                if the resource is not fresh, its Etag must be added to the request so that the server might
+                validate it instead of sending a new one
+                """
+                if element.etag not in request.etag:
+                    request.etag = element.etag
+                    transaction.cache_revalidation = True
+                self.cache.count("revalidations")
+            else:
+                self.cache.count("misses")
+        return transaction
+
+    def send_response(self, transaction):
+        """
+        updates the cache with the response if there was a cache miss
+
+        :param transaction:
+        :return:
+        """
+        if transaction.cacheHit is False:
+            """
+            handling response based on the code
+            """
+            self._handle_response(transaction)
+        return transaction
+
+    def purge(self):
+        """
+        removes the expired responses
+
+        :return:
+        """
+        self.cache.cache.expire()
+
+    def _handle_response(self, transaction):
+        """
+        handles responses based on their type
+
+        :param transaction:
+        :return:
+        """
+        code = transaction.response.code
+        try:
+            utils.check_code(code)
+        except utils.InvalidResponseCode:
+            return transaction
+        """
+        VALID response:
+        change the current cache value by switching the option set with the one provided
+        also resets the timestamp
+        if the ETag was added by the cache and not by the client, send the cached response
+        """
+        if code == Codes.VALID.number:
+            element = self.cache.validate(transaction.request, transaction.response)
+            if element is not None and transaction.cache_revalidation:
+                transaction.response = element.response_for(transaction.request)
+            return transaction
+
+        """
+        CHANGED, CREATED or DELETED response:
+        mark the requested resource as not fresh
+        """
+        if code == Codes.CHANGED.number or code == Codes.CREATED.number or code == Codes.DELETED.number:
+            for element in self.cache.search_related(transaction.request):
+                self.cache.mark(element)
+            return transaction
+
+        """
+        any other response to a GET (not an observe request) can be cached normally
+        """
+        if transaction.request.code == Codes.GET.number and transaction.request.observe is None:
+            self.cache.cache_add(transaction.request, transaction.response)
+        return transaction
@@ -1,6 +1,6 @@
-import copy
 from coapthon.messages.request import Request
-from coapclient import HelperClient
+from coapthon.client.clientpool import ClientPool
+from coapthon.layers.observerelay import ObserveRelay
 from coapthon.messages.response import Response
 from coapthon import defines
 from coapthon.resources.remoteResource import RemoteResource
@@ -12,18 +12,30 @@ __author__ = 'Giacomo Tanganelli'
 class ForwardLayer(object):
     """
     Class used by Proxies to forward messages.
+    The requests are sent on the persistent clients of the upstream servers, without waiting for the responses:
+    when a callback is given, the transaction is completed by the callback once the upstream server answered.
+    On Reverse Proxies, the observations of remote resources are relayed by a single upstream observation.
     """
     def __init__(self, server):
         self._server = server
+        self._pool = ClientPool()
+        self._relay = ObserveRelay(server, self._pool)
 
-    def receive_request(self, transaction):
+    def close(self):
+        """
+        Close the clients of the upstream servers.
+        """
+        self._pool.close()
+
+    def receive_request(self, transaction, callback=None):
         """
         Setup the transaction for forwarding purposes on Forward Proxies.
          
         :type transaction: Transaction
         :param transaction: the transaction that owns the request
+        :param callback: the function invoked with the completed transaction, if None wait for the response
         :rtype : Transaction
-        :return: the edited transaction
+        :return: the edited transaction, None if it will be completed by the callback
         """
         uri = transaction.request.proxy_uri
         host, port, path = parse_uri(uri)
@@ -31,16 +43,17 @@ class ForwardLayer(object):
         transaction.response = Response()
         transaction.response.destination = transaction.request.source
         transaction.response.token = transaction.request.token
-        return self._forward_request(transaction, (host, port), path)
+        return self._forward_request(transaction, (host, port), path, callback)
 
-    def receive_request_reverse(self, transaction):
+    def receive_request_reverse(self, transaction, callback=None):
         """
         Setup the transaction for forwarding purposes on Reverse Proxies.
          
         :type transaction: Transaction
         :param transaction: the transaction that owns the request
+        :param callback: the function invoked with the completed transaction, if None wait for the response
         :rtype : Transaction
-        :return: the edited transaction
+        :return: the edited transaction, None if it will be completed by the callback
         """
         path = str("/" + transaction.request.uri_path)
         transaction.response = Response()
@@ -51,11 +64,10 @@ class ForwardLayer(object):
         else:
             new = False
             if transaction.request.code == defines.Codes.POST.number:
-                new_paths = self._server.root.with_prefix(path)
-                new_path = "/"
-                for tmp in new_paths:
-                    if len(tmp) > len(new_path):
-                        new_path = tmp
+                try:
+                    new_path = self._server.root.longest_prefix(path)[0]
+                except KeyError:
+                    new_path = "/"
                 if path != new_path:
                     new = True
                 path = new_path
@@ -68,45 +80,100 @@ class ForwardLayer(object):
                 transaction.response.code = defines.Codes.NOT_FOUND.number
             else:
                 transaction.resource = resource
-                transaction = self._handle_request(transaction, new)
+                return self._handle_request(transaction, new, callback)
+        if callback is not None:
+            callback(transaction)
+            return None
         return transaction
 
     @staticmethod
-    def _forward_request(transaction, destination, path):
+    def _upstream_request(transaction, destination, path):
         """
-        Forward requests.
+        Build the request sent to the upstream server, sharing the options of the request of the client.
 
         :type transaction: Transaction
         :param transaction: the transaction that owns the request
         :param destination: the destination of the request (IP, port)
         :param path: the path of the request.
-        :rtype : Transaction
-        :return: the edited transaction
+        :return: the request
         """
-        client = HelperClient(destination)
         request = Request()
-        request.options = copy.deepcopy(transaction.request.options)
+        # the options are never modified in place, only added or removed
+        request.options = list(transaction.request.options)
         del request.block2
         del request.block1
         del request.uri_path
         del request.proxy_uri
         del request.proxy_schema
-        # TODO handle observing
+        # the upstream observations are started by the relay (see observerelay.py)
         del request.observe
-        # request.observe = transaction.request.observe
 
         request.uri_path = path
         request.destination = destination
         request.payload = transaction.request.payload
         request.code = transaction.request.code
-        response = client.send_request(request)
-        client.stop()
+        return request
+
+    def _send(self, destination, request, complete, callback):
+        """
+        Send a request to an upstream server.
+
+        :param destination: the upstream server (IP, port)
+        :param request: the request
+        :param complete: the function that fills the transaction with the response (None on timeout)
+        :param callback: the function invoked with the completed transaction, if None wait for the response
+        :return: the completed transaction, None if it will be completed by the callback
+        """
+        if callback is None:
+            return complete(self._pool.request(destination, request))
+        self._pool.send(destination, request, lambda response: callback(complete(response)))
+        return None
+
+    @staticmethod
+    def _copy_response(transaction, response):
+        """
+        Copy the response of the upstream server in the response of the transaction.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :param response: the response of the upstream server, None on timeout
+        :return: False on timeout
+        """
+        if response is None:
+            transaction.response.code = defines.Codes.GATEWAY_TIMEOUT.number
+            return False
         transaction.response.payload = response.payload
         transaction.response.code = response.code
-        transaction.response.options = response.options
-        return transaction
+        # the response of an observation is shared with all the observers
+        transaction.response.options = list(response.options)
+        return True
+
+    def _forward_request(self, transaction, destination, path, callback=None):
+        """
+        Forward requests.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :param destination: the destination of the request (IP, port)
+        :param path: the path of the request.
+        :param callback: the function invoked with the completed transaction, if None wait for the response
+        :rtype : Transaction
+        :return: the edited transaction, None if it will be completed by the callback
+        """
+        request = self._upstream_request(transaction, destination, path)
 
-    def _handle_request(self, transaction, new_resource):
+        def complete(response):
+            self._copy_response(transaction, response)
+            return transaction
+
+        # the forward proxy (Proxy-Uri) has no resource to relay the observations of
+        if callback is not None and transaction.request.observe == 0 and transaction.resource is not None \
+                and transaction.request.code == defines.Codes.GET.number and transaction.resource.observable:
+            self._relay.relay(transaction, request, complete, callback)
+            return None
+        return self._send(destination, request, complete, callback)
+
+    def _handle_request(self, transaction, new_resource, callback=None):
         """
         Forward requests. Used by reverse proxies to also create new virtual resources on the proxy 
         in case of created resources
@@ -116,40 +183,32 @@ class ForwardLayer(object):
         :param transaction: the transaction that owns the request
         :rtype : Transaction
         :param new_resource: if the request will generate a new resource 
-        :return: the edited transaction
+        :param callback: the function invoked with the completed transaction, if None wait for the response
+        :return: the edited transaction, None if it will be completed by the callback
         """
-        client = HelperClient(transaction.resource.remote_server)
-        request = Request()
-        request.options = copy.deepcopy(transaction.request.options)
-        del request.block2
-        del request.block1
-        del request.uri_path
-        del request.proxy_uri
-        del request.proxy_schema
-        # TODO handle observing
-        del request.observe
-        # request.observe = transaction.request.observe
+        destination = transaction.resource.remote_server
+        request = self._upstream_request(transaction, destination,
+                                         "/".join(transaction.request.uri_path.split("/")[1:]))
 
-        request.uri_path = "/".join(transaction.request.uri_path.split("/")[1:])
-        request.destination = transaction.resource.remote_server
-        request.payload = transaction.request.payload
-        request.code = transaction.request.code
-        response = client.send_request(request)
-        client.stop()
-        transaction.response.payload = response.payload
-        transaction.response.code = response.code
-        transaction.response.options = response.options
-        if response.code == defines.Codes.CREATED.number:
-            lp = transaction.response.location_path
-            del transaction.response.location_path
-            transaction.response.location_path = transaction.request.uri_path.split("/")[0] + "/" + lp
-            # TODO handle observing
-            if new_resource:
-                resource = RemoteResource('server', transaction.resource.remote_server, lp, coap_server=self,
-                                          visible=True,
-                                          observable=False,
-                                          allow_children=True)
-                self._server.add_resource(transaction.response.location_path, resource)
-        if response.code == defines.Codes.DELETED.number:
-            del self._server.root["/" + transaction.request.uri_path]
-        return transaction
+        def complete(response):
+            if not self._copy_response(transaction, response):
+                return transaction
+            if response.code == defines.Codes.CREATED.number:
+                lp = transaction.response.location_path
+                del transaction.response.location_path
+                transaction.response.location_path = transaction.request.uri_path.split("/")[0] + "/" + lp
+                if new_resource:
+                    resource = RemoteResource('server', transaction.resource.remote_server, lp, coap_server=self,
+                                              visible=True,
+                                              observable=False,
+                                              allow_children=True)
+                    self._server.add_resource(transaction.response.location_path, resource)
+            if response.code == defines.Codes.DELETED.number:
+                del self._server.root["/" + transaction.request.uri_path]
+            return transaction
+
+        if callback is not None and transaction.request.observe == 0 \
+                and transaction.request.code == defines.Codes.GET.number and transaction.resource.observable:
+            self._relay.relay(transaction, request, complete, callback)
+            return None
+        return self._send(destination, request, complete, callback)
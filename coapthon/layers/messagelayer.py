@@ -1,6 +1,8 @@
 import logging
 import random
+import threading
 import time
+from collections import deque
 from coapthon.messages.message import Message
 from coapthon import defines
 from coapthon.messages.request import Request
@@ -11,13 +13,16 @@ __author__ = 'Giacomo Tanganelli'
 logger = logging.getLogger(__name__)
 
 
-def str_append_hash(*args):
-    """ Convert each argument to a lower case string, appended, then hash """
-    ret_hash = ""
-    for i in args:
-        ret_hash += str(i).lower()
+def transaction_key(host, port, value):
+    """
+    Return the key of a transaction in the transaction tables.
 
-    return hash(ret_hash)
+    :param host: the remote host
+    :param port: the remote port
+    :param value: the mid or the token of the message
+    :return: the key
+    """
+    return host, port, value
 
 
 class MessageLayer(object):
@@ -32,10 +37,17 @@ class MessageLayer(object):
         """
         self._transactions = {}
         self._transactions_token = {}
+        # (expiration time, table, key, transaction) in insertion order, so
+        # that purge only has to look at the expired transactions
+        self._expiry = deque()
+        # (table, key) -> expiration time of the latest store of the key
+        self._expirations = {}
+        self._expiry_lock = threading.Lock()
         if starting_mid is not None:
             self._current_mid = starting_mid
         else:
             self._current_mid = random.randint(1, 1000)
+        self._mid_lock = threading.Lock()
 
     def fetch_mid(self):
         """
@@ -43,24 +55,62 @@ class MessageLayer(object):
 
         :return: the mid to use
         """
-        current_mid = self._current_mid
-        self._current_mid += 1
-        self._current_mid %= 65535
+        with self._mid_lock:
+            current_mid = self._current_mid
+            self._current_mid += 1
+            self._current_mid %= 65535
         return current_mid
 
-    def purge(self):
-        for k in self._transactions.keys():
-            now = time.time()
-            transaction = self._transactions[k]
-            if transaction.timestamp + defines.EXCHANGE_LIFETIME < now:
-                logger.debug("Delete transaction")
-                del self._transactions[k]
-        for k in self._transactions_token.keys():
-            now = time.time()
-            transaction = self._transactions_token[k]
-            if transaction.timestamp + defines.EXCHANGE_LIFETIME < now:
+    def _store(self, table, key, transaction):
+        """
+        Store a transaction in one of the transaction tables.
+
+        :param table: the transaction table (by mid or by token)
+        :param key: the key of the transaction
+        :param transaction: the transaction
+        """
+        table[key] = transaction
+        self._schedule(table, key, transaction)
+
+    def _schedule(self, table, key, transaction):
+        """
+        Schedule the purge of a stored transaction, replacing the previous schedule of its key.
+        The expiration is counted from the time of the store, also for a transaction stored again (e.g. for a
+        notification), so that the insertion order is the expiration order.
+
+        :param table: the transaction table (by mid or by token)
+        :param key: the key of the transaction
+        :param transaction: the transaction
+        """
+        with self._expiry_lock:
+            expiration = time.time() + defines.EXCHANGE_LIFETIME
+            self._expirations[(id(table), key)] = expiration
+            self._expiry.append((expiration, table, key, transaction))
+
+    def purge(self, keep=None):
+        """
+        Delete the expired transactions.
+
+        :param keep: function telling if an expired transaction is still in use (e.g. a running observation)
+        """
+        now = time.time()
+        expired = []
+        with self._expiry_lock:
+            while self._expiry and self._expiry[0][0] < now:
+                expiration, table, key, transaction = self._expiry.popleft()
+                if self._expirations.get((id(table), key)) != expiration:
+                    # stored again after being scheduled
+                    continue
+                del self._expirations[(id(table), key)]
+                expired.append((table, key, transaction))
+        for table, key, transaction in expired:
+            # the key could have been reused by a newer transaction
+            if table.get(key) is transaction:
+                if keep is not None and keep(transaction):
+                    self._schedule(table, key, transaction)
+                    continue
                 logger.debug("Delete transaction")
-                del self._transactions_token[k]
+                table.pop(key, None)
 
     def receive_request(self, request):
         """
@@ -71,24 +121,24 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the edited transaction
         """
-        logger.debug("receive_request - " + str(request))
+        logger.debug("receive_request - %s", request)
         try:
             host, port = request.source
         except AttributeError:
             return
-        key_mid = str_append_hash(host, port, request.mid)
-        key_token = str_append_hash(host, port, request.token)
+        key_mid = transaction_key(host, port, request.mid)
+        key_token = transaction_key(host, port, request.token)
 
-        if key_mid in self._transactions.keys():
+        transaction = self._transactions.get(key_mid)
+        if transaction is not None:
             # Duplicated
-            self._transactions[key_mid].request.duplicated = True
-            transaction = self._transactions[key_mid]
+            transaction.request.duplicated = True
         else:
             request.timestamp = time.time()
             transaction = Transaction(request=request, timestamp=request.timestamp)
             with transaction:
-                self._transactions[key_mid] = transaction
-                self._transactions_token[key_token] = transaction
+                self._store(self._transactions, key_mid, transaction)
+                self._store(self._transactions_token, key_token, transaction)
         return transaction
 
     def receive_response(self, response):
@@ -100,31 +150,31 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the transaction to which the response belongs to
         """
-        logger.debug("receive_response - " + str(response))
+        logger.debug("receive_response - %s", response)
         try:
             host, port = response.source
         except AttributeError:
             return
-        key_mid = str_append_hash(host, port, response.mid)
-        key_mid_multicast = str_append_hash(defines.ALL_COAP_NODES, port, response.mid)
-        key_token = str_append_hash(host, port, response.token)
-        key_token_multicast = str_append_hash(defines.ALL_COAP_NODES, port, response.token)
-        if key_mid in self._transactions.keys():
+        key_mid = transaction_key(host, port, response.mid)
+        key_mid_multicast = transaction_key(defines.ALL_COAP_NODES, port, response.mid)
+        key_token = transaction_key(host, port, response.token)
+        key_token_multicast = transaction_key(defines.ALL_COAP_NODES, port, response.token)
+        if key_mid in self._transactions:
             transaction = self._transactions[key_mid]
             if response.token != transaction.request.token:
-                logger.warning("Tokens does not match -  response message " + str(host) + ":" + str(port))
+                logger.warning("Tokens does not match -  response message %s:%s", host, port)
                 return None, False
         elif key_token in self._transactions_token:
             transaction = self._transactions_token[key_token]
-        elif key_mid_multicast in self._transactions.keys():
+        elif key_mid_multicast in self._transactions:
             transaction = self._transactions[key_mid_multicast]
         elif key_token_multicast in self._transactions_token:
             transaction = self._transactions_token[key_token_multicast]
             if response.token != transaction.request.token:
-                logger.warning("Tokens does not match -  response message " + str(host) + ":" + str(port))
+                logger.warning("Tokens does not match -  response message %s:%s", host, port)
                 return None, False
         else:
-            logger.warning("Un-Matched incoming response message " + str(host) + ":" + str(port))
+            logger.warning("Un-Matched incoming response message %s:%s", host, port)
             return None, False
         send_ack = False
         if response.type == defines.Types["CON"]:
@@ -146,25 +196,25 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the transaction to which the message belongs to
         """
-        logger.debug("receive_empty - " + str(message))
+        logger.debug("receive_empty - %s", message)
         try:
             host, port = message.source
         except AttributeError:
             return
-        key_mid = str_append_hash(host, port, message.mid)
-        key_mid_multicast = str_append_hash(defines.ALL_COAP_NODES, port, message.mid)
-        key_token = str_append_hash(host, port, message.token)
-        key_token_multicast = str_append_hash(defines.ALL_COAP_NODES, port, message.token)
-        if key_mid in self._transactions.keys():
+        key_mid = transaction_key(host, port, message.mid)
+        key_mid_multicast = transaction_key(defines.ALL_COAP_NODES, port, message.mid)
+        key_token = transaction_key(host, port, message.token)
+        key_token_multicast = transaction_key(defines.ALL_COAP_NODES, port, message.token)
+        if key_mid in self._transactions:
             transaction = self._transactions[key_mid]
         elif key_token in self._transactions_token:
             transaction = self._transactions_token[key_token]
-        elif key_mid_multicast in self._transactions.keys():
+        elif key_mid_multicast in self._transactions:
             transaction = self._transactions[key_mid_multicast]
         elif key_token_multicast in self._transactions_token:
             transaction = self._transactions_token[key_token_multicast]
         else:
-            logger.warning("Un-Matched incoming empty message " + str(host) + ":" + str(port))
+            logger.warning("Un-Matched incoming empty message %s:%s", host, port)
             return None
 
         if message.type == defines.Types["ACK"]:
@@ -192,7 +242,7 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the created transaction
         """
-        logger.debug("send_request - " + str(request))
+        logger.debug("send_request - %s", request)
         assert isinstance(request, Request)
         try:
             host, port = request.destination
@@ -207,13 +257,13 @@ class MessageLayer(object):
         if transaction.request.mid is None:
             transaction.request.mid = self.fetch_mid()
 
-        key_mid = str_append_hash(host, port, request.mid)
-        self._transactions[key_mid] = transaction
+        key_mid = transaction_key(host, port, request.mid)
+        self._store(self._transactions, key_mid, transaction)
 
-        key_token = str_append_hash(host, port, request.token)
-        self._transactions_token[key_token] = transaction
+        key_token = transaction_key(host, port, request.token)
+        self._store(self._transactions_token, key_token, transaction)
 
-        return self._transactions[key_mid]
+        return transaction
 
     def send_response(self, transaction):
         """
@@ -224,7 +274,7 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the edited transaction
         """
-        logger.debug("send_response - " + str(transaction.response))
+        logger.debug("send_response - %s", transaction.response)
         if transaction.response.type is None:
             if transaction.request.type == defines.Types["CON"] and not transaction.request.acknowledged:
                 transaction.response.type = defines.Types["ACK"]
@@ -243,8 +293,8 @@ class MessageLayer(object):
                 host, port = transaction.response.destination
             except AttributeError:
                 return
-            key_mid = str_append_hash(host, port, transaction.response.mid)
-            self._transactions[key_mid] = transaction
+            key_mid = transaction_key(host, port, transaction.response.mid)
+            self._store(self._transactions, key_mid, transaction)
 
         transaction.request.acknowledged = True
         return transaction
@@ -259,14 +309,14 @@ class MessageLayer(object):
         :type message: Message
         :param message: the ACK or RST message to send
         """
-        logger.debug("send_empty - " + str(message))
+        logger.debug("send_empty - %s", message)
         if transaction is None:
             try:
                 host, port = message.destination
             except AttributeError:
                 return
-            key_mid = str_append_hash(host, port, message.mid)
-            key_token = str_append_hash(host, port, message.token)
+            key_mid = transaction_key(host, port, message.mid)
+            key_token = transaction_key(host, port, message.token)
             if key_mid in self._transactions:
                 transaction = self._transactions[key_mid]
                 related = transaction.response
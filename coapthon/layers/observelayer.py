@@ -40,12 +40,27 @@ class ObserveLayer(object):
         if request.observe == 0:
             # Observe request
             host, port = request.destination
-            key_token = hash(str(host) + str(port) + str(request.token))
+            key_token = (host, port, request.token)
 
             self._relations[key_token] = ObserveItem(time.time(), None, True, None)
+        elif request.observe == 1:
+            # Cancel an observation
+            host, port = request.destination
+            self._relations.pop((host, port, request.token), None)
 
         return request
 
+    def observing(self, transaction):
+        """
+        Check if a request sent by a client is a running observation.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :return: True, if the observation is running
+        """
+        host, port = transaction.request.destination
+        return (host, port, transaction.request.token) in self._relations
+
     def receive_response(self, transaction):
         """
         Sets notification's parameters.
@@ -56,7 +71,7 @@ class ObserveLayer(object):
         :return: the modified transaction
         """
         host, port = transaction.response.source
-        key_token = hash(str(host) + str(port) + str(transaction.response.token))
+        key_token = (host, port, transaction.response.token)
         if key_token in self._relations and transaction.response.type == defines.Types["CON"]:
             transaction.notification = True
         return transaction
@@ -70,7 +85,7 @@ class ObserveLayer(object):
         :return: the message unmodified
         """
         host, port = message.destination
-        key_token = hash(str(host) + str(port) + str(message.token))
+        key_token = (host, port, message.token)
         if key_token in self._relations and message.type == defines.Types["RST"]:
             del self._relations[key_token]
         return message
@@ -88,7 +103,7 @@ class ObserveLayer(object):
         if transaction.request.observe == 0:
             # Observe request
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = (host, port, transaction.request.token)
             non_counter = 0
             if key_token in self._relations:
                 # Renew registration
@@ -98,7 +113,7 @@ class ObserveLayer(object):
             self._relations[key_token] = ObserveItem(time.time(), non_counter, allowed, transaction)
         elif transaction.request.observe == 1:
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = (host, port, transaction.request.token)
             logger.info("Remove Subscriber")
             try:
                 del self._relations[key_token]
@@ -120,7 +135,7 @@ class ObserveLayer(object):
         """
         if empty.type == defines.Types["RST"]:
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = (host, port, transaction.request.token)
             logger.info("Remove Subscriber")
             try:
                 del self._relations[key_token]
@@ -138,7 +153,7 @@ class ObserveLayer(object):
         :return: the transaction unmodified
         """
         host, port = transaction.request.source
-        key_token = hash(str(host) + str(port) + str(transaction.request.token))
+        key_token = (host, port, transaction.request.token)
         if key_token in self._relations:
             if transaction.response.code == defines.Codes.CONTENT.number:
                 if transaction.resource is not None and transaction.resource.observable:
@@ -182,6 +197,16 @@ class ObserveLayer(object):
                 ret.append(self._relations[key].transaction)
         return ret
 
+    def remove_observer(self, host, port, token):
+        """
+        Remove an observer that can not be notified.
+
+        :param host: the host of the observer
+        :param port: the port of the observer
+        :param token: the token of the observe request
+        """
+        self._relations.pop((host, port, token), None)
+
     def remove_subscriber(self, message):
         """
         Remove a subscriber based on token.
@@ -190,7 +215,7 @@ class ObserveLayer(object):
         """
         logger.debug("Remove Subcriber")
         host, port = message.destination
-        key_token = hash(str(host) + str(port) + str(message.token))
+        key_token = (host, port, message.token)
         try:
             self._relations[key_token].transaction.completed = True
             del self._relations[key_token]
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+
+from coapthon import defines
+
+__author__ = 'Jose Requeijo Dias'
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamObservation(object):
+    def __init__(self, resource, destination, restarted=False):
+        """
+        Data structure for the observation of a remote resource made by the proxy on behalf of its observers.
+
+        :param resource: the remote resource on the proxy
+        :param destination: the upstream server (IP, port)
+        :param restarted: if it replaces an observation of the resource, whose observers are still registered
+        """
+        self.resource = resource
+        self.destination = destination
+        self.restarted = restarted
+        self.token = None
+        self.response = None
+        self.timestamp = None
+        self.waiting = []
+
+    def fresh(self, now):
+        """
+        Check if the last notification can be given to a new observer.
+
+        :param now: the current time
+        :return: True, if the Max-Age of the last notification did not elapse
+        """
+        return self.response is not None and now - self.timestamp < self.response.max_age
+
+
+class ObserveRelay(object):
+    """
+    Relays the observations of the remote resources of a Reverse Proxy: the proxy keeps a single observation of each
+    resource on the upstream server, the notifications are sent to all the observers of the resource on the proxy and
+    the last one is given to the new observers.
+    """
+    def __init__(self, server, pool):
+        """
+        Initialize the relay.
+
+        :param server: the Reverse Proxy
+        :param pool: the ClientPool of the upstream servers
+        """
+        self._server = server
+        self._pool = pool
+        self._observations = {}
+        self._lock = threading.Lock()
+
+    def relay(self, transaction, request, complete, callback):
+        """
+        Answer an observe request, from the last notification or once the upstream observation is started.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the request
+        :param request: the request for the upstream server
+        :param complete: the function that fills the transaction with the upstream response
+        :param callback: the function invoked with the completed transaction
+        """
+        resource = transaction.resource
+        now = time.time()
+        start = None
+        with self._lock:
+            observation = self._observations.get(resource.path)
+            if observation is not None and observation.fresh(now):
+                response = observation.response
+            else:
+                response = None
+                if observation is None or observation.response is not None:
+                    # no observation, or silent since the Max-Age of its last notification
+                    if observation is not None:
+                        self._pool.cancel(observation.destination, observation.token)
+                    observation = UpstreamObservation(resource, request.destination, observation is not None)
+                    self._observations[resource.path] = observation
+                    start = observation
+                observation.waiting.append((complete, callback))
+        if response is not None:
+            callback(complete(response))
+            return
+        if start is not None:
+            request.observe = 0
+            start.token = self._pool.observe(start.destination, request,
+                                             lambda r: self._notification(start, r))
+
+    def _notification(self, observation, response):
+        """
+        Handle a notification of an upstream observation.
+
+        :param observation: the UpstreamObservation
+        :param response: the notification, None if the upstream server could not be reached
+        """
+        ended = response is None or response.observe is None \
+            or response.code >= defines.Codes.ERROR_LOWER_BOUND
+        with self._lock:
+            current = self._observations.get(observation.resource.path) is observation
+            if ended and current:
+                del self._observations[observation.resource.path]
+            if not ended:
+                observation.response = response
+                observation.timestamp = time.time()
+            waiting = observation.waiting
+            observation.waiting = []
+
+        answered = set()
+        for complete, callback in waiting:
+            transaction = complete(response)
+            if ended:
+                # the resource can not be observed through the proxy
+                self._server.remove_observer(transaction)
+            callback(transaction)
+            answered.add(transaction.request.source + (transaction.request.token,))
+
+        if len(waiting) > 0 and not observation.restarted:
+            return
+
+        # after a restart, the observers of the previous observation are notified too
+        if ended:
+            logger.info("Observation of %s ended", observation.resource.path)
+            self._server.notify(observation.resource, response, answered)
+            return
+        notified = self._server.notify(observation.resource, response, answered)
+        if not current or (notified == 0 and len(waiting) == 0):
+            # nobody is interested anymore
+            with self._lock:
+                if self._observations.get(observation.resource.path) is observation:
+                    del self._observations[observation.resource.path]
+            self._pool.cancel(observation.destination, observation.token)
+
+    def size(self):
+        """
+        Get the number of upstream observations.
+
+        :return: the number of observations
+        """
+        return len(self._observations)
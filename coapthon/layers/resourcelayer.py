@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from coapthon import defines
 from coapthon.messages.response import Response
 from coapthon.resources.resource import Resource
@@ -17,6 +18,8 @@ class ResourceLayer(object):
         :param parent: the CoAP server
         """
         self._parent = parent
+        # (version of the resource tree, links of the visible resources, .well-known/core document, rt/if index)
+        self._discovery = (None, [], "", {})
 
     def edit_resource(self, transaction, path):
         """
@@ -215,19 +218,12 @@ class ResourceLayer(object):
         :param transaction: the transaction
         :return: the response
         """
-        t = self._parent.root.with_prefix(path)
-        max_len = 0
-        imax = None
-        for i in t:
-            if i == path:
-                # Resource already present
-                return self.edit_resource(transaction, path)
-            elif len(i) > max_len:
-                imax = i
-                max_len = len(i)
+        imax, parent_resource = self._parent.root.longest_prefix(path)
+        if imax == path:
+            # Resource already present
+            return self.edit_resource(transaction, path)
 
         lp = path
-        parent_resource = self._parent.root[imax]
         if parent_resource.allow_children:
                 return self.add_resource(transaction, parent_resource, lp)
         else:
@@ -369,6 +365,14 @@ class ResourceLayer(object):
                     if transaction.response.code is None:
                         transaction.response.code = defines.Codes.DELETED.number
                     return transaction
+                elif isinstance(ret, tuple) and len(ret) == 2 and isinstance(ret[1], Response) \
+                        and isinstance(ret[0], Resource):
+                    # Advanced handler answering without deleting the resource (e.g. an error)
+                    resource, response = ret
+                    transaction.response = response
+                    if transaction.response.code is None:
+                        transaction.response.code = defines.Codes.DELETED.number
+                    return transaction
                 elif isinstance(ret, tuple) and len(ret) == 3 and isinstance(ret[1], Response) \
                         and isinstance(ret[0], Resource):
                     # Advanced handler separate
@@ -504,25 +508,76 @@ class ResourceLayer(object):
     def discover(self, transaction):
         """
         Render a GET request to the .well-know/core link.
+        The document is cached until a resource is added, removed or changes its attributes. Queries made only of
+        rt and if filters (e.g. ?rt=DeviceState) are answered from an index, touching only the matching resources.
 
         :param transaction: the transaction
         :return: the transaction
         """
         transaction.response.code = defines.Codes.CONTENT.number
-        payload = ""
-        for i in self._parent.root.dump():
-            if i == "/":
-                continue
-            resource = self._parent.root[i]
-            if resource.visible:
-                ret = self.valid(transaction.request.uri_query, resource.attributes)
-                if ret:
-                    payload += self.corelinkformat(resource)
+        version, links, document, index = self._discovery_cache()
+        query = transaction.request.uri_query
+        filters = self.filters(query)
+        if len(filters) == 0:
+            payload = document
+        elif all(k in index for k, v in filters):
+            k, v = filters[0]
+            matches = index[k].get(v, [])
+            for k, v in filters[1:]:
+                selected = set(index[k].get(v, []))
+                matches = [path for path in matches if path in selected]
+            payload = "".join(links[path][1] for path in matches)
+        else:
+            payload = "".join(link for attributes, link in links.itervalues() if self.valid(query, attributes))
 
         transaction.response.payload = payload
         transaction.response.content_type = defines.Content_types["application/link-format"]
         return transaction
 
+    def _discovery_cache(self):
+        """
+        Get the cached .well-known/core document, rebuilding it if the resource tree changed.
+
+        :return: the version of the tree, the links (path -> (attributes, link)), the document and the rt/if index
+        """
+        root = self._parent.root
+        cache = self._discovery
+        if cache[0] == root.version:
+            return cache
+        version = root.version
+        links = OrderedDict()
+        index = {"rt": {}, "if": {}}
+        for path in sorted(root.dump()):
+            if path == "/":
+                continue
+            resource = root[path]
+            if not resource.visible:
+                continue
+            attributes = dict(resource.attributes)
+            links[path] = (attributes, self.corelinkformat(resource))
+            for k in index:
+                v = attributes.get(k)
+                if v is not None:
+                    index[k].setdefault(v, []).append(path)
+        cache = (version, links, "".join(link for attributes, link in links.itervalues()), index)
+        self._discovery = cache
+        return cache
+
+    @staticmethod
+    def filters(query):
+        """
+        Get the attribute filters (name, value) of a discovery query.
+
+        :param query: the Uri-Query of the request
+        :return: the list of filters
+        """
+        ret = []
+        for q in query.split("&"):
+            tmp = str(q).split("=")
+            if len(tmp) > 1:
+                ret.append((tmp[0], tmp[1]))
+        return ret
+
     @staticmethod
     def valid(query, attributes):
         query = query.split("&")
@@ -549,15 +604,16 @@ class ResourceLayer(object):
 
         :return: the string
         """
-        msg = "<" + resource.path + ">;"
         assert(isinstance(resource, Resource))
+        parts = []
         for k in resource.attributes:
             method = getattr(resource, defines.corelinkformat[k], None)
             if method is not None and method != "":
-                v = method
-                msg = msg[:-1] + ";" + str(v) + ","
+                parts.append(str(method))
             else:
                 v = resource.attributes[k]
                 if v is not None:
-                    msg = msg[:-1] + ";" + k + "=" + v + ","
-        return msg
\ No newline at end of file
+                    parts.append(k + "=" + v)
+        if len(parts) == 0:
+            return "<" + resource.path + ">;"
+        return "<" + resource.path + ">;" + ";".join(parts) + ","
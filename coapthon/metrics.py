@@ -0,0 +1,270 @@
+import bisect
+import threading
+import time
+
+from coapthon import defines
+
+__author__ = 'Jose Requeijo Dias'
+
+
+class Counter(object):
+    """
+    Counter of a series, with its own lock.
+    """
+    def __init__(self):
+        """
+        Initialize the counter.
+        """
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value=1):
+        """
+        Increment the counter.
+
+        :param value: the increment
+        """
+        with self._lock:
+            self.value += value
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets, as the Prometheus ones (the counts are cumulated only when exported), with its own
+    lock.
+    """
+    def __init__(self, buckets):
+        """
+        Initialize the histogram.
+
+        :param buckets: the sorted upper bounds of the buckets
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Add a value.
+
+        :param value: the value
+        """
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Get the state of the histogram.
+
+        :return: the counts of the buckets, the sum and the count of the values
+        """
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Metrics(object):
+    """
+    Collects the counters, gauges and histograms of a server and exports them in the Prometheus text format.
+    Series are identified by the metric name and a tuple of (label, value) pairs. Each series has its own lock, the
+    lock of the metrics is only taken to add a series, so the threads updating different series do not wait for each
+    other.
+    """
+    def __init__(self, buckets=defines.METRICS_BUCKETS):
+        """
+        Initialize the metrics.
+
+        :param buckets: the upper bounds of the buckets of the histograms, in seconds
+        """
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        """
+        Set the help text of a metric.
+
+        :param name: the name of the metric
+        :param text: the help text
+        """
+        self._help[name] = text
+
+    def inc(self, name, labels=(), value=1):
+        """
+        Increment a counter.
+
+        :param name: the name of the counter
+        :param labels: the labels of the series
+        :param value: the increment
+        """
+        counter = self._counters.get((name, labels))
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault((name, labels), Counter())
+        counter.inc(value)
+
+    def observe(self, name, labels, value):
+        """
+        Add a value to a histogram.
+
+        :param name: the name of the histogram
+        :param labels: the labels of the series
+        :param value: the value
+        """
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault((name, labels), Histogram(self.buckets))
+        histogram.observe(value)
+
+    def gauge(self, name, function, labels=()):
+        """
+        Register a gauge, whose value is read when the metrics are exported.
+
+        :param name: the name of the gauge
+        :param function: the function returning the value
+        :param labels: the labels of the series
+        """
+        self._gauges[(name, labels)] = function
+
+    def timed(self, name, function, labels=(), label=None):
+        """
+        Wrap a function so that its durations are added to a histogram.
+
+        :param name: the name of the histogram
+        :param function: the function
+        :param labels: the labels of the series
+        :param label: a function returning the labels from the arguments of the call, instead of labels
+        :return: the wrapped function
+        """
+        def measured(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(name, label(args) if label is not None else labels, time.time() - start)
+        return measured
+
+    def instrument(self, target, name, methods, labels=(), label=None):
+        """
+        Wrap an object (e.g. a layer) so that the durations of the calls of some of its methods are added to a
+        histogram, with a "method" label.
+
+        :param target: the object
+        :param name: the name of the histogram
+        :param methods: the names of the methods to time
+        :param labels: the labels of the series
+        :param label: a function returning the labels from the arguments of the call, instead of labels
+        :return: the wrapper of the object
+        """
+        return Instrumented(self, target, name, methods, labels, label)
+
+    def value(self, name, labels=()):
+        """
+        Get the value of a counter or of a gauge.
+
+        :param name: the name of the metric
+        :param labels: the labels of the series
+        :return: the value, 0 if the series does not exist
+        """
+        key = (name, labels)
+        if key in self._gauges:
+            return self._gauges[key]()
+        counter = self._counters.get(key)
+        return counter.value if counter is not None else 0
+
+    def histogram(self, name, labels=()):
+        """
+        Get a histogram.
+
+        :param name: the name of the histogram
+        :param labels: the labels of the series
+        :return: the Histogram, None if the series does not exist
+        """
+        return self._histograms.get((name, labels))
+
+    def render(self):
+        """
+        Export the metrics in the Prometheus text format.
+
+        :return: the metrics
+        """
+        with self._lock:
+            counters = self._counters.items()
+            histograms = self._histograms.items()
+        counters = sorted((key, counter.value) for key, counter in counters)
+        histograms = sorted((key,) + histogram.snapshot() for key, histogram in histograms)
+        gauges = sorted((key, function()) for key, function in self._gauges.items())
+
+        lines = []
+        names = set()
+
+        def header(name, kind):
+            if name not in names:
+                names.add(name)
+                if name in self._help:
+                    lines.append("# HELP " + name + " " + self._help[name])
+                lines.append("# TYPE " + name + " " + kind)
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(name + Metrics.labels(labels) + " " + str(value))
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(name + Metrics.labels(labels) + " " + str(value))
+        for (name, labels), counts, total, count in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(name + "_bucket" + Metrics.labels(labels + (("le", repr(float(bound))),)) + " " +
+                             str(cumulative))
+            lines.append(name + "_bucket" + Metrics.labels(labels + (("le", "+Inf"),)) + " " + str(count))
+            lines.append(name + "_sum" + Metrics.labels(labels) + " " + repr(total))
+            lines.append(name + "_count" + Metrics.labels(labels) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def labels(labels):
+        """
+        Format the labels of a series.
+
+        :param labels: the (label, value) pairs
+        :return: the labels in the Prometheus text format
+        """
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join(k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                              for k, v in labels) + "}"
+
+
+class Instrumented(object):
+    """
+    Wrapper of an object timing the calls of some of its methods, the other attributes are the ones of the object.
+    """
+    def __init__(self, metrics, target, name, methods, labels, label):
+        self.__dict__["_target"] = target
+        for method in methods:
+            function = getattr(target, method)
+            if label is not None:
+                timed = metrics.timed(name, function, label=Instrumented._method_label(method, label))
+            else:
+                timed = metrics.timed(name, function, labels + (("method", method),))
+            self.__dict__[method] = timed
+
+    @staticmethod
+    def _method_label(method, label):
+        return lambda args: label(args) + (("method", method),)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+import thread
+import threading
+import time
+
+from coapthon import defines
+
+__author__ = 'Jose Requeijo Dias'
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler of all the threads of the process: the stacks of the threads are sampled at a fixed interval
+    (with sys._current_frames, so the profiled code is not slowed down by tracing) and aggregated. Only one profile
+    at a time can run in a process.
+    """
+    _running = threading.Lock()
+
+    def __init__(self, interval=defines.PROFILER_INTERVAL):
+        """
+        Initialize the profiler.
+
+        :param interval: the seconds between two samples
+        """
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.duration = 0
+        self._labels = {}
+
+    def profile(self, duration):
+        """
+        Sample the threads for some time, in the calling thread.
+
+        :param duration: the seconds of the profile, bounded by PROFILER_MAX_DURATION
+        :return: the profiler, None if another profile is running
+        """
+        if not SamplingProfiler._running.acquire(False):
+            return None
+        try:
+            duration = max(0, min(duration, defines.PROFILER_MAX_DURATION))
+            me = thread.get_ident()
+            names = {}
+            start = time.time()
+            end = start + duration
+            refresh = start
+            while True:
+                now = time.time()
+                if now >= refresh:
+                    # the request threads are short-lived
+                    names = dict((t.ident, re.sub(r"-\d+$", "", t.name)) for t in threading.enumerate())
+                    refresh = now + 1
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    self._sample(names.get(ident, "Thread"), frame)
+                self.samples += 1
+                if now >= end:
+                    break
+                time.sleep(min(self.interval, max(0, end - now)))
+            self.duration = time.time() - start
+            return self
+        finally:
+            SamplingProfiler._running.release()
+
+    def _sample(self, name, frame):
+        """
+        Add the stack of a thread.
+
+        :param name: the name of the thread
+        :param frame: the current frame of the thread
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = os.path.basename(code.co_filename) + ":" + code.co_name + ":" + str(code.co_firstlineno)
+                self._labels[code] = label
+            stack.append(label)
+            frame = frame.f_back
+        stack.append(name)
+        stack.reverse()
+        key = tuple(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def collapsed(self):
+        """
+        Export the profile as collapsed stacks (one "thread;frame;...;frame count" line for each stack, from the root
+        to the leaf), the input of flamegraph.pl and speedscope.
+
+        :return: the collapsed stacks
+        """
+        lines = [";".join(stack) + " " + str(count) for stack, count in sorted(self.stacks.iteritems())]
+        return "\n".join(lines) + "\n"
+
+    def report(self, top=30):
+        """
+        Export the profile as a report of the samples of each thread and of the functions with more samples.
+
+        :param top: the number of functions in the report
+        :return: the report
+        """
+        threads = {}
+        own = {}
+        total = {}
+        for stack, count in self.stacks.iteritems():
+            threads[stack[0]] = threads.get(stack[0], 0) + count
+            if len(stack) > 1:
+                own[stack[-1]] = own.get(stack[-1], 0) + count
+            for label in set(stack[1:]):
+                total[label] = total.get(label, 0) + count
+
+        lines = ["Sampling profile: %d samples in %.1f s (interval %.0f ms)" %
+                 (self.samples, self.duration, self.interval * 1000), "", "Samples per thread:"]
+        for name, count in sorted(threads.iteritems(), key=lambda item: -item[1]):
+            lines.append("  %8d  %s" % (count, name))
+        lines.extend(["", "Top functions:", "  %8s  %8s  %s" % ("own", "total", "function")])
+        for label, count in sorted(own.iteritems(), key=lambda item: -item[1])[:top]:
+            lines.append("  %8d  %8d  %s" % (count, total[label], label))
+        lines.extend(["", "Top functions (with callees):", "  %8s  %8s  %s" % ("own", "total", "function")])
+        for label, count in sorted(total.iteritems(), key=lambda item: -item[1])[:top]:
+            lines.append("  %8d  %8d  %s" % (own.get(label, 0), count, label))
+        return "\n".join(lines) + "\n"
+
+    def render(self, output):
+        """
+        Export the profile.
+
+        :param output: "collapsed" or "report"
+        :return: the profile
+        """
+        if output == "report":
+            return self.report()
+        return self.collapsed()
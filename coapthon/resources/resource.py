@@ -213,6 +213,7 @@ class Resource(object):
         :param att: the attributes
         """
         self._attributes = att
+        self.attributes_changed()
 
     @property
     def visible(self):
@@ -323,6 +324,7 @@ class Resource(object):
             ct = defines.Content_types[ct]
         lst.append(ct)
         self._attributes["ct"] = lst
+        self.attributes_changed()
 
     @property
     def resource_type(self):
@@ -349,6 +351,7 @@ class Resource(object):
         if not isinstance(rt, str):
             rt = str(rt)
         self._attributes["rt"] = rt
+        self.attributes_changed()
 
     @property
     def interface_type(self):
@@ -375,6 +378,7 @@ class Resource(object):
         if not isinstance(ift, str):
             ift = str(ift)
         self._attributes["if"] = ift
+        self.attributes_changed()
 
     @property
     def maximum_size_estimated(self):
@@ -401,6 +405,16 @@ class Resource(object):
         if not isinstance(sz, str):
             sz = str(sz)
         self._attributes["sz"] = sz
+        self.attributes_changed()
+
+    def attributes_changed(self):
+        """
+        Notify the server that the CoRE Link Format attributes of the resource changed, so that the cached
+        .well-known/core document is rebuilt. Must be called after editing the attributes dictionary in place.
+        """
+        root = getattr(self._coap_server, "root", None)
+        if root is not None:
+            root.touch()
 
     @property
     def observing(self):
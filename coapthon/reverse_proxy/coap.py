@@ -181,7 +181,7 @@ class CoAP(object):
             self._mapping[name] = (host, port)
             self.parse_core_link_format(response.payload, name, (host, port))
         else:
-            logger.error("Server: " + response.source + " isn't valid.")
+            logger.error("Server: %s isn't valid.", response.source)
 
     def parse_core_link_format(self, link_format, base_path, remote_server):
         """
@@ -212,8 +212,8 @@ class CoAP(object):
                         dict_att[a[0]] = a[0]
                 link_format = link_format[result.end(0) + 1:]
             # TODO handle observing
-            resource = RemoteResource('server', remote_server, path, coap_server=self, visible=True, observable=False,
-                                      allow_children=True)
+            resource = RemoteResource('server', remote_server, path, coap_server=self, visible=True,
+                                      observable="obs" in dict_att, allow_children=True)
             resource.attributes = dict_att
             self.add_resource(base_path + "/" + path, resource)
 
@@ -226,6 +226,9 @@ class CoAP(object):
         while not self.stopped.isSet():
             self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
             self._messageLayer.purge()
+            self._blockLayer.purge()
+            if self._cacheLayer is not None:
+                self._cacheLayer.purge()
 
     def listen(self, timeout=10):
         """
@@ -255,6 +258,7 @@ class CoAP(object):
         self.stopped.set()
         for event in self.to_be_stopped:
             event.set()
+        self._forwardLayer.close()
         self._socket.close()
 
     def receive_datagram(self, args):
@@ -276,7 +280,7 @@ class CoAP(object):
             rst.code = message
             self.send_datagram(rst)
             return
-        logger.debug("receive_datagram - " + str(message))
+        logger.debug("receive_datagram - %s", message)
         if isinstance(message, Request):
 
             transaction = self._messageLayer.receive_request(message)
@@ -307,36 +311,15 @@ class CoAP(object):
 
             """
             call to the cache layer to check if there's a cached response for the request
-            if not, call the forward layer
+            if not, call the forward layer, that completes the transaction when the upstream server answers
             """
             if self._cacheLayer is not None:
                 transaction = self._cacheLayer.receive_request(transaction)
 
-                if transaction.cacheHit is False:
-                    print transaction.request
-                    transaction = self._forwardLayer.receive_request_reverse(transaction)
-                    print transaction.response
-
-                transaction = self._observeLayer.send_response(transaction)
-
-                transaction = self._blockLayer.send_response(transaction)
-
-                transaction = self._cacheLayer.send_response(transaction)
+            if self._cacheLayer is None or transaction.cacheHit is False:
+                self._forwardLayer.receive_request_reverse(transaction, self._send_response)
             else:
-                transaction = self._forwardLayer.receive_request_reverse(transaction)
-
-                transaction = self._observeLayer.send_response(transaction)
-
-                transaction = self._blockLayer.send_response(transaction)
-
-            self._stop_separate_timer(transaction.separate_timer)
-
-            transaction = self._messageLayer.send_response(transaction)
-
-            if transaction.response is not None:
-                if transaction.response.type == defines.Types["CON"]:
-                    self._start_retrasmission(transaction, transaction.response)
-                self.send_datagram(transaction.response)
+                self._send_response(transaction)
 
         elif isinstance(message, Message):
             transaction = self._messageLayer.receive_empty(message)
@@ -347,6 +330,73 @@ class CoAP(object):
         else:  # pragma: no cover
             logger.error("Received response from %s", message.source)
 
+    def _send_response(self, transaction):
+        """
+        Send the response of a forwarded request to the client.
+
+        :type transaction: Transaction
+        :param transaction: the completed transaction
+        """
+        if self._cacheLayer is not None:
+            # cache the whole representation, before it is split in blocks
+            transaction = self._cacheLayer.send_response(transaction)
+
+        transaction = self._observeLayer.send_response(transaction)
+
+        transaction = self._blockLayer.send_response(transaction)
+
+        self._stop_separate_timer(transaction.separate_timer)
+
+        transaction = self._messageLayer.send_response(transaction)
+
+        if transaction.response is not None:
+            if transaction.response.type == defines.Types["CON"]:
+                self._start_retrasmission(transaction, transaction.response)
+            self.send_datagram(transaction.response)
+
+    def notify(self, resource, response, exclude=()):
+        """
+        Send a notification of a relayed observation to the observers of a remote resource.
+
+        :param resource: the remote resource
+        :param response: the notification of the upstream server, None if it could not be reached
+        :param exclude: the (host, port, token) of the observers already given the notification
+        :return: the number of observers notified
+        """
+        observers = [transaction for transaction in self._observeLayer.notify(resource)
+                     if transaction.request.source + (transaction.request.token,) not in exclude]
+        if response is not None and response.code < defines.Codes.ERROR_LOWER_BOUND:
+            resource.observe_count += 1
+        for transaction in observers:
+            with transaction:
+                transaction.response.token = transaction.request.token
+                if response is None:
+                    transaction.response.code = defines.Codes.GATEWAY_TIMEOUT.number
+                    transaction.response.payload = None
+                    transaction.response.options = []
+                else:
+                    transaction.response.code = response.code
+                    transaction.response.payload = response.payload
+                    transaction.response.options = list(response.options)
+                transaction = self._observeLayer.send_response(transaction)
+                transaction = self._blockLayer.send_response(transaction)
+                transaction = self._messageLayer.send_response(transaction)
+                if transaction.response is not None:
+                    if transaction.response.type == defines.Types["CON"]:
+                        self._start_retrasmission(transaction, transaction.response)
+                    self.send_datagram(transaction.response)
+        return len(observers)
+
+    def remove_observer(self, transaction):
+        """
+        Remove the client of a transaction from the observers, when its observation can not be relayed.
+
+        :type transaction: Transaction
+        :param transaction: the transaction that owns the observe request
+        """
+        host, port = transaction.request.source
+        self._observeLayer.remove_observer(host, port, transaction.request.token)
+
     def send_datagram(self, message):
         """
         Send a message through the udp socket.
@@ -356,7 +406,7 @@ class CoAP(object):
         """
         if not self.stopped.isSet():
             host, port = message.destination
-            logger.debug("send_datagram - " + str(message))
+            logger.debug("send_datagram - %s", message)
             serializer = Serializer()
             message = serializer.serialize(message)
 
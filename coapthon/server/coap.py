@@ -1,8 +1,10 @@
+import errno
 import logging
 import random
 import socket
 import struct
 import threading
+import time
 
 from coapthon import defines
 from coapthon.layers.blocklayer import BlockLayer
@@ -15,6 +17,7 @@ from coapthon.messages.request import Request
 from coapthon.messages.response import Response
 from coapthon.resources.resource import Resource
 from coapthon.serializer import Serializer
+from coapthon.transaction import Transaction
 from coapthon.utils import Tree
 
 
@@ -28,7 +31,8 @@ class CoAP(object):
     """
     Implementation of the CoAP server
     """
-    def __init__(self, server_address, multicast=False, starting_mid=None, sock=None, cb_ignore_listen_exception=None):
+    def __init__(self, server_address, multicast=False, starting_mid=None, sock=None, cb_ignore_listen_exception=None,
+                 metrics=None, capture=None):
         """
         Initialize the server.
         :param server_address: Server address for incoming connections
@@ -36,6 +40,8 @@ class CoAP(object):
         :param starting_mid: used for testing purposes
         :param sock: if a socket has been created externally, it can be used directly
         :param cb_ignore_listen_exception: Callback function to handle exception raised during the socket listen operation
+        :param metrics: the Metrics collecting the timings of the layers, None to run without instrumentation
+        :param capture: the Capture recording the datagrams received and sent, None to run without capture
         """
         self.stopped = threading.Event()
         self.stopped.clear()
@@ -49,6 +55,12 @@ class CoAP(object):
         self._requestLayer = RequestLayer(self)
         self.resourceLayer = ResourceLayer(self)
 
+        self.capture = capture
+
+        self.metrics = metrics
+        if metrics is not None:
+            self._instrument(metrics)
+
         # Resource directory
         root = Resource('root', self, visible=False, observable=False, allow_children=False)
         root.path = '/'
@@ -119,6 +131,7 @@ class CoAP(object):
         while not self.stopped.isSet():
             self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
             self._messageLayer.purge()
+            self._blockLayer.purge()
 
     def listen(self, timeout=10):
         """
@@ -134,10 +147,15 @@ class CoAP(object):
             except socket.timeout:
                 continue
             except Exception as e:
+                if isinstance(e, socket.error) and e.errno == errno.EINTR:
+                    # interrupted by a signal handled by the process (e.g. saving the capture)
+                    continue
                 if self._cb_ignore_listen_exception is not None and callable(self._cb_ignore_listen_exception):
                     if self._cb_ignore_listen_exception(e, self):
                         continue
                 raise
+            if self.capture is not None:
+                self.capture.received(data, client_address)
             try:
                 serializer = Serializer()
                 message = serializer.deserialize(data, client_address)
@@ -152,7 +170,7 @@ class CoAP(object):
                     self.send_datagram(rst)
                     continue
 
-                logger.debug("receive_datagram - " + str(message))
+                logger.debug("receive_datagram - %s", message)
                 if isinstance(message, Request):
                     transaction = self._messageLayer.receive_request(message)
                     if transaction.request.duplicated and transaction.completed:
@@ -233,6 +251,85 @@ class CoAP(object):
                     self._start_retransmission(transaction, transaction.response)
                 self.send_datagram(transaction.response)
 
+    def _instrument(self, metrics):
+        """
+        Time the layers, the rendering of the resources and the sending of the datagrams and export the state of the
+        server. The layers are replaced by wrappers, so a server without metrics runs without any overhead.
+
+        :type metrics: Metrics
+        :param metrics: the metrics of the server
+        """
+        metrics.describe("coap_layer_seconds", "Time spent in each layer stage")
+        metrics.describe("coap_render_seconds", "Time spent rendering the requests, per resource type")
+        metrics.describe("coap_send_datagram_seconds", "Time spent serializing and sending the datagrams")
+        metrics.describe("coap_request_seconds", "Time spent handling the requests")
+        metrics.describe("coap_requests_total", "Requests handled")
+        metrics.describe("coap_errors_total", "Requests answered with an error")
+        metrics.describe("coap_retransmissions_total", "Retransmissions of confirmable messages")
+        metrics.describe("coap_observers", "Observe relations")
+        metrics.describe("coap_transactions", "Transactions kept by the message layer")
+        metrics.describe("coap_requests_in_flight", "Requests being handled")
+
+        stages = ("receive_request", "send_response", "receive_empty")
+        self._messageLayer = metrics.instrument(self._messageLayer, "coap_layer_seconds", stages,
+                                                (("layer", "message"),))
+        self._blockLayer = metrics.instrument(self._blockLayer, "coap_layer_seconds", stages,
+                                              (("layer", "block"),))
+        self._observeLayer = metrics.instrument(self._observeLayer, "coap_layer_seconds", stages,
+                                                (("layer", "observe"),))
+        self._requestLayer = metrics.instrument(self._requestLayer, "coap_layer_seconds", ("receive_request",),
+                                                (("layer", "request"),))
+        self.resourceLayer = metrics.instrument(self.resourceLayer, "coap_render_seconds",
+                                                ("get_resource", "update_resource", "create_resource",
+                                                 "delete_resource", "discover"), label=CoAP._resource_label)
+        self.send_datagram = metrics.timed("coap_send_datagram_seconds", self.send_datagram)
+        self.receive_request = self._measure_requests(metrics, self.receive_request)
+
+        metrics.gauge("coap_observers", lambda: len(self._observeLayer._relations))
+        metrics.gauge("coap_transactions", lambda: len(self._messageLayer._transactions))
+
+    @staticmethod
+    def _resource_label(args):
+        """
+        Label the rendering of a request with the type of the resource.
+
+        :param args: the arguments of the call to the resource layer
+        :return: the labels
+        """
+        transaction = args[0] if isinstance(args[0], Transaction) else args[1]
+        return ("resource", type(transaction.resource).__name__ if transaction.resource is not None else "None"),
+
+    @staticmethod
+    def _measure_requests(metrics, receive_request):
+        """
+        Wrap the handling of the requests, counting the requests, the errors and the requests in flight.
+
+        :param metrics: the metrics of the server
+        :param receive_request: the function handling the requests
+        :return: the wrapped function
+        """
+        in_flight = [0]
+        lock = threading.Lock()
+        metrics.gauge("coap_requests_in_flight", lambda: in_flight[0])
+
+        def measured(transaction):
+            with lock:
+                in_flight[0] += 1
+            start = time.time()
+            try:
+                receive_request(transaction)
+            finally:
+                metrics.observe("coap_request_seconds", (), time.time() - start)
+                with lock:
+                    in_flight[0] -= 1
+                code = defines.Codes.LIST.get(transaction.request.code)
+                metrics.inc("coap_requests_total", (("method", code.name if code is not None else "UNKNOWN"),))
+                response = transaction.response
+                if response is not None and response.code >= defines.Codes.ERROR_LOWER_BOUND:
+                    code = defines.Codes.LIST.get(response.code)
+                    metrics.inc("coap_errors_total", (("code", code.name if code is not None else "UNKNOWN"),))
+        return measured
+
     def send_datagram(self, message):
         """
         Send a message through the udp socket.
@@ -241,9 +338,11 @@ class CoAP(object):
         """
         if not self.stopped.isSet():
             host, port = message.destination
-            logger.debug("send_datagram - " + str(message))
+            logger.debug("send_datagram - %s", message)
             serializer = Serializer()
             message = serializer.serialize(message)
+            if self.capture is not None:
+                self.capture.sent(message, (host, port))
             if self.multicast:
                 self._unicast_socket.sendto(message, (host, port))
             else:
@@ -308,6 +407,8 @@ class CoAP(object):
                 if not message.acknowledged and not message.rejected and not self.stopped.isSet():
                     retransmit_count += 1
                     future_time *= 2
+                    if self.metrics is not None:
+                        self.metrics.inc("coap_retransmissions_total")
                     self.send_datagram(message)
 
             if message.acknowledged or message.rejected:
@@ -30,6 +30,7 @@ class Transaction(object):
 
         self.cacheHit = False
         self.cached_element = None
+        self.cache_revalidation = False
 
     def __enter__(self):
         self._lock.acquire()
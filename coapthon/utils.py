@@ -146,9 +146,86 @@ def create_logging():  # pragma: no cover
         f.writelines("datefmt=")
 
 
+class TreeNode(object):
+    """
+    Node of the resource Tree, one for each segment of a path.
+    """
+    __slots__ = ("children", "key", "value")
+
+    def __init__(self):
+        self.children = {}
+        self.key = None
+        self.value = None
+
+
 class Tree(object):
+    """
+    The resource directory of the server, indexed by path.
+    The paths are kept in a dictionary, for the exact lookups, and in a trie of path segments, so that the lookups of
+    the ancestors, the descendants and the longest registered prefix of a path only depend on the depth of the path.
+    The version is increased on every change of the registered resources, so that what is computed from the whole
+    directory (e.g. the .well-known/core document) can be cached until the next change.
+    """
     def __init__(self):
         self.tree = {}
+        self._root = TreeNode()
+        self.version = 0
+
+    def touch(self):
+        """
+        Mark the directory as changed (e.g. when the attributes of a registered resource change).
+        """
+        self.version += 1
+
+    @staticmethod
+    def _segments(path):
+        return [p for p in path.split("/") if p]
+
+    def _node(self, path):
+        node = self._root
+        for segment in self._segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def _ancestors(self, path):
+        """
+        Get the nodes of the registered paths that are prefixes of the given path (from the root to the deepest).
+
+        :param path: the path
+        :return: the list of nodes
+        """
+        node = self._root
+        ret = []
+        if node.key is not None:
+            ret.append(node)
+        for segment in self._segments(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.key is not None:
+                ret.append(node)
+        return ret
+
+    def _descendants(self, path):
+        """
+        Get the nodes of the registered paths in the subtree of the given path (including itself).
+
+        :param path: the path
+        :return: the list of nodes
+        """
+        node = self._node(path)
+        if node is None:
+            return []
+        ret = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                ret.append(node)
+            stack.extend(node.children.itervalues())
+        return ret
 
     def dump(self):
         """
@@ -159,30 +236,124 @@ class Tree(object):
         return self.tree.keys()
 
     def with_prefix(self, path):
-        ret = []
-        for key in self.tree.keys():
-            if path.startswith(key):
-                ret.append(key)
+        """
+        Get the registered paths that are a prefix (made of whole segments) of the given path.
 
+        :param path: the path
+        :return: the list of paths
+        """
+        ret = [node.key for node in self._ancestors(path)]
         if len(ret) > 0:
             return ret
         raise KeyError
 
     def with_prefix_resource(self, path):
-        ret = []
-        for key, value in self.tree.iteritems():
-            if path.startswith(key):
-                ret.append(value)
+        """
+        Get the resources whose paths are a prefix (made of whole segments) of the given path.
 
+        :param path: the path
+        :return: the list of resources
+        """
+        ret = [node.value for node in self._ancestors(path)]
         if len(ret) > 0:
             return ret
         raise KeyError
 
+    def longest_prefix(self, path):
+        """
+        Get the longest registered path that is a prefix of the given path.
+
+        :param path: the path
+        :return: the path and the resource
+        """
+        ret = self._ancestors(path)
+        if len(ret) > 0:
+            return ret[-1].key, ret[-1].value
+        raise KeyError
+
+    def subtree(self, path):
+        """
+        Get the registered paths of the subtree of the given path (including itself).
+
+        :param path: the path
+        :return: the list of paths
+        """
+        return [node.key for node in self._descendants(path)]
+
+    def subtree_resource(self, path):
+        """
+        Get the resources of the subtree of the given path (including itself).
+
+        :param path: the path
+        :return: the list of resources
+        """
+        return [node.value for node in self._descendants(path)]
+
+    def del_subtree(self, path):
+        """
+        Delete the given path and all its subtree.
+
+        :param path: the path
+        :return: the list of deleted paths
+        """
+        ret = self.subtree(path)
+        for key in ret:
+            del self.tree[key]
+        self.version += 1
+        segments = self._segments(path)
+        if not segments:
+            self._root = TreeNode()
+            return ret
+        parent = self._node("/".join(segments[:-1]))
+        if parent is not None:
+            parent.children.pop(segments[-1], None)
+            self._prune(segments[:-1])
+        return ret
+
+    def _prune(self, segments):
+        """
+        Remove the nodes without paths and without children along the given segments.
+        """
+        nodes = [self._root]
+        for segment in segments:
+            node = nodes[-1].children.get(segment)
+            if node is None:
+                return
+            nodes.append(node)
+        for i in range(len(segments), 0, -1):
+            node = nodes[i]
+            if node.key is not None or node.children:
+                return
+            del nodes[i - 1].children[segments[i - 1]]
+
+    def __contains__(self, item):
+        return item in self.tree
+
+    def __len__(self):
+        return len(self.tree)
+
     def __getitem__(self, item):
         return self.tree[item]
 
     def __setitem__(self, key, value):
+        node = self._root
+        for segment in self._segments(key):
+            child = node.children.get(segment)
+            if child is None:
+                child = TreeNode()
+                node.children[segment] = child
+            node = child
+        node.key = key
+        node.value = value
         self.tree[key] = value
+        self.version += 1
 
     def __delitem__(self, key):
         del self.tree[key]
+        self.version += 1
+        segments = self._segments(key)
+        node = self._node(key)
+        if node is not None and node.key == key:
+            node.key = None
+            node.value = None
+            self._prune(segments)
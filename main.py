@@ -3,14 +3,18 @@ from multiprocessing import Process
 
 import proxy.proxy_main as proxy
 import server.server_main as server
-from cloudcommunicators.register import register
+from cloudcommunicators.register import register, is_registered
 
-if not register():
+#
+# A Home Server already registered starts serving right away, with the
+# configurations it has, and registers on the cloud service in the background
+background_registration = is_registered()
+if not background_registration and not register():
     sys.exit(4)
 
 #
 ####### Initialize Home Server ########
-server_proc = Process(target=server.run_homeserver)
+server_proc = Process(target=server.run_homeserver, args=(background_registration,))
 server_proc.start()
 
 proxy.run_proxy()
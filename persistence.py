@@ -0,0 +1,115 @@
+"""
+    This is the Persistence File.
+    Here is specified the write-behind writer used to store the configuration
+    files of the Home Server (the configurations, the services and the server
+    configuration) without blocking the requests that change them. The
+    changes to the same file are coalesced and each file is replaced
+    atomically, so it is never left truncated or partially written.
+"""
+import os
+import time
+import logging
+import threading
+
+import settings
+
+__author__ = "Jose Requeijo Dias"
+
+logger = logging.getLogger("proxylog")
+
+def write_atomic(path, content):
+    """
+        This function writes content to the file at path atomically: it is
+        written and synced to a temporary file that is then renamed over it.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+class WriteBehind(object):
+    """
+        This is the Write Behind class.
+        It keeps, for each file, the function that produces its latest content
+        and a background thread writes them, delay seconds after the first
+        change, so that a burst of changes to a file is written only once.
+        The thread is started on the first change of each process (so that it
+        also works on the processes forked after this module is imported).
+        flush() writes the pending files right away, and it must be called
+        before the process exits.
+    """
+    def __init__(self, delay=0.2):
+        self.delay = float(delay)
+        self.pending = {}
+        self.condition = threading.Condition(threading.Lock())
+        self.write_lock = threading.Lock()
+        self.writer = None
+        self.pid = None
+        self.writes = 0
+        self.saves = 0
+
+    def start(self):
+        with self.condition:
+            if self.pid == os.getpid():
+                return
+            self.pending = {}
+            self.writer = threading.Thread(target=self.write_changes, name="FileWriter")
+            self.writer.daemon = True
+            self.pid = os.getpid()
+            self.writer.start()
+
+    def save(self, path, producer):
+        """
+            This method schedules the write of the file at path with the
+            content returned by producer (called on the writer thread, when
+            the file is written). It replaces any pending write of that file.
+        """
+        if self.pid != os.getpid():
+            self.start()
+        with self.condition:
+            self.saves += 1
+            self.pending[path] = producer
+            self.condition.notify()
+
+    def write_changes(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            # gives time for the changes that usually come together
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        """
+            This method writes all the pending files and returns the number of
+            files written.
+        """
+        with self.write_lock:
+            with self.condition:
+                pending, self.pending = self.pending, {}
+            for path, producer in pending.iteritems():
+                try:
+                    write_atomic(str(path), producer())
+                    self.writes += 1
+                    logger.info(str(path)+" file changes saved.")
+                except Exception as err:
+                    logger.error("Could not save "+str(path)+" file: "+str(err))
+            return len(pending)
+
+writer = WriteBehind(settings.PERSISTENCE_DELAY)
+
+def save(path, producer):
+    """
+        This function schedules the write of the file at path with the content
+        returned by producer, on the write-behind writer of the Home Server.
+    """
+    writer.save(path, producer)
+
+def flush():
+    """
+        This function writes the files with pending changes right away.
+    """
+    return writer.flush()
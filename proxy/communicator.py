@@ -3,6 +3,8 @@
     Here are specified the communicator class, used to interconnect proxy and CoAP server
     and a helper Response class, used to ease the management of CoAP responses
 """
+import threading
+
 from coapthon.client.helperclient import HelperClient
 from coapthon import defines
 from utils import AppError
@@ -13,12 +15,17 @@ class Communicator(object):
     """
         This represents a CoAP communicator. It is used to establish connections
         and send data to the CoAP server.
+        A persistent communicator keeps the same CoAP client (and socket) for all
+        its requests, sending one request at a time, instead of starting a new
+        client for each request.
     """
-    def __init__(self, host, port=5683):
+    def __init__(self, host, port=5683, persistent=False):
 
         self.host = host
         self.port = port
         self.client = None
+        self.persistent = persistent
+        self._lock = threading.Lock()
 
     def start(self):
         """
@@ -45,16 +52,7 @@ class Communicator(object):
             on the CoAP server. It waits timeout seconds to receive the response 
             to the get call.
         """
-        try:
-            self.start()
-            resp = self.client.get(path, timeout=timeout)
-        except:
-            self.stop()
-            raise AppError(504, "Connection Timeout. Home Server is down.")
-
-        self.stop()
-
-        return resp
+        return self._request("get", path, timeout=timeout)
 
     def post(self, path, payload, timeout=None):
         """
@@ -62,16 +60,8 @@ class Communicator(object):
             on the CoAP server with the payload JSON message. It waits timeout
             seconds to receive the response to the post call.
         """
-        try:
-            self.start()
-            resp = self.client.post(path, (defines.Content_types["application/json"],\
+        return self._request("post", path, (defines.Content_types["application/json"],\
                                         payload), timeout=timeout)
-        except:
-            self.stop()
-            raise AppError(504, "Connection Timeout. Home Server is down.")
-        self.stop()
-
-        return resp
 
     def put(self, path, payload="", timeout=None):
         """
@@ -79,16 +69,8 @@ class Communicator(object):
             on the CoAP server with the payload JSON message. It waits timeout
             seconds to receive the response to the put call.
         """
-        try:
-            self.start()
-            resp = self.client.put(path, (defines.Content_types["application/json"],\
+        return self._request("put", path, (defines.Content_types["application/json"],\
                                     payload), timeout=timeout)
-        except:
-            self.stop()
-            raise AppError(504, "Connection Timeout. Home Server is down.")
-        self.stop()
-
-        return resp
 
     def delete(self, path, timeout=None):
         """
@@ -96,15 +78,7 @@ class Communicator(object):
             on the CoAP server. It waits timeout seconds to receive the response
             to the delete call.
         """
-        try:
-            self.start()
-            resp = self.client.delete(path, timeout=timeout)
-        except:
-            self.stop()
-            raise AppError(504, "Connection Timeout. Home Server is down.")
-        self.stop()
-
-        return resp
+        return self._request("delete", path, timeout=timeout)
 
     def discover(self, path, timeout=None):
         """
@@ -112,15 +86,36 @@ class Communicator(object):
             on the CoAP server. It waits timeout seconds to receive the response
             to the discover call.
         """
-        try:
-            self.start()
-            resp = self.client.discover(path, timeout=timeout)
-        except:
+        return self._request("discover", path, timeout=timeout)
+
+    def _request(self, method, *args, **kwargs):
+        """
+            This method sends a request with the given method of the CoAP client,
+            starting (and stopping) a new client if the communicator is not persistent.
+        """
+        if not self.persistent:
+            try:
+                self.start()
+                resp = getattr(self.client, method)(*args, **kwargs)
+            except:
+                self.stop()
+                raise AppError(504, "Connection Timeout. Home Server is down.")
             self.stop()
-            raise AppError(504, "Connection Timeout. Home Server is down.")
-        self.stop()
 
-        return resp
+            return resp
+
+        with self._lock:
+            try:
+                if self.client is None:
+                    self.start()
+                return getattr(self.client, method)(*args, **kwargs)
+            except:
+                # a late response could be taken as the response of the next
+                # request, so the client is always replaced after an error
+                if self.client is not None:
+                    self.client.stop()
+                    self.client = None
+                raise AppError(504, "Connection Timeout. Home Server is down.")
 
     def get_response(self, data):
         """
@@ -1,14 +1,14 @@
 
 import json
 import sys
+import hmac
 import logging
-import threading
 import os
 import signal
 import time
 
 from functools import wraps
-from bottle import Bottle, run, request, response, abort, debug
+from bottle import Bottle, run, request, response, abort, debug, HTTPResponse
 
 
 my_dir = os.path.abspath(os.path.dirname(__file__))
@@ -16,8 +16,11 @@ sys.path.append(my_dir+"/../")
 sys.path.append(my_dir+"/../server/")
 
 from coapthon import defines
+from coapthon.metrics import Metrics
+from coapthon.profiler import SamplingProfiler
 
 import settings
+import persistence
 from communicator import Communicator
 from utils import AppError, coap2http_code
 
@@ -35,29 +38,62 @@ def log_to_logger(fn):
     def _log_to_logger(*args, **kwargs):
         actual_response = fn(*args, **kwargs)
         # modify this to log exactly what you need:
-        logger.info("From: %s - %s %s %s" % (request.remote_addr, request.method, request.url,\
-                                                response.status))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("From: %s - %s %s %s", request.remote_addr, request.method, request.url,\
+                                                response.status)
         return actual_response
     return _log_to_logger
 
 
+def measure_request(fn):
+    '''
+    Wrap a Bottle request so that its duration and its status are added to the proxy metrics.
+    '''
+    @wraps(fn)
+    def _measure_request(*args, **kwargs):
+        start = time.time()
+        status = 500
+        try:
+            actual_response = fn(*args, **kwargs)
+            status = response.status_code
+            return actual_response
+        except HTTPResponse as resp:
+            status = resp.status_code
+            raise
+        finally:
+            labels = (("method", request.method), ("route", request.route.rule))
+            proxy_metrics.observe("http_request_seconds", labels, time.time() - start)
+            proxy_metrics.inc("http_requests_total", labels + (("status", status),))
+            if status >= 500:
+                proxy_metrics.inc("http_errors_total", labels)
+    return _measure_request
+
+
 proxy = Bottle()
 proxy.install(log_to_logger)
 
+proxy_metrics = None
+if settings.METRICS_ENABLED:
+    proxy_metrics = Metrics()
+    proxy_metrics.describe("http_request_seconds", "Time spent handling the HTTP requests, per route")
+    proxy_metrics.describe("http_requests_total", "HTTP requests handled")
+    proxy_metrics.describe("http_errors_total", "HTTP requests answered with a server error")
+    proxy.install(measure_request)
+
 comm = Communicator(settings.COAP_ADDR, settings.COAP_PORT)
 
 def save_server_confs(new_name):
-    try:
-        f = open(settings.SERVER_CONFIG_FILE, "r")
-        data = json.load(f)
-        f.close()
-
+    """
+        This function schedules the update of the name of the Home Server on
+        its configuration file, written on the background (see persistence.py).
+    """
+    def server_confs():
+        with open(settings.SERVER_CONFIG_FILE, "r") as f:
+            data = json.load(f)
         data["name"] = new_name
-        f = open(settings.SERVER_CONFIG_FILE, "w")
-        json.dump(data, f)
-        f.close()
-    except Exception:
-        logger.error(Exception)
+        return json.dumps(data)
+
+    persistence.save(settings.SERVER_CONFIG_FILE, server_confs)
 #
 # ################  PROXY ENDPOINTS  ##################
 # ###### Server Root Endpoints########
@@ -106,8 +142,7 @@ def update_info():
                 if err_check is not None:
                     abort(err_check[0], err_check[1])
 
-                update_file_thr = threading.Thread(target=save_server_confs, args=(data["name"],))
-                update_file_thr.start()
+                save_server_confs(data["name"])
 
                 return send_response(resp.payload, resp.code)
             except KeyError as err:
@@ -121,6 +156,67 @@ def update_info():
     else:
         abort(415, "Request body content format not json")
 
+#
+### Server Metrics Endpoint ###
+@proxy.get("/metrics")
+def get_metrics():
+    if proxy_metrics is None:
+        abort(404, "Metrics are disabled")
+
+    try:
+        resp = comm.get("/metrics", timeout=settings.COMM_TIMEOUT)
+        resp = comm.get_response(resp)
+        server_metrics = resp.payload if resp.code < defines.Codes.ERROR_LOWER_BOUND else ""
+    except Exception:
+        # the metrics of the proxy are still useful when the Home Server is down
+        server_metrics = ""
+
+    response.set_header("Content-Type", "text/plain; version=0.0.4")
+    return (server_metrics or "") + proxy_metrics.render()
+
+#
+### Profiler Endpoint ###
+@proxy.get("/profile")
+def get_profile():
+    token = request.headers.get("X-Admin-Token", "")
+    if not settings.PROFILER_ADMIN_TOKEN or not hmac.compare_digest(token, settings.PROFILER_ADMIN_TOKEN):
+        abort(403, "Profiling is restricted to the administrator")
+
+    try:
+        seconds = min(float(request.query.get("seconds", 5)), defines.PROFILER_MAX_DURATION)
+    except ValueError:
+        abort(400, "The seconds of the profile must be a number")
+    output = request.query.get("format", "collapsed")
+    if output not in ("collapsed", "report"):
+        abort(400, "The format of the profile must be collapsed or report")
+    target = request.query.get("target", "server")
+
+    if target == "proxy":
+        profiler = SamplingProfiler().profile(seconds)
+        if profiler is None:
+            abort(503, "A profile is already being taken")
+        profile = profiler.render(output)
+    elif target == "server":
+        try:
+            resp = comm.get("/profile?seconds="+str(seconds)+"&format="+output,\
+                                                timeout=seconds+settings.COMM_TIMEOUT)
+        except AppError as err:
+            abort(err.code, err.msg)
+        except:
+            abort(500, "Unknown Proxy fatal error")
+
+        resp = comm.get_response(resp)
+
+        err_check = check_error_response(resp)
+        if err_check is not None:
+            abort(err_check[0], err_check[1])
+        profile = resp.payload
+    else:
+        abort(400, "The target of the profile must be server or proxy")
+
+    response.set_header("Content-Type", "text/plain")
+    return profile
+
 #
 ### Server Services Endpoints ###
 @proxy.get("/services")
@@ -179,6 +275,26 @@ def update_server_services():
             abort(400, "Request body formated in json is missing")
     else:
         abort(415, "Request body content format not json")
+
+@proxy.get("/services/<service_id:int>/devices")
+def get_service_devices(service_id):
+    if request.headers["accept"] != "application/json" and request.headers["accept"] != "*/*":
+        abort(406, "Could not satisfy the request Accept header")
+
+    try:
+        resp = comm.get("/services/"+str(service_id)+"/devices", timeout=settings.COMM_TIMEOUT)
+    except AppError as err:
+        abort(err.code, err.msg)
+    except:
+        abort(500, "Unknown Proxy fatal error")
+
+    resp = comm.get_response(resp)
+
+    err_check = check_error_response(resp)
+    if err_check is not None:
+        abort(err_check[0], err_check[1])
+
+    return send_response(resp.payload, resp.code)
 #
 ### Server Configs Endpoints ###
 @proxy.get("/configs")
@@ -246,6 +362,63 @@ def update_server_configurations():
     else:
         abort(415, "Request body content format not json")
 
+@proxy.put("/configs/<c_type>/<config_id:int>")
+def upsert_server_configuration(c_type, config_id):
+    if request.headers["accept"] != "application/json" and request.headers["accept"] != "*/*":
+        abort(406, "Could not satisfy the request Accept header")
+
+    if request.headers["content-type"] == "application/json":
+        try:
+            body = request.json
+        except:
+            abort(400, "Request body not properly json formated")
+
+        if not isinstance(body, dict):
+            abort(400, "Request body formated in json is missing")
+        if c_type not in ["SCALAR_TYPES", "ENUM_TYPES", "PROPERTY_TYPES", "DEVICE_TYPES"]:
+            abort(400, "Config type must be one of SCALAR_TYPES, ENUM_TYPES, PROPERTY_TYPES or DEVICE_TYPES")
+
+        body["id"] = config_id
+        try:
+            resp = comm.post("/configs?type="+str(c_type), json.dumps(body),\
+                                                    timeout=settings.COMM_TIMEOUT)
+            resp = comm.get_response(resp)
+        except AppError as err:
+            abort(err.code, err.msg)
+        except:
+            abort(500, "Unknown Proxy fatal error")
+
+        err_check = check_error_response(resp)
+        if err_check is not None:
+            abort(err_check[0], err_check[1])
+
+        return send_response(resp.payload, resp.code)
+    else:
+        abort(415, "Request body content format not json")
+
+@proxy.delete("/configs/<c_type>/<config_id:int>")
+def delete_server_configuration(c_type, config_id):
+    if request.headers["accept"] != "application/json" and request.headers["accept"] != "*/*":
+        abort(406, "Could not satisfy the request Accept header")
+
+    if c_type not in ["SCALAR_TYPES", "ENUM_TYPES", "PROPERTY_TYPES", "DEVICE_TYPES"]:
+        abort(400, "Config type must be one of SCALAR_TYPES, ENUM_TYPES, PROPERTY_TYPES or DEVICE_TYPES")
+
+    try:
+        resp = comm.delete("/configs?type="+str(c_type)+"&id="+str(config_id),\
+                                                    timeout=settings.COMM_TIMEOUT)
+        resp = comm.get_response(resp)
+    except AppError as err:
+        abort(err.code, err.msg)
+    except:
+        abort(500, "Unknown Proxy fatal error")
+
+    err_check = check_error_response(resp)
+    if err_check is not None:
+        abort(err_check[0], err_check[1])
+
+    return send_response(resp.payload, resp.code)
+
 #
 # ###### Devices List Endpoints########
 @proxy.get("/devices")
@@ -504,6 +677,7 @@ def check_error_response(response):
 @proxy.error(415)
 @proxy.error(500)
 @proxy.error(502)
+@proxy.error(503)
 @proxy.error(504)
 def errorHandler(error):
     return send_response(json.dumps({"error_code": error.status_code, "error_msg": error.body}))
@@ -518,6 +692,7 @@ def run_proxy():
         run(proxy, host=settings.COAP_ADDR, port=settings.PROXY_PORT, quiet=settings.QUIET)
     finally:
         logger.info("Shutting down proxy")
+        persistence.flush()
         logger.info("Proxy is down")
         sys.exit()
 
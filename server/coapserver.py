@@ -8,16 +8,23 @@ import threading
 import copy
 
 from coapthon.server.coap import CoAP
+from coapthon.metrics import Metrics
+from coapthon.capture import Capture
 from coapthon import defines
 
 from server.idgenerator import IDGenerator
 from server.homeserverinfo import HomeServerInfo
+from server.homeservermetrics import HomeServerMetrics
+from server.homeserverprofiler import HomeServerProfiler
 from server.devices import DevicesList, DeviceState
 from server.services import HomeServerServices
 from server.serverconfigs import HomeServerConfigs
 
+import utils
 import settings
+import persistence
 import cloudcommunicators.mhouse_comm as cloud_comm
+from cloudcommunicators.bulksync import bulk_sync
 
 __author__ = "Jose Requeijo Dias"
 
@@ -38,13 +45,20 @@ class CoAPServer(CoAP):
         self.coapport = settings.COAP_PORT
         self.multicast = settings.COAP_MULTICAST
 
-        self.proxyaddress = settings.PROXY_ADDR
+        self._proxyaddress = None
         self.proxyport = settings.PROXY_PORT
 
         self.timeout = settings.HOME_SERVER_TIMEOUT
 
+        # cleared while the Home Server is registered in background (see on_registered)
+        self.registered = threading.Event()
+        self.registered.set()
+
         logger.info("Starting CoAP Server...")
-        CoAP.__init__(self, (self.coapaddress, self.coapport), self.multicast)
+        metrics = Metrics() if settings.METRICS_ENABLED else None
+        capture = Capture(settings.CAPTURE_SIZE) if settings.CAPTURE_SIZE > 0 else None
+        CoAP.__init__(self, (self.coapaddress, self.coapport), self.multicast, metrics=metrics,\
+                        capture=capture)
 
         self.info = HomeServerInfo(self)
 
@@ -53,6 +67,15 @@ class CoAPServer(CoAP):
         self.services = HomeServerServices(self)
         self.configs = HomeServerConfigs(self)
 
+        if metrics is not None:
+            metrics.describe("homeserver_devices", "Devices registered on the Home Server")
+            metrics.describe("homeserver_outbox_pending", "Cloud events waiting on the outbox")
+            metrics.gauge("homeserver_devices", lambda: len(self.devices.devices))
+            metrics.gauge("homeserver_outbox_pending", cloud_comm.outbox.pending)
+            self.metrics_resource = HomeServerMetrics(self, metrics)
+
+        self.profiler = HomeServerProfiler(self)
+
         logger.info("CoAP Server start on " + self.coapaddress + ":" + str(self.coapport))
         logger.info(self.root.dump())
     
@@ -128,6 +151,8 @@ class CoAPServer(CoAP):
                 if not message.acknowledged and not message.rejected and not self.stopped.isSet():
                     retransmit_count += 1
                     future_time *= 2
+                    if self.metrics is not None:
+                        self.metrics.inc("coap_retransmissions_total")
                     self.send_datagram(message)
 
             if message.acknowledged or message.rejected:
@@ -138,7 +163,7 @@ class CoAPServer(CoAP):
                 if message.observe is not None:
                     self._observeLayer.remove_subscriber(message)
 
-                    for d in self.devices.devices.itervalues():
+                    for d in self.devices.devices.values():
                         if transaction.request.source[0] == d.address:
                             d.delete()
                             transaction.resource.deleted = True
@@ -247,10 +272,72 @@ class CoAPServer(CoAP):
                                                     args=(self,))
             sendServerAlive_t.start()
 
+            outbox_t = threading.Thread(target=cloud_comm.run_outbox_worker, args=(self,))
+            outbox_t.start()
+
+            sync_t = threading.Thread(target=bulk_sync.run_startup_sync, args=(self,))
+            sync_t.start()
+
             self.listen(10)
         except KeyboardInterrupt:
             self.shutdown()
 
+    def save_capture(self):
+        """
+            This method writes the traffic capture of the Home Server CoAP server
+            (the last datagrams received and sent) to 'settings.CAPTURE_FILE'.
+        """
+        if self.capture is None:
+            return
+        try:
+            records = self.capture.save(settings.CAPTURE_FILE)
+            logger.info("Capture of %s datagrams saved to %s", records, settings.CAPTURE_FILE)
+        except (IOError, OSError) as err:
+            logger.error("Unable to save the capture: %s", err)
+
+    @property
+    def proxyaddress(self):
+        """
+            This property returns the public address of the proxy, resolved
+            when it is first known: the one on the settings, the last one found
+            (see utils.get_my_ip) or the one registered on the cloud service.
+            It is None while none of them is known.
+        """
+        if self._proxyaddress is None:
+            self._proxyaddress = settings.PROXY_ADDR or\
+                                 utils.get_cached_ip(settings.ADDRESSES_CACHE_FILE, public=True) or\
+                                 getattr(settings, "HOME_SERVER_PROXY_ADDRESS", None)
+        return self._proxyaddress
+
+    def reload_configs(self):
+        """
+            This method reloads the configurations and the services of the
+            Home Server from their configuration files (e.g. after they are
+            refreshed from the cloud service) and notifies their observers,
+            and the observers of its information.
+        """
+        self.configs.reload_from_files()
+        self.configs.payload = self.configs.get_payload()
+        self.notify(self.configs)
+
+        self.services.load_services_from_file()
+        self.services.payload = self.services.get_payload()
+        self.notify(self.services)
+
+        # the address of the proxy may only be known after the registration
+        self.info.payload = self.info.get_payload()
+        self.notify(self.info)
+
+    def on_registered(self):
+        """
+            This method is called when the Home Server registration in background
+            (see cloudcommunicators.register.register_in_background) succeeds.
+            It reloads the configurations and lets the devices be synchronized
+            with the cloud service.
+        """
+        self.reload_configs()
+        self.registered.set()
+
     def shutdown(self):
         """
             This method shuts down the Home Server CoAP server
@@ -258,6 +345,7 @@ class CoAPServer(CoAP):
         """
         logger.info("Shutting down server")
         self.close()
+        persistence.flush()
         logger.info("Server is down")
         sys.exit(0)
 
@@ -8,6 +8,7 @@
 """
 import json
 import thread
+import threading
 import os.path
 import logging
 import copy
@@ -127,14 +128,11 @@ class Device(Resource):
             CoAP representation and all its sub-endpoints/childrens CoAP representations,
             'deleting' the full device from this server
         """
-        logger.debug("Deleting device "+str(self.id))
-        self.device_type.delete()
-        self.state.delete()
-        self.services.delete()
-
+        logger.debug("Deleting device %s", self.id)
         self.devices_list.remove_device(self.id)
 
-        del self.server.root[self.root_uri]
+        # deletes the device and its state, type and services endpoints
+        self.server.root.del_subtree(self.root_uri)
         return True
 
     def update_all_info(self, data):
@@ -173,8 +171,19 @@ class Device(Resource):
         # services of the device
         self.services = DeviceServicesResource(self)
 
+        self.server.configs.link_device(self)
+
         self.last_access = time.time()
 
+    def revalidate_device_type(self):
+        """
+            This method updates the device type of the device and revalidates
+            its state after the configuration of its device type changed.
+        """
+        self.device_type.type = self.server.configs.device_types[int(self.device_type_id)]
+        if self.state.revalidate():
+            self.server.notify(self.state)
+
     ## CoAP Methods
     def render_GET_advanced(self, request, response):
         if request.accept != defines.Content_types["application/json"] and request.accept != None:
@@ -255,6 +264,9 @@ class DevicesList(Resource):
         self.server.add_resource(self.root_uri, self)
         self.construct_devices_list(devices)
 
+        # the requests are handled on concurrent threads
+        self.lock = threading.Lock()
+
         self.res_content_type = "application/json"
         self.payload = self.get_payload()
 
@@ -303,19 +315,21 @@ class DevicesList(Resource):
             and it must be a dictionary representing the device (with the device
             informations)
         """
-        existing_dev = self.check_existing_device(address)
-        if existing_dev is not None:
-            raise AppError(defines.Codes.BAD_REQUEST, "Device with address ("+address\
-                                                        +") already exists with ID ("+\
-                                                        str(existing_dev)+")")
-        else:
-            device_id = self.server.id_gen.new_device_id()
+        with self.lock:
+            existing_dev = self.check_existing_device(address)
+            if existing_dev is not None:
+                raise AppError(defines.Codes.BAD_REQUEST, "Device with address ("+address\
+                                                            +") already exists with ID ("+\
+                                                            str(existing_dev)+")")
+            else:
+                device_id = self.server.id_gen.new_device_id()
 
-        #alterar a criacao do Device pondo todos os campos
-        res = Device(self, device_id, name=device["name"],\
-                     address=address, port=port, type_id=device["device_type"],\
-                     services=device["services"], timeout=device["timeout"])
-        self.devices[device_id] = res
+            #alterar a criacao do Device pondo todos os campos
+            res = Device(self, device_id, name=device["name"],\
+                         address=address, port=port, type_id=device["device_type"],\
+                         services=device["services"], timeout=device["timeout"])
+            self.devices[device_id] = res
+            self.server.configs.link_device(res)
 
         return res
 
@@ -329,7 +343,9 @@ class DevicesList(Resource):
             full device use the 'delete' method on the Device CoAP representation, which
             by itself calls this method to remove the device from the list of devices.
         """
-        self.devices.pop(device_id)
+        device = self.devices.pop(device_id)
+        self.server.configs.unlink_device(device_id)
+        self.server.services.unsubscribe(device_id, device.services.services)
         return True
 
     def get_devices_list(self):
@@ -372,7 +388,7 @@ class DevicesList(Resource):
             raise AppError(defines.Codes.BAD_REQUEST,\
                             "Invalid IP address ("+str(device_address)+")")
 
-        for d in self.devices.itervalues():
+        for d in self.devices.values():
             if d.address == device_address:
                 d.last_access = time.time()
                 return d.id
@@ -391,7 +407,7 @@ class DevicesList(Resource):
             try:
                 now = time.time()
                 del_marked = []
-                for d in self.devices.itervalues():
+                for d in self.devices.values():
                     if (now-d.timeout) > d.last_access:
                         comm = Communicator(d.address)
                         try:
@@ -399,13 +415,13 @@ class DevicesList(Resource):
                             d.last_access = time.time()
                         except:
                             comm.stop()
-                            logger.debug("Device ("+str(d.id)+") is down")
+                            logger.debug("Device (%s) is down", d.id)
                             del_marked.append(d)
-                            logger.debug("Device ("+str(d.id)+") marked for deletion")
+                            logger.debug("Device (%s) marked for deletion", d.id)
 
                 for d in del_marked:
                     d.delete()
-                    logger.debug("Device ("+str(d.id)+") Deleted")
+                    logger.debug("Device (%s) Deleted", d.id)
             except Exception as e:
                 logger.error(e.message)
 
@@ -417,7 +433,7 @@ class DevicesList(Resource):
             return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
                                     "Could not satisfy the request Accept header")
 
-        for d in self.devices.itervalues():
+        for d in self.devices.values():
             if d.address == str(request.source[0]):
                 d.last_access = time.time()
 
@@ -548,6 +564,38 @@ class DeviceState(Resource):
             ret[p["name"]] = p["value"]
 
         return ret
+    def revalidate(self):
+        """
+            This method revalidates the current and wanted states of the device
+            against its device type, after its configuration changed: the
+            properties no longer on the type are dropped, the new ones get their
+            default value and so do the ones whose value is no longer valid.
+            It returns True if the state changed.
+        """
+        properties = self.device.device_type.type.properties
+        changed = False
+        for name in ["state", "wanted_state"]:
+            old = dict((p["property_id"], p) for p in getattr(self, name))
+            new = []
+            for prop in properties:
+                p = old.get(prop.id)
+                if p is not None and prop.validate(p["value"]):
+                    value = p["value"]
+                else:
+                    value = prop.default_value
+                rep = {"property_id": prop.id, "name": prop.name, "value": value,\
+                        "type": prop.valuetype_class}
+                if rep != p:
+                    changed = True
+                new.append(rep)
+            if len(new) != len(old):
+                changed = True
+            setattr(self, name, new)
+
+        if changed:
+            self.payload = self.get_payload()
+        return changed
+
     def change_state(self, new_state):
         """
             This method updates the state of a given device.
@@ -810,12 +858,12 @@ class DeviceServicesResource(Resource):
 
         device.server.add_resource(self.root_uri, self)
 
-        self.services = device.services_aux
-        del device.services_aux
-
         ### CoAP Resource Data ###
         self.res_content_type = "application/json"
-        self.payload = self.get_payload()
+
+        self.services = []
+        self.set_services(device.services_aux)
+        del device.services_aux
 
         self.resource_type = "DeviceServices"
         self.interface_type = "if1"
@@ -845,20 +893,30 @@ class DeviceServicesResource(Resource):
     def get_services(self):
         """
             This method returns the list of services subscribed by the device.
-            It auto-updates where some service is removed from the server and is
-            no longer supported by it, so the devices cannot use it anymore.
+            The services removed from the server are removed from this list
+            when they are removed (see HomeServerServices.prune_subscriptions),
+            so the devices cannot use them anymore.
         """
-        aux = self.services
-        for s in aux:
-            if int(s) not in self.device.server.services.services.keys():
-                self.services.remove(s)
-
         return self.services
 
+    def set_services(self, service_ids):
+        """
+            This method replaces the services subscribed by the device (the
+            ones not present on the server are left out), updating the
+            subscriptions of the server services.
+        """
+        server_services = self.device.server.services
+        with server_services.lock:
+            server_services.unsubscribe(self.device.id, self.services)
+            self.services = [int(s) for s in service_ids if int(s) in server_services.services]
+            server_services.subscribe(self.device.id, self.services)
+        self.payload = self.get_payload()
+
     def delete(self):
         """
             This method deletes the services CoAP representation from the server.
         """
+        self.device.server.services.unsubscribe(self.device.id, self.services)
         del self.device.server.root[self.root_uri]
         return True
 
@@ -888,10 +946,7 @@ class DeviceServicesResource(Resource):
 
             try:
                 if self.device.server.services.validate_services(body):
-                    del self.services
-                    self.services = []
-                    for n in body:
-                        self.services.append(int(n))
+                    self.set_services(body)
                 else:
                     return error(self, response, defines.Codes.BAD_REQUEST,\
                                     "Services provided are not valid")
@@ -0,0 +1,54 @@
+"""
+    This is the Home Server Metrics File.
+    Here is specified the CoAP resource that represents the endpoint (URI)
+    where the metrics of the home server (latency histograms of the CoAP
+    layers and of the resources, requests, errors, observers...) can be fetched
+    in the Prometheus text format.
+"""
+import logging
+
+from coapthon import defines
+from coapthon.resources.resource import Resource
+
+from utils import status, error
+
+__author__ = "Jose Requeijo Dias"
+
+logger = logging.getLogger(__name__)
+
+class HomeServerMetrics(Resource):
+    """
+        This is the Home Server Metrics CoAP resource.
+        It represents the endpoint (URI) where the metrics collected by
+        the home server can be fetched.
+    """
+    def __init__(self, server, metrics):
+
+        super(HomeServerMetrics, self).__init__("HomeServerMetrics", server, visible=True,
+                                                observable=False, allow_children=False)
+
+        self.server = server
+        self.metrics = metrics
+        self.root_uri = "/metrics"
+
+        self.server.add_resource(self.root_uri, self)
+
+        self.res_content_type = "text/plain"
+        self.payload = self.get_payload()
+
+        self.resource_type = "HomeServerMetrics"
+        self.interface_type = "if1"
+
+    def get_payload(self):
+        """
+            This method returns a valid CoAPthon payload representation
+            with the metrics in the Prometheus text format.
+        """
+        return (defines.Content_types[self.res_content_type], self.metrics.render())
+
+    def render_GET_advanced(self, request, response):
+        if request.accept != defines.Content_types["text/plain"] and request.accept != None:
+            return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
+                                    "Could not satisfy the request Accept header")
+        self.payload = self.get_payload()
+        return status(self, response, defines.Codes.CONTENT)
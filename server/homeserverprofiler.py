@@ -0,0 +1,70 @@
+"""
+    This is the Home Server Profiler File.
+    Here is specified the CoAP resource that represents the endpoint (URI)
+    where the home server can be profiled on demand: a GET samples the stacks
+    of all its threads during some seconds and returns the aggregated stacks.
+    It only answers requests made from the machine of the home server.
+"""
+import logging
+import urlparse
+
+from coapthon import defines
+from coapthon.profiler import SamplingProfiler
+from coapthon.resources.resource import Resource
+
+from utils import status, error
+
+__author__ = "Jose Requeijo Dias"
+
+logger = logging.getLogger(__name__)
+
+class HomeServerProfiler(Resource):
+    """
+        This is the Home Server Profiler CoAP resource.
+        It represents the endpoint (URI) where a profile of the home
+        server can be taken. The query can specify the seconds of the
+        profile (seconds=5) and its format (format=collapsed or report).
+    """
+    def __init__(self, server):
+
+        super(HomeServerProfiler, self).__init__("HomeServerProfiler", server, visible=False,
+                                                 observable=False, allow_children=False)
+
+        self.server = server
+        self.root_uri = "/profile"
+
+        self.server.add_resource(self.root_uri, self)
+
+        self.res_content_type = "text/plain"
+
+        self.resource_type = "HomeServerProfiler"
+        self.interface_type = "if1"
+
+    def render_GET_advanced(self, request, response):
+        if request.accept != defines.Content_types["text/plain"] and request.accept != None:
+            return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
+                                    "Could not satisfy the request Accept header")
+
+        if str(request.source[0]) not in ("127.0.0.1", "::1", self.server.coapaddress):
+            return error(self, response, defines.Codes.FORBIDDEN,\
+                            "The server can only be profiled from its own machine")
+
+        query = urlparse.parse_qs(request.uri_query)
+        try:
+            seconds = float(query.get("seconds", ["5"])[0])
+        except ValueError:
+            return error(self, response, defines.Codes.BAD_REQUEST,\
+                            "The seconds of the profile must be a number")
+        output = query.get("format", ["collapsed"])[0]
+        if output not in ("collapsed", "report"):
+            return error(self, response, defines.Codes.BAD_REQUEST,\
+                            "The format of the profile must be collapsed or report")
+
+        logger.info("Profiling the Home Server for %s seconds", seconds)
+        profiler = SamplingProfiler().profile(seconds)
+        if profiler is None:
+            return error(self, response, defines.Codes.SERVICE_UNAVAILABLE,\
+                            "A profile is already being taken")
+
+        self.payload = (defines.Content_types[self.res_content_type], profiler.render(output))
+        return status(self, response, defines.Codes.CONTENT)
@@ -3,6 +3,7 @@ import sys
 import os
 import logging
 import signal
+import threading
 
 my_dir = os.path.abspath(os.path.dirname(__file__))
 sys.path.append(my_dir+"/../")
@@ -11,20 +12,41 @@ sys.path.append(my_dir+"/../proxy/")
 import settings
 
 from coapserver import CoAPServer
+from cloudcommunicators.register import load_server_confs, register_in_background
 
 logging.config.fileConfig(settings.LOGGING_CONFIG_FILE, disable_existing_loggers=False)
 logger = logging.getLogger(__name__)
 
-def run_homeserver():
+def run_homeserver(background_registration=False):
+    """
+        This function runs the Home Server. With background_registration (for a
+        Home Server already registered) it starts serving with the configurations
+        it has while it registers on the cloud service and refreshes them.
+    """
     logger.info("Starting Home Server...")
     try:
         f = open(settings.SERVER_CONFIG_FILE, "r")
         server_conf = json.load(f)
+        if background_registration:
+            load_server_confs()
     except IOError:
         logger.error("ERROR: Unable to open server configuration file. Server probably not registed.")
         sys.exit()
+    except KeyError as err:
+        logger.error("Home Server configurations file improperly setted. "+str(err)+" is missing.")
+        sys.exit()
 
     server = CoAPServer(server_conf["id"], server_conf["name"])
+    if server.capture is not None:
+        # kill -USR1 <pid> saves the traffic capture
+        signal.signal(signal.SIGUSR1, lambda signum, frame: server.save_capture())
+        signal.siginterrupt(signal.SIGUSR1, False)
+    if background_registration:
+        server.registered.clear()
+        register_t = threading.Thread(target=register_in_background,
+                                      args=(server.stopped, server.on_registered))
+        register_t.daemon = True
+        register_t.start()
     server.start()
 
 if __name__ == "__main__":
@@ -6,12 +6,14 @@
 """
 import json
 import logging
+import threading
 
 from coapthon import defines
 from coapthon.resources.resource import Resource
 
 from utils import status, error, check_on_body, AppError, AppHTTPError
 import settings
+import persistence
 
 __author__ = "Jose Requeijo Dias"
 
@@ -263,6 +265,10 @@ class HomeServerConfigs(Resource):
         self.device_types = {}
         self.load_device_types_from_file()
 
+        # the configurations are updated on concurrent threads
+        self.lock = threading.RLock()
+        self.build_graph()
+
         self.server.add_resource(self.root_uri, self)
 
         self.res_content_type = "application/json"
@@ -410,58 +416,40 @@ class HomeServerConfigs(Resource):
             This is an auxiliary method that saves to the correspondent configuration
             file, pointed by 'settings.DEVICE_TYPES_CONFIG_FILE', all
             the Device Type Configurations present on this resource.
+            The file is written on the background (see persistence.py).
         """
-        try:
-            fp = open(str(settings.DEVICE_TYPES_CONFIG_FILE), "w")
-
-            data = self.get_all_device_types()
-
-            logger.info("Saving "+str(settings.DEVICE_TYPES_CONFIG_FILE)+" file...")
-            json.dump(data, fp)
-            fp.close()
+        persistence.save(settings.DEVICE_TYPES_CONFIG_FILE,\
+                        lambda: self.dump_configs(self.get_all_device_types))
 
-            logger.info(str(settings.DEVICE_TYPES_CONFIG_FILE)+" file changes saved.")
-        except:
-            logger.info("FILE: "+str(settings.DEVICE_TYPES_CONFIG_FILE)+" not found")
-    
     def save_property_types_to_file(self):
         """
             This is an auxiliary method that saves to the correspondent configuration
             file, pointed by 'settings.PROPERTY_TYPES_CONFIG_FILE', all
             the Property Type Configurations present on this resource.
+            The file is written on the background (see persistence.py).
         """
-        try:
-            fp = open(str(settings.PROPERTY_TYPES_CONFIG_FILE), "w")
-
-            data = self.get_all_property_types()
-
-            logger.info("Saving "+str(settings.PROPERTY_TYPES_CONFIG_FILE)+" file...")
-            json.dump(data, fp)
-            fp.close()
+        persistence.save(settings.PROPERTY_TYPES_CONFIG_FILE,\
+                        lambda: self.dump_configs(self.get_all_property_types))
 
-            logger.info(str(settings.PROPERTY_TYPES_CONFIG_FILE)+" file changes saved.")
-        except:
-            logger.info("FILE: "+str(settings.PROPERTY_TYPES_CONFIG_FILE)+" not found")
-    
     def save_value_types_to_file(self):
         """
             This is an auxiliary method that saves to the correspondent configuration
             file, pointed by 'settings.VALUE_TYPES_CONFIG_FILE', all
             the Value Types Configurations (Scalar and Enumerated Types) present on
             this resource.
+            The file is written on the background (see persistence.py).
         """
-        try:
-            fp = open(str(settings.VALUE_TYPES_CONFIG_FILE), "w")
+        persistence.save(settings.VALUE_TYPES_CONFIG_FILE,\
+                        lambda: self.dump_configs(lambda: self.get_all_value_types()["VALUE_TYPES"]))
 
-            data = self.get_all_value_types()["VALUE_TYPES"]
-
-            logger.info("Saving "+str(settings.VALUE_TYPES_CONFIG_FILE)+" file...")
-            json.dump(data, fp)
-            fp.close()
-
-            logger.info(str(settings.VALUE_TYPES_CONFIG_FILE)+" file changes saved.")
-        except:
-            logger.info("FILE: "+str(settings.VALUE_TYPES_CONFIG_FILE)+" not found")
+    def dump_configs(self, get_configs):
+        """
+            This is an auxiliary method that returns the JSON representation of
+            the configurations returned by get_configs, taken while no other
+            thread is changing them.
+        """
+        with self.lock:
+            return json.dumps(get_configs())
 
     def validate_device_type(self, type_id):
         """
@@ -538,6 +526,175 @@ class HomeServerConfigs(Resource):
             data["ENUM_TYPES"].append(enum.get_info())
         return data
 
+    def build_config(self, c_type, ele):
+        """
+            This method builds the configuration object of type c_type (one of:
+            DEVICE_TYPES, PROPERTY_TYPES, SCALAR_TYPES or ENUM_TYPES) described by
+            the dictionary ele, with the configurations it depends on present on
+            this CoAP resource. It raises an AppError if it is not valid.
+        """
+        try:
+            id = int(ele["id"])
+            name = str(ele["name"])
+            if c_type == "SCALAR_TYPES":
+                return ScalarValueType(id, name, str(ele["units"]), float(ele["min_value"]),\
+                                        float(ele["max_value"]), float(ele["step"]),\
+                                        float(ele["default_value"]))
+            if c_type == "ENUM_TYPES":
+                if not isinstance(ele["choices"], dict):
+                    raise ValueError
+                return EnumValueType(id, name, ele["choices"], str(ele["default_value"]))
+            if c_type == "PROPERTY_TYPES":
+                return PropertyType(self, id, name, str(ele["access_mode"]),\
+                                    str(ele["value_type_class"]), int(ele["value_type_id"]))
+            if c_type == "DEVICE_TYPES":
+                if not isinstance(ele["properties"], list):
+                    raise ValueError
+                for p in ele["properties"]:
+                    if int(p) not in self.property_types:
+                        raise ValueError
+                return DeviceType(self, id, name, ele["properties"])
+        except:
+            raise AppError(defines.Codes.BAD_REQUEST,\
+                        "List of "+str(c_type)+" improperly formated")
+        raise AppError(defines.Codes.BAD_REQUEST,\
+                    "Config type must be one of: DEVICE_TYPES, PROPERTY_TYPES, SCALAR_TYPES or ENUM_TYPES")
+
+    def get_configs_of_type(self, c_type):
+        """
+            This method returns the dictionary (by ID) with the configurations
+            of type c_type present on this CoAP resource.
+        """
+        configs = {"SCALAR_TYPES": self.scalar_value_types, "ENUM_TYPES": self.enum_value_types,\
+                   "PROPERTY_TYPES": self.property_types, "DEVICE_TYPES": self.device_types}
+        try:
+            return configs[c_type]
+        except KeyError:
+            raise AppError(defines.Codes.BAD_REQUEST,\
+                    "Config type must be one of: DEVICE_TYPES, PROPERTY_TYPES, SCALAR_TYPES or ENUM_TYPES")
+
+    def save_configs_of_type(self, c_type):
+        """
+            This method saves the configurations of type c_type to their
+            configuration file.
+        """
+        if c_type in ["SCALAR_TYPES", "ENUM_TYPES"]:
+            self.save_value_types_to_file()
+        elif c_type == "PROPERTY_TYPES":
+            self.save_property_types_to_file()
+        elif c_type == "DEVICE_TYPES":
+            self.save_device_types_to_file()
+
+    def link_config(self, c_type, config):
+        """
+            This method sets the edges of the dependency graph from the
+            configurations the given configuration depends on to it.
+        """
+        if c_type == "PROPERTY_TYPES":
+            value_type = "SCALAR_TYPES" if config.valuetype_class == "SCALAR" else "ENUM_TYPES"
+            self.graph.link((c_type, config.id), [(value_type, config.valuetype_id)])
+        elif c_type == "DEVICE_TYPES":
+            self.graph.link((c_type, config.id), [("PROPERTY_TYPES", p.id) for p in config.properties])
+
+    def build_graph(self):
+        """
+            This method builds the dependency graph of all the configurations
+            present on this CoAP resource (and of the devices using them).
+        """
+        self.graph = ConfigsGraph()
+        for prop in self.property_types.itervalues():
+            self.link_config("PROPERTY_TYPES", prop)
+        for dev_type in self.device_types.itervalues():
+            self.link_config("DEVICE_TYPES", dev_type)
+        for dev in self.server.devices.devices.values():
+            self.graph.link(("DEVICES", dev.id), [("DEVICE_TYPES", int(dev.device_type_id))])
+
+    def link_device(self, device):
+        """
+            This method sets the device type a device depends on, on the
+            dependency graph.
+        """
+        with self.lock:
+            self.graph.link(("DEVICES", device.id), [("DEVICE_TYPES", int(device.device_type_id))])
+
+    def unlink_device(self, device_id):
+        """
+            This method removes a device from the dependency graph.
+        """
+        with self.lock:
+            self.graph.unlink(("DEVICES", device_id))
+
+    def upsert_configs(self, c_type, configs):
+        """
+            This method adds and/or updates the configurations of type c_type
+            given on the list configs (of dictionaries), and then rebuilds and
+            revalidates only the configurations and devices that depend on the
+            ones that changed. The configurations are all validated before any
+            of them is applied. It returns the number of configurations changed.
+        """
+        with self.lock:
+            current = self.get_configs_of_type(c_type)
+            changed = {}
+            for ele in configs:
+                config = self.build_config(c_type, ele)
+                old = current.get(config.id)
+                if old is None or old.get_info() != config.get_info():
+                    changed[config.id] = config
+
+            for config in changed.itervalues():
+                current[config.id] = config
+                self.link_config(c_type, config)
+            if changed:
+                self.revalidate(self.graph.dependents([(c_type, id) for id in changed]))
+                self.save_configs_of_type(c_type)
+            return len(changed)
+
+    def check_unused(self, c_type, config_ids):
+        """
+            This method raises an AppError if any of the configurations of type
+            c_type with the IDs given on the list config_ids is used by another
+            configuration or device.
+        """
+        for id in config_ids:
+            users = self.graph.dependents([(c_type, id)], transitive=False)
+            if users:
+                raise AppError(defines.Codes.BAD_REQUEST,\
+                        str(c_type)+" ("+str(id)+") is used by "+\
+                        ", ".join(t+" ("+str(i)+")" for t, i in sorted(users)))
+
+    def delete_configs(self, c_type, config_ids):
+        """
+            This method deletes the configurations of type c_type with the IDs
+            given on the list config_ids. None of them is deleted if any of them
+            is still used by another configuration or device.
+        """
+        with self.lock:
+            current = self.get_configs_of_type(c_type)
+            config_ids = [int(id) for id in config_ids if int(id) in current]
+            self.check_unused(c_type, config_ids)
+            for id in config_ids:
+                del current[id]
+                self.graph.unlink((c_type, id))
+            if config_ids:
+                self.save_configs_of_type(c_type)
+            return len(config_ids)
+
+    def revalidate(self, nodes):
+        """
+            This method rebuilds the configurations (and revalidates the devices)
+            given on the list nodes of the dependency graph, by dependency order,
+            so that they refer to the current configurations they depend on.
+        """
+        for c_type, id in sorted(nodes, key=lambda node: ConfigsGraph.LEVELS[node[0]]):
+            if c_type == "PROPERTY_TYPES":
+                self.property_types[id] = self.build_config(c_type, self.property_types[id].get_info())
+            elif c_type == "DEVICE_TYPES":
+                self.device_types[id] = self.build_config(c_type, self.device_types[id].get_info())
+            elif c_type == "DEVICES":
+                dev = self.server.devices.devices.get(id)
+                if dev is not None:
+                    dev.revalidate_device_type()
+
     def update_server_configs(self, new_configs, c_type):
         """
             This method adds new and/or updates the configurations present
@@ -562,6 +719,9 @@ class HomeServerConfigs(Resource):
             that should be updated and give the full list of configurations, now with
             the updated ones, but applying the same logic as the examples before (always
             specifying which type of configuration we are updating on c_type argument).
+
+            Only the configurations that changed are applied (see upsert_configs and
+            delete_configs).
         """
         try:
             configs = new_configs[c_type]
@@ -570,77 +730,60 @@ class HomeServerConfigs(Resource):
                         "Update "+str(c_type)+" Data bad formated")
 
         if isinstance(configs, list):
-            try:
-                data = {}
-                if c_type == "SCALAR_TYPES":
-                    for ele in configs:
-                        id = int(ele["id"])
-                        name = str(ele["name"])
-                        unit = str(ele["units"])
-                        min_val = float(ele["min_value"])
-                        max_val = float(ele["max_value"])
-                        step = float(ele["step"])
-                        deflt = float(ele["default_value"])
-
-                        data[int(id)] = ScalarValueType(id, name, unit, min_val,\
-                                                                max_val, step, deflt)
-
-                    self.scalar_value_types.clear()
-                    self.scalar_value_types = data
-                    self.save_value_types_to_file()
-
-                if c_type == "ENUM_TYPES":
-                    for ele in configs:
-                        id = int(ele["id"])
-                        name = str(ele["name"])
-                        if not isinstance(ele["choices"], dict):
-                            raise ValueError
-                        else:
-                            enum = ele["choices"]
-
-                        deflt = str(ele["default_value"])
-
-                        data[int(id)] = EnumValueType(id, name, enum, deflt)
-
-                    self.enum_value_types.clear()
-                    self.enum_value_types = data
-                    self.save_value_types_to_file()
-
-                if c_type == "PROPERTY_TYPES":
-                    for ele in configs:
-                        id = int(ele["id"])
-                        name = str(ele["name"])
-                        access_mode = str(ele["access_mode"])
-                        value_type = str(ele["value_type_class"])
-                        value_type_id = int(ele["value_type_id"])
-
-                        data[int(id)] = PropertyType(self, id, name, access_mode,\
-                                                                        value_type, value_type_id)
-
-                    self.property_types.clear()
-                    self.property_types = data
-                    self.save_property_types_to_file()
-
-                if c_type == "DEVICE_TYPES":
-                    for ele in configs:
-                        id = int(ele["id"])
-                        name = str(ele["name"])
-                        if not isinstance(ele["properties"], list):
-                            raise ValueError
-                        else:
-                            properties = ele["properties"]
-
-                        data[int(id)] = DeviceType(self, id, name, properties)
-
-                    self.device_types.clear()
-                    self.device_types = data
-                    self.save_device_types_to_file()
-            except:
-                raise AppError(defines.Codes.BAD_REQUEST,\
-                            "List of "+str(c_type)+" improperly formated")
+            with self.lock:
+                current = self.get_configs_of_type(c_type)
+                try:
+                    ids = set(int(ele["id"]) for ele in configs)
+                except:
+                    raise AppError(defines.Codes.BAD_REQUEST,\
+                                "List of "+str(c_type)+" improperly formated")
+                removed = [id for id in current if id not in ids]
+                # checked before any change, so that nothing is applied
+                self.check_unused(c_type, removed)
+
+                self.upsert_configs(c_type, configs)
+                self.delete_configs(c_type, removed)
         else:
             raise AppError(defines.Codes.BAD_REQUEST,\
                             "Request body should be a json element with a key "+str(c_type)+" and a list of "+str(c_type)+" as value")
+
+    def reload_from_files(self):
+        """
+            This method updates the configurations present on this CoAP resource
+            with the ones on their configuration files (e.g. after they are
+            refreshed from the cloud service): the new and changed ones are
+            applied by dependency order and then the ones no longer present are
+            deleted, if they are not used.
+        """
+        files = [(["SCALAR_TYPES", "ENUM_TYPES"], settings.VALUE_TYPES_CONFIG_FILE),\
+                 (["PROPERTY_TYPES"], settings.PROPERTY_TYPES_CONFIG_FILE),\
+                 (["DEVICE_TYPES"], settings.DEVICE_TYPES_CONFIG_FILE)]
+        configs = []
+        for c_types, path in files:
+            try:
+                with open(str(path), "r") as fp:
+                    data = json.load(fp)
+                for c_type in c_types:
+                    configs.append((c_type, data[c_type]))
+            except (IOError, ValueError, KeyError):
+                logger.error("Unable to reload "+str(path)+" file")
+                return False
+
+        with self.lock:
+            for c_type, items in configs:
+                try:
+                    self.upsert_configs(c_type, items)
+                except AppError as err:
+                    logger.error("Unable to reload "+str(c_type)+": "+str(err.msg))
+            for c_type, items in reversed(configs):
+                ids = set(int(ele["id"]) for ele in items)
+                for id in [id for id in self.get_configs_of_type(c_type) if id not in ids]:
+                    try:
+                        self.delete_configs(c_type, [id])
+                    except AppError as err:
+                        logger.error("Unable to reload "+str(c_type)+": "+str(err.msg))
+        return True
+
     #
     ### COAP METHODS
     def render_GET_advanced(self, request, response):
@@ -657,10 +800,7 @@ class HomeServerConfigs(Resource):
           
         if request.content_type is defines.Content_types.get("application/json"):
             try:
-                query = request.uri_query
-                aux = [query]
-                d = dict(s.split("=") for s in aux)
-                c_type = d["type"]
+                c_type = get_query(request)["type"]
             except:
                 return error(self, response, defines.Codes.BAD_REQUEST,\
                         "Request query must specify a type of the config to update")
@@ -679,3 +819,121 @@ class HomeServerConfigs(Resource):
                 return status(self, response, defines.Codes.CHANGED)
             except AppError as e:
                 return error(self, response, e.code, e.msg)
+
+    def render_POST_advanced(self, request, response):
+        if request.accept != defines.Content_types["application/json"] and request.accept != None:
+            return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
+                                    "Could not satisfy the request Accept header")
+
+        if request.content_type is defines.Content_types.get("application/json"):
+            try:
+                c_type = get_query(request)["type"]
+            except:
+                return error(self, response, defines.Codes.BAD_REQUEST,\
+                        "Request query must specify a type of the config to add/update")
+
+            try:
+                body = json.loads(request.payload)
+            except:
+                logger.error("Request payload not json")
+                return error(self, response, defines.Codes.BAD_REQUEST,\
+                                    "Body content not properly json formated")
+
+            try:
+                if not isinstance(body, dict):
+                    raise AppError(defines.Codes.BAD_REQUEST,\
+                                    "Request body should be a json element with one "+str(c_type))
+                self.upsert_configs(c_type, [body])
+
+                self.payload = self.get_payload()
+                return status(self, response, defines.Codes.CHANGED)
+            except AppError as e:
+                return error(self, response, e.code, e.msg)
+        else:
+            return error(self, response, defines.Codes.UNSUPPORTED_CONTENT_FORMAT,\
+                        "Request content must be application/json")
+
+    def render_DELETE_advanced(self, request, response):
+        if request.accept != defines.Content_types["application/json"] and request.accept != None:
+            return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
+                                    "Could not satisfy the request Accept header")
+        try:
+            query = get_query(request)
+            c_type = query["type"]
+            config_id = int(query["id"])
+        except:
+            return error(self, response, defines.Codes.BAD_REQUEST,\
+                    "Request query must specify the type and the id of the config to delete")
+
+        try:
+            if not self.delete_configs(c_type, [config_id]):
+                return error(self, response, defines.Codes.NOT_FOUND,\
+                                    str(c_type)+" ("+str(config_id)+") not found")
+
+            self.payload = self.get_payload()
+            self.changed = True
+            return status(self, response, defines.Codes.DELETED)
+        except AppError as e:
+            return error(self, response, e.code, e.msg)
+
+#
+### CONFIGS DEPENDENCY GRAPH
+class ConfigsGraph(object):
+    """
+        This is the dependency graph of the Home Server configurations.
+        Its nodes are (type, id) tuples, of the value types (SCALAR_TYPES and
+        ENUM_TYPES), PROPERTY_TYPES, DEVICE_TYPES and DEVICES, and each node
+        has the edges to the nodes that depend on it (value type -> property
+        types -> device types -> devices).
+    """
+    LEVELS = {"SCALAR_TYPES": 0, "ENUM_TYPES": 0, "PROPERTY_TYPES": 1, "DEVICE_TYPES": 2, "DEVICES": 3}
+
+    def __init__(self):
+        self.users = {}
+        self.uses = {}
+
+    def link(self, node, dependencies):
+        """
+            This method sets the nodes the given node depends on (replacing
+            the previous ones).
+        """
+        self.unlink(node, keep_users=True)
+        self.uses[node] = set(dependencies)
+        for dep in self.uses[node]:
+            self.users.setdefault(dep, set()).add(node)
+
+    def unlink(self, node, keep_users=False):
+        """
+            This method removes the edges from the nodes the given node depends
+            on (and the node, unless keep_users is set).
+        """
+        for dep in self.uses.pop(node, ()):
+            users = self.users.get(dep)
+            if users is not None:
+                users.discard(node)
+                if not users:
+                    del self.users[dep]
+        if not keep_users:
+            self.users.pop(node, None)
+
+    def dependents(self, nodes, transitive=True):
+        """
+            This method returns the set of nodes that depend on the given ones
+            (directly, or also indirectly if transitive is set).
+        """
+        ret = set()
+        pending = list(nodes)
+        while pending:
+            for user in self.users.get(pending.pop(), ()):
+                if user not in ret:
+                    ret.add(user)
+                    if transitive:
+                        pending.append(user)
+        return ret
+
+def get_query(request):
+    """
+        This function returns the dictionary with the query parameters of
+        a request.
+    """
+    return dict(s.split("=", 1) for s in request.uri_query.split("&"))
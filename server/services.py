@@ -6,6 +6,7 @@
 """
 import json
 import logging
+import threading
 
 from coapthon import defines
 from coapthon.resources.resource import Resource
@@ -13,6 +14,7 @@ from coapthon.resources.resource import Resource
 from utils import status, error, check_on_body, AppError, AppHTTPError
 
 import settings
+import persistence
 
 __author__ = "Jose Requeijo Dias"
 
@@ -59,11 +61,16 @@ class HomeServerServices(Resource):
         self.server = server
         self.root_uri = "/services"
 
+        self.server.add_resource(self.root_uri, self)
+
+        # reverse index of the subscriptions: service id -> set of device ids
+        self.subscribers = {}
+        # the requests are handled on concurrent threads
+        self.lock = threading.RLock()
+
         self.services = {}
         self.load_services_from_file()
 
-        self.server.add_resource(self.root_uri, self)
-
         self.res_content_type = "application/json"
         self.payload = self.get_payload()
 
@@ -103,34 +110,29 @@ class HomeServerServices(Resource):
             data = json.load(fp)
             logger.info("Loading "+str(settings.SERVICES_CONFIG_FILE)+" file...")
 
+            services = {}
             for ele in data["SERVICES"]:
                 id = ele["id"]
                 name = ele["name"]
                 core_service_ref = ele["core_service_ref"]
-                self.services[int(id)] = Service(id, name, core_service_ref)
+                services[int(id)] = Service(id, name, core_service_ref)
 
             fp.close()
         except:
             logger.info("FILE: "+str(settings.SERVICES_CONFIG_FILE)+" not found")
+            return
+
+        self.set_services(services)
 
     def save_services_to_file(self):
         """
             This is an auxiliary method that saves to the correspondent configuration
             file, pointed by 'settings.SERVICES_CONFIG_FILE', all
             the Services represented by this resource.
+            The file is written on the background (see persistence.py).
         """
-        try:
-            fp = open(str(settings.SERVICES_CONFIG_FILE), "w")
-
-            data = self.get_all_services()
-
-            logger.info("Saving "+str(settings.SERVICES_CONFIG_FILE)+" file...")
-            json.dump(data, fp)
-            fp.close()
-
-            logger.info(str(settings.SERVICES_CONFIG_FILE)+" file changes saved.")
-        except:
-            logger.info("FILE: "+str(settings.SERVICES_CONFIG_FILE)+" not found")
+        persistence.save(settings.SERVICES_CONFIG_FILE,\
+                        lambda: json.dumps(self.get_all_services()))
 
     def validate_services(self, service_ids):
         """
@@ -139,19 +141,89 @@ class HomeServerServices(Resource):
         """
         for s in service_ids:
             try:
-                if not self.services[int(s)]:
+                if int(s) not in self.services:
                     return False
-            except:
+            except (TypeError, ValueError):
                 return False
         return True
 
+    def set_services(self, services):
+        """
+            This method replaces the services of the Home Server by the given
+            ones (a dictionary of Services by id). The services removed are
+            also removed from the devices that subscribed them, and the CoAP
+            resources of each service are added and deleted accordingly.
+        """
+        with self.lock:
+            removed = [s for s in self.services if s not in services]
+            added = [s for s in services if s not in self.services]
+            self.services = services
+            self.prune_subscriptions(removed)
+
+            for service_id in removed:
+                self.server.root.del_subtree(self.root_uri+"/"+str(service_id))
+            for service_id in added:
+                ServiceResource(self, service_id)
+
+    def subscribe(self, device_id, service_ids):
+        """
+            This method adds to the reverse index the subscription of the given
+            services by the device with id device_id.
+        """
+        with self.lock:
+            for s in service_ids:
+                self.subscribers.setdefault(int(s), set()).add(device_id)
+
+    def unsubscribe(self, device_id, service_ids):
+        """
+            This method removes from the reverse index the subscription of the
+            given services by the device with id device_id.
+        """
+        with self.lock:
+            for s in service_ids:
+                devices = self.subscribers.get(int(s))
+                if devices is not None:
+                    devices.discard(device_id)
+                    if not devices:
+                        del self.subscribers[int(s)]
+
+    def get_subscribers(self, service_id):
+        """
+            This method returns the sorted list of the ids of the devices
+            that subscribed the service with id service_id.
+        """
+        with self.lock:
+            return sorted(self.subscribers.get(int(service_id), ()))
+
+    def prune_subscriptions(self, service_ids):
+        """
+            This method removes the given services (removed from the server)
+            from the services subscribed by each device, visiting only the
+            devices that subscribed them.
+        """
+        removed = set(service_ids)
+        devices = self.server.devices.devices
+        with self.lock:
+            affected = set()
+            for s in removed:
+                affected.update(self.subscribers.pop(s, ()))
+
+            for device_id in affected:
+                device = devices.get(device_id)
+                if device is None:
+                    continue
+                dev_services = device.services
+                dev_services.services = [s for s in dev_services.services if s not in removed]
+                dev_services.payload = dev_services.get_payload()
+        return len(affected)
+
     def get_all_services(self):
         """
             This method returns a dictionary with all the services
             represented by this CoAP resource
         """
         data = {"SERVICES":[]}
-        for s in self.services.itervalues():
+        for s in self.services.values():
             data["SERVICES"].append(s.get_info())
         return data
 
@@ -187,13 +259,12 @@ class HomeServerServices(Resource):
                     check_on_body(n_serv, ["name", "id", "core_service_ref"])
                     data[int(n_serv["id"])] = Service(int(n_serv["id"]), str(n_serv["name"]),\
                                                         n_serv["core_service_ref"])
-
-                self.services.clear()
-                self.services = data
-                self.save_services_to_file()
             except:
                 raise AppError(defines.Codes.BAD_REQUEST,\
                             "List of services improperly formated")
+
+            self.set_services(data)
+            self.save_services_to_file()
         else:
             raise AppError(defines.Codes.BAD_REQUEST,\
                             "Request body should be a json element with a key SERVICES and a list of services as value")
@@ -226,3 +297,117 @@ class HomeServerServices(Resource):
                 return status(self, response, defines.Codes.CHANGED)
             except AppError as e:
                 return error(self, response, e.code, e.msg)
+
+
+class ServiceResource(Resource):
+    """
+        This is the Service CoAP resource.
+        It represents the endpoint (URI) of each service of the Home Server,
+        where the service can be fetched, and has the endpoint with the
+        devices that subscribed it.
+    """
+    def __init__(self, services, service_id):
+
+        super(ServiceResource, self).__init__("Service", services.server, visible=True,\
+                                                observable=False, allow_children=False)
+
+        self.services = services
+        self.id = service_id
+
+        self.root_uri = services.root_uri+"/"+str(service_id)
+
+        services.server.add_resource(self.root_uri, self)
+
+        # devices that subscribed the service
+        self.devices = ServiceDevicesResource(self)
+
+        self.res_content_type = "application/json"
+        self.payload = self.get_payload()
+
+        self.resource_type = "Service"
+        self.interface_type = "if1"
+
+    def get_info(self):
+        """
+            This method returns a dictionary with the service information.
+        """
+        return self.services.services[self.id].get_info()
+
+    def get_json(self):
+        """
+            This method returns a JSON representation with the service information.
+        """
+        return json.dumps(self.get_info())
+
+    def get_payload(self):
+        """
+            This method returns a valid CoAPthon payload representation
+            with the service information.
+        """
+        return (defines.Content_types[self.res_content_type], self.get_json())
+
+    ## CoAP Methods
+    def render_GET_advanced(self, request, response):
+        if request.accept != defines.Content_types["application/json"] and request.accept != None:
+            return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
+                                    "Could not satisfy the request Accept header")
+        try:
+            self.payload = self.get_payload()
+        except KeyError:
+            return error(self, response, defines.Codes.NOT_FOUND,\
+                                    "Service ("+str(self.id)+") not found")
+        return status(self, response, defines.Codes.CONTENT)
+
+
+class ServiceDevicesResource(Resource):
+    """
+        This is the Service Devices CoAP resource.
+        It represents the endpoint (URI) with the devices that subscribed
+        a given service.
+    """
+    def __init__(self, service):
+
+        super(ServiceDevicesResource, self).__init__("ServiceDevices", service.services.server,\
+                                                visible=True, observable=False, allow_children=False)
+
+        self.service = service
+
+        self.root_uri = service.root_uri+"/devices"
+
+        service.services.server.add_resource(self.root_uri, self)
+
+        self.res_content_type = "application/json"
+        self.payload = self.get_payload()
+
+        self.resource_type = "ServiceDevices"
+        self.interface_type = "if1"
+
+    def get_info(self):
+        """
+            This method returns a dictionary with the ids of the devices
+            that subscribed the service.
+        """
+        return {"service_id": self.service.id,\
+                "devices": self.service.services.get_subscribers(self.service.id)}
+
+    def get_json(self):
+        """
+            This method returns a JSON representation with the ids of the
+            devices that subscribed the service.
+        """
+        return json.dumps(self.get_info())
+
+    def get_payload(self):
+        """
+            This method returns a valid CoAPthon payload representation
+            with the ids of the devices that subscribed the service.
+        """
+        return (defines.Content_types[self.res_content_type], self.get_json())
+
+    ## CoAP Methods
+    def render_GET_advanced(self, request, response):
+        if request.accept != defines.Content_types["application/json"] and request.accept != None:
+            return error(self, response, defines.Codes.NOT_ACCEPTABLE,\
+                                    "Could not satisfy the request Accept header")
+        self.payload = self.get_payload()
+        return status(self, response, defines.Codes.CONTENT)
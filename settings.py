@@ -16,6 +16,9 @@ Specification of the Home Server configurations folder and file names.
 Each one of these files stores the main configurations for the Home Server.
 These Files are updated each time the Home Server start/restart and each time new
 configurations are added/updated on the online cloud service.
+The validators (ETag/Last-Modified) of the configurations fetched from the cloud
+service are kept on CONFIGS_VALIDATORS_FILE, so that they are only downloaded again
+(and their files rewritten) when they are modified.
 """
 CONFIGS_ROOT = ROOT+"/config/"
 
@@ -24,6 +27,15 @@ DEVICE_TYPES_CONFIG_FILE = CONFIGS_ROOT+"device_types.json"
 PROPERTY_TYPES_CONFIG_FILE = CONFIGS_ROOT+"property_types.json"
 VALUE_TYPES_CONFIG_FILE = CONFIGS_ROOT+"value_types.json"
 SERVICES_CONFIG_FILE = CONFIGS_ROOT+"services.json"
+CONFIGS_VALIDATORS_FILE = CONFIGS_ROOT+"validators.json"
+
+"""
+Specification of the persistence of the configuration files. The changes made by the
+requests (configurations, services and the server name) are written to their files on
+the background, PERSISTENCE_DELAY seconds after the first change, so that the changes
+that come together are written only once. Each file is replaced atomically.
+"""
+PERSISTENCE_DELAY = 0.2
 
 
 LOG_TO_TERMINAL = False
@@ -44,12 +56,22 @@ QUIET = True
 
 """
 Specification of the IP address and port for the Proxy and the CoAP server
+When COAP_ADDR is empty it is the local address of the Home Server (found without
+any network traffic). PROXY_ADDR is the public address of the proxy, given to the
+cloud service when the Home Server registers from scratch. When it is empty it is
+asked to jsonip.com, only on that registration. The last addresses found are kept
+on ADDRESSES_CACHE_FILE and used when they can not be found (e.g. without network).
 """
-PROXY_ADDR = utils.get_my_ip(public=True)
+ADDRESSES_CACHE_FILE = CONFIGS_ROOT+"addresses.json"
+
+PROXY_ADDR = ""
 PROXY_PORT = 8080
 
-COAP_ADDR = utils.get_my_ip()
+COAP_ADDR = ""
 COAP_PORT = 5683
+
+if not COAP_ADDR:
+    COAP_ADDR = utils.get_my_ip(cache_file=ADDRESSES_CACHE_FILE)
 COAP_MULTICAST = False
 
 HOME_SERVER_TIMEOUT = 40
@@ -64,6 +86,36 @@ COMM_TIMEOUT = 5
 DEVICES_MONITORING_TIMEOUT = 15
 ENDPOINT_DEFAULT_TIMEOUT = 60
 
+"""
+Specification of the metrics of the Home Server. When METRICS_ENABLED is True the
+CoAP server times each layer stage and the rendering of each resource type, counts
+the requests, errors and retransmissions, and exposes them (with the number of
+observers and of requests in flight) on its /metrics CoAP resource. The proxy adds
+the timings of its HTTP handlers and exposes everything in the Prometheus text
+format on GET /metrics. When it is False (the default) nothing is instrumented.
+"""
+METRICS_ENABLED = False
+
+"""
+Specification of the on-demand profiler. GET /profile on the proxy samples the stacks
+of all the threads of the Home Server (or of the proxy, with target=proxy) during the
+given seconds and returns the collapsed stacks (for flame graphs) or a report. It is
+only answered when the request carries the X-Admin-Token header with the value of
+PROFILER_ADMIN_TOKEN, and it is disabled while PROFILER_ADMIN_TOKEN is empty. The
+/profile CoAP resource of the Home Server only answers local requests.
+"""
+PROFILER_ADMIN_TOKEN = ""
+
+"""
+Specification of the traffic capture. When CAPTURE_SIZE is greater than 0 the CoAP
+server keeps the last CAPTURE_SIZE datagrams it received and sent (with their times
+and addresses) in memory, and writes them to CAPTURE_FILE when the Home Server process
+receives the SIGUSR1 signal (kill -USR1 <pid>). The capture file can be replayed
+against a test Home Server with benchmarks/replay.py.
+"""
+CAPTURE_SIZE = 0
+CAPTURE_FILE = ROOT+"/logs/capture.coapcap"
+
 """
 Specification of the cloud service URL and the working offline setting for the
 Home Server.
@@ -71,9 +123,49 @@ When the ALLOW_WORKING_OFFLINE is set to False the HomeServer only works if it
 has connection with the mHouse cloud service specified by the URL. If it is set
 to True the Home Server works without internet connection but the devices are only
 reachable from the local Home Server's REST API.
+A Home Server already registered (with its configurations files) starts serving its
+devices right away, with the configurations it has, while it registers on the cloud
+service in the background (retrying every REGISTER_RETRY_MIN up to REGISTER_RETRY_MAX
+seconds) and then refreshes its configurations and services.
 """
 CLOUD_BASE_URL = "http://mhouseframework.eu-west-1.elasticbeanstalk.com/"
 ALLOW_WORKING_OFFLINE = False
+WORKING_OFFLINE = False
+REGISTER_RETRY_MIN = 5
+REGISTER_RETRY_MAX = 300
+
+"""
+Specification of the cloud outbox. When the cloud service is not reachable, the
+device registrations, unregistrations and state notifications are stored on the
+CLOUD_OUTBOX_DIR folder (only the latest event of each kind is kept for each device)
+and they are sent to the cloud when the connection comes back, retrying with an
+exponential backoff between CLOUD_OUTBOX_RETRY_MIN and CLOUD_OUTBOX_RETRY_MAX seconds.
+The sizes are in bytes and CLOUD_OUTBOX_MAX_SIZE bounds the disk used by the outbox.
+"""
+CLOUD_OUTBOX_DIR = ROOT+"/outbox/"
+CLOUD_OUTBOX_SEGMENT_SIZE = 256*1024
+CLOUD_OUTBOX_MAX_SIZE = 8*1024*1024
+CLOUD_OUTBOX_RETRY_MIN = 1
+CLOUD_OUTBOX_RETRY_MAX = 300
+
+"""
+Specification of the maximum age (in seconds) of the local index of the devices
+present on the cloud service. The index is fetched from the cloud when it is older
+than this value, and it is updated with every device registration response.
+"""
+CLOUD_DEVICE_INDEX_MAX_AGE = 300
+
+"""
+Specification of the bulk synchronization of the devices with the cloud service.
+During the first CLOUD_SYNC_STARTUP_DELAY seconds after the Home Server starts, the
+device registrations are not sent one by one: when that window ends, all the devices
+are compared with the ones known by the cloud and only the differences are sent, using
+CLOUD_SYNC_WORKERS parallel connections. Set CLOUD_SYNC_DELETE_MISSING to True to also
+delete from the cloud the devices of this Home Server that did not register again.
+"""
+CLOUD_SYNC_STARTUP_DELAY = 30
+CLOUD_SYNC_WORKERS = 8
+CLOUD_SYNC_DELETE_MISSING = False
 
 
 """
@@ -94,4 +186,24 @@ AWS_INTEGRATION = False
 # You can specify here your AWS credentials or use the environment configurations
 # generated by the AWS CLI when you configure your credentials.
 AWS_ACCESS_KEY_ID = ""
-AWS_SECRET_ACCESS_KEY = ""
\ No newline at end of file
+AWS_SECRET_ACCESS_KEY = ""
+# The wanted states changed on the AWS shadows are received through MQTT subscriptions
+# to the shadow deltas ("mqtt" mode) or by reading all the shadows every
+# AWS_SHADOW_POLLING_INTERVAL seconds ("polling" mode). The "mqtt" mode needs the AWS IoT
+# endpoint and the thing certificate files, and it falls back to polling if it cannot
+# connect to AWS IoT.
+AWS_SHADOW_MODE = "mqtt"
+AWS_SHADOW_POLLING_INTERVAL = 5
+AWS_IOT_ENDPOINT = ""
+AWS_IOT_PORT = 8883
+AWS_IOT_CLIENT_ID = "mhouse-home-server"
+AWS_IOT_ROOT_CA = ROOT+"/certs/root-CA.crt"
+AWS_IOT_PRIVATE_KEY = ROOT+"/certs/private.pem.key"
+AWS_IOT_CERTIFICATE = ROOT+"/certs/certificate.pem.crt"
+# The AWS operations are run by AWS_EXECUTOR_WORKERS threads and limited to
+# AWS_THING_RATE_LIMIT thing registry operations (create/delete thing) and
+# AWS_SHADOW_RATE_LIMIT shadow operations (get/update shadow) per second, to keep
+# them within the AWS IoT quotas of your account.
+AWS_EXECUTOR_WORKERS = 8
+AWS_THING_RATE_LIMIT = 10
+AWS_SHADOW_RATE_LIMIT = 400
\ No newline at end of file
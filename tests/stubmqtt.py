@@ -0,0 +1,216 @@
+"""
+    This is the Stub MQTT file for the Home Server tests and benchmarks.
+    Here are specified an in-process MQTT broker stand-in, a client with the
+    subset of the AWSIoTMQTTClient interface used by the AWS communicator, and
+    stubs of the AWS IoT registry (the boto3 "iot" client calls) and shadow
+    service (the boto3 "iot-data" client calls), the latter publishing the
+    shadow deltas on the broker like AWS IoT does.
+"""
+import json
+import time
+import Queue
+import threading
+from StringIO import StringIO
+
+__author__ = "Jose Requeijo Dias"
+
+
+def topic_matches(pattern, topic):
+    """
+        This function checks if the given topic matches the given MQTT
+        subscription pattern (with the '+' and '#' wildcards).
+    """
+    p = pattern.split("/")
+    t = topic.split("/")
+    for i, level in enumerate(p):
+        if level == "#":
+            return True
+        if i >= len(t) or (level != "+" and level != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+class StubMQTTMessage(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class StubMQTTBroker(object):
+    """
+        This is the Stub MQTT Broker class.
+        The published messages are delivered to the subscribed callbacks by a
+        single delivery thread, as the AWS IoT SDK does.
+    """
+    def __init__(self):
+        self.subscriptions = []
+        self.published = 0
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._deliver)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def subscribe(self, client, pattern, callback):
+        with self._lock:
+            self.subscriptions.append((client, pattern, callback))
+
+    def unsubscribe(self, client, pattern):
+        with self._lock:
+            self.subscriptions = [s for s in self.subscriptions\
+                                    if s[0] != client or s[1] != pattern]
+
+    def publish(self, topic, payload):
+        with self._lock:
+            self.published += 1
+        self._queue.put(StubMQTTMessage(topic, payload))
+
+    def _deliver(self):
+        while True:
+            message = self._queue.get()
+            with self._lock:
+                subscriptions = list(self.subscriptions)
+            for client, pattern, callback in subscriptions:
+                if topic_matches(pattern, message.topic):
+                    callback(client, None, message)
+            self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+class StubMQTTClient(object):
+    """
+        This is the Stub MQTT Client class, with the AWSIoTMQTTClient methods
+        used by the Home Server.
+    """
+    def __init__(self, broker, client_id="stub"):
+        self.broker = broker
+        self.client_id = client_id
+        self.connected = False
+
+    def configureEndpoint(self, host, port):
+        pass
+
+    def configureCredentials(self, root_ca, private_key=None, certificate=None):
+        pass
+
+    def configureAutoReconnectBackoffTime(self, base, maximum, stable):
+        pass
+
+    def configureOfflinePublishQueueing(self, size, drop_behavior=None):
+        pass
+
+    def configureConnectDisconnectTimeout(self, timeout):
+        pass
+
+    def configureMQTTOperationTimeout(self, timeout):
+        pass
+
+    def connect(self, keep_alive=600):
+        self.connected = True
+        return True
+
+    def disconnect(self):
+        self.connected = False
+        return True
+
+    def subscribe(self, topic, qos, callback):
+        self.broker.subscribe(self, topic, callback)
+        return True
+
+    def unsubscribe(self, topic):
+        self.broker.unsubscribe(self, topic)
+        return True
+
+    def publish(self, topic, payload, qos):
+        self.broker.publish(topic, payload)
+        return True
+
+
+class StubCallCounter(object):
+    """
+        This counts the calls made to a stub AWS service, and the peak number
+        of calls made during one second.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            second = int(time.time())
+            self.seconds[second] = self.seconds.get(second, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total_calls(self):
+        return sum(self.calls.itervalues())
+
+    def peak_rate(self):
+        return max(self.seconds.itervalues()) if self.seconds else 0
+
+
+class StubIoTService(StubCallCounter):
+    """
+        This is the Stub IoT Service class, with the boto3 "iot" client methods
+        used by the Home Server.
+    """
+    def __init__(self, latency=0.0):
+        StubCallCounter.__init__(self, latency)
+        self.things = set()
+
+    def create_thing(self, thingName):
+        self.count("create_thing")
+        with self._lock:
+            self.things.add(thingName)
+        return {"thingName": thingName}
+
+    def delete_thing(self, thingName):
+        self.count("delete_thing")
+        with self._lock:
+            self.things.discard(thingName)
+        return {}
+
+
+class StubShadowService(StubCallCounter):
+    """
+        This is the Stub Shadow Service class, with the boto3 "iot-data" client
+        methods used by the Home Server. Every desired state change that differs
+        from the reported state is published as a shadow delta on the broker.
+    """
+    def __init__(self, broker, latency=0.0):
+        StubCallCounter.__init__(self, latency)
+        self.broker = broker
+        self.shadows = {}
+
+    def delta(self, shadow):
+        reported = shadow.get("reported", {})
+        return dict((k, v) for k, v in shadow.get("desired", {}).iteritems()\
+                    if reported.get(k) != v)
+
+    def update_thing_shadow(self, thingName, payload):
+        self.count("update_thing_shadow")
+        state = json.loads(payload)["state"]
+        with self._lock:
+            shadow = self.shadows.setdefault(thingName, {"desired": {}, "reported": {}})
+            for k in ["desired", "reported"]:
+                shadow[k].update(state.get(k, {}))
+            delta = self.delta(shadow)
+        if delta and "desired" in state:
+            self.broker.publish("$aws/things/"+thingName+"/shadow/update/delta",\
+                                json.dumps({"state": delta, "timestamp": int(time.time())}))
+        return {"payload": StringIO(payload)}
+
+    def get_thing_shadow(self, thingName):
+        self.count("get_thing_shadow")
+        with self._lock:
+            shadow = self.shadows.get(thingName, {"desired": {}, "reported": {}})
+            state = {"desired": dict(shadow["desired"]), "reported": dict(shadow["reported"])}
+            delta = self.delta(shadow)
+        if delta:
+            state["delta"] = delta
+        return {"payload": StringIO(json.dumps({"state": state}))}
@@ -0,0 +1,139 @@
+"""
+    These are the tests of the AWS shadows synchronization of the AWS
+    communicator (cloudcommunicators.aws_comm): the MQTT shadow delta listener
+    and the shadow polling fallback. AWS IoT is replaced by the stub MQTT
+    broker and shadow service (see stubmqtt.py) and the local CoAP server by
+    a recorder of the requests made to it.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+
+import settings
+from stubmqtt import StubMQTTBroker, StubMQTTClient, StubShadowService
+from cloudcommunicators.aws_comm import AWSCommunicator
+
+__author__ = "Jose Requeijo Dias"
+
+DEVICES = [{"local_id": n, "name": "lamp"} for n in range(1, 4)]
+
+class RecordingResponse(object):
+    def __init__(self, payload):
+        self.payload = payload
+
+class RecordingComm(object):
+    """
+        This records the requests made to the local CoAP server.
+    """
+    def __init__(self, devices):
+        self.devices = devices
+        self.puts = []
+        self.put_done = threading.Event()
+
+    def get(self, path, timeout=None):
+        return RecordingResponse(json.dumps({"devices": self.devices}))
+
+    def get_response(self, resp):
+        return resp
+
+    def put(self, path, payload, timeout=None):
+        self.puts.append((path, json.loads(payload)))
+        self.put_done.set()
+
+class FailingMQTTClient(StubMQTTClient):
+    """
+        This is an MQTT client that can not connect to AWS IoT.
+    """
+    def connect(self, keep_alive=600):
+        raise IOError("connection refused")
+
+def thing_name(dev):
+    return dev["name"]+"-"+str(dev["local_id"])
+
+class AWSShadowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = settings.AWS_SHADOW_MODE
+        self.interval = settings.AWS_SHADOW_POLLING_INTERVAL
+        self.broker = StubMQTTBroker()
+        self.shadows = StubShadowService(self.broker)
+        for dev in DEVICES:
+            self.set_shadow(dev, {"desired": {"power": "off"}, "reported": {"power": "off"}})
+        self.comm = RecordingComm(DEVICES)
+        self.aws = None
+
+    def tearDown(self):
+        if self.aws is not None:
+            self.aws.stop()
+            for t in self.aws.executor.workers:
+                t.join()
+        settings.AWS_SHADOW_MODE = self.mode
+        settings.AWS_SHADOW_POLLING_INTERVAL = self.interval
+
+    def set_shadow(self, dev, state):
+        self.shadows.update_thing_shadow(thingName=thing_name(dev), payload=json.dumps({"state": state}))
+        self.broker.join()
+
+    def start(self, mode, mqtt_client):
+        settings.AWS_SHADOW_MODE = mode
+        self.aws = AWSCommunicator(mqtt_client=mqtt_client, clients=(None, self.shadows), listen=False)
+        self.aws.comm = self.comm
+        self.aws.start_shadow_listener()
+
+    def wait_put(self):
+        self.assertTrue(self.comm.put_done.wait(5))
+        self.comm.put_done.clear()
+        return self.comm.puts[-1]
+
+    def test_delta_listener(self):
+        self.start("mqtt", StubMQTTClient(self.broker))
+        self.assertIsNone(self.aws.listener_thread)
+        reads = self.shadows.calls.get("get_thing_shadow", 0)
+        self.assertEqual(reads, len(DEVICES))
+
+        self.set_shadow(DEVICES[1], {"desired": {"power": "on"}})
+        self.assertEqual(self.wait_put(), ("/devices/2/state", {"power": "on"}))
+        # the shadows are no longer read
+        self.assertEqual(self.shadows.calls.get("get_thing_shadow", 0), reads)
+        self.assertEqual(len(self.comm.puts), 1)
+
+    def test_pending_delta_on_startup(self):
+        # changed on AWS while the Home Server was offline
+        self.set_shadow(DEVICES[2], {"desired": {"power": "on"}})
+        self.start("mqtt", StubMQTTClient(self.broker))
+        self.assertEqual(self.comm.puts, [("/devices/3/state", {"power": "on"})])
+
+    def test_invalid_delta(self):
+        self.start("mqtt", StubMQTTClient(self.broker))
+        self.broker.publish("$aws/things/lamp/shadow/update/delta", "{}")
+        self.broker.join()
+        self.assertEqual(self.comm.puts, [])
+
+    def test_polling_fallback(self):
+        settings.AWS_SHADOW_POLLING_INTERVAL = 0.05
+        self.start("mqtt", FailingMQTTClient(self.broker))
+        self.assertTrue(self.aws.listener_thread.isAlive())
+
+        self.set_shadow(DEVICES[0], {"desired": {"power": "on"}})
+        self.assertEqual(self.wait_put(), ("/devices/1/state", {"power": "on"}))
+
+    def test_polling_mode(self):
+        settings.AWS_SHADOW_POLLING_INTERVAL = 0.05
+        mqtt_client = StubMQTTClient(self.broker)
+        self.start("polling", mqtt_client)
+        self.assertFalse(mqtt_client.connected)
+        self.assertTrue(self.aws.listener_thread.isAlive())
+
+        self.set_shadow(DEVICES[0], {"desired": {"power": "on"}})
+        self.assertEqual(self.wait_put(), ("/devices/1/state", {"power": "on"}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+"""
+    These are the tests of the blockwise transfers of the CoAPthon block layer:
+    the Block2 transfers served from concurrent threads while the idle
+    transfers are purged, as on the Home Server, and the reassembly of the
+    Block1 uploads, flooded with abandoned uploads.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.layers.blocklayer import BlockLayer
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+
+__author__ = "Jose Requeijo Dias"
+
+PAYLOAD_BLOCKS = 8
+IDLE_LIFETIME = 0.5
+# the Block1 buffers are kept small, so they are filled by a few uploads
+MAX_BLOCK1_BUFFERS = 32 * defines.BLOCKWISE_SIZE
+MAX_BLOCK1_PAYLOAD = 8 * defines.BLOCKWISE_SIZE
+
+class Block2Test(unittest.TestCase):
+
+    def setUp(self):
+        self.layer = BlockLayer()
+        self.errors = []
+
+    def get_block(self, source, token, num, payload):
+        """
+            This method sends the GET of the block num of a transfer through
+            the layer (rendering payload when the block is not served from the
+            snapshot) and returns the response.
+        """
+        request = Request()
+        request.code = defines.Codes.GET.number
+        request.source = source
+        request.token = token
+        request.uri_path = "devices"
+        if num > 0:
+            request.block2 = (num, 0, defines.MAX_PAYLOAD)
+        transaction = self.layer.receive_request(Transaction(request=request))
+        if transaction.block_transfer:
+            # served from the snapshot, as the server sends it
+            return transaction.response
+        transaction.response = Response()
+        transaction.response.code = defines.Codes.CONTENT.number
+        transaction.response.payload = payload
+        return self.layer.send_response(transaction).response
+
+    def transfer(self, n, transfers):
+        try:
+            source = ("10.0.%d.%d" % (n / 250, n % 250 + 1), 5683)
+            for t in range(transfers):
+                token = "t%d" % t
+                # an abandoned transfer, for the purge
+                self.get_block(source, "a%d" % t, 0, "x" * defines.MAX_PAYLOAD * 2)
+                payload = ("%04d" % t) * (defines.MAX_PAYLOAD * PAYLOAD_BLOCKS / 4)
+                received = ""
+                num = 0
+                while True:
+                    response = self.get_block(source, token, num, payload)
+                    received += response.payload
+                    num, m, size = response.block2
+                    if not m:
+                        break
+                    num += 1
+                if received != payload:
+                    self.errors.append("transfer %s %s is corrupted" % (n, t))
+        except Exception as err:
+            self.errors.append(repr(err))
+
+    def test_concurrent_transfers(self):
+        stop = threading.Event()
+        # switches between the threads as often as possible
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        self.addCleanup(sys.setcheckinterval, interval)
+
+        def purge():
+            while not stop.isSet():
+                try:
+                    self.layer.purge(lifetime=IDLE_LIFETIME)
+                except Exception as err:
+                    self.errors.append(repr(err))
+
+        purger = threading.Thread(target=purge)
+        purger.start()
+        threads = [threading.Thread(target=self.transfer, args=(n, 20)) for n in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stop.set()
+        purger.join()
+
+        self.assertEqual(self.errors, [])
+        self.layer.purge(lifetime=-1)
+        self.assertEqual(len(self.layer._block2_receive), 0)
+
+class Block1Test(unittest.TestCase):
+
+    def setUp(self):
+        self.layer = BlockLayer()
+        for name, value in (("MAX_BLOCK1_BUFFERS", MAX_BLOCK1_BUFFERS), ("MAX_BLOCK1_PAYLOAD", MAX_BLOCK1_PAYLOAD)):
+            self.addCleanup(setattr, defines, name, getattr(defines, name))
+            setattr(defines, name, value)
+
+    def put_block(self, n, num, m, chunk="x" * defines.BLOCKWISE_SIZE, token="tk"):
+        """
+            This method sends the PUT of the block num of the upload of the
+            client n through the layer and returns the transaction.
+        """
+        request = Request()
+        request.code = defines.Codes.PUT.number
+        request.source = ("10.1.%d.%d" % (n / 250, n % 250 + 1), 5683)
+        request.token = token
+        request.uri_path = "devices"
+        request.payload = chunk
+        request.block1 = (num, m, defines.BLOCKWISE_SIZE)
+        return self.layer.receive_request(Transaction(request=request))
+
+    def assert_buffers(self):
+        buffered = sum(len(item.payload) for item in self.layer._block1_receive.values())
+        self.assertEqual(self.layer._block1_bytes, buffered)
+        self.assertLessEqual(buffered, MAX_BLOCK1_BUFFERS)
+
+    def test_reassembly(self):
+        chunks = ["%04d" % num * (defines.BLOCKWISE_SIZE / 4) for num in range(4)]
+        for num, chunk in enumerate(chunks):
+            transaction = self.put_block(0, num, int(num < 3), chunk)
+        self.assertFalse(transaction.block_transfer)
+        self.assertEqual(transaction.request.payload, "".join(chunks))
+        self.assertEqual(len(self.layer._block1_receive), 0)
+        self.assertEqual(self.layer._block1_bytes, 0)
+
+    def test_flood_of_abandoned_uploads(self):
+        rejected = 0
+        for n in range(200):
+            for num in range(4):
+                transaction = self.put_block(n, num, 1)
+                self.assert_buffers()
+                if transaction.response.code == defines.Codes.REQUEST_ENTITY_TOO_LARGE.number:
+                    rejected += 1
+                    break
+                self.assertEqual(transaction.response.code, defines.Codes.CONTINUE.number)
+        # the active uploads are kept, the new ones are refused
+        self.assertEqual(rejected, 200 - MAX_BLOCK1_BUFFERS / (4 * defines.BLOCKWISE_SIZE))
+        self.layer.purge(lifetime=-1)
+        self.assertEqual(len(self.layer._block1_receive), 0)
+        self.assertEqual(self.layer._block1_bytes, 0)
+
+    def test_idle_uploads_are_evicted(self):
+        for n in range(MAX_BLOCK1_BUFFERS / defines.BLOCKWISE_SIZE):
+            self.put_block(n, 0, 1)
+        self.assertEqual(self.put_block(1000, 0, 1).response.code, defines.Codes.REQUEST_ENTITY_TOO_LARGE.number)
+
+        for item in self.layer._block1_receive.values():
+            item.timestamp = time.time() - defines.BLOCKWISE_LIFETIME - 1
+        self.assertEqual(self.put_block(1000, 0, 1).response.code, defines.Codes.CONTINUE.number)
+        self.assert_buffers()
+        self.assertEqual(len(self.layer._block1_receive), 1)
+
+    def test_too_large(self):
+        for num in range(MAX_BLOCK1_PAYLOAD / defines.BLOCKWISE_SIZE):
+            self.assertEqual(self.put_block(0, num, 1).response.code, defines.Codes.CONTINUE.number)
+        response = self.put_block(0, num + 1, 1).response
+        self.assertEqual(response.code, defines.Codes.REQUEST_ENTITY_TOO_LARGE.number)
+        size1 = [option.value for option in response.options
+                 if option.number == defines.OptionRegistry.SIZE1.number]
+        self.assertEqual(size1, [MAX_BLOCK1_PAYLOAD])
+        self.assertEqual(len(self.layer._block1_receive), 0)
+        self.assertEqual(self.layer._block1_bytes, 0)
+
+    def test_incomplete(self):
+        self.assertEqual(self.put_block(0, 1, 1).response.code, defines.Codes.REQUEST_ENTITY_INCOMPLETE.number)
+        self.put_block(0, 0, 1)
+        self.assertEqual(self.put_block(0, 2, 1).response.code, defines.Codes.REQUEST_ENTITY_INCOMPLETE.number)
+        self.assertEqual(self.layer._block1_bytes, 0)
+
+if __name__ == "__main__":
+    unittest.main()
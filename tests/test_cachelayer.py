@@ -0,0 +1,63 @@
+"""
+    These are the tests of the stats of the cache of the CoAPthon proxies
+    (coapthon.layers.cachelayer), updated from concurrent threads.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.layers.cachelayer import CacheLayer
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+
+__author__ = "Jose Requeijo Dias"
+
+THREADS = 8
+REQUESTS = 1000
+
+class CacheStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.layer = CacheLayer(defines.REVERSE_PROXY)
+        response = Response()
+        response.code = defines.Codes.CONTENT.number
+        response.payload = "on"
+        self.layer.cache.cache_add(self.request("/lamp/state"), response)
+
+    def request(self, path):
+        request = Request()
+        request.code = defines.Codes.GET.number
+        request.uri_path = path
+        return request
+
+    def test_concurrent_requests(self):
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        self.addCleanup(sys.setcheckinterval, interval)
+
+        def get(n):
+            path = "/lamp/state" if n % 2 else "/lamp/power"
+            for r in range(REQUESTS):
+                self.layer.receive_request(Transaction(request=self.request(path)))
+
+        threads = [threading.Thread(target=get, args=(n,)) for n in range(THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = self.layer.cache.get_stats()
+        self.assertEqual(stats["hits"], THREADS / 2 * REQUESTS)
+        self.assertEqual(stats["misses"], THREADS / 2 * REQUESTS)
+        self.assertEqual(stats["elements"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+    These are the tests of the traffic capture of the CoAPthon servers
+    (coapthon.capture), saved on a signal as on the Home Server
+    (kill -USR1 <pid>).
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.capture import Capture
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from coapthon.server.coap import CoAP
+
+__author__ = "Jose Requeijo Dias"
+
+class CaptureSignalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, "capture.coapcap")
+        self.server = CoAP(("127.0.0.1", 0), capture=Capture(100))
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(5)
+        self.previous = signal.signal(signal.SIGUSR1, lambda signum, frame: self.server.capture.save(self.path))
+
+    def tearDown(self):
+        signal.signal(signal.SIGUSR1, self.previous)
+        self.server.close()
+        self.client.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def get(self, mid):
+        """
+            This method sends a GET to the server and returns the datagram
+            answered.
+        """
+        request = Request()
+        request.code = defines.Codes.GET.number
+        request.type = defines.Types["CON"]
+        request.mid = mid
+        request.token = "t%d" % mid
+        request.uri_path = "missing"
+        request.destination = self.server._socket.getsockname()
+        self.client.sendto(Serializer().serialize(request), request.destination)
+        data, address = self.client.recvfrom(4096)
+        return data
+
+    def test_signal_saves_capture_while_listening(self):
+        answers = []
+        errors = []
+
+        def requests():
+            try:
+                answers.append(self.get(1))
+                # the server is blocked on the socket when it gets the signal
+                time.sleep(0.2)
+                os.kill(os.getpid(), signal.SIGUSR1)
+                answers.append(self.get(2))
+            except Exception as err:
+                errors.append(repr(err))
+            finally:
+                self.server.close()
+
+        t = threading.Thread(target=requests)
+        t.start()
+        self.server.listen(timeout=1)
+        t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(answers), 2)
+        records = Capture.load(self.path)
+        self.assertEqual([direction for timestamp, direction, host, port, data in records], ["i", "o"])
+
+if __name__ == "__main__":
+    unittest.main()
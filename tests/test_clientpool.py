@@ -0,0 +1,72 @@
+"""
+    These are the tests of the persistent clients of the upstream servers
+    (coapthon.client.clientpool), shared by the threads of a proxy.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.client.clientpool import PooledClient
+from coapthon.messages.request import Request
+
+__author__ = "Jose Requeijo Dias"
+
+class PooledClientTest(unittest.TestCase):
+
+    def setUp(self):
+        # an upstream server that never answers
+        self.upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.upstream.bind(("127.0.0.1", 0))
+        self.client = PooledClient(self.upstream.getsockname())
+
+    def tearDown(self):
+        self.client.close()
+        self.upstream.close()
+
+    def test_concurrent_first_sends(self):
+        start = threading.Event()
+        errors = []
+
+        def send():
+            request = Request()
+            request.code = defines.Codes.GET.number
+            request.type = defines.Types["NON"]
+            request.uri_path = "info"
+            start.wait()
+            try:
+                self.client.send(request, lambda response: None, timeout=0)
+            except Exception as err:
+                errors.append(repr(err))
+
+        # a slow start of the receiver, while the other threads send
+        receiver = self.client.protocol._receiver_thread
+        starts = []
+
+        def slow_start():
+            starts.append(threading.current_thread())
+            time.sleep(0.1)
+            threading.Thread.start(receiver)
+        receiver.start = slow_start
+
+        threads = [threading.Thread(target=send) for n in range(16)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(starts), 1)
+        self.assertTrue(self.client.protocol._receiver_thread.isAlive())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+    These are the tests of the forward layer of the CoAPthon proxies.
+    The requests are forwarded to a pool that answers them right away, in
+    place of the upstream servers.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.layers.forwardLayer import ForwardLayer
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+
+__author__ = "Jose Requeijo Dias"
+
+class AnsweringPool(object):
+    """
+        This is a pool of upstream clients that answers every request with
+        2.05 Content.
+    """
+    def __init__(self):
+        self.requests = []
+
+    def send(self, server, request, callback):
+        self.requests.append((server, request))
+        response = Response()
+        response.code = defines.Codes.CONTENT.number
+        response.payload = "upstream"
+        callback(response)
+
+    def close(self):
+        pass
+
+class ForwardProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.layer = ForwardLayer(None)
+        self.layer._pool = AnsweringPool()
+
+    def test_observe_through_forward_proxy(self):
+        request = Request()
+        request.code = defines.Codes.GET.number
+        request.source = ("127.0.0.1", 40000)
+        request.token = "ob"
+        request.proxy_uri = "coap://127.0.0.1:5683/devices"
+        request.observe = 0
+        done = []
+
+        ret = self.layer.receive_request(Transaction(request=request), done.append)
+
+        self.assertIsNone(ret)
+        self.assertEqual(len(done), 1)
+        self.assertEqual(done[0].response.code, defines.Codes.CONTENT.number)
+        self.assertEqual(done[0].response.payload, "upstream")
+        server, upstream = self.layer._pool.requests[0]
+        self.assertEqual(server, ("127.0.0.1", 5683))
+        self.assertEqual(upstream.uri_path, "devices")
+        self.assertIsNone(upstream.observe)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+    These are the tests of the pooled HTTP server of the HTTP-CoAP proxy
+    (coapthon.http_proxy.http_coap_proxy.PooledHTTPServer), with more idle
+    persistent connections than threads.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import httplib
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon.http_proxy.http_coap_proxy import PooledHTTPServer
+
+__author__ = "Jose Requeijo Dias"
+
+WORKERS = 2
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """
+        This handler answers the path of each request, on persistent connections.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = 10
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.path)))
+        self.end_headers()
+        self.wfile.write(self.path)
+
+    def log_message(self, format, *args):
+        pass
+
+class PooledHTTPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PooledHTTPServer(("127.0.0.1", 0), EchoHandler, WORKERS)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.1})
+        self.thread.start()
+        self.port = self.server.server_address[1]
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def get(self, connection, path):
+        connection.request("GET", path)
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        return response.read()
+
+    def connect(self):
+        connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        self.connections.append(connection)
+        return connection
+
+    def test_more_idle_connections_than_workers(self):
+        start = time.time()
+        idle = [self.connect() for n in range(WORKERS * 4)]
+        for n, connection in enumerate(idle):
+            self.assertEqual(self.get(connection, "/first/%d" % n), "/first/%d" % n)
+        # the idle connections do not keep the threads from serving a new one
+        self.assertEqual(self.get(self.connect(), "/new"), "/new")
+        for n, connection in enumerate(idle):
+            self.assertEqual(self.get(connection, "/second/%d" % n), "/second/%d" % n)
+        self.assertLess(time.time() - start, EchoHandler.timeout / 2.0)
+
+    def test_pipelined_requests(self):
+        connection = self.connect()
+        connection.connect()
+        connection.sock.sendall("GET /a HTTP/1.1\r\nHost: x\r\n\r\nGET /b HTTP/1.1\r\nHost: x\r\n\r\n")
+        data = ""
+        while data.count("HTTP/1.1 200") < 2 or not data.endswith("/b"):
+            chunk = connection.sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        self.assertTrue(data.endswith("/b"))
+        self.assertIn("/a", data)
+
+    def test_closed_connection(self):
+        connection = self.connect()
+        self.get(connection, "/")
+        connection.close()
+        time.sleep(0.2)
+        self.assertEqual(len(self.server._idle), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+    These are the tests of the purge of the expired transactions of the
+    message layer of CoAPthon (coapthon.layers.messagelayer). The clock of the
+    layer is replaced, so that the EXCHANGE_LIFETIME elapses right away.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.layers import messagelayer
+from coapthon.layers.messagelayer import MessageLayer, transaction_key
+from coapthon.messages.request import Request
+from coapthon.transaction import Transaction
+
+__author__ = "Jose Requeijo Dias"
+
+CLIENT = ("10.0.0.1", 5683)
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class MessageLayerPurgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.time = messagelayer.time
+        messagelayer.time = self.clock
+        self.layer = MessageLayer(1)
+        self.table = self.layer._transactions
+
+    def tearDown(self):
+        messagelayer.time = self.time
+
+    def store(self, mid, transaction=None):
+        if transaction is None:
+            transaction = Transaction(request=Request(), timestamp=self.clock.time())
+        self.layer._store(self.table, transaction_key(CLIENT[0], CLIENT[1], mid), transaction)
+        return transaction
+
+    def purge(self, after, keep=None):
+        self.clock.now += after
+        self.layer.purge(keep)
+        return sorted(key[2] for key in self.table)
+
+    def test_expired(self):
+        self.store(1)
+        self.clock.now += 10
+        self.store(2)
+        self.assertEqual(self.purge(defines.EXCHANGE_LIFETIME - 5), [2])
+        self.assertEqual(self.purge(10), [])
+
+    def test_stored_again(self):
+        # the request of an observation
+        transaction = self.store(1)
+        # and its latest notification
+        self.clock.now += defines.EXCHANGE_LIFETIME - 1
+        self.store(2, transaction)
+        self.assertEqual(self.purge(2), [2])
+
+    def test_key_stored_again(self):
+        transaction = self.store(1)
+        self.clock.now += defines.EXCHANGE_LIFETIME - 1
+        self.store(1, transaction)
+        self.assertEqual(self.purge(2), [1])
+        self.assertEqual(len(self.layer._expirations), 1)
+
+    def test_kept(self):
+        self.store(1)
+        self.assertEqual(self.purge(defines.EXCHANGE_LIFETIME + 1, keep=lambda transaction: True), [1])
+        self.assertEqual(self.purge(defines.EXCHANGE_LIFETIME + 1), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+    These are the tests of the metrics of the CoAPthon servers
+    (coapthon.metrics), updated from concurrent threads.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon.metrics import Metrics
+
+__author__ = "Jose Requeijo Dias"
+
+THREADS = 8
+UPDATES = 2000
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.5, 1))
+        self.metrics.describe("requests_total", "Requests handled")
+
+    def test_concurrent_updates(self):
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        self.addCleanup(sys.setcheckinterval, interval)
+
+        def update(n):
+            labels = (("method", "GET" if n % 2 else "PUT"),)
+            for u in range(UPDATES):
+                self.metrics.inc("requests_total", labels)
+                self.metrics.observe("request_seconds", labels, 0.25 if u % 2 else 0.75)
+
+        threads = [threading.Thread(target=update, args=(n,)) for n in range(THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for method in ("GET", "PUT"):
+            labels = (("method", method),)
+            self.assertEqual(self.metrics.value("requests_total", labels), THREADS / 2 * UPDATES)
+            histogram = self.metrics.histogram("request_seconds", labels)
+            self.assertEqual(histogram.count, THREADS / 2 * UPDATES)
+            self.assertEqual(histogram.counts, [THREADS / 4 * UPDATES, THREADS / 4 * UPDATES, 0])
+
+    def test_render(self):
+        self.metrics.inc("requests_total", (("method", "GET"),), 3)
+        self.metrics.observe("request_seconds", (), 0.75)
+        self.metrics.gauge("observers", lambda: 2)
+        self.assertEqual(self.metrics.render().splitlines(), [
+            "# HELP requests_total Requests handled",
+            "# TYPE requests_total counter",
+            'requests_total{method="GET"} 3',
+            "# TYPE observers gauge",
+            "observers 2",
+            "# TYPE request_seconds histogram",
+            'request_seconds_bucket{le="0.5"} 0',
+            'request_seconds_bucket{le="1.0"} 1',
+            'request_seconds_bucket{le="+Inf"} 1',
+            "request_seconds_sum 0.75",
+            "request_seconds_count 1"])
+
+if __name__ == "__main__":
+    unittest.main()
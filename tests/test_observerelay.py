@@ -0,0 +1,117 @@
+"""
+    These are the tests of the relay of the observations of the remote
+    resources of the CoAPthon reverse proxies (coapthon.layers.observerelay).
+    The upstream observations are kept by a pool that only records them, and
+    the notifications of the proxy observers by a recording server.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.layers.observerelay import ObserveRelay
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+
+__author__ = "Jose Requeijo Dias"
+
+class RecordingPool(object):
+    """
+        This is a pool of upstream clients that records the observations.
+    """
+    def __init__(self):
+        self.observations = []
+        self.cancelled = []
+
+    def observe(self, server, request, callback):
+        self.observations.append(callback)
+        return "ob%d" % len(self.observations)
+
+    def cancel(self, server, token):
+        self.cancelled.append(token)
+
+class RecordingServer(object):
+    """
+        This is a reverse proxy whose observers are the given (host, port, token).
+    """
+    def __init__(self):
+        self.observers = set()
+        self.notifications = []
+
+    def notify(self, resource, response, exclude=()):
+        notified = sorted(self.observers - set(exclude))
+        self.notifications.append((response.payload, notified))
+        return len(notified)
+
+    def remove_observer(self, transaction):
+        pass
+
+class Resource(object):
+    path = "/lamp/state"
+    observable = True
+
+class ObserveRelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RecordingServer()
+        self.pool = RecordingPool()
+        self.relay = ObserveRelay(self.server, self.pool)
+        self.resource = Resource()
+        self.answered = []
+
+    def observe(self, port):
+        request = Request()
+        request.code = defines.Codes.GET.number
+        request.source = ("10.0.0.1", port)
+        request.token = "tk"
+        request.observe = 0
+        transaction = Transaction(request=request, response=Response(), resource=self.resource)
+        self.server.observers.add(("10.0.0.1", port, "tk"))
+
+        def complete(response):
+            transaction.response.payload = response.payload
+            return transaction
+        self.relay.relay(transaction, Request(), complete, self.answered.append)
+
+    def notification(self, payload, max_age=60):
+        response = Response()
+        response.code = defines.Codes.CONTENT.number
+        response.observe = 1
+        response.max_age = max_age
+        response.payload = payload
+        self.pool.observations[-1](response)
+
+    def test_first_notification(self):
+        self.observe(1)
+        self.observe(2)
+        self.assertEqual(len(self.pool.observations), 1)
+        self.notification("on")
+        self.assertEqual([t.response.payload for t in self.answered], ["on", "on"])
+        self.assertEqual(self.server.notifications, [])
+
+        self.notification("off")
+        self.assertEqual(self.server.notifications, [("off", [("10.0.0.1", 1, "tk"), ("10.0.0.1", 2, "tk")])])
+
+    def test_restart_after_max_age(self):
+        self.observe(1)
+        self.notification("on")
+        # the upstream server is silent for longer than the Max-Age
+        self.relay._observations[self.resource.path].timestamp = time.time() - 120
+
+        self.observe(2)
+        self.assertEqual(len(self.pool.observations), 2)
+        self.assertEqual(self.pool.cancelled, ["ob1"])
+        self.notification("off")
+        self.assertEqual(self.answered[-1].response.payload, "off")
+        # the observer of the previous observation gets the notification too, only once
+        self.assertEqual(self.server.notifications, [("off", [("10.0.0.1", 1, "tk")])])
+
+if __name__ == "__main__":
+    unittest.main()
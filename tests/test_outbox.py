@@ -0,0 +1,90 @@
+"""
+    These are the tests of the cloud outbox (cloudcommunicators.outbox) drained
+    by the mHouse cloud communicator, with a cloud session that records the
+    requests in place of the cloud service.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from cloudcommunicators import mhouse_comm
+from cloudcommunicators.outbox import CloudOutbox
+
+__author__ = "Jose Requeijo Dias"
+
+class RecordingClient(object):
+    """
+        This is a cloud session that answers every request with 200 OK.
+    """
+    status_code = 200
+
+    def __init__(self):
+        self.patches = []
+
+    def patch(self, url, data=None):
+        self.patches.append(url)
+        return self
+
+class Device(object):
+    def __init__(self, address):
+        self.address = address
+        self.universal_id = None
+
+class DevicesList(object):
+    def __init__(self, addresses):
+        self.devices = dict((n, Device(a)) for n, a in enumerate(addresses))
+
+class Server(object):
+    def __init__(self, addresses):
+        self.devices = DevicesList(addresses)
+
+class OutboxStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.outbox = CloudOutbox(self.work_dir)
+        self.client = RecordingClient()
+        self.server = Server(["10.0.0.1", "10.0.0.2"])
+        mhouse_comm.device_index.devices.clear()
+
+    def tearDown(self):
+        mhouse_comm.device_index.devices.clear()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def send(self, record, context):
+        context.setdefault("client", self.client)
+        context.setdefault("universal_ids", {})
+        return mhouse_comm.send_outbox_record(record, context, self.server)
+
+    def put_state(self, address, universal_id):
+        self.outbox.put("state", address, {"universal_id": universal_id, "current_state": []})
+
+    def test_state_waits_for_registration(self):
+        # registered on the Home Server but still not on the cloud
+        self.put_state("10.0.0.1", None)
+        self.put_state("10.0.0.2", 7)
+        # no longer on the Home Server
+        self.put_state("10.0.0.3", None)
+
+        sent, done = self.outbox.drain(self.send)
+        self.assertEqual((sent, done), (2, False))
+        self.assertEqual(self.outbox.pending(), 1)
+        self.assertEqual(len(self.client.patches), 1)
+        self.assertIn("api/devices/7/state/", self.client.patches[0])
+
+        # registered by the bulk synchronization
+        mhouse_comm.device_index.update([{"id": 9, "address": "10.0.0.1"}])
+        sent, done = self.outbox.drain(self.send)
+        self.assertEqual((sent, done), (1, True))
+        self.assertEqual(self.outbox.pending(), 0)
+        self.assertIn("api/devices/9/state/", self.client.patches[1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+    These are the tests of the Home Server Configurations CoAP resource.
+    They build a Home Server (server.coapserver.CoAPServer, working offline
+    and not listening) and send it the requests through its resource layer.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.transaction import Transaction
+
+import settings
+from utils import code_convert
+
+__author__ = "Jose Requeijo Dias"
+
+CONFIGS = {
+    "device_types.json": {"DEVICE_TYPES": [{"id": 1, "name": "Lamp", "properties": [1]}]},
+    "property_types.json": {"PROPERTY_TYPES": [
+        {"id": 1, "name": "level", "access_mode": "RW", "value_type_class": "SCALAR", "value_type_id": 1}]},
+    "value_types.json": {
+        "SCALAR_TYPES": [{"id": 1, "name": "Percentage", "units": "%", "min_value": 0, "max_value": 100,
+                          "step": 1, "default_value": 0},
+                         {"id": 2, "name": "Degrees", "units": "C", "min_value": 0, "max_value": 40,
+                          "step": 1, "default_value": 20}],
+        "ENUM_TYPES": []},
+    "services.json": {"SERVICES": []}
+}
+
+class ConfigsDeleteTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        for name, data in CONFIGS.iteritems():
+            with open(os.path.join(cls.work_dir, name), "w") as f:
+                json.dump(data, f)
+        settings.DEVICE_TYPES_CONFIG_FILE = os.path.join(cls.work_dir, "device_types.json")
+        settings.PROPERTY_TYPES_CONFIG_FILE = os.path.join(cls.work_dir, "property_types.json")
+        settings.VALUE_TYPES_CONFIG_FILE = os.path.join(cls.work_dir, "value_types.json")
+        settings.SERVICES_CONFIG_FILE = os.path.join(cls.work_dir, "services.json")
+        settings.CLOUD_OUTBOX_DIR = os.path.join(cls.work_dir, "outbox/")
+        settings.COAP_ADDR = "127.0.0.1"
+        settings.COAP_PORT = 0
+        settings.COAP_MULTICAST = False
+        settings.WORKING_OFFLINE = True
+
+        from server.coapserver import CoAPServer
+        cls.server = CoAPServer(1, "TestHomeServer")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def delete(self, query=None, accept=None):
+        request = Request()
+        request.code = defines.Codes.DELETE.number
+        request.uri_path = "configs"
+        if query is not None:
+            request.uri_query = query
+        if accept is not None:
+            request.accept = accept
+        transaction = Transaction(request=request, response=Response(),\
+                                  resource=self.server.root["/configs"])
+        transaction = self.server.resourceLayer.delete_resource(transaction, "/configs")
+        return transaction.response
+
+    def assert_error(self, response, code):
+        self.assertEqual(response.code, code.number)
+        self.assertEqual(json.loads(response.payload)["error_code"], code_convert(code.number))
+
+    def test_delete_without_query(self):
+        self.assert_error(self.delete(), defines.Codes.BAD_REQUEST)
+
+    def test_delete_with_bad_query(self):
+        self.assert_error(self.delete("type=SCALAR_TYPES&id=two"), defines.Codes.BAD_REQUEST)
+        self.assert_error(self.delete("id=2"), defines.Codes.BAD_REQUEST)
+
+    def test_delete_not_acceptable(self):
+        self.assert_error(self.delete("type=SCALAR_TYPES&id=2", defines.Content_types["text/plain"]),\
+                          defines.Codes.NOT_ACCEPTABLE)
+
+    def test_delete_missing_config(self):
+        self.assert_error(self.delete("type=SCALAR_TYPES&id=99"), defines.Codes.NOT_FOUND)
+
+    def test_delete_config_in_use(self):
+        self.assert_error(self.delete("type=SCALAR_TYPES&id=1"), defines.Codes.BAD_REQUEST)
+        self.assertIn(1, self.server.configs.scalar_value_types)
+
+    def test_delete_config(self):
+        response = self.delete("type=SCALAR_TYPES&id=2")
+        self.assertEqual(response.code, defines.Codes.DELETED.number)
+        self.assertNotIn(2, self.server.configs.scalar_value_types)
+        self.assertIn("/configs", self.server.root)
+
+if __name__ == "__main__":
+    unittest.main()
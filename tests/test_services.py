@@ -0,0 +1,87 @@
+"""
+    These are the tests of the Home Server Services, subscribed by the devices.
+    They build a Home Server (server.coapserver.CoAPServer, working offline
+    and not listening) and send it the requests through its resource layer.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+import settings
+from utils import AppError
+
+__author__ = "Jose Requeijo Dias"
+
+CONFIGS = {
+    "device_types.json": {"DEVICE_TYPES": [{"id": 1, "name": "Lamp", "properties": [1]}]},
+    "property_types.json": {"PROPERTY_TYPES": [
+        {"id": 1, "name": "level", "access_mode": "RW", "value_type_class": "SCALAR", "value_type_id": 1}]},
+    "value_types.json": {
+        "SCALAR_TYPES": [{"id": 1, "name": "Percentage", "units": "%", "min_value": 0, "max_value": 100,
+                          "step": 1, "default_value": 0},
+                         {"id": 2, "name": "Degrees", "units": "C", "min_value": 0, "max_value": 40,
+                          "step": 1, "default_value": 20}],
+        "ENUM_TYPES": []},
+    "services.json": {"SERVICES": [{"id": 1, "name": "Lights", "core_service_ref": None}]}
+}
+
+DEVICE = {"name": "Lamp", "device_type": 1, "timeout": 60}
+
+class DeviceServicesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        for name, data in CONFIGS.iteritems():
+            with open(os.path.join(cls.work_dir, name), "w") as f:
+                json.dump(data, f)
+        settings.DEVICE_TYPES_CONFIG_FILE = os.path.join(cls.work_dir, "device_types.json")
+        settings.PROPERTY_TYPES_CONFIG_FILE = os.path.join(cls.work_dir, "property_types.json")
+        settings.VALUE_TYPES_CONFIG_FILE = os.path.join(cls.work_dir, "value_types.json")
+        settings.SERVICES_CONFIG_FILE = os.path.join(cls.work_dir, "services.json")
+        settings.CLOUD_OUTBOX_DIR = os.path.join(cls.work_dir, "outbox/")
+        settings.COAP_ADDR = "127.0.0.1"
+        settings.COAP_PORT = 0
+        settings.COAP_MULTICAST = False
+        settings.WORKING_OFFLINE = True
+
+        from server.coapserver import CoAPServer
+        cls.server = CoAPServer(1, "TestHomeServer")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def add_device(self, address, services):
+        device = dict(DEVICE)
+        device["services"] = services
+        return self.server.devices.add_device(device, address, 5683)
+
+    def test_unknown_service(self):
+        self.assertFalse(self.server.services.validate_services([1, 99]))
+        self.assertRaises(AppError, self.add_device, "10.0.0.1", [1, 99])
+        self.assertIsNone(self.server.devices.check_existing_device("10.0.0.1"))
+        self.assertNotIn(99, self.server.services.subscribers)
+
+    def test_subscribed_service(self):
+        device = self.add_device("10.0.0.2", ["1"])
+        self.assertEqual(device.services.services, [1])
+        self.assertIn(device.id, self.server.services.get_subscribers(1))
+
+    def test_service_removed_meanwhile(self):
+        device = self.add_device("10.0.0.3", [1])
+        device.services.set_services([1, 99])
+        self.assertEqual(device.services.services, [1])
+        self.assertNotIn(99, self.server.services.subscribers)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+    These are the tests of the executor and the rate limiter of the AWS
+    thing and shadow operations (cloudcommunicators.shadowexecutor), and of
+    their use by the AWS communicator with a stub of the boto3 "iot" client.
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+sys.path.append(my_dir+"/../cloudcommunicators/")
+
+from cloudcommunicators.shadowexecutor import ShadowExecutor, RateLimiter
+from cloudcommunicators.aws_comm import AWSCommunicator
+
+__author__ = "Jose Requeijo Dias"
+
+class ShadowExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ShadowExecutor(workers=1)
+        self.calls = []
+        # the worker is kept busy, so the operations submitted stay pending
+        self.release = threading.Event()
+        self.executor.submit("other", "update", self.release.wait)
+        while self.executor.size() > 0:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.stop()
+
+    def operation(self, name):
+        return lambda: self.calls.append(name)
+
+    def run_pending(self):
+        self.release.set()
+        self.assertTrue(self.executor.join(5))
+
+    def test_coalescing(self):
+        tasks = [self.executor.submit("lamp", "update", self.operation("update %d" % n)) for n in range(5)]
+        self.assertEqual(self.executor.size(), 1)
+        self.run_pending()
+        self.assertEqual(self.calls, ["update 4"])
+        self.assertTrue(all(task is tasks[0] for task in tasks))
+        self.assertTrue(tasks[0].done.isSet())
+
+    def test_order(self):
+        self.executor.submit("lamp", "register", self.operation("register 1"))
+        self.executor.submit("lamp", "update", self.operation("update"))
+        self.executor.submit("lamp", "unregister", self.operation("unregister"))
+        self.executor.submit("lamp", "register", self.operation("register 2"))
+        self.run_pending()
+        self.assertEqual(self.calls, ["update", "unregister", "register 2"])
+
+    def test_cancel(self):
+        task = self.executor.submit("lamp", "update", self.operation("update"))
+        self.assertTrue(self.executor.cancel("lamp", "update"))
+        self.assertTrue(task.done.isSet())
+        self.run_pending()
+        self.assertEqual(self.calls, [])
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_rate(self):
+        limiter = RateLimiter(20, burst=1)
+        start = time.time()
+        threads = [threading.Thread(target=lambda: [limiter.acquire() for n in range(3)]) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # the first operation is taken from the burst
+        self.assertGreaterEqual(time.time() - start, 11/20.0 - 0.01)
+
+    def test_wait_without_lock(self):
+        limiter = RateLimiter(1, burst=1)
+        limiter.acquire()
+        waiting = threading.Thread(target=limiter.acquire)
+        waiting.start()
+        time.sleep(0.1)
+        self.assertTrue(waiting.isAlive())
+        self.assertTrue(limiter._lock.acquire(False))
+        limiter._lock.release()
+        waiting.join()
+
+class RecordingIoTClient(object):
+    """
+        This is a stub of the boto3 "iot" client that records the calls.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def create_thing(self, thingName):
+        self.calls.append(("create_thing", thingName))
+
+    def delete_thing(self, thingName):
+        self.calls.append(("delete_thing", thingName))
+
+class AWSUnregisterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.iot = RecordingIoTClient()
+        self.aws = AWSCommunicator(clients=(self.iot, None), listen=False)
+
+    def tearDown(self):
+        self.aws.executor.stop()
+
+    def test_unregister_deletes_thing(self):
+        self.aws.unregister_device("lamp-1").wait(5)
+        self.assertEqual(self.iot.calls, [("delete_thing", "lamp-1")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+    These are the tests of the logging file handler of the Home Server
+    (utils.QueueFileHandler).
+
+    Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+my_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(my_dir+"/../")
+
+from utils import QueueFileHandler
+
+__author__ = "Jose Requeijo Dias"
+
+class LateRecordHandler(QueueFileHandler):
+    """
+        This handler gets a record from another thread right after each
+        write of the queued records once it is being closed, i.e. after the
+        last write of its writer.
+    """
+    def write_queued(self):
+        running = QueueFileHandler.write_queued(self)
+        if self.stopped.isSet() and not getattr(self, "late", False):
+            self.late = True
+            self.emit(logging.LogRecord("test", logging.INFO, __file__, 0, "late record", None, None))
+        return running
+
+class QueueFileHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.work_dir, "test.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def log(self, handler, records):
+        logger = logging.Logger("test")
+        logger.addHandler(handler)
+        for n in range(records):
+            logger.info("record %s", n)
+        handler.close()
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_close_writes_queued_records(self):
+        handler = QueueFileHandler(self.path, interval=60)
+        lines = self.log(handler, 1000)
+        self.assertEqual(lines, ["record %s" % n for n in range(1000)])
+
+    def test_close_writes_records_after_last_write(self):
+        handler = LateRecordHandler(self.path, interval=60)
+        lines = self.log(handler, 10)
+        self.assertEqual(lines, ["record %s" % n for n in range(10)] + ["late record"])
+
+if __name__ == "__main__":
+    unittest.main()
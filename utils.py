@@ -2,8 +2,12 @@
     This is the utilities file for the HomeServer.
     Here are help/utility functions that are used overall the HomeServer
 """
+import os
 import json
 import socket
+import logging
+import threading
+import collections
 import requests
 
 from coapthon import defines
@@ -53,6 +57,107 @@ class AppHTTPError(AppError):
         if msg is not None:
             self.msg = msg
 
+class QueueFileHandler(logging.FileHandler):
+    """
+        This is a logging file handler that does not block the logging thread.
+        The records are queued and a background thread formats and writes
+        them to the file in batches, every interval seconds. The thread is
+        started on the first record of each process (so that it also works on
+        the processes forked after the logging configuration). Closing the
+        handler writes the queued records.
+        It is used from the logging configuration file like a FileHandler:
+        class=utils.QueueFileHandler
+    """
+    # mark put on the queue when the handler is closed
+    STOP = object()
+
+    def __init__(self, filename, mode="a", encoding=None, delay=0, interval=0.1):
+        logging.FileHandler.__init__(self, filename, mode, encoding, delay)
+        self.interval = interval
+        self.records = collections.deque()
+        self.stopped = threading.Event()
+        self.writer = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.records = collections.deque()
+            self.stopped = threading.Event()
+            self.writer = threading.Thread(target=self.write_records, name="LogWriter")
+            self.writer.daemon = True
+            self.pid = os.getpid()
+            self.writer.start()
+
+    def prepare(self, record):
+        """
+            Merges the arguments on the message of the record, so that the
+            objects being logged can change before the record is written.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.formatter or logging._defaultFormatter).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            if self.pid != os.getpid():
+                self.start()
+            # deque appends are atomic, the logging thread never waits for the writer
+            self.records.append(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def write_records(self):
+        while self.write_queued():
+            self.stopped.wait(self.interval)
+
+    def write_queued(self):
+        """
+            Writes the queued records, up to the stop mark put by close().
+            Returns False if the mark was found.
+        """
+        lines = []
+        record = None
+        running = True
+        try:
+            while True:
+                record = self.records.popleft()
+                if record is QueueFileHandler.STOP:
+                    running = False
+                    break
+                msg = self.format(record)
+                if isinstance(msg, unicode):
+                    msg = msg.encode(self.encoding or "utf-8")
+                lines.append(msg + "\n")
+        except IndexError:
+            pass
+        if len(lines) == 0:
+            return running
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except Exception:
+            self.handleError(record)
+        return running
+
+    def close(self):
+        if self.writer is not None and self.pid == os.getpid():
+            # the writer drains the queue up to the mark before it stops
+            self.records.append(QueueFileHandler.STOP)
+            self.stopped.set()
+            self.writer.join()
+            self.writer = None
+            # and the records logged meanwhile by other threads
+            self.write_queued()
+        logging.FileHandler.close(self)
+
 def error(resource, response, error_tup, info):
     """
         This function returns a RESTful JSON error representation that
@@ -121,29 +226,74 @@ def validate_IPv4(addr):
     else:
         return False
 
-def get_my_ip(public=False):
+def get_cached_ip(cache_file, public=False):
     """
-        This function get the local IPv4 address for the HomeServer
+        This function returns the last known local IPv4 address (or public one)
+        for the HomeServer, stored on cache_file, or None if it is not known.
     """
-    if not public:
-        try:
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f).get("public" if public else "local")
+    except (IOError, ValueError, AttributeError):
+        return None
+
+def cache_ip(cache_file, myip, public=False):
+    """
+        This function stores the local IPv4 address (or public one) for the
+        HomeServer on cache_file, when it is not the one already stored.
+    """
+    key = "public" if public else "local"
+    try:
+        with open(cache_file, "r") as f:
+            addresses = json.load(f)
+    except (IOError, ValueError):
+        addresses = {}
+    if not isinstance(addresses, dict):
+        addresses = {}
+    if addresses.get(key) == myip:
+        return
+    addresses[key] = myip
+    try:
+        tmp = cache_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(addresses, f)
+        os.rename(tmp, cache_file)
+    except (IOError, OSError):
+        pass
+
+def get_my_ip(public=False, cache_file=None, timeout=5):
+    """
+        This function get the local IPv4 address for the HomeServer, i.e. the
+        address of the interface of the default route, which is found without
+        any name resolution or traffic (connecting an UDP socket sends nothing).
+        With public set it gets the public IPv4 address of the HomeServer from
+        jsonip.com, waiting at most timeout seconds.
+        With a cache_file the address found is stored on it, and when it can not
+        be found (e.g. the network is down) the last known one is returned.
+    """
+    try:
+        if not public:
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.connect(("coap.technology", 80))
-            myip = sock.getsockname()[0]
-            sock.close()
-            return myip
-        except:
-            print "ERROR: Unable to connect to Network"
-            raise AppError(500, "Unable to connect to Network")
-    else:
-        try:
-            resp = requests.get("https://jsonip.com/")
+            try:
+                # any routable address, it is not contacted
+                sock.connect(("192.0.2.1", 80))
+                myip = sock.getsockname()[0]
+            finally:
+                sock.close()
+        else:
+            resp = requests.get("https://jsonip.com/", timeout=timeout)
             myip = json.loads(resp.text)
             myip = myip["ip"]
-            return myip
-        except:
+    except:
+        myip = get_cached_ip(cache_file, public) if cache_file is not None else None
+        if myip is None:
             print "ERROR: Unable to connect to Network"
             raise AppError(500, "Unable to connect to Network")
+        return myip
+
+    if cache_file is not None:
+        cache_ip(cache_file, myip, public)
+    return myip
 
 def check_on_body(body, keys):
     """